@@ -0,0 +1,125 @@
+# Board description
+#
+# The pins and addresses of a board as one table, the controller builds its
+# channels from it in loops. A channel is an encoder, its push switch and the
+# display it sets; the buttons are further switches with an LED each. The
+# first channels are development timers, the last one selects the recipe. A
+# variant with other pins or more channels passes its own Board.
+#
+# Event sources follow the table: encoders are 0 .. len(encoders) - 1, the
+# encoder switches and then the buttons come after them.
+
+from micropython import const
+
+# Encoder values, the displays show three digits
+_MIN = const(0)
+_MAX = const(999)
+
+
+def _bit(address):
+    for bit in range(8):
+        if 1 << bit == address:
+            return bit
+    raise ValueError("LED address {} is not one bit of the register".format(address))
+
+
+class Board:
+    # encoders: (clk, dt, switch) pins per channel, buttons: (switch pin, LED
+    # address in the LED register) per button, timers: how many channels are
+    # timers, all but the last by default. sm_base is the first PIO state
+    # machine of the PIO encoders.
+    def __init__(self, encoders, buttons, min_val=_MIN, max_val=_MAX, half_step=True, sm_base=4,
+                 digits=3, timers=None) -> None:
+        if len(buttons) > 8:
+            raise ValueError("The LED register holds 8 LEDs")
+        if timers is None:
+            timers = max(0, len(encoders) - 1)
+        if timers < 0 or timers and timers >= len(encoders):
+            raise ValueError("The last channel selects the recipe, it cannot be a timer")
+        self.encoders = encoders
+        self.buttons = buttons
+        self.min_val = min_val
+        self.max_val = max_val
+        self.half_step = half_step
+        self.sm_base = sm_base
+        self.digits = digits
+        self.timers = timers
+        self.rotary_pins = tuple((clk, dt) for clk, dt, _ in encoders)
+        # All switches in source order
+        self.switch_pins = tuple(switch for _, _, switch in encoders) + tuple(pin for pin, _ in buttons)
+        self.switch_names = tuple("rotary_{}_button".format(i + 1) for i in range(len(encoders))) + tuple(
+            "button{}".format(i + 1) for i in range(len(buttons)))
+        self.led_addresses = bytes(address for _, address in buttons)
+        self.led_bits = bytes(_bit(address) for address in self.led_addresses)
+        self.source_base = len(encoders)
+
+    @property
+    def channels(self):
+        return len(self.encoders)
+
+
+FRANKENSTEIN = Board(
+    encoders=((6, 7, 27), (26, 1, 13), (19, 20, 21), (16, 17, 18)),
+    buttons=((4, 8), (5, 4), (14, 2), (15, 1)),
+)
+
+
+class Display:
+    # One display of the controller's arrays, as the dict it used to be:
+    # display["value"], display["blink"] and display["point"]
+    def __init__(self, controller, index) -> None:
+        self._c = controller
+        self._i = index
+
+    def __getitem__(self, key):
+        c = self._c
+        if key == "value":
+            return c.values[self._i]
+        if key == "blink":
+            return bool(c.blinks[self._i])
+        if key == "point":
+            return c.points[self._i]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        c = self._c
+        if key == "value":
+            c.values[self._i] = value
+        elif key == "blink":
+            c.blinks[self._i] = 1 if value else 0
+        elif key == "point":
+            c.points[self._i] = value
+        else:
+            raise KeyError(key)
+
+    def __repr__(self):
+        return "{{'value': {}, 'blink': {}, 'point': {}}}".format(self["value"], self["blink"], self["point"])
+
+
+class ButtonLED:
+    # One button LED the same way: led["value"], led["blink"], led["address"]
+    def __init__(self, controller, index) -> None:
+        self._c = controller
+        self._i = index
+
+    def __getitem__(self, key):
+        c = self._c
+        if key == "value":
+            return bool(c.leds[self._i])
+        if key == "blink":
+            return bool(c.led_blinks[self._i])
+        if key == "address":
+            return c.board.led_addresses[self._i]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        c = self._c
+        if key == "value":
+            c.leds[self._i] = 1 if value else 0
+        elif key == "blink":
+            c.led_blinks[self._i] = 1 if value else 0
+        else:
+            raise KeyError(key)
+
+    def __repr__(self):
+        return "{{'value': {}, 'blink': {}, 'address': {}}}".format(self["value"], self["blink"], self["address"])
@@ -0,0 +1,48 @@
+# Boot phase timestamps
+#
+# main.py calls mark() as each phase of the boot completes. ticks_ms counts
+# from reset, so a mark is the time since power-on. save() appends one line
+# per boot to a small log, which can be compared across releases:
+#
+#   <version> total=<ms> <phase>=<ms> ...
+
+import time
+
+_marks = []
+
+
+def mark(name) -> None:
+    _marks.append((name, time.ticks_ms()))
+
+
+def marks():
+    return _marks
+
+
+# "<phase> <ms since the previous mark> ms" for each phase, then the total
+def summary():
+    parts = []
+    last = 0
+    for name, ticks in _marks:
+        parts.append("{} {} ms".format(name, time.ticks_diff(ticks, last)))
+        last = ticks
+    return "{} (total {} ms)".format(", ".join(parts), last)
+
+
+def save(version, path="boottimes.log", max_bytes=4096) -> None:
+    line = "{} total={}".format(version, _marks[-1][1] if _marks else 0)
+    last = 0
+    for name, ticks in _marks:
+        line += " {}={}".format(name, time.ticks_diff(ticks, last))
+        last = ticks
+    try:
+        with open(path) as f:
+            old = f.read()
+    except OSError:
+        old = ""
+    # Keeps the newest half once the log is full
+    if len(old) + len(line) >= max_bytes:
+        old = old[len(old) // 2:]
+        old = old[old.find("\n") + 1:]
+    with open(path, "w") as f:
+        f.write(old + line + "\n")
@@ -0,0 +1,403 @@
+# Several controllers on one RS485 bus: clock sync, mirrored settings and
+# synchronized exposures
+#
+# With the DMX_ENABLE jumpers closed the SP3485 hangs off GP8 (UART1 TX), GP9
+# (UART1 RX) and GP22 (driver enable), so the bus excludes DMX and the stepper
+# on GP8/GP9. One node is the master (address 0), the others (1-254) only
+# answer when addressed, so the half-duplex bus never has two drivers.
+#
+# Frames are binary, CRC-16/CCITT over everything before it:
+#
+#   0x7E, destination, source, command, length, payload[length], crc (LE)
+#
+# A bad CRC drops the frame and the receiver hunts for the next 0x7E.
+#
+# The master broadcasts a BEACON every beacon_ms carrying its ticks_us at the
+# moment the frame's last byte leaves the UART. A node takes its own ticks_us
+# at the end of the frame; the difference is the offset of its clock to the
+# master's plus however late the node got to the frame. Where the UART has an
+# RX idle interrupt its soft IRQ timestamps the end of the frame, tens of µs
+# late; without one poll() does, up to its period late. That lateness is never
+# negative, so the smallest of the last _SAMPLES differences is the estimate
+# (within the clocks' drift over the window, 100 ppm over 0.8 s is 80 µs).
+# Bus time is the master's ticks_us. START_AT carries a bus time and an
+# exposure; every node converts it to its own ticks_us and arms its
+# ExposureScheduler on that deadline, so the lamps come on together whatever
+# the bus and the event loops were doing.
+
+from array import array
+import logging
+from machine import Pin, UART
+from micropython import const
+import struct
+import time
+
+from .exposure import MAX_EXPOSURE_US
+
+MASTER = const(0)
+BROADCAST = const(0xFF)
+
+_TX_PIN = const(8)
+_RX_PIN = const(9)
+_ENABLE_PIN = const(22)
+_BAUD = const(250_000)
+
+_SYNC = const(0x7E)
+_HEADER = const(5)
+_MAX_PAYLOAD = const(16)
+_MAX_FRAME = const(23)
+
+# Commands and their payloads
+BEACON = const(1)  # B sequence, I master ticks_us at the end of the frame
+SETTINGS = const(2)  # H per display (_UNSET for none yet), B low speed
+START_AT = const(3)  # I bus time, I exposure µs
+PING = const(4)
+STATUS = const(5)  # B synced, i offset µs, H exposures, B exposure state
+_BEACON = "<BI"
+_START_AT = "<II"
+_STATUS = "<BiHB"
+_BEACON_FRAME = const(12)
+_UNSET = const(0xFFFF)
+
+# Offset samples the estimate is the smallest of, and how many make it usable
+_SAMPLES = const(8)
+_MIN_SAMPLES = const(3)
+# A sample this far off means the master restarted, the estimate starts over
+_RESYNC_US = const(50_000)
+
+# CRC-16/CCITT (poly 0x1021, init 0xFFFF) a nibble at a time
+_CRC4 = (
+    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50A5, 0x60C6, 0x70E7,
+    0x8108, 0x9129, 0xA14A, 0xB16B, 0xC18C, 0xD1AD, 0xE1CE, 0xF1EF,
+)
+
+
+def crc16(buf, n, crc=0xFFFF):
+    table = _CRC4
+    for i in range(n):
+        b = buf[i]
+        crc = ((crc << 4) & 0xFFFF) ^ table[(crc >> 12) ^ (b >> 4)]
+        crc = ((crc << 4) & 0xFFFF) ^ table[(crc >> 12) ^ (b & 0x0F)]
+    return crc
+
+
+class BusNode:
+    # port is a UART (or anything with write, readinto returning None when
+    # empty, flush, and any and irq for the idle interrupt), enable the
+    # transceiver's driver enable pin
+    def __init__(self, port, address, enable=None, controller=None, baud=_BAUD, beacon_ms=100,
+                 mirror=True) -> None:
+        if not 0 <= address < BROADCAST:
+            raise ValueError("address must be 0-254")
+        self.logger = logging.getLogger(__name__)
+        self.port = port
+        self.enable = enable
+        self.address = address
+        self.master = address == MASTER
+        self.controller = controller
+        if controller is not None:
+            controller.bus = self
+        self.baud = baud
+        self.beacon_ms = beacon_ms
+        # The master sends the displays and speed to the nodes when they change
+        self.mirror = mirror
+        # The time base; nodes simulated on one host each have their own
+        self.ticks_us = time.ticks_us
+        self._tx = bytearray(_MAX_FRAME)
+        self._rx = bytearray(_MAX_FRAME)
+        self._rx_len = 0
+        self._chunk = bytearray(32)
+        # RX idle interrupts and how many bytes were unread at the last one
+        self._idles = 0
+        self._idles_seen = 0
+        self._idle_us = 0
+        self._idle_bytes = 0
+        # Delay from the last stop bit to the idle interrupt, the rp2 UART
+        # waits 32 bit times
+        self.rx_latency_us = 0
+        trigger = getattr(port, "IRQ_RXIDLE", None)
+        if trigger is not None:
+            self.rx_latency_us = 32_000_000 // baud
+            self._rx_idle_cb = self._rx_idle
+            port.irq(self._rx_idle_cb, trigger)
+        # Clock sync on the nodes
+        self._samples = array("i", [0] * _SAMPLES)
+        self._sample_count = 0
+        self._sequence = 0
+        self.offset_us = 0
+        self.synced = self.master
+        # Master side: how long building a beacon takes, STATUS by address
+        self._lead_us = 0
+        self._next_beacon = time.ticks_ms()
+        # What the nodes were sent last, the displays of the board and the speed
+        channels = controller.board.channels if controller is not None else 0
+        if 2 * channels + 1 > _MAX_PAYLOAD:
+            raise ValueError("SETTINGS carries {} displays at most".format((_MAX_PAYLOAD - 1) // 2))
+        self._settings_format = "<{}HB".format(channels)
+        self._settings = array("H", [_UNSET] * (channels + 1))
+        # The displays at the last mirror, and which of them counted down or
+        # showed the exposure time then
+        self._seen = array("h", [-1] * channels)
+        self._local = bytearray(channels)
+        self.nodes = {}
+        # Statistics
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.crc_errors = 0
+        self.beacons_missed = 0
+        self.starts = 0
+
+    # µs a frame of n bytes takes on the wire, 10 bits per byte
+    def airtime_us(self, n):
+        return n * 10_000_000 // self.baud
+
+    def bus_time(self):
+        return time.ticks_add(self.ticks_us(), -self.offset_us)
+
+    def local_time(self, bus_us):
+        return time.ticks_add(bus_us, self.offset_us)
+
+    # Soft IRQ: the line went idle, the last of the unread bytes ended
+    # rx_latency_us ago
+    def _rx_idle(self, port):
+        self._idle_us = self.ticks_us()
+        self._idle_bytes = port.any()
+        self._idles += 1
+
+    # Reads what arrived, handles complete frames; the master also sends
+    # beacons and changed settings. Called every few ms by the runtime.
+    def poll(self) -> None:
+        port = self.port
+        chunk = self._chunk
+        byte_us = self.airtime_us(1)
+        idles = self._idles
+        idle_bytes = self._idle_bytes if idles != self._idles_seen else 0
+        idle_end = time.ticks_add(self._idle_us, -self.rx_latency_us)
+        # The interrupt came while taking these
+        if self._idles != idles:
+            idle_bytes = 0
+        read = 0
+        while True:
+            n = port.readinto(chunk)
+            if not n:
+                break
+            now = self.ticks_us()
+            for i in range(n):
+                if read < idle_bytes:
+                    end = time.ticks_add(idle_end, -(idle_bytes - 1 - read) * byte_us)
+                else:
+                    # Bytes that came after this one were on the wire since
+                    end = time.ticks_add(now, -(n - 1 - i) * byte_us)
+                self._feed(chunk[i], end)
+                read += 1
+            if n < len(chunk):
+                break
+        # An interrupt during the reads counted bytes that are gone now
+        self._idles_seen = self._idles
+        if self.master:
+            if time.ticks_diff(time.ticks_ms(), self._next_beacon) >= 0:
+                self._next_beacon = time.ticks_add(self._next_beacon, self.beacon_ms)
+                self.beacon()
+            if self.mirror and self.controller is not None:
+                self._mirror_changes()
+
+    def _feed(self, byte, end_us):
+        rx = self._rx
+        n = self._rx_len
+        if n == 0 and byte != _SYNC:
+            return
+        rx[n] = byte
+        n += 1
+        if n == _HEADER and rx[4] > _MAX_PAYLOAD:
+            n = 0
+        elif n > _HEADER and n == _HEADER + rx[4] + 2:
+            if crc16(rx, n - 2) == rx[n - 2] | rx[n - 1] << 8:
+                self.frames_received += 1
+                self._handle(end_us)
+            else:
+                self.crc_errors += 1
+            n = 0
+        self._rx_len = n
+
+    def _handle(self, end_us):
+        rx = self._rx
+        destination = rx[1]
+        if destination != self.address and destination != BROADCAST:
+            return
+        source = rx[2]
+        command = rx[3]
+        if command == BEACON and not self.master:
+            sequence, master_us = struct.unpack_from(_BEACON, rx, _HEADER)
+            if self._sample_count:
+                self.beacons_missed += (sequence - self._sequence - 1) & 0xFF
+            self._sequence = sequence
+            self._add_sample(time.ticks_diff(end_us, master_us))
+        elif command == SETTINGS and not self.master and rx[4] & 1:
+            # As many displays as the master has
+            self._apply_settings(struct.unpack_from("<{}HB".format((rx[4] - 1) // 2), rx, _HEADER))
+        elif command == START_AT and not self.master:
+            bus_us, duration_us = struct.unpack_from(_START_AT, rx, _HEADER)
+            self._start(bus_us, duration_us)
+        elif command == PING:
+            exposure = self.controller.exposure if self.controller is not None else None
+            self._send(source, STATUS, _STATUS, 1 if self.synced else 0, self.offset_us,
+                       (exposure.exposures if exposure is not None else 0) & 0xFFFF,
+                       exposure.state if exposure is not None else 0)
+        elif command == STATUS and self.master:
+            self.nodes[source] = struct.unpack_from(_STATUS, rx, _HEADER)
+
+    def _add_sample(self, sample):
+        if self._sample_count and abs(sample - self.offset_us) > _RESYNC_US:
+            self.logger.info("Bus clock jumped, resynchronizing")
+            self._sample_count = 0
+        samples = self._samples
+        samples[self._sample_count % _SAMPLES] = sample
+        self._sample_count += 1
+        count = min(self._sample_count, _SAMPLES)
+        best = samples[0]
+        for i in range(1, count):
+            if samples[i] < best:
+                best = samples[i]
+        self.offset_us = best
+        self.synced = count >= _MIN_SAMPLES
+        if self._sample_count >= 2 * _SAMPLES:
+            self._sample_count -= _SAMPLES
+
+    def _send(self, destination, command, fmt=None, *values):
+        tx = self._tx
+        n = _HEADER
+        if fmt is not None:
+            struct.pack_into(fmt, tx, _HEADER, *values)
+            n += struct.calcsize(fmt)
+        tx[0] = _SYNC
+        tx[1] = destination
+        tx[2] = self.address
+        tx[3] = command
+        tx[4] = n - _HEADER
+        crc = crc16(tx, n)
+        tx[n] = crc & 0xFF
+        tx[n + 1] = crc >> 8
+        self._write(n + 2)
+
+    def _write(self, n):
+        enable = self.enable
+        if enable is not None:
+            enable.on()
+        self.port.write(memoryview(self._tx)[:n])
+        # Waits for the last stop bit before the driver lets go of the bus
+        self.port.flush()
+        if enable is not None:
+            enable.off()
+        self.frames_sent += 1
+
+    # Master: the timestamp is where the frame will end, the time building it
+    # takes is measured on the previous beacon
+    def beacon(self) -> None:
+        start = self.ticks_us()
+        self._sequence = (self._sequence + 1) & 0xFF
+        end = time.ticks_add(start, self._lead_us + self.airtime_us(_BEACON_FRAME))
+        tx = self._tx
+        struct.pack_into(_BEACON, tx, _HEADER, self._sequence, end)
+        tx[0] = _SYNC
+        tx[1] = BROADCAST
+        tx[2] = self.address
+        tx[3] = BEACON
+        tx[4] = _BEACON_FRAME - _HEADER - 2
+        crc = crc16(tx, _BEACON_FRAME - 2)
+        tx[_BEACON_FRAME - 2] = crc & 0xFF
+        tx[_BEACON_FRAME - 1] = crc >> 8
+        self._lead_us = time.ticks_diff(self.ticks_us(), start)
+        self._write(_BEACON_FRAME)
+
+    def ping(self, address) -> None:
+        self._send(address, PING)
+
+    # Master: the displays and the speed, to every node. A display that
+    # counts down or shows the exposure time goes as it was last set.
+    def send_settings(self) -> None:
+        c = self.controller
+        settings = self._settings
+        values = c.values
+        n = len(values)
+        for i in range(n):
+            if not _local(c, i):
+                settings[i] = values[i]
+        settings[n] = 1 if c.low_speed else 0
+        self._send(BROADCAST, SETTINGS, self._settings_format, *settings)
+
+    # Only what the user sets is mirrored: the ticks of a running countdown,
+    # the time it stops at and the exposure time are taken as they are
+    def _mirror_changes(self):
+        c = self.controller
+        seen = self._seen
+        values = c.values
+        was_local = self._local
+        changed = False
+        n = len(values)
+        for i in range(n):
+            local = _local(c, i)
+            if seen[i] != values[i]:
+                seen[i] = values[i]
+                if not local and not was_local[i]:
+                    changed = True
+            was_local[i] = local
+        if self._settings[n] != (1 if c.low_speed else 0):
+            changed = True
+        if changed:
+            self.send_settings()
+
+    def _apply_settings(self, settings):
+        c = self.controller
+        if c is None:
+            return
+        values = c.values
+        board = c.board
+        n = len(settings) - 1
+        for i in range(min(n, len(values))):
+            if settings[i] == _UNSET:
+                continue
+            value = max(board.min_val, min(board.max_val, settings[i]))
+            # A node's own countdown or exposure time is not overwritten
+            if value != values[i] and not _local(c, i):
+                c.rotary_event(i + 1, value - values[i])
+        if bool(settings[n]) != c.low_speed:
+            c.select_speed(bool(settings[n]))
+
+    # Master: every node and the master itself expose for duration_us from
+    # delay_ms from now; returns the bus time the lamps come on
+    def start_at(self, delay_ms, duration_us):
+        if not 0 < duration_us <= MAX_EXPOSURE_US:
+            raise ValueError("exposure out of range")
+        bus_us = time.ticks_add(self.bus_time(), delay_ms * 1000)
+        self._send(BROADCAST, START_AT, _START_AT, bus_us, duration_us)
+        self._start(bus_us, duration_us)
+        return bus_us
+
+    def _start(self, bus_us, duration_us):
+        exposure = self.controller.exposure if self.controller is not None else None
+        if exposure is None:
+            return
+        if not self.synced:
+            self.logger.warning("START_AT before the bus clock is synchronized, ignored")
+            return
+        # A bad frame must not end poll() and the bus task with it
+        try:
+            exposure.run((duration_us,), at_us=self.local_time(bus_us))
+        except ValueError as e:
+            self.logger.warning("START_AT of %d us rejected: %s", duration_us, e)
+            return
+        self.starts += 1
+
+
+# Display i counts down or shows the exposure time, nothing to mirror
+def _local(controller, i):
+    if controller.running == i + 1:
+        return 1
+    return 1 if controller.exposure_mode and i == len(controller.values) - 1 else 0
+
+
+# The node on UART1 and the SP3485, with the DMX_ENABLE jumpers closed
+def make_bus(address, controller=None, baud=_BAUD, **kwargs):
+    uart = UART(1, baudrate=baud, tx=Pin(_TX_PIN), rx=Pin(_RX_PIN), timeout=0, rxbuf=256)
+    enable = Pin(_ENABLE_PIN, Pin.OUT, value=0)
+    return BusNode(uart, address, enable, controller, baud, **kwargs)
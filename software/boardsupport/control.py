@@ -0,0 +1,236 @@
+# Remote control over TCP, a line protocol for a darkroom tablet
+#
+# Runs as a task on the runtime's event loop, so commands are applied between
+# other tasks and never race the UI. The exposure itself is switched by its
+# timer, which the network cannot delay.
+#
+# The server listens on every interface, so a client first sends the shared
+# secret from config.json ("control_token") as "AUTH <token>" within
+# _AUTH_TIMEOUT_S; anything else is answered "ERR auth" and the connection
+# closed. Without a token the server is not started. Commands, one per line:
+#
+#   GET                 the state, as a push line ahead of the OK
+#   SET <n> <value>     set display n; a running timer moves its deadline, the
+#                       exposure time is set in tenths of a second
+#   LATCH <n>           start or pause timer n
+#   SPEED LOW|HIGH      agitation speed
+#   LOAD                load the recipe selected on the last display
+#   EXPOSE <ms>         expose on the lamp
+#   STOPS <n>           move the exposure time by n thirds of a stop
+#   STRIP               start a test strip from the exposure time, or its next strip
+#   EXPOSEALL <ms>      expose on every node of the RS485 bus at once, on the master
+#   TRACE START|SAVE    restart the input trace or save it to flash now
+#
+# Each command is answered with "OK" or "ERR <reason>", a command that fails
+# unexpectedly with "ERR internal". Every authenticated client also receives
+# the state right after AUTH and whenever it changes, at most once per
+# push_ms, as one line:
+#
+#   S <seq> <display1> .. <displayN> <running timer, 0 for none> <low speed 0|1> <exposing 0|1>
+#
+# with one display per channel of the controller's board, four displays and
+# three timers on the Frankenstein board.
+
+import asyncio
+import logging
+
+# Lead time of EXPOSEALL, for the command to reach every node
+_BUS_DELAY_MS = 100
+_AUTH_TIMEOUT_S = 5
+
+
+# Takes as long for any wrong token, a byte at a time cannot be guessed
+def _same(a, b):
+    if len(a) != len(b):
+        return False
+    diff = 0
+    for i in range(len(a)):
+        diff |= a[i] ^ b[i]
+    return diff == 0
+
+
+class ControlServer:
+    def __init__(self, controller, token, port=7000, push_ms=100, max_clients=8) -> None:
+        if not token:
+            raise ValueError("The control server needs a token")
+        self.logger = logging.getLogger(__name__)
+        self.controller = controller
+        self._token = token.encode()
+        self.port = port
+        self.push_ms = push_ms
+        self.max_clients = max_clients
+        self.clients = []
+        # Connections still inside the AUTH window hold a slot too
+        self._pending = 0
+        self.sequence = 0
+        self._state = None
+        self._server = None
+        # Statistics
+        self.commands = 0
+        self.errors = 0
+        self.pushes = 0
+        self.refused = 0
+
+    def state(self):
+        c = self.controller
+        exposing = 1 if c.exposure is not None and c.exposure.remaining_us() else 0
+        return tuple(c.values) + (c.running, 1 if c.low_speed else 0, exposing)
+
+    def _state_line(self, state):
+        return "S {} {}\n".format(self.sequence, " ".join(str(v) for v in state))
+
+    # Returns the reply line for one command line
+    def handle(self, line):
+        self.commands += 1
+        words = line.split()
+        try:
+            reply = self._execute(words) if words else "ERR empty"
+        except (ValueError, IndexError) as e:
+            reply = "ERR {}".format(e)
+        except Exception as e:
+            # A bug behind one command must not end the connection
+            self.logger.error("%s failed: %r", words[0], e)
+            reply = "ERR internal"
+        if reply.startswith("ERR"):
+            self.errors += 1
+        return reply + "\n"
+
+    def _execute(self, words):
+        c = self.controller
+        command = words[0].upper()
+        if command == "GET":
+            return self._state_line(self.state()) + "OK"
+        board = c.board
+        if command == "SET":
+            display = int(words[1])
+            if not 1 <= display <= board.channels:
+                raise ValueError("display must be 1-{}".format(board.channels))
+            value = int(words[2])
+            if c.exposure_mode and display == board.channels:
+                # The exposure time in tenths, not a detent count
+                if not 1 <= value <= board.max_val:
+                    raise ValueError("exposure must be 1-{} tenths".format(board.max_val))
+                c.set_exposure(value * 100_000)
+                return "OK"
+            if not board.min_val <= value <= board.max_val:
+                raise ValueError("value must be {}-{}".format(board.min_val, board.max_val))
+            c.rotary_event(display, value - c.values[display - 1])
+            return "OK"
+        if command == "LATCH":
+            timer = int(words[1])
+            if not 1 <= timer <= board.timers:
+                raise ValueError("timer must be 1-{}".format(board.timers))
+            c.button_event(board.switch_names[timer - 1])
+            return "OK"
+        if command == "SPEED":
+            speed = words[1].upper()
+            if speed not in ("LOW", "HIGH"):
+                raise ValueError("speed must be LOW or HIGH")
+            if not c.select_speed(speed == "LOW"):
+                return "ERR no speed switch"
+            return "OK"
+        if command == "LOAD":
+            c.button_event("button4")
+            return "OK"
+        if command == "EXPOSE":
+            if c.exposure is None:
+                return "ERR no lamp"
+            c.exposure.expose(int(words[1]) * 1000)
+            return "OK"
+        if command == "STOPS":
+            if c.exposure is None:
+                return "ERR no lamp"
+            c.adjust_exposure(int(words[1]))
+            return "OK"
+        if command == "STRIP":
+            if c.exposure is None:
+                return "ERR no lamp"
+            c.button_event("button3")
+            return "OK"
+        if command == "EXPOSEALL":
+            if c.bus is None or not c.bus.master:
+                return "ERR not the bus master"
+            c.bus.start_at(_BUS_DELAY_MS, int(words[1]) * 1000)
+            return "OK"
+        if command == "TRACE":
+            if c.trace is None:
+                return "ERR no trace"
+            action = words[1].upper()
+            if action == "START":
+                c.trace.start()
+            elif action == "SAVE":
+                c.trace.save()
+            else:
+                raise ValueError("TRACE START or SAVE")
+            return "OK"
+        return "ERR unknown command"
+
+    async def _client(self, reader, writer):
+        if len(self.clients) + self._pending >= self.max_clients:
+            writer.write(b"ERR busy\n")
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+            return
+        self._pending += 1
+        try:
+            try:
+                authenticated = await self._authenticate(reader)
+            finally:
+                self._pending -= 1
+            if not authenticated:
+                self.refused += 1
+                writer.write(b"ERR auth\n")
+                await writer.drain()
+                return
+            self.clients.append(writer)
+            writer.write(self._state_line(self.state()).encode())
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(self.handle(line.decode()).encode())
+                await writer.drain()
+                # Changes show up in the next push, not in the reply
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            if writer in self.clients:
+                self.clients.remove(writer)
+            writer.close()
+            await writer.wait_closed()
+
+    async def _authenticate(self, reader):
+        line = await asyncio.wait_for(reader.readline(), _AUTH_TIMEOUT_S)
+        words = line.split()
+        return len(words) == 2 and words[0] == b"AUTH" and _same(words[1], self._token)
+
+    # One line per change and interval, to every client
+    async def _push(self):
+        while True:
+            await asyncio.sleep_ms(self.push_ms)
+            state = self.state()
+            if state == self._state or not self.clients:
+                self._state = state
+                continue
+            self._state = state
+            self.sequence += 1
+            data = self._state_line(state).encode()
+            for writer in self.clients:
+                writer.write(data)
+            self.pushes += 1
+            for writer in tuple(self.clients):
+                try:
+                    await writer.drain()
+                except OSError:
+                    self.clients.remove(writer)
+
+    async def run(self):
+        self._server = await asyncio.start_server(self._client, "0.0.0.0", self.port)
+        self.logger.info("Control server on port %d", self.port)
+        try:
+            await self._push()
+        finally:
+            self._server.close()
+            await self._server.wait_closed()
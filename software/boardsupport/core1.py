@@ -0,0 +1,357 @@
+# Motion and exposure timing on the second core
+#
+# With dual_core=True the controller hands its AgitationMotion and
+# ExposureScheduler to a Core1 engine, which runs them on core 1 with
+# _thread. Core 1 has no timers of its own: the engine swaps their one-shot
+# timers for PolledTimers and checks the deadlines in a tight loop, so a step
+# or the lamp switches within one pass of the loop of its deadline, whatever
+# core 0 is busy with (rendering, encoder IRQs, WiFi, the GC).
+#
+# The cores share no dicts and take no locks. Core 0 posts commands into a
+# Mailbox, a preallocated ring of (command, argument, payload) entries whose
+# head is only written by core 0 and whose tail only by core 1; objects that
+# go along with a command (new ramp tables, test strip segments) are built on
+# core 0 and stored in the command's own entry before the head moves, so a
+# second command cannot replace the payload of one still queued. Core 1
+# publishes its state in a status array under a sequence number that is odd
+# while it writes, core 0 reads it again when the number changed. The
+# RP2040's cores see memory in program order, so publishing an index last is
+# enough. MotionProxy and ExposureProxy present both over the mailbox with
+# the API the controller and the control server already use.
+
+from array import array
+from micropython import const
+import time
+from .exposure import EXPOSING as _EXPOSING, MAX_EXPOSURE_US
+from .motion import IDLE as _MOTION_IDLE, TrapezoidRamp
+from .telemetry import Probe
+
+# Commands
+_MOTION_START = const(1)
+_MOTION_STOP = const(2)
+_MOTION_RAMPS = const(3)
+_EXPOSURE_RUN = const(4)
+_EXPOSURE_START = const(5)
+_EXPOSURE_CANCEL = const(6)
+_RESET_STATS = const(7)
+_QUIT = const(8)
+# _EXPOSURE_RUN with the ticks_us deadline of the first segment as argument
+_EXPOSURE_RUN_AT = const(9)
+
+# Status words
+_SEQUENCE = const(0)
+_MOTION_STATE = const(1)
+_CYCLES = const(2)
+_EXPOSURE_STATE = const(3)
+# ticks_us the running segment ends at
+_EXPOSURE_END = const(4)
+_LAST_ERROR = const(5)
+_MAX_ERROR = const(6)
+_EXPOSURES = const(7)
+_STATUS_SIZE = const(8)
+
+# How long a full mailbox is waited on before core 1 is given up
+_POST_TIMEOUT_US = const(10_000)
+# Counters on core 1 stay small ints, anything larger would allocate there
+_SMALL_MAX = const(0x3FFFFFFF)
+
+
+class Mailbox:
+    def __init__(self, size=16) -> None:
+        if size & (size - 1):
+            raise ValueError("size must be a power of two")
+        self._mask = size - 1
+        # Positions count modulo twice the size, so full and empty differ
+        self._wrap = 2 * size - 1
+        self._commands = array("i", [0] * size)
+        self._args = array("i", [0] * size)
+        self._payloads = [None] * size
+        # head, written by the producer only; tail, by the consumer only
+        self._index = array("I", [0, 0])
+        # Argument and payload of the command get() returned last
+        self.arg = 0
+        self.payload = None
+
+    def __len__(self):
+        return (self._index[0] - self._index[1]) & self._wrap
+
+    # Producer side, False when the ring is full
+    def put(self, command, arg=0, payload=None) -> bool:
+        index = self._index
+        head = index[0]
+        if ((head - index[1]) & self._wrap) > self._mask:
+            return False
+        i = head & self._mask
+        self._commands[i] = command
+        self._args[i] = arg
+        self._payloads[i] = payload
+        index[0] = (head + 1) & self._wrap
+        return True
+
+    # Consumer side, the next command or -1
+    def get(self):
+        index = self._index
+        tail = index[1]
+        if tail == index[0]:
+            return -1
+        i = tail & self._mask
+        command = self._commands[i]
+        self.arg = self._args[i]
+        payloads = self._payloads
+        self.payload = payloads[i]
+        # The ring does not keep it alive once taken
+        payloads[i] = None
+        index[1] = (tail + 1) & self._wrap
+        return command
+
+
+class PolledTimer:
+    # Stands in for the one-shot machine.Timer of motion and exposure. A timer
+    # re-armed from its own callback counts from the deadline that fired, so
+    # lateness does not add up over a move. period is in µs (tick_hz 1 MHz).
+    def __init__(self, late=None) -> None:
+        self.callback = None
+        self.late = late
+        self._due = 0
+        self._firing = False
+
+    def init(self, mode=0, tick_hz=1_000_000, period=0, callback=None) -> None:
+        base = self._due if self._firing else time.ticks_us()
+        self._due = time.ticks_add(base, period)
+        self.callback = callback
+
+    def deinit(self) -> None:
+        self.callback = None
+
+    def poll(self, now) -> None:
+        callback = self.callback
+        if callback is None:
+            return
+        late = time.ticks_diff(now, self._due)
+        if late < 0:
+            return
+        probe = self.late
+        if probe is not None:
+            if probe.total_us > _SMALL_MAX - late:
+                probe.reset()
+            probe.record(late)
+        self.callback = None
+        self._firing = True
+        callback(self)
+        self._firing = False
+
+
+class Core1:
+    def __init__(self, motion=None, exposure=None, mailbox_size=16) -> None:
+        self.motion = motion
+        self.exposure = exposure
+        self.mailbox = Mailbox(mailbox_size)
+        self.status = array("i", [0] * _STATUS_SIZE)
+        # Lateness of the steps against their deadlines, in µs
+        self.step_late = Probe()
+        self._motion_timer = None
+        self._exposure_timer = None
+        if motion is not None:
+            self._motion_timer = motion._timer = PolledTimer(self.step_late)
+        if exposure is not None:
+            self._exposure_timer = exposure._timer = PolledTimer()
+        self.running = False
+        self.loops = 0
+        self._publish()
+
+    def start(self) -> None:
+        import _thread
+
+        self.running = True
+        _thread.start_new_thread(self._run, ())
+
+    def stop(self) -> None:
+        self.post(_QUIT)
+
+    # Core 0 side: waits for room while core 1 works through the ring
+    def post(self, command, arg=0, payload=None) -> None:
+        mailbox = self.mailbox
+        if mailbox.put(command, arg, payload):
+            return
+        start = time.ticks_us()
+        while not mailbox.put(command, arg, payload):
+            if time.ticks_diff(time.ticks_us(), start) > _POST_TIMEOUT_US:
+                raise RuntimeError("core 1 not responding")
+
+    # Core 0 side: copies a consistent status into out
+    def read_status(self, out) -> None:
+        status = self.status
+        while True:
+            sequence = status[_SEQUENCE]
+            for i in range(1, _STATUS_SIZE):
+                out[i] = status[i]
+            if not sequence & 1 and status[_SEQUENCE] == sequence:
+                out[_SEQUENCE] = sequence
+                return
+
+    def _run(self):
+        while self.running:
+            self.poll()
+
+    # One pass of the core 1 loop; also usable from core 0 without the thread
+    def poll(self) -> None:
+        mailbox = self.mailbox
+        command = mailbox.get()
+        while command >= 0:
+            self._execute(command, mailbox.arg, mailbox.payload)
+            command = mailbox.get()
+        now = time.ticks_us()
+        if self._motion_timer is not None:
+            self._motion_timer.poll(now)
+        if self._exposure_timer is not None:
+            self._exposure_timer.poll(now)
+        self._publish()
+        self.loops = (self.loops + 1) & _SMALL_MAX
+
+    def _execute(self, command, arg, payload):
+        motion = self.motion
+        exposure = self.exposure
+        if command == _MOTION_START:
+            motion.start()
+        elif command == _MOTION_STOP:
+            motion.stop()
+        elif command == _MOTION_RAMPS:
+            # Replaced whole, a running move picks them up at its next step
+            motion._forward = payload[0]
+            motion._reverse = payload[1]
+        elif command == _EXPOSURE_RUN:
+            exposure.run(payload)
+        elif command == _EXPOSURE_RUN_AT:
+            exposure.run(payload, arg)
+        elif command == _EXPOSURE_START:
+            exposure.start()
+        elif command == _EXPOSURE_CANCEL:
+            exposure.cancel()
+        elif command == _RESET_STATS:
+            self.step_late.reset()
+            if exposure is not None:
+                exposure.max_error_us = 0
+        elif command == _QUIT:
+            if motion is not None:
+                motion.stop()
+            if exposure is not None:
+                exposure.cancel()
+            self.running = False
+
+    def _publish(self):
+        status = self.status
+        # Odd while the words below are written
+        status[_SEQUENCE] = (status[_SEQUENCE] + 1) & _SMALL_MAX
+        motion = self.motion
+        if motion is not None:
+            status[_MOTION_STATE] = motion.state
+            status[_CYCLES] = motion.cycles
+        exposure = self.exposure
+        if exposure is not None:
+            status[_EXPOSURE_STATE] = exposure.state
+            status[_EXPOSURE_END] = time.ticks_add(exposure._last, exposure._left)
+            status[_LAST_ERROR] = exposure.last_error_us
+            status[_MAX_ERROR] = exposure.max_error_us
+            status[_EXPOSURES] = exposure.exposures
+        status[_SEQUENCE] = (status[_SEQUENCE] + 1) & _SMALL_MAX
+
+
+class MotionProxy:
+    # AgitationMotion's controls, for the instance running on core 1
+    def __init__(self, core1) -> None:
+        self.core1 = core1
+        self.profile = core1.motion.profile
+        self._status = array("i", [0] * _STATUS_SIZE)
+
+    def start(self) -> None:
+        self.core1.post(_MOTION_START)
+
+    def stop(self) -> None:
+        self.core1.post(_MOTION_STOP)
+
+    # The tables are computed here on core 0, core 1 only swaps them in
+    def configure(self, **kwargs) -> None:
+        p = self.profile
+        for name, value in kwargs.items():
+            if not hasattr(p, name):
+                raise AttributeError(name)
+            setattr(p, name, value)
+        ramps = (
+            TrapezoidRamp(p.forward_steps, p.speed, p.accel, p.start_speed),
+            TrapezoidRamp(p.reverse_steps, p.speed, p.accel, p.start_speed),
+        )
+        self.core1.post(_MOTION_RAMPS, 0, ramps)
+
+    def set_speed(self, speed) -> None:
+        self.configure(speed=speed)
+
+    @property
+    def state(self):
+        self.core1.read_status(self._status)
+        return self._status[_MOTION_STATE]
+
+    @property
+    def running(self):
+        return self.state != _MOTION_IDLE
+
+    @property
+    def cycles(self):
+        self.core1.read_status(self._status)
+        return self._status[_CYCLES]
+
+
+class ExposureProxy:
+    # ExposureScheduler's controls, for the instance running on core 1
+    def __init__(self, core1) -> None:
+        self.core1 = core1
+        self.lamp = core1.exposure.lamp
+        self._status = array("i", [0] * _STATUS_SIZE)
+
+    def expose(self, duration_us) -> None:
+        self.run((duration_us,))
+
+    def run(self, segments, at_us=None) -> None:
+        for duration in segments:
+            if not 0 < duration <= MAX_EXPOSURE_US:
+                raise ValueError("exposure out of range")
+        segments = tuple(segments)
+        if at_us is None:
+            self.core1.post(_EXPOSURE_RUN, 0, segments)
+        else:
+            self.core1.post(_EXPOSURE_RUN_AT, at_us, segments)
+
+    def start(self) -> None:
+        self.core1.post(_EXPOSURE_START)
+
+    def cancel(self) -> None:
+        self.core1.post(_EXPOSURE_CANCEL)
+
+    def reset_stats(self) -> None:
+        self.core1.post(_RESET_STATS)
+
+    def _read(self, field):
+        self.core1.read_status(self._status)
+        return self._status[field]
+
+    @property
+    def state(self):
+        return self._read(_EXPOSURE_STATE)
+
+    def remaining_us(self):
+        status = self._status
+        self.core1.read_status(status)
+        if status[_EXPOSURE_STATE] != _EXPOSING:
+            return 0
+        return max(0, time.ticks_diff(status[_EXPOSURE_END], time.ticks_us()))
+
+    @property
+    def last_error_us(self):
+        return self._read(_LAST_ERROR)
+
+    @property
+    def max_error_us(self):
+        return self._read(_MAX_ERROR)
+
+    @property
+    def exposures(self):
+        return self._read(_EXPOSURES)
@@ -10,9 +10,22 @@ except ImportError:
     from pyb import Timer
     timer_init = lambda t, p, cb: t.init(freq=1000 // p, callback=cb)
 
+try:
+    from machine import Pin, mem32
+except ImportError:
+    mem32 = None
+
 # uncomment when debugging callback problems
 #micropython.alloc_emergency_exception_buf(100)
 
+# RP2040 SIO GPIO_IN: the level of GPIO0-29 in one word
+_SIO_GPIO_IN = const(0xD0000004)
+
+# Event codes BankDebouncer posts as the record's delta
+PRESS = const(1)
+RELEASE = const(-1)
+LONG_PRESS = const(2)
+
 
 class DebouncedSwitch:
     def __init__(self, sw, cb, arg=None, delay=50):
@@ -43,6 +56,87 @@ class DebouncedSwitch:
         self._set_cb(self._sw_cb if cb else None)
 
 
+class BankDebouncer:
+    # Debounces a group of switches with one timer. Every scan reads all pins
+    # as one word and runs a 2-bit vertical counter per bit: a pin has to read
+    # the same for four scans in a row before its debounced state flips, at
+    # the same cost for any number of switches. Edges and long presses are
+    # posted to an EventQueue as (source_base + index, PRESS/RELEASE/LONG_PRESS).
+    def __init__(self, pins, queue, source_base=0, period_ms=5, long_ms=800,
+                 active_high=True, pull=None):
+        if mem32 is None:
+            raise OSError("BankDebouncer needs machine.mem32")
+        self.queue = queue
+        self.source_base = source_base
+        self.period_ms = period_ms
+        self._long_scans = long_ms // period_ms
+        self._bits = tuple(1 << p for p in pins)
+        self.mask = 0
+        for bit in self._bits:
+            self.mask |= bit
+        if pull is None:
+            pull = Pin.PULL_DOWN if active_high else Pin.PULL_UP
+        self._pins = tuple(Pin(p, Pin.IN, pull) for p in pins)
+        self._invert = 0 if active_high else self.mask
+        self.state = 0
+        self._ct0 = self.mask
+        self._ct1 = self.mask
+        # Scans each pressed switch has been held, until it reports a long press
+        self._held = bytearray(len(pins)) if self._long_scans < 256 else [0] * len(pins)
+        self._pressed = 0
+        self.scans = 0
+        self._scan_cb = self.scan
+        self.tim = Timer()
+
+    def start(self):
+        timer_init(self.tim, self.period_ms, self._scan_cb)
+
+    def stop(self):
+        self.tim.deinit()
+
+    def scan(self, tim=None):
+        mask = self.mask
+        sample = (mem32[_SIO_GPIO_IN] ^ self._invert) & mask
+        changed = sample ^ self.state
+        # Vertical counter: bits that differ count up, bits that agree reset
+        ct0 = ~(self._ct0 & changed) & mask
+        ct1 = (ct0 ^ (self._ct1 & changed)) & mask
+        self._ct0 = ct0
+        self._ct1 = ct1
+        toggled = changed & ct0 & ct1
+        self.scans += 1
+        if self._pressed:
+            self._count_held()
+        if toggled:
+            self.state ^= toggled
+            self._report(toggled)
+
+    def _report(self, toggled):
+        bits = self._bits
+        state = self.state
+        for i in range(len(bits)):
+            bit = bits[i]
+            if toggled & bit:
+                if state & bit:
+                    self._pressed |= bit
+                    self._held[i] = 0
+                    self.queue.post(self.source_base + i, PRESS)
+                else:
+                    self._pressed &= ~bit
+                    self.queue.post(self.source_base + i, RELEASE)
+
+    def _count_held(self):
+        bits = self._bits
+        held = self._held
+        for i in range(len(bits)):
+            if self._pressed & bits[i]:
+                held[i] += 1
+                if held[i] >= self._long_scans:
+                    # Reported once per press
+                    self._pressed &= ~bits[i]
+                    self.queue.post(self.source_base + i, LONG_PRESS)
+
+
 def test_pyb(ledno=1):
     import pyb
     sw = pyb.Switch()
@@ -0,0 +1,83 @@
+# Double-buffered DMA ring feeding a PIO state machine
+#
+# A data channel streams the current frame into the state machine's TX FIFO,
+# paced by the FIFO's DREQ. When it finishes it chains to a control channel
+# that re-arms it from a one-word pointer, so the frame repeats forever with
+# no CPU involvement. show() copies a new frame into the idle buffer and swaps
+# the pointer; the DMA picks it up at the next frame boundary, so frames are
+# never torn as long as show() is not called faster than the ring repeats.
+
+from array import array
+from micropython import const
+import rp2
+import uctypes
+
+_DMA_BASE = const(0x50000000)
+_DMA_CH_STRIDE = const(0x40)
+_DMA_AL3_READ_ADDR_TRIG = const(0x3C)
+_PIO0_BASE = const(0x50200000)
+_PIO1_BASE = const(0x50300000)
+_PIO_TXF0 = const(0x10)
+_TREQ_PERMANENT = const(0x3F)
+_DMA_SIZE_8 = const(0)
+_DMA_SIZE_32 = const(2)
+# x[_WHOLE] = y copies like x[:] = y without a new slice object per call
+_WHOLE = slice(None)
+
+
+class FrameRing:
+    def __init__(self, sm_id, initial) -> None:
+        self._buffers = (bytearray(initial), bytearray(initial))
+        # One copy per show(), however long the ring is
+        self._views = (memoryview(self._buffers[0]), memoryview(self._buffers[1]))
+        self._addresses = (
+            uctypes.addressof(self._buffers[0]),
+            uctypes.addressof(self._buffers[1]),
+        )
+        self._back = 1
+        self._ptr = array("I", [self._addresses[0]])
+
+        pio, index = sm_id // 4, sm_id % 4
+        txf = (_PIO1_BASE if pio else _PIO0_BASE) + _PIO_TXF0 + 4 * index
+        dreq = 8 * pio + index
+
+        self._data = rp2.DMA()
+        self._ctrl = rp2.DMA()
+        self._data.config(
+            read=self._buffers[0],
+            write=txf,
+            count=len(initial),
+            ctrl=self._data.pack_ctrl(
+                size=_DMA_SIZE_8,
+                inc_read=True,
+                inc_write=False,
+                treq_sel=dreq,
+                chain_to=self._ctrl.channel,
+            ),
+        )
+        self._ctrl.config(
+            read=self._ptr,
+            write=_DMA_BASE + _DMA_CH_STRIDE * self._data.channel + _DMA_AL3_READ_ADDR_TRIG,
+            count=1,
+            ctrl=self._ctrl.pack_ctrl(
+                size=_DMA_SIZE_32,
+                inc_read=False,
+                inc_write=False,
+                treq_sel=_TREQ_PERMANENT,
+            ),
+        )
+
+    def start(self) -> None:
+        self._ctrl.active(1)
+
+    def stop(self) -> None:
+        self._data.active(0)
+        self._ctrl.active(0)
+        self._data.close()
+        self._ctrl.close()
+
+    def show(self, buf) -> None:
+        back = self._back
+        self._views[back][_WHOLE] = buf
+        self._ptr[0] = self._addresses[back]
+        self._back = back ^ 1
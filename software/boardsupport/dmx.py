@@ -0,0 +1,151 @@
+# DMX512 output on the SP3485 RS485 transceiver
+#
+# With the DMX_ENABLE jumpers closed the transceiver's driver input is GP8 and
+# its driver enable GP22. A PIO state machine generates the whole packet:
+# break, mark-after-break, then the start code and slots as 250 kbaud 8N2
+# frames. It is fed by the same DMA ring as the display refresh, so the
+# universe is retransmitted continuously and set()/commit() only touch RAM.
+#
+# At 1 MHz a bit is 4 cycles, a slot 44. A full universe takes
+# 94 + 13 + 513 * 44 = 22679 µs, about 44 packets per second. DMX512 wants
+# at least 1204 µs from break to break, which many fixtures rely on; shorter
+# universes are padded with zero slots up to MIN_SLOTS, 94 + 13 + 25 * 44 =
+# 1207 µs.
+#
+# DMX shares GP8/GP9 with the TMC5160 breakout, only one can be fitted.
+
+from machine import Pin
+from micropython import const
+import rp2
+from .dmaring import FrameRing
+
+_TX_PIN = const(8)
+_ENABLE_PIN = const(22)
+
+_SM_FREQ = const(1_000_000)
+_CYCLES_PER_SLOT = const(44)
+# Break and mark-after-break as generated by the program below, in cycles
+_BREAK_CYCLES = const(94)
+_MAB_CYCLES = const(13)
+
+START_CODE = const(0x00)
+MAX_SLOTS = const(512)
+MIN_SLOTS = const(24)
+MIN_PACKET_US = const(1204)
+
+
+@rp2.asm_pio(
+    out_init=rp2.PIO.OUT_HIGH,
+    set_init=rp2.PIO.OUT_HIGH,
+    out_shiftdir=rp2.PIO.SHIFT_RIGHT,
+    autopull=True,
+    pull_thresh=8,
+)
+def _dmx_packet():
+    # ISR holds the number of slots per packet including the start code, minus one
+    wrap_target()
+    # Break: 2 + 23 * 4 = 94 µs low
+    set(pins, 0)
+    set(y, 22)
+    label("break")
+    jmp(y_dec, "break")     [3]
+    # Mark after break: 13 µs
+    set(pins, 1)            [11]
+    mov(x, isr)
+    label("slot")
+    # Start bit, LSB first data bits, two stop bits: 4 cycles per bit
+    set(pins, 0)            [2]
+    set(y, 7)
+    label("bit")
+    out(pins, 1)            [2]
+    jmp(y_dec, "bit")
+    set(pins, 1)            [6]
+    jmp(x_dec, "slot")
+    wrap()
+
+
+class DMXOutput:
+    def __init__(self, slots=MAX_SLOTS, sm_id=1, tx=_TX_PIN, enable=_ENABLE_PIN) -> None:
+        if not 1 <= slots <= MAX_SLOTS:
+            raise ValueError("slots must be 1..512")
+        slots = max(slots, MIN_SLOTS)
+        self.slots = slots
+        # universe[0] is the start code, universe[n] channel n
+        self.universe = bytearray(slots + 1)
+        self.universe[0] = START_CODE
+        self.cycles_per_packet = _BREAK_CYCLES + _MAB_CYCLES + (slots + 1) * _CYCLES_PER_SLOT
+        self.commits = 0
+        self._dirty = False
+        self._enable = Pin(enable, Pin.OUT, value=1)
+        self._sm = rp2.StateMachine(sm_id, _dmx_packet, freq=_SM_FREQ, out_base=Pin(tx), set_base=Pin(tx))
+        self._sm.put(slots)
+        self._sm.exec("pull()")
+        self._sm.exec("mov(isr, osr)")
+        self._sm.exec("out(null, 32)")
+        self._ring = FrameRing(sm_id, self.universe)
+        self._sm.active(1)
+        self._ring.start()
+
+    @property
+    def rate(self):
+        return _SM_FREQ / self.cycles_per_packet
+
+    def set(self, channel, value) -> None:
+        self.universe[channel] = value
+        self._dirty = True
+
+    def get(self, channel):
+        return self.universe[channel]
+
+    def blackout(self) -> None:
+        universe = self.universe
+        for i in range(1, len(universe)):
+            universe[i] = 0
+        self._dirty = True
+        self.commit()
+
+    # Hands the universe to the ring, it goes out from the next packet on
+    def commit(self) -> bool:
+        if not self._dirty:
+            return False
+        self._ring.show(self.universe)
+        self._dirty = False
+        self.commits += 1
+        return True
+
+    def deinit(self) -> None:
+        self._ring.stop()
+        self._sm.active(0)
+        self._enable.value(0)
+
+
+class DMXLamp:
+    # An enlarger light head on one (8 bit) or two (16 bit, coarse first) channels
+    def __init__(self, dmx, channel, fine=False, level=0xFFFF) -> None:
+        self.dmx = dmx
+        self.channel = channel
+        self.fine = fine
+        self.level = level
+        self.lit = False
+
+    def set_level(self, level) -> None:
+        self.level = level
+        if self.lit:
+            self._write(level)
+
+    def _write(self, level):
+        dmx = self.dmx
+        if self.fine:
+            dmx.set(self.channel, level >> 8)
+            dmx.set(self.channel + 1, level & 0xFF)
+        else:
+            dmx.set(self.channel, level >> 8)
+        dmx.commit()
+
+    def on(self) -> None:
+        self.lit = True
+        self._write(self.level)
+
+    def off(self) -> None:
+        self.lit = False
+        self._write(0)
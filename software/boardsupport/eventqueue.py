@@ -0,0 +1,127 @@
+# Input event queue between the IRQ handlers and the controller
+#
+# Records are (source, delta, ticks_ms) in three preallocated arrays used as
+# a ring, so posting from an IRQ never allocates. Encoder deltas from the
+# same source coalesce into the newest pending record while the consumer has
+# not caught up. The first post after a drain schedules a single consumer,
+# which hands every pending record to the handler in one batch.
+
+from array import array
+import machine
+import micropython
+from micropython import const
+import time
+
+_DELTA_MAX = const(32767)
+
+
+class EventQueue:
+    def __init__(self, handler, size=32) -> None:
+        if size & (size - 1):
+            raise ValueError("size must be a power of two")
+        self.handler = handler
+        self._mask = size - 1
+        self._sources = bytearray(size)
+        self._deltas = array("h", [0] * size)
+        self._ticks = array("I", [0] * size)
+        # Positions count modulo twice the size, so full and empty differ
+        self._wrap = 2 * size - 1
+        self._head = 0
+        self._tail = 0
+        self._scheduled = False
+        self._drain_cb = self.drain
+        self._notify = None
+        # Statistics
+        self.posted = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.schedule_failures = 0
+        self.drains = 0
+        self.drained = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return (self._head - self._tail) & self._wrap
+
+    # Called from IRQ context: a button press or other discrete event
+    def post(self, source, delta=1) -> None:
+        self.posted += 1
+        self._push(source, delta)
+
+    # Called from IRQ context: merges into a pending record of the same source
+    def post_delta(self, source, delta) -> None:
+        self.posted += 1
+        head = self._head
+        if head != self._tail:
+            last = (head - 1) & self._mask
+            if self._sources[last] == source:
+                total = self._deltas[last] + delta
+                if -_DELTA_MAX <= total <= _DELTA_MAX:
+                    self._deltas[last] = total
+                    self._ticks[last] = time.ticks_ms()
+                    self.coalesced += 1
+                    self._wake()
+                    return
+        self._push(source, delta)
+
+    def _push(self, source, delta):
+        head = self._head
+        depth = (head - self._tail) & self._wrap
+        if depth > self._mask:
+            self.overflows += 1
+        else:
+            i = head & self._mask
+            self._sources[i] = source
+            self._deltas[i] = delta
+            self._ticks[i] = time.ticks_ms()
+            self._head = (head + 1) & self._wrap
+            if depth + 1 > self.max_depth:
+                self.max_depth = depth + 1
+        self._wake()
+
+    # Instead of scheduling drain(), call notify() (e.g. ThreadSafeFlag.set)
+    # and leave draining to whoever waits on it
+    def notify(self, callback) -> None:
+        self._notify = callback
+
+    def _wake(self):
+        if self._notify is not None:
+            self._notify()
+            return
+        if not self._scheduled:
+            self._scheduled = True
+            try:
+                micropython.schedule(self._drain_cb, None)
+            except RuntimeError:
+                # The next post tries again
+                self._scheduled = False
+                self.schedule_failures += 1
+
+    # Runs as the scheduled consumer, handler(source, delta, ticks) per record
+    def drain(self, arg=None) -> None:
+        self._scheduled = False
+        self.drains += 1
+        mask = self._mask
+        handler = self.handler
+        while True:
+            state = machine.disable_irq()
+            tail = self._tail
+            if tail == self._head:
+                machine.enable_irq(state)
+                break
+            i = tail & mask
+            source = self._sources[i]
+            delta = self._deltas[i]
+            ticks = self._ticks[i]
+            self._tail = (tail + 1) & self._wrap
+            machine.enable_irq(state)
+            self.drained += 1
+            handler(source, delta, ticks)
+
+    @property
+    def coalesce_rate(self):
+        return self.coalesced / self.posted if self.posted else 0.0
+
+    @property
+    def overflow_rate(self):
+        return self.overflows / self.posted if self.posted else 0.0
@@ -0,0 +1,202 @@
+# Exposure and countdown timing on tick deadlines
+#
+# Time is always measured against the moment a run started, never derived
+# from how often a callback happened to run, so timer latency and render time
+# do not accumulate. ExposureScheduler arms its one-shot timer a guard
+# interval early and spins on ticks_us for the rest. The spin holds up every
+# other IRQ, so the guard is only GUARD_US: the lamp switches within a few µs
+# of the deadline when the timer callback runs less than that late, and
+# otherwise as late as the callback. On core 1 (see core1.py) the timer is
+# polled and never that late. ticks_us wraps after about 17 minutes, so the
+# remaining time is carried forward at every wake-up (at least every
+# _CHUNK_US) instead of being compared against one distant tick value.
+
+from machine import Timer
+from micropython import const
+import time
+
+# Step sizes for adjust(): tenths of a second or fractions of a stop
+TENTHS = const(0)
+THIRD_STOP = const(3)
+SIXTH_STOP = const(6)
+TWELFTH_STOP = const(12)
+
+# Keeps every µs count a small int
+MAX_EXPOSURE_US = const(1_000_000_000)
+
+# 2 ** (k / 12) for k in 0..11, scaled by 2 ** 24, so adjust() needs no float
+_STOP_SHIFT = const(24)
+_STOP_FACTORS = (
+    16777216, 17774841, 18831788, 19951585, 21137968, 22394897,
+    23726566, 25137421, 26632170, 28215802, 29893600, 31671166,
+)
+
+_CHUNK_US = const(250_000)
+# Longest the lamp-off spin may hold up the encoders, steps and bus
+GUARD_US = const(50)
+_TICK_HZ = const(1_000_000)
+
+IDLE = const(0)
+EXPOSING = const(1)
+# Between the segments of a test strip, waiting for start()
+READY = const(2)
+# Waiting for the ticks_us deadline the first segment starts at
+ARMED = const(3)
+
+
+def adjust(duration_us, steps, mode=TENTHS):
+    if mode == TENTHS:
+        duration_us += steps * 100_000
+    else:
+        # Whole stops shift, the twelfths left over come from the table. The
+        # product leaves the small int range, which is fine on a button press.
+        twelfths = steps * (12 // mode)
+        shift = _STOP_SHIFT - twelfths // 12
+        scaled = duration_us * _STOP_FACTORS[twelfths % 12]
+        if shift > 0:
+            duration_us = (scaled + (1 << (shift - 1))) >> shift
+        else:
+            duration_us = scaled << min(-shift, 32)
+    return max(0, min(MAX_EXPOSURE_US, duration_us))
+
+
+# Exposure times of `count` strips, each `step` mode units above the last.
+# Incremental strips are exposed one after another while more of the paper
+# is covered, so the segments are the differences between the times.
+def test_strip(base_us, count, step=1, mode=THIRD_STOP, incremental=True):
+    times = [adjust(base_us, i * step, mode) for i in range(count)]
+    if not incremental:
+        return times
+    return [times[0]] + [times[i] - times[i - 1] for i in range(1, count)]
+
+
+class ExposureScheduler:
+    def __init__(self, lamp, guard_us=GUARD_US) -> None:
+        self.lamp = lamp
+        self.guard_us = guard_us
+        self.state = IDLE
+        self.segments = ()
+        self.index = 0
+        self._left = 0
+        self._last = 0
+        self._timer = Timer()
+        self._tick_cb = self._tick
+        # The time base; bus nodes simulated on one host each have their own
+        self.ticks_us = time.ticks_us
+        # How late the lamp came on for run(at_us=), in µs
+        self.start_error_us = 0
+        # Lamp-off error of the last segment and the worst so far, in µs
+        self.last_error_us = 0
+        self.max_error_us = 0
+        self.exposures = 0
+
+    def expose(self, duration_us) -> None:
+        self.run((duration_us,))
+
+    # Runs the first segment now, or at the ticks_us deadline at_us, each
+    # further one on the next start()
+    def run(self, segments, at_us=None) -> None:
+        for duration in segments:
+            if not 0 < duration <= MAX_EXPOSURE_US:
+                raise ValueError("exposure out of range")
+        self.cancel()
+        self.segments = segments
+        self.index = 0
+        if at_us is None:
+            self.state = READY
+            self.start()
+            return
+        # The lamp comes on from the same guard spin that switches it off
+        self.state = ARMED
+        self._last = self.ticks_us()
+        self._left = max(0, time.ticks_diff(at_us, self._last))
+        self._arm()
+
+    def start(self) -> None:
+        if self.state != READY:
+            return
+        self.state = EXPOSING
+        self._left = self.segments[self.index]
+        self.lamp.on()
+        self._last = self.ticks_us()
+        self._arm()
+
+    def cancel(self) -> None:
+        if self.state == EXPOSING:
+            self._timer.deinit()
+            self.lamp.off()
+        elif self.state == ARMED:
+            self._timer.deinit()
+        self.state = IDLE
+
+    def remaining_us(self):
+        if self.state != EXPOSING:
+            return 0
+        return max(0, self._left - time.ticks_diff(self.ticks_us(), self._last))
+
+    def _arm(self):
+        wait = self._left - self.guard_us
+        if wait <= 0:
+            self._finish()
+            return
+        if wait > _CHUNK_US:
+            wait = _CHUNK_US
+        self._timer.init(mode=Timer.ONE_SHOT, tick_hz=_TICK_HZ, period=wait, callback=self._tick_cb)
+
+    def _tick(self, timer):
+        now = self.ticks_us()
+        self._left -= time.ticks_diff(now, self._last)
+        self._last = now
+        self._arm()
+
+    def _finish(self):
+        last = self._last
+        left = self._left
+        ticks_us = self.ticks_us
+        ticks_diff = time.ticks_diff
+        now = ticks_us()
+        while ticks_diff(now, last) < left:
+            now = ticks_us()
+        if self.state == ARMED:
+            self.lamp.on()
+            self.start_error_us = ticks_diff(now, last) - left
+            self.state = EXPOSING
+            self._left = self.segments[self.index]
+            self._last = ticks_us()
+            self._arm()
+            return
+        self.lamp.off()
+        error = ticks_diff(now, last) - left
+        self.last_error_us = error
+        if error > self.max_error_us:
+            self.max_error_us = error
+        self.exposures += 1
+        self.index += 1
+        self.state = READY if self.index < len(self.segments) else IDLE
+
+
+class Countdown:
+    # A whole-second display countdown on a ticks_ms deadline, pausable
+    def __init__(self) -> None:
+        self.running = False
+        self._deadline = 0
+        self._remaining = 0
+
+    def start(self, duration_ms) -> None:
+        self._deadline = time.ticks_add(time.ticks_ms(), duration_ms)
+        self.running = True
+
+    def stop(self) -> None:
+        self._remaining = self.remaining_ms()
+        self.running = False
+
+    def extend(self, delta_ms) -> None:
+        if self.running:
+            self._deadline = time.ticks_add(self._deadline, delta_ms)
+        else:
+            self._remaining = max(0, self._remaining + delta_ms)
+
+    def remaining_ms(self):
+        if not self.running:
+            return self._remaining
+        return max(0, time.ticks_diff(self._deadline, time.ticks_ms()))
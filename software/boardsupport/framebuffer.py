@@ -0,0 +1,129 @@
+# Framebuffer for the 74HC595 chain behind the 7-segment displays and button LEDs
+#
+# The chain is stored in wire order: byte 0 is the button LED register (active
+# low), followed by the digits of the last display down to the first digit of
+# display 1. Rendering happens in place and only for displays whose value,
+# blink flag or blink phase changed, so a steady frame allocates nothing.
+# Values are fixed-point ints: with point=1 a value of 125 shows as 12.5, the
+# digits come out of integer division alone.
+
+from micropython import const
+
+_SEGMENT_DP = const(0x01)
+
+# Segment patterns for 0-9, the decimal point is bit 0
+GLYPHS = b"\xbe\x0a\xe6\x6e\x5a\x7c\xfc\x0e\xfe\x7e"
+BLANK = const(0x00)
+LEDS_OFF = const(0xFF)
+
+
+class FrameBuffer:
+    def __init__(self, displays=4, digits=3) -> None:
+        self.displays = displays
+        self.digits = digits
+        self.buf = bytearray(displays * digits + 1)
+        self._limit = 10**digits
+        self._values = [0] * displays
+        self._blink = bytearray(displays)
+        # Digits behind the decimal point, per display
+        self._points = bytearray(displays)
+        self._dirty = bytearray(displays)
+        self._led_mask = 0
+        self._led_blink = 0
+        self._led_dirty = True
+        self._phase = 0
+        self._changed = True
+        self.clear()
+
+    # Blank everything (all segments off, all LEDs off) and force a full redraw
+    def clear(self, leds=LEDS_OFF, segments=BLANK) -> None:
+        buf = self.buf
+        buf[0] = leds
+        for i in range(1, len(buf)):
+            buf[i] = segments
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        for i in range(self.displays):
+            self._dirty[i] = 1
+        self._led_dirty = True
+        self._changed = True
+
+    def set_display(self, index, value, blink=False, point=0) -> None:
+        if value != self._values[index] or blink != self._blink[index] or point != self._points[index]:
+            if not 0 <= point < self.digits:
+                raise ValueError
+            self._values[index] = value
+            self._blink[index] = blink
+            self._points[index] = point
+            self._dirty[index] = 1
+
+    # Position in buf of a display's digit, 0 is the leftmost
+    def digit_index(self, index, digit) -> int:
+        return len(self.buf) - 1 - self.digits * index - digit
+
+    def set_leds(self, mask, blink_mask=0) -> None:
+        if mask != self._led_mask or blink_mask != self._led_blink:
+            self._led_mask = mask
+            self._led_blink = blink_mask
+            self._led_dirty = True
+
+    def set_phase(self, phase) -> None:
+        if phase == self._phase:
+            return
+        self._phase = phase
+        for i in range(self.displays):
+            if self._blink[i]:
+                self._dirty[i] = 1
+        if self._led_blink:
+            self._led_dirty = True
+
+    # Bring buf up to date, returns True if it differs from the last rendered frame
+    def render(self) -> bool:
+        buf = self.buf
+        phase = self._phase
+        for i in range(self.displays):
+            if not self._dirty[i]:
+                continue
+            pos = len(buf) - 1 - self.digits * i
+            if self._blink[i] and phase:
+                for j in range(self.digits):
+                    if buf[pos - j] != BLANK:
+                        buf[pos - j] = BLANK
+                        self._changed = True
+            else:
+                self._render_value(self._values[i], pos, self._points[i])
+            self._dirty[i] = 0
+
+        if self._led_dirty:
+            lit = self._led_mask
+            if phase:
+                lit &= ~self._led_blink
+            leds = LEDS_OFF & ~lit
+            if buf[0] != leds:
+                buf[0] = leds
+                self._changed = True
+            self._led_dirty = False
+
+        changed = self._changed
+        self._changed = False
+        return changed
+
+    def _render_value(self, value, pos, point) -> None:
+        digits = self.digits
+        if not isinstance(value, int):
+            raise TypeError
+        if value < 0 or value >= self._limit:
+            raise ValueError
+
+        buf = self.buf
+        # The point sits on the last digit before the fraction
+        dot = digits - 1 - point if point else -1
+        for j in range(digits - 1, -1, -1):
+            glyph = GLYPHS[value % 10]
+            value //= 10
+            if j == dot:
+                glyph |= _SEGMENT_DP
+            if buf[pos - j] != glyph:
+                buf[pos - j] = glyph
+                self._changed = True
@@ -1,360 +1,696 @@
-from machine import Pin, SPI, PWM, Timer
+from array import array
+from machine import Pin, PWM, Timer
 import time
-import math
 from .rotary_irq_rp2 import RotaryIRQ
 import logging
-from .debounce import DebouncedSwitch
-from time import sleep_us, sleep
+from .debounce import BankDebouncer, PRESS, RELEASE, LONG_PRESS
+from .framebuffer import FrameBuffer
+from .refresh import make_refresh
+from .eventqueue import EventQueue
+from .logring import LogRing, DEBUG, WARNING
+from .exposure import ExposureScheduler, Countdown, IDLE, EXPOSING, READY, ARMED, THIRD_STOP, adjust, test_strip
+from .motion import AgitationMotion, AgitationProfile
+from .board import FRANKENSTEIN, Display, ButtonLED
+
+# The PIO encoders, the TMC5160 and DMX are imported when they are
+# configured, a board without them does not load them at boot
+
+# Pins and event sources of the Frankenstein board, see board.py: the four
+# encoders are sources 0-3, their switches and the buttons follow
+_ROTARY_PINS = FRANKENSTEIN.rotary_pins
+_BUTTON_PINS = FRANKENSTEIN.switch_pins
+_BUTTON_NAMES = FRANKENSTEIN.switch_names
+_BUTTON_SOURCE_BASE = FRANKENSTEIN.source_base
+
+# Messages of the input path. They go to the controller's LogRing and are
+# formatted when the runtime drains it; a %s is one of the switch names
+_LOG_ENCODER = 0
+_LOG_BUTTON = 1
+_LOG_LONG_PRESS = 2
+_LOG_LATCH_BUSY = 3
+_LOG_NO_RECIPE = 4
+LOG_MESSAGES = (
+    (DEBUG, "Encoder %d moved by %d"),
+    (DEBUG, "Button %s"),
+    (DEBUG, "Long press on %s"),
+    (DEBUG, "Tried to enable %s, but another latch is active"),
+    (WARNING, "No recipe %d"),
+)
+
+# Encoder acceleration, see Rotary.set_acceleration(): a detent within 8 ms
+# of the previous one counts 50, within 30 ms 10, slower ones 1
+_ACCELERATION = ((8, 50), (30, 10))
+
+# With dimming a blinking display or LED fades out and in over this period
+_PULSE_MS = 2000
+
+# Stepper speeds in steps/s selected by button1 and button2
+_LOW_SPEED = 400
+_HIGH_SPEED = 800
+
+# Timer values of recipe 0, the defaults
+_DEFAULT_TIMES = (300, 60, 300)
+
+# What button1..4 do on a press, None for nothing
+_BUTTON_ACTIONS = ("_select_low_speed", "_select_high_speed", "run_test_strip", "load_settings")
+
+# Exposure time in the exposure mode of the last display, in µs: 8 s at
+# first, shown in tenths and set in thirds of a stop. button3 exposes a test
+# strip of _STRIP_COUNT segments from it, a third of a stop apart.
+_EXPOSURE_US = 8_000_000
+_EXPOSURE_STEP = THIRD_STOP
+_STRIP_COUNT = 6
+
+# journal.Journal keys of the state restored at boot: the speed, display1..4
+# and the number (1..) of the timer that was running, 0 for none. Displays
+# of a board with more channels follow from _STATE_MORE_DISPLAYS.
+_STATE_LOW_SPEED = 0
+_STATE_DISPLAY = 1
+_STATE_RUNNING = 5
+_STATE_MORE_DISPLAYS = 6
+
+
+def _display_key(index):
+    return _STATE_DISPLAY + index if index < 4 else _STATE_MORE_DISPLAYS + index - 4
+
 
 class FrankensteinController:
-    def __init__(self) -> None:
+    def __init__(
+        self, pio_refresh=False, refresh_rate=200, encoder_backend="irq", dmx_lamp=None, timers=True,
+        acceleration=None, dimming=None, lamp_pin=None, board=FRANKENSTEIN,
+    ) -> None:
         # Logging
 
         self.logger = logging.getLogger(__name__)
         self.logger.debug("Initializing FrankensteinController")
         # Setup the physical part
         self.pwm_pin = Pin(0, Pin.OUT)
-        self.latch_pin = Pin(12, Pin.OUT)
-        self.spi_bus = SPI(0, baudrate=10_000_000, sck=Pin(2), mosi=Pin(3))
         self.pwm = PWM(self.pwm_pin)
         self.pwm.freq(4000)
         self.pwm.duty_u16(63000)
 
-        # Display options
-        self.display1 = {"value": 0, "blink": False}
-        self.display2 = {"value": 0, "blink": False}
-        self.display3 = {"value": 0, "blink": False}
-        self.display4 = {"value": 0, "blink": False}
+        # Pins, encoders and LED addresses of the channels and buttons
+        self.board = board
+        channels = board.channels
+        # Display state per channel, values are ints with points[i] digits
+        # behind the decimal point
+        self.values = array("h", [0] * channels)
+        self.blinks = bytearray(channels)
+        self.points = bytearray(channels)
+        # Button LED state per button
+        self.leds = bytearray(len(board.buttons))
+        self.led_blinks = bytearray(len(board.buttons))
+        # The same as display1.. and button1_led.. dicts, e.g. display1["value"]
+        self._displays = tuple(Display(self, i) for i in range(channels))
+        self._button_leds = tuple(ButtonLED(self, i) for i in range(len(board.buttons)))
+        for i in range(channels):
+            setattr(self, "display{}".format(i + 1), self._displays[i])
+        for i in range(len(board.buttons)):
+            setattr(self, "button{}_led".format(i + 1), self._button_leds[i])
 
-        self.button1_led = {"value": False, "blink": False, "address": 8}
-        self.button2_led = {"value": False, "blink": False, "address": 4}
-        self.button3_led = {"value": False, "blink": False, "address": 2}
-        self.button4_led = {"value": False, "blink": False, "address": 1}
+        # Preallocated views for the render path, the timer callback must not allocate
+        self.framebuffer = FrameBuffer(displays=channels, digits=board.digits)
+        # With pio_refresh the chain is shifted and latched continuously by PIO+DMA
+        self.refresh = make_refresh(self.framebuffer.buf, pio=pio_refresh, rate=refresh_rate, dimming=dimming)
+        # With dimming (a dict of BCMRefresh settings) every digit and button
+        # LED has its own brightness, on top of the PWM on pin 0
+        self.dimming = self.refresh if self.refresh.levels is not None else None
+        # Displays, then button LEDs, that blink as a pulse of the dimming
+        self._pulsing = bytearray(channels + len(board.buttons))
 
-        # Rotary Encoders
-        self.rotary_1 = RotaryIRQ(
-            pin_num_clk=6, pin_num_dt=7, min_val=0, max_val=999, half_step=True, id=1
-        )
-        self.rotary_2 = RotaryIRQ(
-            pin_num_clk=26, pin_num_dt=1, min_val=0, max_val=999, half_step=True, id=2
-        )
-        self.rotary_3 = RotaryIRQ(
-            pin_num_clk=19, pin_num_dt=20, min_val=0, max_val=999, half_step=True, id=3
-        )
-        self.rotary_4 = RotaryIRQ(
-            pin_num_clk=16, pin_num_dt=17, min_val=0, max_val=999, half_step=True, id=4
-        )
+        # Rotary Encoders, also as rotary_1..
+        self.encoder_bank = None
+        self.rotaries = self._make_rotaries(encoder_backend)
+        for i in range(channels):
+            setattr(self, "rotary_{}".format(i + 1), self.rotaries[i])
+        self._set_acceleration(acceleration)
+
+        # Encoder deltas and button presses are queued by the IRQs and
+        # handed to rotary_event()/button_event() by one scheduled drain
+        self.events = EventQueue(self._dispatch_event, size=64)
+        # Log of the event handlers, drained by runtime.Runtime
+        self.log = LogRing(LOG_MESSAGES, board.switch_names)
+        rotaries = self.rotaries
+        for i in range(len(rotaries)):
+            rotaries[i].post_to(self.events, i)
+
+        # All switches are debounced together by one scan timer
+        self.buttons = BankDebouncer(board.switch_pins, self.events, source_base=board.source_base)
 
-        self.rotary_1.add_listener(self.rotary_event)
-        self.rotary_2.add_listener(self.rotary_event)
-        self.rotary_3.add_listener(self.rotary_event)
-        self.rotary_4.add_listener(self.rotary_event)
-
-        # TODO: Buttons
-
-        self.rotary_1_button = DebouncedSwitch(Pin(27, Pin.IN, Pin.PULL_DOWN), None)
-        self.rotary_1_button.callback(self.button_event, "rotary_1_button")
-        self.rotary_2_button = DebouncedSwitch(Pin(13, Pin.IN, Pin.PULL_DOWN), None)
-        self.rotary_2_button.callback(self.button_event, "rotary_2_button")
-        self.rotary_3_button = DebouncedSwitch(Pin(21, Pin.IN, Pin.PULL_DOWN), None)
-        self.rotary_3_button.callback(self.button_event, "rotary_3_button")
-        self.rotary_4_button = DebouncedSwitch(Pin(18, Pin.IN, Pin.PULL_DOWN), None)
-        self.rotary_4_button.callback(self.button_event, "rotary_4_button")
-
-        self.button1 = DebouncedSwitch(Pin(4, Pin.IN, Pin.PULL_DOWN), None)
-        self.button1.callback(self.button_event, "button1")
-        self.button2 = DebouncedSwitch(Pin(5, Pin.IN, Pin.PULL_DOWN), None)
-        self.button2.callback(self.button_event, "button2")
-        self.button3 = DebouncedSwitch(Pin(14, Pin.IN, Pin.PULL_DOWN), None)
-        self.button3.callback(self.button_event, "button3")
-        self.button4 = DebouncedSwitch(Pin(15, Pin.IN, Pin.PULL_DOWN), None)
-        self.button4.callback(self.button_event, "button4")
+        # Light head on the DMX output, dmx_lamp is a dict of DMXLamp settings
+        self.dmx = None
+        self.lamp = None
+        if dmx_lamp is not None:
+            self._make_lamp(dmx_lamp)
+        elif lamp_pin is not None:
+            # Or a relay (an SSR) on a spare GPIO, a Pin switches like a lamp
+            self.lamp = Pin(lamp_pin, Pin.OUT, value=0)
+        # Switches the lamp on ticks_us deadlines, independent of the displays
+        self.exposure = ExposureScheduler(self.lamp) if self.lamp is not None else None
 
+        # Set by telemetry.Telemetry.attach()
+        self.telemetry = None
+        # Set by bus.BusNode
+        self.bus = None
+        # Set by trace.EdgeTrace.attach()
+        self.trace = None
+        # Set by memory.MemoryManager
+        self.memory = None
+
+        # With timers=False the periodic work is left to runtime.Runtime
+        self.timers = timers
         self.display_timer = Timer()
-        self.display_timer.init(freq=10, callback=self.render_full_display)
+        if timers:
+            self.display_timer.init(freq=10, callback=self.render_full_display)
+            if self.encoder_bank is not None:
+                self.encoder_bank.start()
+            self.buttons.start()
+
+    # "pio" counts the encoders in PIO state machines, "irq" decodes pin IRQs in Python
+    def _make_rotaries(self, backend) -> tuple:
+        board = self.board
+        RotaryPIO = None
+        if backend == "pio":
+            try:
+                from .rotary_pio_rp2 import RotaryPIO, QuadratureBank
+            except ImportError:
+                pass
+        if backend == "pio" and RotaryPIO is not None:
+            rotaries = []
+            try:
+                for i in range(len(board.rotary_pins)):
+                    clk, dt = board.rotary_pins[i]
+                    rotaries.append(
+                        RotaryPIO(
+                            pin_num_clk=clk, pin_num_dt=dt, min_val=board.min_val, max_val=board.max_val,
+                            half_step=board.half_step, id=i + 1, sm_id=board.sm_base + i,
+                        )
+                    )
+            except (ValueError, OSError) as e:
+                self.logger.warning(f"PIO encoders unavailable ({e}), using IRQs")
+                for rotary in rotaries:
+                    rotary.close()
+            else:
+                rotaries = tuple(rotaries)
+                self.encoder_bank = QuadratureBank(rotaries)
+                return rotaries
+        elif backend == "pio":
+            self.logger.warning("PIO encoders unavailable, using IRQs")
+
+        rotaries = []
+        for i in range(len(board.rotary_pins)):
+            clk, dt = board.rotary_pins[i]
+            rotaries.append(
+                RotaryIRQ(pin_num_clk=clk, pin_num_dt=dt, min_val=board.min_val, max_val=board.max_val,
+                          half_step=board.half_step, id=i + 1)
+            )
+        return tuple(rotaries)
+
+    # One curve for all encoders or a list of one per encoder, None in the list
+    # turns an encoder's acceleration off and False all of them; None is
+    # _ACCELERATION
+    def _set_acceleration(self, acceleration) -> None:
+        if acceleration is None:
+            acceleration = _ACCELERATION
+        rotaries = self.rotaries
+        if not acceleration:
+            acceleration = (None,) * len(rotaries)
+        per_encoder = False
+        for curve in acceleration:
+            if curve is None or (curve and isinstance(curve[0], (list, tuple))):
+                per_encoder = True
+        for i in range(len(rotaries)):
+            rotaries[i].set_acceleration(acceleration[i] if per_encoder else acceleration)
+
+    def _make_lamp(self, settings) -> None:
+        try:
+            from .dmx import DMXOutput, DMXLamp
+        except ImportError:
+            self.logger.warning("DMX output needs PIO, no lamp")
+            return
+        settings = dict(settings)
+        channel = settings.pop("channel", 1)
+        fine = settings.get("fine", False)
+        # Only as many slots as the lamp needs, short packets refresh faster;
+        # DMXOutput pads them to the shortest packet DMX512 allows
+        slots = settings.pop("slots", channel + (1 if fine else 0))
+        try:
+            self.dmx = DMXOutput(slots=slots)
+        except (ValueError, OSError) as e:
+            self.logger.warning(f"DMX output unavailable ({e}), no lamp")
+            return
+        self.lamp = DMXLamp(self.dmx, channel, **settings)
+        self.lamp.off()
 
     # Clear the display
     def reset(self) -> None:
-        self.spi_bus.write(bytearray([0xFF]))
-        for _ in range(12):
-            self.spi_bus.write(bytearray([0x00]))
-        self.latch_pin.off()
-        self.latch_pin.on()
-        self.latch_pin.off()
+        self.framebuffer.clear()
+        self._write_frame(self.framebuffer.buf)
 
     # Enable all LEDs for debugging
     def all_leds_on(self) -> None:
-        self.spi_bus.write(bytearray([0x00]))
-        for _ in range(12):
-            self.spi_bus.write(bytearray([0xFF]))
-        self.latch_pin.off()
-        self.latch_pin.on()
-        self.latch_pin.off()
-
-    def _single_digit_to_byte(self, digit) -> int:
-        mapping = {
-            0: 190,
-            1: 10,
-            2: 230,
-            3: 110,
-            4: 90,
-            5: 124,
-            6: 252,
-            7: 14,
-            8: 254,
-            9: 126,
-            None: 0,
-        }
-        return int(mapping[digit])
-
-    def _render_integer(self, display, blinky_time) -> list:
-        if display["value"] < 0 or display["value"] > 1000:
-            self.reset()
-            raise ValueError
-        # return all zeros if blink
-        if display["blink"] and blinky_time:
-            return [0, 0, 0]
-        display_bytes = []
-        display_string = f"{display['value']:03d}"
-        for i in display_string:
-            display_bytes.append(self._single_digit_to_byte(int(i)))
-        return display_bytes
-
-    def _render_float(self, display, blinky_time) -> list:
-        # We only support 2 digits before the colon, and we will always take the first digit after the colon
-        if int(math.log10(display["value"])) + 1 > 2:
-            self.reset()
-            raise ValueError
-        # return all zeros if blink
-        if display["blink"] and blinky_time:
-            return [0, 0, 0]
-        display_bytes = []
-        display_string = f"{display['value']:4.1f}"
-        digit = 0
-        for i in display_string:
-            if i == " ":
-                i = 0
-            if i == ".":
-                continue
-            if digit == 1:
-                display_bytes.append(self._single_digit_to_byte(int(i)) + 1)
-            else:
-                display_bytes.append(self._single_digit_to_byte(int(i)))
-            digit = digit + 1
-        return display_bytes
+        self.framebuffer.clear(leds=0x00, segments=0xFF)
+        self._write_frame(self.framebuffer.buf)
+
+    def _write_frame(self, buf) -> None:
+        self.refresh.show(buf)
+
+    def _blink_phase(self) -> int:
+        return (time.ticks_ms() // 1000) & 1
+
+    # Periodic UI work, 10 times a second
+    def update(self) -> None:
+        self.render_full_display(None)
 
     def render_full_display(self, timer) -> None:
-        if time.time() % 2:
-            blinky_time = True
+        framebuffer = self.framebuffer
+        framebuffer.set_phase(self._blink_phase())
+
+        dimming = self.dimming
+        pulsing = self._pulsing
+        values = self.values
+        blinks = self.blinks
+        points = self.points
+        for i in range(len(values)):
+            blink = blinks[i]
+            if dimming is not None:
+                if blink != pulsing[i]:
+                    self._set_pulse(i, blink)
+                blink = 0
+            framebuffer.set_display(i, values[i], blink, points[i])
+
+        led_mask = 0
+        led_blink = 0
+        leds = self.leds
+        led_blinks = self.led_blinks
+        addresses = self.board.led_addresses
+        base = len(values)
+        for i in range(len(leds)):
+            if leds[i]:
+                led_mask |= addresses[i]
+            if dimming is not None:
+                if led_blinks[i] != pulsing[base + i]:
+                    self._set_pulse(base + i, led_blinks[i])
+            elif led_blinks[i]:
+                led_blink |= addresses[i]
+        framebuffer.set_leds(led_mask, led_blink)
+
+        try:
+            changed = framebuffer.render()
+        except ValueError:
+            self.reset()
+            raise
+        if changed:
+            self._write_frame(framebuffer.buf)
+        if dimming is not None:
+            dimming.animate()
+
+    # Brightness of display 1.. or of one of its digits (0 is the leftmost),
+    # from 0 to dimming.max_level, reached after fade_ms. Without dimming
+    # only the PWM on pin 0 dims, all at once.
+    def set_brightness(self, display, level, digit=None, fade_ms=0) -> None:
+        if self.dimming is None:
+            return
+        framebuffer = self.framebuffer
+        for j in range(framebuffer.digits):
+            if digit is None or j == digit:
+                self.dimming.fade(framebuffer.digit_index(display - 1, j), level, fade_ms)
+
+    # Brightness of button LED 1..
+    def set_led_brightness(self, led, level, fade_ms=0) -> None:
+        if self.dimming is None:
+            return
+        self.dimming.fade(self.dimming.led(self.board.led_bits[led - 1]), level, fade_ms)
+
+    # Blinking with dimming: the displays and then the LEDs pulse instead of blanking
+    def _set_pulse(self, index, on) -> None:
+        self._pulsing[index] = on
+        period = _PULSE_MS if on else 0
+        channels = self.board.channels
+        if index < channels:
+            framebuffer = self.framebuffer
+            for j in range(framebuffer.digits):
+                self.dimming.pulse(framebuffer.digit_index(index, j), period)
         else:
-            blinky_time = False
-
-        output_buffer = []
-        for display in [self.display1, self.display2, self.display3, self.display4]:
-            if isinstance(display["value"], int):
-                for byte in self._render_integer(display, blinky_time):
-                    output_buffer.append(byte)
-            if isinstance(display["value"], float):
-                for byte in self._render_float(display, blinky_time):
-                    output_buffer.append(byte)
-
-        output_buffer.append(255)
-        for button_led in [
-            self.button1_led,
-            self.button2_led,
-            self.button3_led,
-            self.button4_led,
-        ]:
-            if button_led["value"] and not (button_led["blink"] and blinky_time):
-                output_buffer[-1] = output_buffer[-1] - button_led["address"]
-
-        self.spi_bus.write(bytearray(reversed(output_buffer)))
-        self.latch_pin.off()
-        self.latch_pin.on()
-        self.latch_pin.off()
-
-    # Overwrite these functions in your base application
-    def rotary_event(self) -> None:
-        self.logger.debug("Rotary Event occured")
-        for rotary in [self.rotary_1, self.rotary_2, self.rotary_3, self.rotary_4]:
-            if rotary.value() != 0:
-                self.logger.debug(f"Encoder {rotary.id} value change: {rotary.value()}")
-                rotary.set(value=0)
+            self.dimming.pulse(self.dimming.led(self.board.led_bits[index - channels]), period)
+
+    def _dispatch_event(self, source, delta, ticks) -> None:
+        base = self.board.source_base
+        if source < base:
+            self.rotary_event(source + 1, delta)
+        else:
+            self.switch_event(source - base, delta)
+
+    # Overwrite these functions in your base application. switch_event() gets
+    # the switch's index in board.switch_names, the button_*_event() by name
+    # are called from here
+    def rotary_event(self, rotary_id, delta) -> None:
+        self.log.log(_LOG_ENCODER, rotary_id, delta)
+
+    def switch_event(self, index, event) -> None:
+        name = self.board.switch_names[index]
+        if event == PRESS:
+            self.button_event(name)
+        elif event == RELEASE:
+            self.button_release_event(name)
+        elif event == LONG_PRESS:
+            self.button_long_event(name)
 
     def button_event(self, pin) -> None:
-        self.logger.debug(f"Button Event occured on {pin}")
+        self.log.log(_LOG_BUTTON, self.board.switch_names.index(pin))
+
+    def button_release_event(self, pin) -> None:
+        pass
+
+    def button_long_event(self, pin) -> None:
+        self.log.log(_LOG_LONG_PRESS, self.board.switch_names.index(pin))
 
 
 class FrankensteinRotaryController(FrankensteinController):
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(
+        self,
+        pio_refresh=False,
+        refresh_rate=200,
+        encoder_backend="irq",
+        agitation=None,
+        motion_backend="step",
+        dmx_lamp=None,
+        timers=True,
+        recipes=None,
+        journal=None,
+        dual_core=False,
+        acceleration=None,
+        dimming=None,
+        lamp_pin=None,
+        board=FRANKENSTEIN,
+    ) -> None:
+        if dmx_lamp is not None and motion_backend != "none":
+            # The stepper (STEP/DIR or TMC5160) and DMX share GP8/GP9, the jumpers select one
+            raise ValueError("DMX needs motion_backend='none'")
+        super().__init__(
+            pio_refresh, refresh_rate, encoder_backend, dmx_lamp, timers, acceleration, dimming, lamp_pin, board
+        )
         self.low_speed = True
-        self.step_timer = Timer()
+        # recipes.RecipeStore selected by the last display, None for the defaults only
+        self.recipes = recipes
+        # agitation: dict of AgitationProfile settings, e.g. from config.json
+        self.motion = self._make_motion(motion_backend, AgitationProfile(**(agitation or {})))
+        # With dual_core the step pulses and the lamp run on core 1, see core1.py
+        self.core1 = None
+        if dual_core:
+            self._start_core1()
         self._set_speed_button()
         self.display_timer.deinit()
+        # Number (1..board.timers) of the timer the switch of its encoder
+        # latched, 0 for none
+        self.running = 0
+        # Development timers on the first board.timers displays, counting
+        # down on deadlines
+        self._countdowns = tuple(Countdown() for _ in range(board.timers))
+        # Bound once, a press looks its action up by the button's index
+        self._button_actions = tuple(
+            getattr(self, _BUTTON_ACTIONS[i]) if i < len(_BUTTON_ACTIONS) and _BUTTON_ACTIONS[i] else None
+            for i in range(len(board.buttons))
+        )
+        # journal.Journal the UI state is kept in across resets
+        self.journal = journal
+        # A long press on the last encoder's switch turns its display from the
+        # recipe to the exposure time, which turning sets in f-stops
+        self.exposure_mode = False
+        self.exposure_us = _EXPOSURE_US
+        # The recipe number while the display shows the exposure time
+        self._recipe = 0
+        # A test strip waits for button3, and the blink of the last display before
+        self._strip_waiting = False
+        self._strip_blink = 0
+        self._restore_state()
         self.second_tick_timer = Timer()
-        self.second_tick_timer.init(period=100, callback=self._second_tick)
-        self.tick_counter = 0
-        self.rotary_1_button_latch = False
-        self.rotary_2_button_latch = False
-        self.rotary_3_button_latch = False
-        self.rotary_4_button_latch = False
-        self.stepper_steps = 0
+        if timers:
+            self.second_tick_timer.init(period=100, callback=self._second_tick)
+
+    # "tmc5160" runs the move on the breakout's ramp generator over SPI1,
+    # "step" pulses STEP/DIR on pins 9/10, "none" leaves GP8-GP11 to DMX
+    def _make_motion(self, backend, profile):
+        if backend == "none":
+            return None
+        if backend == "tmc5160":
+            from .tmc5160 import open_tmc5160, TMC5160Agitation
+            try:
+                driver = open_tmc5160()
+                driver.init()
+                return TMC5160Agitation(driver, profile)
+            except OSError as e:
+                self.logger.warning(f"TMC5160 unavailable ({e}), using STEP/DIR")
         self.en_pin = Pin(8, Pin.OUT)
-        self.en_pin.value(1)
         self.step_pin = Pin(9, Pin.OUT)
         self.dir_pin = Pin(10, Pin.OUT)
-        self.noop_begin = 0
-        self.noop_seconds = 2
-        self.noop_active = False
-        
+        return AgitationMotion(self.step_pin, self.dir_pin, self.en_pin, profile)
+
+    def _start_core1(self) -> None:
+        from .core1 import Core1, MotionProxy, ExposureProxy
+
+        # The TMC5160 runs its ramps itself, only STEP/DIR needs the core
+        motion = self.motion if isinstance(self.motion, AgitationMotion) else None
+        self.core1 = Core1(motion, self.exposure)
+        if motion is not None:
+            self.motion = MotionProxy(self.core1)
+        if self.exposure is not None:
+            self.exposure = ExposureProxy(self.core1)
+        self.core1.start()
+
     def _second_tick(self, timer):
-        self.render_full_display(timer)
-        if self.tick_counter == 10:
-            self.tick_counter = 0
-            if self.rotary_1_button_latch and self.display1["value"] > 0:
-                self.display1["value"] = self.display1["value"] - 1
-                if self.display1["value"]==0:
-                    self.rotary_1_button_latch = False
-            if self.rotary_2_button_latch and self.display2["value"] > 0:
-                self.display2["value"] = self.display2["value"] - 1
-                if self.display2["value"]==0:
-                    self.rotary_2_button_latch = False
-            if self.rotary_3_button_latch and self.display3["value"] > 0:
-                self.display3["value"] = self.display3["value"] - 1
-                if self.display3["value"]==0:
-                    self.rotary_3_button_latch = False
-        self.tick_counter = self.tick_counter+1
-        
+        self.update()
+
+    # Mirrors the countdowns on the displays, a late tick shows a late
+    # number but never shifts the deadline
+    def update(self) -> None:
+        countdowns = self._countdowns
+        values = self.values
+        for i in range(len(countdowns)):
+            countdown = countdowns[i]
+            if countdown.running:
+                remaining = countdown.remaining_ms()
+                values[i] = (remaining + 999) // 1000
+                if remaining == 0:
+                    self._finish_countdown(i)
+        exposure = self.exposure
+        if exposure is not None:
+            # A test strip waiting for button3 blinks the last display, which
+            # gets its own blink back after
+            ready = exposure.state == READY
+            if ready != self._strip_waiting:
+                last = len(values) - 1
+                self._strip_waiting = ready
+                if ready:
+                    self._strip_blink = self.blinks[last]
+                    self.blinks[last] = 1
+                else:
+                    self.blinks[last] = self._strip_blink
+        self.render_full_display(None)
+        self._save_state()
+
+    # A timer that was running at the reset comes back paused and blinking,
+    # with the time it was started with; its button continues it
+    def _restore_state(self) -> None:
+        journal = self.journal
+        if journal is None:
+            return
+        self.low_speed = bool(journal.get(_STATE_LOW_SPEED, 1))
+        self._set_speed_button()
+        board = self.board
+        values = self.values
+        for i in range(len(values)):
+            values[i] = max(board.min_val, min(board.max_val, journal.get(_display_key(i), 0)))
+        running = journal.get(_STATE_RUNNING, 0)
+        if 1 <= running <= len(self._countdowns):
+            self.blinks[running - 1] = 1
+
+    # Only changed values are journaled, and flushed together after a pause.
+    # A running countdown keeps the value it started from, its ticks are
+    # not journaled.
+    def _save_state(self) -> None:
+        journal = self.journal
+        if journal is None:
+            return
+        journal.set(_STATE_LOW_SPEED, 1 if self.low_speed else 0)
+        values = self.values
+        countdowns = self._countdowns
+        last = len(values) - 1
+        for i in range(len(values)):
+            if i < len(countdowns) and countdowns[i].running:
+                continue
+            # Not the exposure time the last display may show for now
+            journal.set(_display_key(i), self._recipe if i == last and self.exposure_mode else values[i])
+        journal.set(_STATE_RUNNING, self.running)
+        if not self._busy():
+            journal.poll()
+
+    # A flash write stalls the IRQs and core 1, the lamp and the agitation
+    # must not wait for one
+    def _busy(self):
+        exposure = self.exposure
+        if exposure is not None:
+            state = exposure.state
+            if state == EXPOSING or state == ARMED:
+                return True
+        return self.motion is not None and self.motion.running
+
+    def _finish_countdown(self, index) -> None:
+        self._countdowns[index].stop()
+        if self.running == index + 1:
+            self.running = 0
+        self._update_motion()
+
+    # Start or pause the countdown behind a latch, the agitation follows
+    def _latch_changed(self, index, latched) -> None:
+        countdown = self._countdowns[index]
+        if latched:
+            self.blinks[index] = 0
+            # The start value and the running timer are written now, before
+            # the agitation starts
+            self._save_state()
+            if self.journal is not None and not self._busy():
+                self.journal.flush()
+            countdown.start(self.values[index] * 1000)
+        else:
+            countdown.stop()
+        self._update_motion()
+
+    # One timer at a time: its switch starts and pauses it, the others are busy
+    def _toggle_latch(self, index) -> None:
+        if self.running == index + 1:
+            self.running = 0
+            self._latch_changed(index, False)
+        elif self.running:
+            self.log.log(_LOG_LATCH_BUSY, index)
+        else:
+            self.running = index + 1
+            self._latch_changed(index, True)
+
     def _set_speed_button(self):
-        if self.low_speed:
-            self.button1_led["value"] = True
-            self.button2_led["value"] = False
-            self.step_timer.init(freq=400, callback = self._rotate)
+        leds = self.leds
+        # button1 and button2, where the board has them
+        if len(leds) > 1:
+            leds[0] = 1 if self.low_speed else 0
+            leds[1] = 0 if self.low_speed else 1
+        if self.motion is not None:
+            self.motion.set_speed(_LOW_SPEED if self.low_speed else _HIGH_SPEED)
+
+    def _select_low_speed(self):
+        self.low_speed = True
+        self._set_speed_button()
+
+    def _select_high_speed(self):
+        self.low_speed = False
+        self._set_speed_button()
+
+    # Presses the speed switch as the user would; False on a board without one
+    def select_speed(self, low) -> bool:
+        button = _BUTTON_ACTIONS.index("_select_low_speed" if low else "_select_high_speed")
+        if button >= len(self.board.buttons):
+            return False
+        self.switch_event(self.board.channels + button, PRESS)
+        return True
+
+    # The tank agitates while one of the timers is running
+    def _update_motion(self) -> None:
+        if self.motion is None:
+            return
+        if self.running:
+            self.motion.start()
         else:
-            self.button1_led["value"] = False
-            self.button2_led["value"] = True
-            self.step_timer.init(freq=800, callback = self._rotate)
-
-    def _rotate(self, timer):
-        if self.rotary_1_button_latch or self.rotary_2_button_latch or self.rotary_3_button_latch:
-            #Enable stepper driver
-            self.en_pin.value(0)
-            if self.stepper_steps < 200*8*0.75:
-                self.dir_pin.value(0)
-                self.stepper_steps = self.stepper_steps + 1
-                self.step_pin.value(1)
-                sleep_us(1)
-                self.step_pin.value(0)
-                sleep_us(1)
-            elif self.stepper_steps == 200*8*0.75:
-                sleep(1)
-                self.stepper_steps = self.stepper_steps + 1
-            elif self.stepper_steps > 200*8*0.75:
-                self.dir_pin.value(1)
-                self.stepper_steps = self.stepper_steps + 1
-                self.step_pin.value(1)
-                sleep_us(1)
-                self.step_pin.value(0)
-                sleep_us(1)
-                if self.stepper_steps > (200*8*0.75)+(200*8*0.3):
-                    if self.noop_active:
-                        if self.noop_begin == time.time() - self.noop_seconds:
-                            self_noop_active = False
-                            self.stepper_steps = 0
-                        else:
-                            self_noop_active = True
-                            
+            self.motion.stop()
+
+    # Displays hold board.min_val..max_val, a coalesced delta may overshoot either end
+    def rotary_event(self, rotary_id, delta) -> None:
+        self.log.log(_LOG_ENCODER, rotary_id, delta)
+        i = rotary_id - 1
+        values = self.values
+        if self.exposure_mode and i == len(values) - 1:
+            self.adjust_exposure(delta)
+            return
+        old_value = values[i]
+        board = self.board
+        value = max(board.min_val, min(board.max_val, old_value + delta))
+        values[i] = value
+        if i < len(self._countdowns):
+            # Turning a running timer moves its deadline
+            self._countdowns[i].extend((value - old_value) * 1000)
+
+    # One detent is one _EXPOSURE_STEP
+    def adjust_exposure(self, steps) -> None:
+        self.set_exposure(adjust(self.exposure_us, steps, _EXPOSURE_STEP))
+
+    # Within what the display can show in tenths
+    def set_exposure(self, exposure_us) -> None:
+        self.exposure_us = max(100_000, min(self.board.max_val * 100_000, exposure_us))
+        if self.exposure_mode:
+            self.values[len(self.values) - 1] = (self.exposure_us + 50_000) // 100_000
+
+    # The last display between the recipe number and the exposure time
+    def _toggle_exposure_mode(self) -> None:
+        if self.exposure is None:
+            return
+        values = self.values
+        last = len(values) - 1
+        if self.exposure_mode:
+            self.exposure_mode = False
+            values[last] = self._recipe
+            self.points[last] = 0
         else:
-            #Disable stepper driver
-            self.en_pin.value(1)
-            self.stepper_steps = 0
-        return None
-            
-    def _update_display_value(self, display, value):
-        if display["value"] == 0 and value < 0:
-            pass
+            self.exposure_mode = True
+            self._recipe = values[last]
+            self.points[last] = 1
+            self.adjust_exposure(0)
+
+    # Incremental test strip from the exposure time: the first press starts
+    # it, each further one exposes the next strip, a press during a segment
+    # cancels the rest
+    def run_test_strip(self):
+        exposure = self.exposure
+        if exposure is None:
+            return
+        state = exposure.state
+        if state == READY:
+            exposure.start()
+        elif state == IDLE:
+            exposure.run(test_strip(self.exposure_us, _STRIP_COUNT, 1, _EXPOSURE_STEP))
         else:
-            display["value"] = display["value"] + value
-
-    def rotary_event(self) -> None:
-        for rotary in [self.rotary_1, self.rotary_2, self.rotary_3, self.rotary_4]:
-            current_rotary_value = rotary.value()
-            if current_rotary_value != 0:
-                self.logger.debug(
-                    f"Encoder {rotary.id} value change: {current_rotary_value}"
-                )
-                rotary.set(value=0)
-
-                if rotary.id == 1:
-                    self._update_display_value(self.display1, current_rotary_value)
-                if rotary.id == 2:
-                    self._update_display_value(self.display2, current_rotary_value)
-                if rotary.id == 3:
-                    self._update_display_value(self.display3, current_rotary_value)
-                if rotary.id == 4:
-                    self._update_display_value(self.display4, current_rotary_value)
+            exposure.cancel()
 
+    # Recipe selected on the last display
     def load_settings(self):
-        if self.display4["value"] == 0:
+        values = self.values
+        number = self._recipe if self.exposure_mode else values[len(values) - 1]
+        if number == 0:
             # We set a default if nothing in here
-            self.display1["value"] = 300
-            self.display2["value"] = 60
-            self.display3["value"] = 300
-            pass
+            times = _DEFAULT_TIMES
         else:
-            # TODO: Load a recipe from server
-            pass
+            times = self.recipes.get(number) if self.recipes is not None else None
+        if times is None:
+            self.log.log(_LOG_NO_RECIPE, number)
+            return
+        board = self.board
+        for i in range(min(len(times), board.timers)):
+            values[i] = max(board.min_val, min(board.max_val, times[i]))
+
+    # Presses by the switch's index; releases and long presses by name
+    def switch_event(self, index, event) -> None:
+        if event == LONG_PRESS and index == self.board.channels - 1:
+            self._toggle_exposure_mode()
+            return
+        if event != PRESS:
+            super().switch_event(index, event)
+            return
+        self.log.log(_LOG_BUTTON, index)
+        if index < len(self._countdowns):
+            self._toggle_latch(index)
+            return
+        button = index - self.board.channels
+        if button >= 0:
+            action = self._button_actions[button]
+            if action is not None:
+                action()
 
     def button_event(self, pin) -> None:
-        self.logger.debug(f"Button: {pin}")
-        if pin == "button1":
-            self.low_speed = True
-            self._set_speed_button()
-            return None
-        if pin == "button2":
-            self.low_speed = False
-            self._set_speed_button()
-            return None
-        if pin == "button3":
-            self.logger.debug(f"Label Button Event")
-            return None
-        if pin == "button4":
-            self.logger.debug(f"Load Button Event")
-            self.load_settings()
-            return None
-        if pin == "rotary_1_button":
-            if self.rotary_1_button_latch:
-                self.rotary_1_button_latch = False
-                return None
-            if (
-                self.rotary_2_button_latch
-                or self.rotary_3_button_latch
-            ):
-                self.logger.debug(f"Tried to enable {pin}, but another latch is active")
-            else:
-                self.rotary_1_button_latch = True
-   
-        if pin == "rotary_2_button":
-            if self.rotary_2_button_latch:
-                self.rotary_2_button_latch = False
-                return None
-            if (
-                self.rotary_1_button_latch
-                or self.rotary_3_button_latch
-            ):
-                self.logger.debug(f"Tried to enable {pin}, but another latch is active")
-            else:
-                self.rotary_2_button_latch = True
-                
-        if pin == "rotary_3_button":
-            if self.rotary_3_button_latch:
-                self.rotary_3_button_latch = False
-                return None
-            if (
-                self.rotary_1_button_latch
-                or self.rotary_2_button_latch
-            ):
-                self.logger.debug(f"Tried to enable {pin}, but another latch is active")
-            else:
-                self.rotary_3_button_latch = True
+        self.switch_event(self.board.switch_names.index(pin), PRESS)
@@ -0,0 +1,173 @@
+# Append-only key/value journal for state that survives a reset
+#
+# Keys are small ints, values 32 bit signed ints. Changes are collected by
+# set() and appended as 8 byte records by flush(), several at once, so a knob
+# turn costs a few bytes instead of rewriting a whole file. Two files take
+# turns: when the active one passes max_bytes, a snapshot of every value is
+# written to the other one with the next generation number and appending
+# continues there.
+#
+# A file is a header (magic, generation) followed by the snapshot, a commit
+# record and the appended records. Restoring reads the newest file that has
+# its commit record in one go and stops at the first damaged record, so a
+# write torn by a power cut loses at most the records that were being
+# written. A snapshot torn the same way leaves the older file in charge.
+
+from micropython import const
+import struct
+import time
+
+_MAGIC = b"FJNL"
+_HEADER = "<4sI"
+_HEADER_SIZE = const(8)
+# marker, key, check, value
+_RECORD = "<BBHi"
+_RECORD_SIZE = const(8)
+_MARKER = const(0xA5)
+# Ends the snapshot, its value is the number of snapshot records
+_COMMIT = const(0xFF)
+
+MAX_KEY = const(0xFE)
+
+
+def _check(key, value):
+    # Fletcher-16 over the key and the value bytes
+    a = key + 1
+    b = a
+    for shift in (0, 8, 16, 24):
+        a = (a + ((value >> shift) & 0xFF)) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+def _record(key, value):
+    return struct.pack(_RECORD, _MARKER, key, _check(key, value), value)
+
+
+class Journal:
+    def __init__(self, path="state", max_bytes=4096, delay_ms=2000) -> None:
+        self.paths = (path + ".0", path + ".1")
+        self.max_bytes = max_bytes
+        self.delay_ms = delay_ms
+        self.values = {}
+        self.generation = 0
+        self._active = 0
+        self._size = 0
+        self._pending = []
+        self._pending_since = 0
+        # Set when the active file ends in a torn write or does not exist
+        self._needs_compact = True
+        # Statistics
+        self.appends = 0
+        self.compactions = 0
+        self.dropped_bytes = 0
+        self.restore()
+
+    # Rebuilds values from the newest intact file
+    def restore(self) -> None:
+        candidates = []
+        for slot in (0, 1):
+            try:
+                with open(self.paths[slot], "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if len(data) < _HEADER_SIZE:
+                continue
+            magic, generation = struct.unpack_from(_HEADER, data)
+            if magic == _MAGIC:
+                candidates.append((generation, slot, data))
+        candidates.sort(reverse=True)
+        for generation, slot, data in candidates:
+            values = self._replay(data)
+            if values is None:
+                continue
+            self.values = values
+            self.generation = generation
+            self._active = slot
+            return
+        self.values = {}
+
+    def _replay(self, data):
+        values = {}
+        committed = False
+        pos = _HEADER_SIZE
+        end = len(data)
+        while pos + _RECORD_SIZE <= end:
+            marker, key, check, value = struct.unpack_from(_RECORD, data, pos)
+            if marker != _MARKER or check != _check(key, value):
+                break
+            pos += _RECORD_SIZE
+            if key == _COMMIT:
+                if committed or value != len(values):
+                    break
+                committed = True
+            else:
+                values[key] = value
+        if not committed:
+            return None
+        self._size = pos
+        # Appending behind damaged bytes would hide everything written later
+        self._needs_compact = pos != end
+        self.dropped_bytes += end - pos
+        return values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value) -> None:
+        if not 0 <= key <= MAX_KEY:
+            raise ValueError("key out of range")
+        if self.values.get(key) == value:
+            return
+        self.values[key] = value
+        if not self._pending:
+            self._pending_since = time.ticks_ms()
+        if key not in self._pending:
+            self._pending.append(key)
+
+    @property
+    def dirty(self):
+        return bool(self._pending)
+
+    # Flushes once the oldest pending change is delay_ms old, so a burst of
+    # knob turns ends up in one write
+    def poll(self) -> bool:
+        if not self._pending:
+            return False
+        if time.ticks_diff(time.ticks_ms(), self._pending_since) < self.delay_ms:
+            return False
+        self.flush()
+        return True
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        if self._needs_compact or self._size + len(self._pending) * _RECORD_SIZE > self.max_bytes:
+            # The snapshot already holds the pending values
+            self.compact()
+            return
+        buf = bytearray()
+        for key in self._pending:
+            buf += _record(key, self.values[key])
+        with open(self.paths[self._active], "ab") as f:
+            f.write(buf)
+        self._size += len(buf)
+        self.appends += len(self._pending)
+        self._pending = []
+
+    def compact(self) -> None:
+        slot = 1 - self._active
+        generation = self.generation + 1
+        buf = bytearray(struct.pack(_HEADER, _MAGIC, generation))
+        for key in self.values:
+            buf += _record(key, self.values[key])
+        buf += _record(_COMMIT, len(self.values))
+        with open(self.paths[slot], "wb") as f:
+            f.write(buf)
+        self._active = slot
+        self.generation = generation
+        self._size = len(buf)
+        self._needs_compact = False
+        self._pending = []
+        self.compactions += 1
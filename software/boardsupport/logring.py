@@ -0,0 +1,133 @@
+# Deferred binary log for code that runs scheduled from IRQs
+#
+# log() stores a record of ticks_ms, message id and two small int arguments
+# in preallocated arrays used as a ring, so logging from the input path
+# neither formats a string nor waits for the serial console. A message below
+# the ring's level is one table lookup. drain() formats the records later,
+# from an idle task, and hands them to a logging.Logger; when the ring is
+# full the oldest records are overwritten and counted as dropped.
+#
+# Messages are (level, text) in a table owned by the caller, the id is the
+# index. Arguments fill the %d in the text; a %s is replaced by names[arg].
+# dump() packs the undrained records for tools/logring_decode.py:
+#   header  4s magic, B version, x, H records, I dropped, I ticks_ms
+#   record  I ticks_ms, B message, x, h arg, h arg
+
+from array import array
+from micropython import const
+import struct
+import time
+
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+
+_MAGIC = b"FLOG"
+_VERSION = const(1)
+_HEADER = "<4sBxHII"
+_HEADER_SIZE = const(16)
+_RECORD = "<IBxhh"
+_RECORD_SIZE = const(10)
+
+
+def format_message(text, args, names=None):
+    parts = text.split("%")
+    out = parts[0]
+    for i in range(1, len(parts)):
+        part = parts[i]
+        arg = args[i - 1] if i <= len(args) else 0
+        if part[:1] == "s" and names is not None and 0 <= arg < len(names):
+            out += names[arg]
+        else:
+            out += str(arg)
+        out += part[1:]
+    return out
+
+
+class LogRing:
+    def __init__(self, messages, names=None, size=128, level=DEBUG) -> None:
+        if size & (size - 1):
+            raise ValueError("size must be a power of two")
+        self.messages = messages
+        self.names = names
+        self._mask = size - 1
+        self._levels = bytearray(level for level, _ in messages)
+        self._ids = bytearray(size)
+        self._ticks = array("I", [0] * size)
+        self._args = array("h", [0] * (2 * size))
+        # Free-running counts, the ring holds the last size records
+        self._head = 0
+        self._tail = 0
+        self.level = level
+        # Statistics
+        self.logged = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def log(self, message, a=0, b=0) -> None:
+        if self._levels[message] < self.level:
+            return
+        head = self._head
+        i = head & self._mask
+        self._ids[i] = message
+        self._ticks[i] = time.ticks_ms()
+        self._args[2 * i] = a
+        self._args[2 * i + 1] = b
+        head += 1
+        self._head = head
+        self.logged += 1
+        if head - self._tail > self._mask + 1:
+            self._tail += 1
+            self.dropped += 1
+
+    def _line(self, i):
+        level, text = self.messages[self._ids[i]]
+        ticks = self._ticks[i]
+        return level, "{}.{:03d} {}".format(ticks // 1000, ticks % 1000, format_message(
+            text, (self._args[2 * i], self._args[2 * i + 1]), self.names))
+
+    # Formats up to limit records into logger, oldest first
+    def drain(self, logger, limit=16) -> int:
+        n = 0
+        while self._tail != self._head and n < limit:
+            level, line = self._line(self._tail & self._mask)
+            self._tail += 1
+            logger.log(level, line)
+            n += 1
+        return n
+
+    # The undrained records, without draining them
+    def dump(self):
+        count = self._head - self._tail
+        buf = bytearray(_HEADER_SIZE + count * _RECORD_SIZE)
+        struct.pack_into(_HEADER, buf, 0, _MAGIC, _VERSION, count, self.dropped, time.ticks_ms())
+        offset = _HEADER_SIZE
+        for n in range(self._tail, self._head):
+            i = n & self._mask
+            struct.pack_into(_RECORD, buf, offset, self._ticks[i], self._ids[i],
+                             self._args[2 * i], self._args[2 * i + 1])
+            offset += _RECORD_SIZE
+        return buf
+
+    def save(self, path="log.bin") -> None:
+        with open(path, "wb") as f:
+            f.write(self.dump())
+
+
+# {"dropped", "ticks_ms", "records": [(ticks_ms, message, (a, b)), ...]}
+def decode(data):
+    if len(data) < _HEADER_SIZE:
+        raise ValueError("not a log dump")
+    magic, version, count, dropped, ticks = struct.unpack_from(_HEADER, data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("not a log dump")
+    if len(data) < _HEADER_SIZE + count * _RECORD_SIZE:
+        raise ValueError("short log dump")
+    records = []
+    for n in range(count):
+        t, message, a, b = struct.unpack_from(_RECORD, data, _HEADER_SIZE + n * _RECORD_SIZE)
+        records.append((t, message, (a, b)))
+    return {"dropped": dropped, "ticks_ms": ticks, "records": records}
@@ -0,0 +1,164 @@
+# Garbage collection in idle windows
+#
+# MicroPython collects when an allocation finds the heap full, in the middle of
+# whatever allocates, and the step timer and the exposure deadline wait behind
+# the collection for milliseconds. The MemoryManager collects before that from
+# the runtime's "memory" task, once a share of the free heap has been
+# allocated, but only when the board is idle: never while an exposure is armed
+# or running, and with the agitation only in a dwell long enough for it.
+# gc.threshold() stays set as the backstop for allocations that outrun the
+# polls; those and full-heap collections count as forced.
+#
+# Every probe_s, again in an idle window, it samples the free heap and the
+# largest free block into preallocated rings. MicroPython has no call for the
+# largest block, it is found by bisecting allocations. tools/check_alloc.py
+# makes sure the IRQ and timer paths allocate nothing in the first place.
+
+from array import array
+import gc
+import logging
+from micropython import const
+import time
+
+from .exposure import ARMED, EXPOSING
+
+# Samples kept, one per probe
+SAMPLES = const(60)
+# Free bytes the largest block is found to
+_PROBE_STEP = const(256)
+# quiet_ms() with nothing timed running
+_QUIET_IDLE_MS = const(0x3FFFFFFF)
+
+
+class MemoryManager:
+    # A collection is due when 1/budget of the free heap has been allocated
+    # since the last one, the threshold backstop at 1/threshold. margin_ms is
+    # the quiet time a collection needs, probe_margin_ms that of a probe,
+    # which may collect several times.
+    def __init__(self, controller, period_ms=100, budget=8, threshold=2, margin_ms=20,
+                 probe_margin_ms=250, probe_s=60) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.controller = controller
+        controller.memory = self
+        self.period_ms = period_ms
+        self.budget = budget
+        self.threshold = threshold
+        self.margin_ms = margin_ms
+        self.probe_margin_ms = probe_margin_ms
+        self.probe_s = probe_s
+        # Rings of free heap and largest block, the newest at (samples - 1) % SAMPLES
+        self.free = array("I", [0] * SAMPLES)
+        self.largest = array("I", [0] * SAMPLES)
+        self.samples = 0
+        self.heap_free = 0
+        self.heap_largest = 0
+        self.low_free = 0
+        self.low_largest = 0
+        self.reset_stats()
+        self._bytes = 0
+        self._base = 0
+        self._alloc = 0
+        self._waiting = False
+        self._probe_due = 0
+
+    def reset_stats(self) -> None:
+        self.collections = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.deferred = 0
+        self.forced = 0
+
+    # After the setup, before the runtime starts: the heap is as full as it
+    # gets for good, what is allocated from now on is garbage sooner or later
+    def start(self) -> None:
+        gc.collect()
+        free = gc.mem_free()
+        self._bytes = free // self.budget
+        gc.threshold(free // self.threshold)
+        self._base = self._alloc = gc.mem_alloc()
+        self.low_free = self.low_largest = free
+        self.sample()
+        self._probe_due = time.ticks_add(time.ticks_ms(), self.probe_s * 1000)
+        self.logger.info("Heap: %d free, %d in one block, collecting every %d", free, self.heap_largest,
+                         self._bytes)
+
+    # ms until an exposure deadline or a step needs the CPU
+    def quiet_ms(self):
+        controller = self.controller
+        if controller.core1 is not None:
+            # Both run on core 1, which does not allocate
+            return _QUIET_IDLE_MS
+        exposure = controller.exposure
+        if exposure is not None and (exposure.state == ARMED or exposure.state == EXPOSING):
+            return 0
+        motion = controller.motion
+        if motion is not None and hasattr(motion, "quiet_ms"):
+            return motion.quiet_ms()
+        return _QUIET_IDLE_MS
+
+    def collect(self) -> None:
+        start = time.ticks_us()
+        gc.collect()
+        us = time.ticks_diff(time.ticks_us(), start)
+        self.collections += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+        self._base = self._alloc = gc.mem_alloc()
+        self._waiting = False
+
+    def poll(self) -> None:
+        alloc = gc.mem_alloc()
+        if alloc < self._alloc:
+            # Collected since the last poll, by the threshold or a full heap
+            self.forced += 1
+            self._base = alloc
+        self._alloc = alloc
+        probe = time.ticks_diff(time.ticks_ms(), self._probe_due) >= 0
+        if alloc - self._base < self._bytes and not probe:
+            return
+        quiet = self.quiet_ms()
+        if probe and quiet >= self.probe_margin_ms:
+            self.sample()
+            self._probe_due = time.ticks_add(time.ticks_ms(), self.probe_s * 1000)
+        elif alloc - self._base < self._bytes:
+            return
+        elif quiet >= self.margin_ms:
+            self.collect()
+        elif not self._waiting:
+            self._waiting = True
+            self.deferred += 1
+
+    # Collects first, then bisects for the largest allocation that succeeds.
+    # A failed one collects by itself before it gives up, so the garbage of
+    # the bisection never skews it.
+    def sample(self) -> None:
+        self.collect()
+        free = gc.mem_free()
+        low = 0
+        high = free
+        while high - low > _PROBE_STEP:
+            mid = (low + high) >> 1
+            try:
+                bytearray(mid)
+                low = mid
+            except MemoryError:
+                high = mid
+        self.collect()
+        i = self.samples % SAMPLES
+        self.free[i] = self.heap_free = free
+        self.largest[i] = self.heap_largest = low
+        self.samples += 1
+        if free < self.low_free:
+            self.low_free = free
+        if low < self.low_largest:
+            self.low_largest = low
+
+    def report(self):
+        return [
+            "heap: {} free, {} in one block, lowest {} and {}".format(
+                self.heap_free, self.heap_largest, self.low_free, self.low_largest),
+            "gc: {} collections, avg {} us, max {} us, {} deferred, {} forced".format(
+                self.collections, self.total_us // self.collections if self.collections else 0,
+                self.max_us, self.deferred, self.forced),
+        ]
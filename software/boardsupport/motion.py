@@ -0,0 +1,199 @@
+# Stepper motion for the tank agitation move
+#
+# One agitation cycle is: forward leg, reversal dwell, reverse leg, cycle
+# dwell, repeated while running. Each leg follows a trapezoidal profile whose
+# step intervals are precomputed whenever the speed or acceleration changes.
+# Pulses come from a single one-shot timer that re-arms itself with the next
+# interval; a dwell is just one long interval, so nothing ever sleeps.
+
+from array import array
+from machine import Timer
+from micropython import const
+import math
+import time
+
+IDLE = const(0)
+FORWARD = const(1)
+REVERSAL_DWELL = const(2)
+REVERSE = const(3)
+CYCLE_DWELL = const(4)
+
+_TICK_HZ = const(1_000_000)
+# quiet_ms() while the motor is off
+QUIET_IDLE_MS = const(0x3FFFFFFF)
+
+
+class AgitationProfile:
+    # Speeds in steps/s, acceleration in steps/s², dwells in ms
+    def __init__(
+        self,
+        steps_per_rev=200 * 8,
+        forward_rev=0.75,
+        reverse_rev=0.3,
+        speed=400,
+        accel=2000,
+        start_speed=100,
+        reversal_dwell_ms=1000,
+        cycle_dwell_ms=2000,
+    ):
+        self.steps_per_rev = steps_per_rev
+        self.forward_rev = forward_rev
+        self.reverse_rev = reverse_rev
+        self.speed = speed
+        self.accel = accel
+        self.start_speed = start_speed
+        self.reversal_dwell_ms = reversal_dwell_ms
+        self.cycle_dwell_ms = cycle_dwell_ms
+
+    @property
+    def forward_steps(self):
+        return int(self.steps_per_rev * self.forward_rev + 0.5)
+
+    @property
+    def reverse_steps(self):
+        return int(self.steps_per_rev * self.reverse_rev + 0.5)
+
+
+class TrapezoidRamp:
+    # Step intervals in µs for a move of `steps` steps. Interval 0 is the delay
+    # before the first pulse, interval i the gap between pulse i-1 and i. The
+    # acceleration table is played backwards for the deceleration, between them
+    # the move cruises.
+    def __init__(self, steps, speed, accel, start_speed):
+        if steps <= 0 or speed <= 0 or accel <= 0:
+            raise ValueError("steps, speed and accel must be positive")
+        start_speed = min(start_speed, speed)
+        self.steps = steps
+        self.cruise = int(_TICK_HZ / speed + 0.5)
+        ramp_steps = int((speed * speed - start_speed * start_speed) / (2 * accel))
+        # Short moves never reach cruise speed and turn into a triangle
+        triangle = ramp_steps > (steps - 1) // 2
+        if triangle:
+            ramp_steps = (steps - 1) // 2
+        self.ramp = array("I", bytearray(4 * ramp_steps))
+        # Time of step i under constant acceleration from start_speed
+        v0 = start_speed
+        last = 0.0
+        for i in range(ramp_steps):
+            t = (math.sqrt(v0 * v0 + 2 * accel * (i + 1)) - v0) / accel
+            self.ramp[i] = int((t - last) * _TICK_HZ + 0.5)
+            last = t
+        self.start = int(_TICK_HZ / start_speed + 0.5)
+        if triangle:
+            # The odd gap at the peak holds the speed reached
+            self.cruise = self.ramp[-1] if ramp_steps else self.start
+        self._decel_from = steps - ramp_steps
+
+    def interval(self, step):
+        if step == 0:
+            return self.start
+        if step <= len(self.ramp):
+            return self.ramp[step - 1]
+        if step >= self._decel_from:
+            return self.ramp[self.steps - 1 - step]
+        return self.cruise
+
+    def duration_us(self):
+        total = 0
+        for i in range(self.steps):
+            total += self.interval(i)
+        return total
+
+
+class AgitationMotion:
+    def __init__(self, step_pin, dir_pin, en_pin, profile=None):
+        self.profile = profile if profile is not None else AgitationProfile()
+        self.step_pin = step_pin
+        self.dir_pin = dir_pin
+        self.en_pin = en_pin
+        self.en_pin.value(1)
+        self.state = IDLE
+        self.cycles = 0
+        self._step = 0
+        # End of the dwell in progress, ticks_ms
+        self._dwell_end = 0
+        self._timer = Timer()
+        self._tick_cb = self._tick
+        self._build()
+
+    def _build(self):
+        p = self.profile
+        # Replaced whole, a running move picks the new tables up at its next step
+        self._forward = TrapezoidRamp(p.forward_steps, p.speed, p.accel, p.start_speed)
+        self._reverse = TrapezoidRamp(p.reverse_steps, p.speed, p.accel, p.start_speed)
+
+    def configure(self, **kwargs) -> None:
+        for name, value in kwargs.items():
+            if not hasattr(self.profile, name):
+                raise AttributeError(name)
+            setattr(self.profile, name, value)
+        self._build()
+
+    def set_speed(self, speed) -> None:
+        self.configure(speed=speed)
+
+    @property
+    def running(self):
+        return self.state != IDLE
+
+    def start(self) -> None:
+        if self.state != IDLE:
+            return
+        self.en_pin.value(0)
+        self._begin_leg(FORWARD)
+
+    def stop(self) -> None:
+        if self.state == IDLE:
+            return
+        self._timer.deinit()
+        self.state = IDLE
+        self.step_pin.value(0)
+        self.en_pin.value(1)
+
+    # ms until the timer needs the CPU for the next step: the rest of a dwell,
+    # none while stepping; for work that would delay a pulse, e.g. a collection
+    def quiet_ms(self):
+        state = self.state
+        if state == IDLE:
+            return QUIET_IDLE_MS
+        if state == REVERSAL_DWELL or state == CYCLE_DWELL:
+            left = time.ticks_diff(self._dwell_end, time.ticks_ms())
+            return left if left > 0 else 0
+        return 0
+
+    def _arm(self, period_us):
+        self._timer.init(mode=Timer.ONE_SHOT, tick_hz=_TICK_HZ, period=period_us, callback=self._tick_cb)
+
+    def _begin_leg(self, state):
+        self.state = state
+        self._step = 0
+        self.dir_pin.value(0 if state == FORWARD else 1)
+        ramp = self._forward if state == FORWARD else self._reverse
+        # The first interval doubles as the driver's direction setup time
+        self._arm(ramp.interval(0))
+
+    def _dwell(self, ms):
+        self._dwell_end = time.ticks_add(time.ticks_ms(), ms)
+        self._arm(ms * 1000)
+
+    def _tick(self, timer):
+        state = self.state
+        if state == FORWARD or state == REVERSE:
+            # Two pin writes are well above the driver's minimum pulse width
+            self.step_pin.value(1)
+            self.step_pin.value(0)
+            self._step += 1
+            ramp = self._forward if state == FORWARD else self._reverse
+            if self._step < ramp.steps:
+                self._arm(ramp.interval(self._step))
+            elif state == FORWARD:
+                self.state = REVERSAL_DWELL
+                self._dwell(self.profile.reversal_dwell_ms)
+            else:
+                self.state = CYCLE_DWELL
+                self._dwell(self.profile.cycle_dwell_ms)
+        elif state == REVERSAL_DWELL:
+            self._begin_leg(REVERSE)
+        elif state == CYCLE_DWELL:
+            self.cycles += 1
+            self._begin_leg(FORWARD)
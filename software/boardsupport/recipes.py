@@ -0,0 +1,242 @@
+# Development recipes: a fixed-record store on flash and an HTTP fetcher
+#
+# recipes.bin is an 8 byte header followed by one 16 byte record per recipe
+# number, so a lookup is one seek and one read into a preallocated buffer,
+# with nothing to parse. A record holds the three times shown on display1..3
+# (seconds) and a short name. The server hands out the same file, built by
+# pack(). The fetcher replaces the local copy only after a complete and
+# valid download, with If-None-Match/If-Modified-Since so an unchanged set
+# costs one 304.
+
+import asyncio
+import logging
+from micropython import const
+import os
+import struct
+
+_MAGIC = b"FRCP"
+_VERSION = const(1)
+_HEADER = "<4sHH"
+_HEADER_SIZE = const(8)
+# flags, three times, name
+_RECORD = "<B3H9s"
+RECORD_SIZE = const(16)
+_VALID = const(0x01)
+
+MAX_RECIPES = const(1000)
+NAME_SIZE = const(9)
+
+
+def pack(recipes, count=None):
+    # recipes maps number -> (times, name), times being three seconds values
+    if count is None:
+        count = max(recipes) + 1 if recipes else 0
+    if count > MAX_RECIPES:
+        raise ValueError("recipe number out of range")
+    buf = bytearray(_HEADER_SIZE + count * RECORD_SIZE)
+    struct.pack_into(_HEADER, buf, 0, _MAGIC, _VERSION, count)
+    for number, (times, name) in recipes.items():
+        if not 0 <= number < count:
+            raise ValueError("recipe number out of range")
+        if isinstance(name, str):
+            name = name.encode()
+        struct.pack_into(_RECORD, buf, _HEADER_SIZE + number * RECORD_SIZE,
+                         _VALID, times[0], times[1], times[2], name[:NAME_SIZE])
+    return buf
+
+
+# Number of records in a recipe file of `size` bytes starting with `header`
+def _check_header(header, size):
+    magic, version, count = struct.unpack_from(_HEADER, header)
+    if magic != _MAGIC or version != _VERSION or count > MAX_RECIPES:
+        raise ValueError("not a recipe file")
+    if size != _HEADER_SIZE + count * RECORD_SIZE:
+        raise ValueError("truncated recipe file")
+    return count
+
+
+def _size(path):
+    return os.stat(path)[6]
+
+
+class RecipeStore:
+    def __init__(self, path="recipes.bin") -> None:
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._record = bytearray(RECORD_SIZE)
+        self.open()
+
+    # (Re)opens the file, a missing or damaged one is an empty store
+    def open(self) -> None:
+        self.close()
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return
+        try:
+            self.count = _check_header(f.read(_HEADER_SIZE), _size(self.path))
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring {self.path}: {e}")
+            f.close()
+            self.count = 0
+            return
+        self._file = f
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.count = 0
+
+    def _read(self, number):
+        if self._file is None or not 0 <= number < self.count:
+            return False
+        self._file.seek(_HEADER_SIZE + number * RECORD_SIZE)
+        self._file.readinto(self._record)
+        return self._record[0] & _VALID
+
+    # (time1, time2, time3) in seconds, or None if there is no such recipe
+    def get(self, number):
+        if not self._read(number):
+            return None
+        return struct.unpack_from("<3H", self._record, 1)
+
+    def name(self, number):
+        if not self._read(number):
+            return None
+        return bytes(self._record[7:]).rstrip(b"\x00").decode()
+
+    # Installs a complete recipe file, e.g. a finished download
+    def replace(self, new_path) -> None:
+        with open(new_path, "rb") as f:
+            _check_header(f.read(_HEADER_SIZE), _size(new_path))
+        self.close()
+        os.rename(new_path, self.path)
+        self.open()
+
+    def save(self, recipes) -> None:
+        tmp = self.path + ".new"
+        with open(tmp, "wb") as f:
+            f.write(pack(recipes))
+        self.replace(tmp)
+
+
+def _split_url(url):
+    if not url.startswith("http://"):
+        raise ValueError("only http:// URLs are supported")
+    host, _, path = url[7:].partition("/")
+    host, _, port = host.partition(":")
+    return host, int(port) if port else 80, "/" + path
+
+
+class RecipeFetcher:
+    # Keeps store in sync with url, checking every period_s seconds
+    def __init__(self, store, url, period_s=600, timeout_s=10) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.store = store
+        self.url = url
+        self.period_s = period_s
+        self.timeout_s = timeout_s
+        self.etag = None
+        self.last_modified = None
+        self._load_validators()
+        # Statistics
+        self.checks = 0
+        self.updates = 0
+        self.not_modified = 0
+        self.failures = 0
+
+    def _validators_path(self):
+        return self.store.path + ".etag"
+
+    def _load_validators(self):
+        try:
+            with open(self._validators_path()) as f:
+                lines = f.read().split("\n")
+        except OSError:
+            return
+        # Only trust them while the file they describe is still there
+        if self.store.count and len(lines) >= 2:
+            self.etag = lines[0] or None
+            self.last_modified = lines[1] or None
+
+    def _save_validators(self):
+        with open(self._validators_path(), "w") as f:
+            f.write("{}\n{}\n".format(self.etag or "", self.last_modified or ""))
+
+    # One conditional GET, True if the store was replaced
+    async def sync(self):
+        self.checks += 1
+        return await asyncio.wait_for(self._sync(), self.timeout_s)
+
+    async def _sync(self):
+        host, port, path = _split_url(self.url)
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            request = "GET {} HTTP/1.0\r\nHost: {}\r\n".format(path, host)
+            if self.etag:
+                request += "If-None-Match: {}\r\n".format(self.etag)
+            if self.last_modified:
+                request += "If-Modified-Since: {}\r\n".format(self.last_modified)
+            writer.write((request + "\r\n").encode())
+            await writer.drain()
+
+            status = (await reader.readline()).split()
+            if len(status) < 2:
+                raise ValueError("bad response")
+            code = int(status[1])
+            length = -1
+            etag = last_modified = None
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                name = name.strip().lower()
+                value = value.strip()
+                if name == "content-length":
+                    length = int(value)
+                elif name == "etag":
+                    etag = value
+                elif name == "last-modified":
+                    last_modified = value
+            if code == 304:
+                self.not_modified += 1
+                return False
+            if code != 200:
+                raise ValueError("HTTP {}".format(code))
+
+            tmp = self.store.path + ".new"
+            received = 0
+            with open(tmp, "wb") as f:
+                while length < 0 or received < length:
+                    chunk = await reader.read(512)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+            if 0 <= length != received:
+                raise ValueError("short body")
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+        # Raises on a damaged file and leaves the old recipes in place
+        self.store.replace(tmp)
+        self.etag = etag
+        self.last_modified = last_modified
+        self._save_validators()
+        self.updates += 1
+        self.logger.info(f"{self.store.count} recipes loaded from {self.url}")
+        return True
+
+    async def run(self):
+        while True:
+            try:
+                await self.sync()
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                self.failures += 1
+                self.logger.warning("Recipe sync failed: %r", e)
+            await asyncio.sleep(self.period_s)
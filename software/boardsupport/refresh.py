@@ -0,0 +1,289 @@
+# Display chain refresh engines
+#
+# SPIRefresh writes each frame with a blocking SPI transfer and pulses the
+# latch from Python. PIORefresh hands the chain to a PIO state machine that
+# shifts and latches frames on its own at a fixed rate, fed by a DMA ring, so
+# showing a frame only costs a copy into RAM. BCMRefresh dims every digit and
+# button LED on its own with binary code modulation on top of PIORefresh.
+
+from array import array
+import logging
+from machine import Pin, SPI
+from micropython import const
+import time
+
+try:
+    import rp2
+    from .dmaring import FrameRing
+except ImportError:
+    rp2 = None
+
+_SCK_PIN = const(2)
+_MOSI_PIN = const(3)
+_LATCH_PIN = const(12)
+
+# Two cycles per bit plus loading the bit counter and the latch pulse
+_CYCLES_PER_BIT = const(2)
+_CYCLES_PER_FRAME = const(3)
+
+# BCMRefresh effects
+_FADE = const(1)
+_PULSE = const(2)
+# x[_WHOLE] = y copies like x[:] = y without a new slice object per call
+_WHOLE = slice(None)
+
+if rp2 is not None:
+
+    @rp2.asm_pio(
+        out_init=rp2.PIO.OUT_LOW,
+        set_init=rp2.PIO.OUT_LOW,
+        sideset_init=rp2.PIO.OUT_LOW,
+        out_shiftdir=rp2.PIO.SHIFT_LEFT,
+        autopull=True,
+        pull_thresh=8,
+    )
+    def _shift_latch():
+        # ISR holds the number of bits per frame minus one for the whole run
+        wrap_target()
+        mov(x, isr)             .side(0)
+        label("bit")
+        out(pins, 1)            .side(0)
+        jmp(x_dec, "bit")       .side(1)
+        set(pins, 1)            .side(0)
+        set(pins, 0)            .side(0)
+        wrap()
+
+
+class SPIRefresh:
+    # No per-element brightness, see BCMRefresh
+    levels = None
+
+    def __init__(self, spi, latch_pin) -> None:
+        self.spi = spi
+        self.latch_pin = latch_pin
+        self.frames = 0
+
+    def show(self, buf) -> None:
+        self.spi.write(buf)
+        self.latch_pin.off()
+        self.latch_pin.on()
+        self.latch_pin.off()
+        self.frames += 1
+
+    def deinit(self) -> None:
+        pass
+
+
+class PIORefresh:
+    levels = None
+
+    # With frame_bytes the ring holds several frames, each one latched on its own
+    def __init__(self, initial, rate=200, sm_id=0, sck=_SCK_PIN, mosi=_MOSI_PIN, latch=_LATCH_PIN,
+                 frame_bytes=None) -> None:
+        bits = (frame_bytes or len(initial)) * 8
+        cycles = bits * _CYCLES_PER_BIT + _CYCLES_PER_FRAME
+        self.cycles_per_frame = cycles
+        self.rate = rate
+        self.frames = 0
+        self._sm = rp2.StateMachine(
+            sm_id,
+            _shift_latch,
+            freq=rate * cycles,
+            sideset_base=Pin(sck),
+            out_base=Pin(mosi),
+            set_base=Pin(latch),
+        )
+        self._sm.put(bits - 1)
+        self._sm.exec("pull()")
+        self._sm.exec("mov(isr, osr)")
+        # Leave the OSR empty so the first out() autopulls frame data
+        self._sm.exec("out(null, 32)")
+        self._ring = FrameRing(sm_id, initial)
+        self._sm.active(1)
+        self._ring.start()
+
+    def show(self, buf) -> None:
+        self._ring.show(buf)
+        self.frames += 1
+
+    def deinit(self) -> None:
+        self._ring.stop()
+        self._sm.active(0)
+
+
+# Plane of every slot of a BCM cycle: plane k in 2**k of the 2**bits - 1
+# slots, the most significant one every other slot, so even a dim element is
+# lit several times per cycle
+def bcm_order(bits):
+    order = bytearray((1 << bits) - 1)
+    for slot in range(1, 1 << bits):
+        plane = bits - 1
+        s = slot
+        while not s & 1:
+            s >>= 1
+            plane -= 1
+        order[slot - 1] = plane
+    return order
+
+
+class BCMRefresh:
+    # Frames are shown as bit planes: plane k keeps the segments and LEDs
+    # whose level has bit k set, and the PIO engine latches the planes in
+    # bcm_order() at rate full cycles per second, so an element with level l
+    # is lit l / max_level of the time. The planes are rebuilt when the frame
+    # or a level changes, in between the DMA ring refreshes without the CPU.
+    #
+    # Elements 1 to len(frame) - 1 are the digits (chain bytes, as in the
+    # framebuffer), led(bit) is the element of a bit of the LED register,
+    # which is active low like byte 0 of every frame.
+    def __init__(self, initial, rate=1000, bits=5, sm_id=0) -> None:
+        n = len(initial)
+        self.bits = bits
+        self.max_level = (1 << bits) - 1
+        self.rate = rate
+        self.frames = 0
+        self.builds = 0
+        self._n = n
+        self._frame = bytearray(initial)
+        self._frame_view = memoryview(self._frame)
+        self._order = bcm_order(bits)
+        self._planes = bytearray(bits * n)
+        self._slots = bytearray(len(self._order) * n)
+        self._plane_views = [memoryview(self._planes)[k * n:(k + 1) * n] for k in range(bits)]
+        slots = memoryview(self._slots)
+        self._slot_views = [slots[s * n:(s + 1) * n] for s in range(len(self._order))]
+        # Levels set, levels shown (they differ while an effect runs)
+        self.levels = bytearray([self.max_level] * (n + 8))
+        self._shown = bytearray(self.levels)
+        # Effects: fade from _from to levels over _span ms from _start, or
+        # pulse between 0 and levels every _span ms
+        self._effect = bytearray(n + 8)
+        self._from = bytearray(n + 8)
+        self._start = array("i", [0] * (n + 8))
+        self._span = array("i", [0] * (n + 8))
+        self._effects = 0
+        self._build()
+        self._engine = PIORefresh(self._slots, rate * len(self._order), sm_id, frame_bytes=n)
+
+    def led(self, bit):
+        return self._n + bit
+
+    def show(self, buf) -> None:
+        self._frame_view[_WHOLE] = buf
+        self._build()
+        self._engine.show(self._slots)
+        self.frames += 1
+
+    def set_level(self, element, level) -> None:
+        self.fade(element, level, 0)
+
+    # Fade an element to level over ms, 0 sets it at the next animate()
+    def fade(self, element, level, ms=0) -> None:
+        if not 0 <= level <= self.max_level:
+            raise ValueError("level out of range")
+        self.levels[element] = level
+        # A pulse goes on around the new level
+        if self._effect[element] == _PULSE:
+            return
+        self._stop(element)
+        if ms <= 0:
+            self._shown[element] = level
+            self._changed = True
+            return
+        self._from[element] = self._shown[element]
+        self._start[element] = time.ticks_ms()
+        self._span[element] = ms
+        self._effect[element] = _FADE
+        self._effects += 1
+
+    # Blink an element smoothly, from its level to dark and back every
+    # period_ms; 0 stops it
+    def pulse(self, element, period_ms) -> None:
+        self._stop(element)
+        self._shown[element] = self.levels[element]
+        self._changed = True
+        if period_ms:
+            self._span[element] = period_ms
+            self._effect[element] = _PULSE
+            self._effects += 1
+
+    def _stop(self, element):
+        if self._effect[element]:
+            self._effect[element] = 0
+            self._effects -= 1
+
+    # Advance the effects, rebuilds and shows the planes when a level moved
+    def animate(self) -> bool:
+        changed = self._changed
+        if self._effects:
+            now = time.ticks_ms()
+            effect = self._effect
+            shown = self._shown
+            for e in range(len(effect)):
+                if not effect[e]:
+                    continue
+                target = self.levels[e]
+                t = time.ticks_diff(now, self._start[e])
+                span = self._span[e]
+                if effect[e] == _FADE:
+                    if t >= span:
+                        level = target
+                        effect[e] = 0
+                        self._effects -= 1
+                    else:
+                        level = self._from[e] + (target - self._from[e]) * t // span
+                else:
+                    # Triangle, dark half way through the period
+                    t = 2 * target * (now % span) // span
+                    level = target - t if t <= target else t - target
+                if shown[e] != level:
+                    shown[e] = level
+                    changed = True
+        if changed:
+            self._build()
+            self._engine.show(self._slots)
+        return changed
+
+    def _build(self):
+        self._changed = False
+        n = self._n
+        frame = self._frame
+        planes = self._planes
+        shown = self._shown
+        for k in range(self.bits):
+            base = k * n
+            # LEDs are lit by a low bit
+            mask = 0
+            for bit in range(8):
+                if shown[n + bit] >> k & 1:
+                    mask |= 1 << bit
+            planes[base] = frame[0] | (~mask & 0xFF)
+            for i in range(1, n):
+                planes[base + i] = frame[i] if shown[i] >> k & 1 else 0
+        order = self._order
+        views = self._plane_views
+        slots = self._slot_views
+        for s in range(len(order)):
+            slots[s][_WHOLE] = views[order[s]]
+        self.builds += 1
+
+    def deinit(self) -> None:
+        self._engine.deinit()
+
+
+# Use the PIO engine when asked for and available, the SPI(0) path otherwise.
+# dimming is None or a dict of BCMRefresh settings (rate, bits), it needs PIO.
+def make_refresh(initial, pio=False, rate=200, dimming=None):
+    if (pio or dimming) and rp2 is not None:
+        try:
+            if dimming:
+                return BCMRefresh(initial, **dimming)
+            return PIORefresh(initial, rate)
+        except (ValueError, OSError) as e:
+            logging.getLogger(__name__).warning(f"PIO refresh unavailable ({e}), using SPI")
+    elif dimming:
+        logging.getLogger(__name__).warning("Dimming needs PIO, using SPI at full brightness")
+    return SPIRefresh(
+        SPI(0, baudrate=10_000_000, sck=Pin(_SCK_PIN), mosi=Pin(_MOSI_PIN)),
+        Pin(_LATCH_PIN, Pin.OUT),
+    )
@@ -8,6 +8,7 @@
 #   https://github.com/MikeTeachman/micropython-rotary
 
 import micropython
+import time
 
 _DIR_CW = const(0x10)  # Clockwise step
 _DIR_CCW = const(0x20)  # Counter-clockwise step
@@ -86,6 +87,12 @@ class Rotary(object):
         self._half_step = half_step
         self._invert = invert
         self._listener = []
+        self._queue = None
+        self._source = 0
+        # Flat (interval_us, multiplier, ...) pairs, see set_acceleration()
+        self._accel = ()
+        self._last_step_us = 0
+        self._last_sign = 0
 
     def set(self, value=None, min_val=None, incr=None,
             max_val=None, reverse=None, range_mode=None):
@@ -109,6 +116,41 @@ class Rotary(object):
         # enable DT and CLK pin interrupts
         self._hal_enable_irq()
 
+    # Velocity acceleration. curve is ((interval_ms, multiplier), ...) from
+    # the shortest interval up: a step that follows the previous one in the
+    # same direction within interval_ms counts multiplier times. A reversal
+    # or a pause starts over at one. None or () turns it off.
+    def set_acceleration(self, curve):
+        flat = []
+        last = 0
+        for interval_ms, multiplier in curve or ():
+            if interval_ms <= last or multiplier < 1:
+                raise ValueError('intervals must rise and multipliers be >= 1')
+            last = interval_ms
+            flat.append(interval_ms * 1000)
+            flat.append(multiplier)
+        self._hal_disable_irq()
+        self._accel = tuple(flat)
+        self._last_sign = 0
+        self._hal_enable_irq()
+
+    # Multiplier for `steps` steps in the direction of sign, taken since the
+    # previous ones; runs in IRQ context and only compares small ints
+    def _accelerate(self, sign, steps):
+        now = time.ticks_us()
+        interval = time.ticks_diff(now, self._last_step_us) // steps
+        self._last_step_us = now
+        if sign != self._last_sign:
+            self._last_sign = sign
+            return 1
+        curve = self._accel
+        i = 0
+        while i < len(curve):
+            if interval < curve[i]:
+                return curve[i + 1]
+            i += 2
+        return 1
+
     def value(self):
         return self._value
 
@@ -118,6 +160,11 @@ class Rotary(object):
     def close(self):
         self._hal_close()
 
+    # Report every value change as a delta record to an EventQueue
+    def post_to(self, queue, source):
+        self._queue = queue
+        self._source = source
+
     def add_listener(self, l):
         self._listener.append(l)
 
@@ -127,7 +174,6 @@ class Rotary(object):
         self._listener.remove(l)
         
     def _process_rotary_pins(self, pin):
-        old_value = self._value
         clk_dt_pins = (self._hal_get_clk_value() <<
                        1) | self._hal_get_dt_value()
                        
@@ -149,8 +195,13 @@ class Rotary(object):
         elif direction == _DIR_CCW:
             incr = -self._incr
 
+        if incr and self._accel:
+            incr *= self._accelerate(1 if incr > 0 else -1, 1)
         incr *= self._reverse
+        self._change_value(incr)
 
+    def _change_value(self, incr):
+        old_value = self._value
         if self._range_mode == self.RANGE_WRAP:
             self._value = _wrap(
                 self._value,
@@ -166,9 +217,11 @@ class Rotary(object):
         else:
             self._value = self._value + incr
 
+        if old_value != self._value and self._queue is not None:
+            self._queue.post_delta(self._source, self._value - old_value)
+
         try:
             if old_value != self._value and len(self._listener) != 0:
                 _trigger(self)
         except:
             pass
-
@@ -33,6 +33,8 @@ class RotaryIRQ(Rotary):
         super().__init__(min_val, max_val, incr, reverse, range_mode, half_step, invert)
 
         self.id = id
+        # trace.EdgeTrace takes the pins as hard IRQs and schedules the decoder
+        self._hard = False
 
         if pull_up:
             self._pin_clk = Pin(pin_num_clk, Pin.IN, Pin.PULL_UP)
@@ -44,10 +46,10 @@ class RotaryIRQ(Rotary):
         self._hal_enable_irq()
 
     def _enable_clk_irq(self):
-        self._pin_clk.irq(self._process_rotary_pins, IRQ_RISING_FALLING)
+        self._pin_clk.irq(self._process_rotary_pins, IRQ_RISING_FALLING, hard=self._hard)
 
     def _enable_dt_irq(self):
-        self._pin_dt.irq(self._process_rotary_pins, IRQ_RISING_FALLING)
+        self._pin_dt.irq(self._process_rotary_pins, IRQ_RISING_FALLING, hard=self._hard)
 
     def _disable_clk_irq(self):
         self._pin_clk.irq(None, 0)
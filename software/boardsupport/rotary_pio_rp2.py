@@ -0,0 +1,155 @@
+# Platform-specific MicroPython code for the rotary encoder module
+# Raspberry Pi Pico PIO implementation
+#
+# Each encoder runs on its own PIO state machine that follows CLK in hardware
+# and, depending on DT at every CLK edge, decrements X (clockwise) or Y
+# (counter-clockwise). Nothing runs in Python per edge, so fast spins cannot
+# drop steps. QuadratureBank.poll() reads all counters in one pass and feeds
+# the accumulated steps through the usual Rotary range and listener logic.
+
+from machine import Pin, Timer
+from micropython import const
+import rp2
+from .rotary import Rotary
+
+# Counters start mid-range so every value read back stays a small int
+_COUNTER_START = const(1 << 29)
+
+
+@rp2.asm_pio(out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+def _quadrature():
+    # Y holds the start value, copy it to X and enter the loop at the edge
+    # CLK will make next
+    mov(osr, pins)
+    out(x, 1)
+    jmp(not_x, "low")
+    mov(x, y)
+    jmp("fall")
+    label("low")
+    mov(x, y)
+    wrap_target()
+    label("top")
+    # CLK rising: DT low is clockwise
+    wait(1, pin, 0)
+    jmp(pin, "ccw_rise")
+    jmp(x_dec, "fall")
+    jmp("fall")
+    label("ccw_rise")
+    jmp(y_dec, "fall")
+    label("fall")
+    # CLK falling: DT high is clockwise
+    wait(0, pin, 0)
+    jmp(pin, "cw_fall")
+    jmp(y_dec, "top")
+    jmp("top")
+    label("cw_fall")
+    jmp(x_dec, "top")
+    wrap()
+
+
+# Injected with exec() to copy a counter into the RX FIFO while the program runs
+_MOV_ISR_X = rp2.asm_pio_encode("mov(isr, x)", 0)
+_MOV_ISR_Y = rp2.asm_pio_encode("mov(isr, y)", 0)
+_PUSH = rp2.asm_pio_encode("push(noblock)", 0)
+
+
+class RotaryPIO(Rotary):
+    def __init__(
+        self,
+        pin_num_clk,
+        pin_num_dt,
+        min_val=0,
+        max_val=10,
+        incr=1,
+        reverse=False,
+        range_mode=Rotary.RANGE_UNBOUNDED,
+        pull_up=False,
+        half_step=False,
+        invert=False,
+        id=0,
+        sm_id=4,
+    ):
+        super().__init__(min_val, max_val, incr, reverse, range_mode, half_step, invert)
+
+        self.id = id
+        # The decoder counts both CLK edges, a full step detent spans two.
+        # The IRQ decoder's full step table counts the other way round, match it
+        self._edges_per_step = 1 if half_step else 2
+        self._direction = 1 if half_step else -1
+        self._count = 0
+        self._pending = 0
+
+        if pull_up:
+            self._pin_clk = Pin(pin_num_clk, Pin.IN, Pin.PULL_UP)
+            self._pin_dt = Pin(pin_num_dt, Pin.IN, Pin.PULL_UP)
+        else:
+            self._pin_clk = Pin(pin_num_clk, Pin.IN)
+            self._pin_dt = Pin(pin_num_dt, Pin.IN)
+
+        # Inverting both signals maps rising/low onto falling/high, the
+        # direction rule is unchanged so invert needs no special handling
+        self._sm = rp2.StateMachine(sm_id, _quadrature, in_base=self._pin_clk, jmp_pin=self._pin_dt)
+        self._sm.put(_COUNTER_START)
+        self._sm.exec("pull()")
+        self._sm.exec("mov(y, osr)")
+        self._sm.active(1)
+
+    def _hal_read_count(self):
+        sm = self._sm
+        sm.exec(_MOV_ISR_X)
+        sm.exec(_PUSH)
+        cw = sm.get()
+        sm.exec(_MOV_ISR_Y)
+        sm.exec(_PUSH)
+        ccw = sm.get()
+        # Both registers count down from the same start, the difference is the position
+        return ccw - cw
+
+    def _update(self, count):
+        edges = count - self._count + self._pending
+        self._count = count
+        if edges == 0:
+            return
+        if edges >= 0:
+            steps = edges // self._edges_per_step
+        else:
+            steps = -(-edges // self._edges_per_step)
+        self._pending = edges - steps * self._edges_per_step
+        if steps:
+            incr = steps * self._direction * self._incr
+            if self._accel:
+                # Several steps in one poll share the time since the last ones
+                incr *= self._accelerate(1 if steps > 0 else -1, abs(steps))
+            self._change_value(incr * self._reverse)
+
+    def _hal_enable_irq(self):
+        pass
+
+    def _hal_disable_irq(self):
+        pass
+
+    def _hal_close(self):
+        self._sm.active(0)
+
+
+class QuadratureBank:
+    # Polls a group of RotaryPIO encoders together from one timer
+    def __init__(self, rotaries, period_ms=20):
+        self.rotaries = rotaries
+        self.period_ms = period_ms
+        self.polls = 0
+        self._timer = Timer()
+        self._poll_cb = self.poll
+
+    def start(self):
+        self._timer.init(period=self.period_ms, callback=self._poll_cb)
+
+    def stop(self):
+        self._timer.deinit()
+
+    def poll(self, timer=None):
+        rotaries = self.rotaries
+        for i in range(len(rotaries)):
+            rotary = rotaries[i]
+            rotary._update(rotary._hal_read_count())
+        self.polls += 1
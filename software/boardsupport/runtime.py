@@ -0,0 +1,220 @@
+# asyncio application core
+#
+# Runs the controller's periodic work as tasks on one event loop: input (the
+# event queue and the switch scan), display and countdowns, the fades of the
+# display dimming, encoder polling, networking, the RS485 bus, saving the
+# input trace, garbage collection in idle windows, the controller's log and
+# statistics. Tasks only yield between whole pieces of work, so the UI state
+# is never touched by two of them at once. Step pulses, encoder edges and the
+# exposure deadline stay in IRQ context.
+#
+# Every task records how long its work takes, and a probe task measures how
+# late the loop wakes it up, which is the headroom that is left.
+
+import asyncio
+import logging
+from micropython import const
+import time
+from . import boottime
+
+_PROBE_MS = const(10)
+_LOG_MS = const(200)
+# Fades and pulses of the display dimming
+_DIMMING_MS = const(20)
+# The RS485 bus, its receive buffer holds 10 ms at 250 kbaud
+_BUS_MS = const(2)
+# Saves a full input trace
+_TRACE_MS = const(1000)
+# 10 s per association attempt
+_CONNECT_POLLS = const(50)
+_BACKOFF_MIN_S = const(2)
+_BACKOFF_MAX_S = const(120)
+
+
+class TaskStats:
+    def __init__(self, name) -> None:
+        self.name = name
+        self.reset()
+
+    def reset(self) -> None:
+        self.runs = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def add(self, us) -> None:
+        self.runs += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    @property
+    def avg_us(self):
+        return self.total_us // self.runs if self.runs else 0
+
+
+class Runtime:
+    # The controller must be built with timers=False. wifi is a
+    # (ssid, password, hostname) tuple or None, fetcher a recipes.RecipeFetcher,
+    # control a control.ControlServer and bus a bus.BusNode.
+    def __init__(
+        self, controller, wifi=None, stats_period_s=60, fetcher=None, control=None, bus=None,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.controller = controller
+        self.wifi = wifi
+        self.stats_period_s = stats_period_s
+        self.fetcher = fetcher
+        self.control = control
+        self.bus = bus
+        self.tasks = []
+        self.lag = TaskStats("loop lag")
+        self.wlan = None
+        self.wifi_connects = 0
+        self._input_flag = asyncio.ThreadSafeFlag()
+        controller.events.notify(self._input_flag.set)
+        # Whatever was queued before the loop started
+        self._input_flag.set()
+
+    def _stats(self, name):
+        stats = TaskStats(name)
+        self.tasks.append(stats)
+        return stats
+
+    async def _every(self, name, period_ms, func):
+        stats = self._stats(name)
+        ticks_us = time.ticks_us
+        ticks_diff = time.ticks_diff
+        while True:
+            start = ticks_us()
+            try:
+                func()
+            except Exception as e:
+                # One failing poll must not end the gather and every other task
+                self.logger.error("%s failed: %r", name, e)
+            stats.add(ticks_diff(ticks_us(), start))
+            await asyncio.sleep_ms(period_ms)
+
+    async def _input(self):
+        stats = self._stats("input")
+        queue = self.controller.events
+        flag = self._input_flag
+        while True:
+            await flag.wait()
+            start = time.ticks_us()
+            try:
+                queue.drain()
+            except Exception as e:
+                self.logger.error("input failed: %r", e)
+                # The events behind the failed one are still queued
+                flag.set()
+            stats.add(time.ticks_diff(time.ticks_us(), start))
+
+    # The controller's log is formatted here, off the input path
+    def _drain_log(self):
+        self.controller.log.drain(self.controller.logger)
+
+    async def _probe(self):
+        lag = self.lag
+        while True:
+            start = time.ticks_us()
+            await asyncio.sleep_ms(_PROBE_MS)
+            late = time.ticks_diff(time.ticks_us(), start) - _PROBE_MS * 1000
+            lag.add(late if late > 0 else 0)
+
+    # Associates in the background, backing off from 2 s to 2 min between
+    # failed attempts; a lost connection starts over at 2 s
+    async def _network(self):
+        try:
+            import network
+        except ImportError:
+            return
+        ssid, password, hostname = self.wifi
+        network.hostname(hostname)
+        self.wlan = wlan = network.WLAN(network.STA_IF)
+        wlan.active(True)
+        backoff = _BACKOFF_MIN_S
+        while True:
+            if wlan.isconnected():
+                backoff = _BACKOFF_MIN_S
+                await asyncio.sleep(10)
+                continue
+            self.logger.info("Connecting to %s", ssid)
+            wlan.connect(ssid, password)
+            for _ in range(_CONNECT_POLLS):
+                if wlan.isconnected():
+                    break
+                await asyncio.sleep_ms(200)
+            if wlan.isconnected():
+                self.wifi_connects += 1
+                if self.wifi_connects == 1:
+                    boottime.mark("wifi")
+                self.logger.info("WiFi up: %s", wlan.ifconfig()[0])
+                continue
+            wlan.disconnect()
+            self.logger.info("WiFi not up, retrying in %d s", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(_BACKOFF_MAX_S, backoff * 2)
+
+    def report(self):
+        lines = ["loop lag: avg {} us, max {} us".format(self.lag.avg_us, self.lag.max_us)]
+        for stats in self.tasks:
+            lines.append("{}: {} runs, avg {} us, max {} us".format(
+                stats.name, stats.runs, stats.avg_us, stats.max_us))
+        if self.controller.memory is not None:
+            lines.extend(self.controller.memory.report())
+        return lines
+
+    def reset_stats(self) -> None:
+        self.lag.reset()
+        for stats in self.tasks:
+            stats.reset()
+        if self.controller.memory is not None:
+            self.controller.memory.reset_stats()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.stats_period_s)
+            for line in self.report():
+                self.logger.info(line)
+            self.reset_stats()
+
+    def create_tasks(self):
+        controller = self.controller
+        tasks = [
+            asyncio.create_task(self._input()),
+            asyncio.create_task(self._every("buttons", controller.buttons.period_ms, controller.buttons.scan)),
+            asyncio.create_task(self._every("display", 100, controller.update)),
+            asyncio.create_task(self._probe()),
+            asyncio.create_task(self._every("log", _LOG_MS, self._drain_log)),
+        ]
+        if controller.dimming is not None:
+            tasks.append(asyncio.create_task(self._every("dimming", _DIMMING_MS, controller.dimming.animate)))
+        if controller.encoder_bank is not None:
+            bank = controller.encoder_bank
+            tasks.append(asyncio.create_task(self._every("encoders", bank.period_ms, bank.poll)))
+        if self.wifi is not None:
+            tasks.append(asyncio.create_task(self._network()))
+        if self.fetcher is not None:
+            tasks.append(asyncio.create_task(self.fetcher.run()))
+        if self.control is not None:
+            tasks.append(asyncio.create_task(self.control.run()))
+        if self.bus is not None:
+            tasks.append(asyncio.create_task(self._every("bus", _BUS_MS, self.bus.poll)))
+        if controller.trace is not None:
+            tasks.append(asyncio.create_task(self._every("trace", _TRACE_MS, controller.trace.poll)))
+        memory = controller.memory
+        if memory is not None:
+            tasks.append(asyncio.create_task(self._every("memory", memory.period_ms, memory.poll)))
+        telemetry = controller.telemetry
+        if telemetry is not None:
+            tasks.append(asyncio.create_task(self._every("telemetry", telemetry.period_ms, telemetry.send)))
+        if self.stats_period_s:
+            tasks.append(asyncio.create_task(self._report()))
+        return tasks
+
+    async def main(self):
+        tasks = self.create_tasks()
+        await asyncio.gather(*tasks)
+
+    def run(self) -> None:
+        asyncio.run(self.main())
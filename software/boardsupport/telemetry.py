@@ -0,0 +1,270 @@
+# Timing and health telemetry for the hot paths
+#
+# attach() replaces the controller's IRQ and timer callbacks on the instances
+# with wrappers that time each call with ticks_us into a Probe: count, total,
+# min, max and a histogram of power-of-two µs buckets, all preallocated, so
+# recording never allocates. Without attach() nothing is wrapped and main.py
+# does not even import this module, telemetry then costs nothing.
+#
+# snapshot() packs every probe and counter into one binary packet and starts
+# the next interval; sinks send it over UDP or as a "#TLM <hex>" line on the
+# serial console. tools/telemetry_decode.py prints the packets.
+#
+# Packet, little endian:
+#   header  4s magic, B version, B probes, B counters, x, I sequence, I ticks_ms
+#   probe   B id, 3x, I count, I total_us, I min_us, I max_us, 12I histogram
+#   counter I value, in COUNTERS order
+
+from array import array
+from micropython import const
+import struct
+import time
+
+# Probe ids, in packet order. encoder is the pin IRQ handler or, with the
+# PIO encoders, the bank poll
+RENDER = const(0)
+ENCODER = const(1)
+SCAN = const(2)
+STEP = const(3)
+STEP_LATE = const(4)
+DRAIN = const(5)
+PROBES = ("render", "encoder", "scan", "step", "step_late", "drain")
+
+# Counter ids
+SCHEDULE_FAILURES = const(0)
+QUEUE_OVERFLOWS = const(1)
+QUEUE_MAX_DEPTH = const(2)
+LATE_STEPS = const(3)
+STALLS = const(4)
+EXPOSURE_MAX_ERROR_US = const(5)
+# From memory.MemoryManager, 0 without one
+HEAP_FREE = const(6)
+HEAP_LARGEST = const(7)
+GC_COLLECTIONS = const(8)
+GC_MAX_US = const(9)
+GC_FORCED = const(10)
+COUNTERS = ("schedule_failures", "queue_overflows", "queue_max_depth", "late_steps", "stalls",
+            "exposure_max_error_us", "heap_free", "heap_largest", "gc_collections", "gc_max_us",
+            "gc_forced")
+
+# Bucket i counts durations of 2**i .. 2**(i+1)-1 µs, the last one the rest
+BUCKETS = const(12)
+
+_MAGIC = b"FTLM"
+_VERSION = const(1)
+_HEADER = "<4sBBBxII"
+_HEADER_SIZE = const(16)
+_PROBE = "<B3x4I12I"
+_PROBE_SIZE = const(68)
+_MIN_NONE = const(0x3FFFFFFF)
+
+
+class Probe:
+    def __init__(self) -> None:
+        self.hist = array("I", [0] * BUCKETS)
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.total_us = 0
+        self.min_us = _MIN_NONE
+        self.max_us = 0
+        hist = self.hist
+        for i in range(BUCKETS):
+            hist[i] = 0
+
+    # May run in IRQ context
+    def record(self, us) -> None:
+        self.count += 1
+        self.total_us += us
+        if us < self.min_us:
+            self.min_us = us
+        if us > self.max_us:
+            self.max_us = us
+        bucket = 0
+        while us > 1 and bucket < BUCKETS - 1:
+            us >>= 1
+            bucket += 1
+        self.hist[bucket] += 1
+
+
+def _timed(probe, func):
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+    record = probe.record
+
+    def timed(arg=None):
+        start = ticks_us()
+        func(arg)
+        record(ticks_diff(ticks_us(), start))
+
+    return timed
+
+
+class Telemetry:
+    def __init__(self, period_ms=10_000) -> None:
+        self.period_ms = period_ms
+        self.probes = tuple(Probe() for _ in PROBES)
+        self.counters = array("I", [0] * len(COUNTERS))
+        self.sequence = 0
+        self.sink = None
+        self.controller = None
+        self._buf = bytearray(_HEADER_SIZE + len(PROBES) * _PROBE_SIZE + 4 * len(COUNTERS))
+        # Time and period of the step timer's last arming
+        self._armed = array("i", [0, 0])
+
+    # Instruments a controller built with timers=False, before the runtime
+    # starts its tasks
+    def attach(self, controller) -> None:
+        self.controller = controller
+        controller.telemetry = self
+        probes = self.probes
+        controller.render_full_display = _timed(probes[RENDER], controller.render_full_display)
+        for rotary in controller.rotaries:
+            if hasattr(rotary, "_pin_clk"):
+                # Registered with the pins again to pick the wrapper up
+                rotary._process_rotary_pins = _timed(probes[ENCODER], rotary._process_rotary_pins)
+                rotary._hal_enable_irq()
+        bank = controller.encoder_bank
+        if bank is not None:
+            bank.poll = bank._poll_cb = _timed(probes[ENCODER], bank.poll)
+        buttons = controller.buttons
+        buttons.scan = buttons._scan_cb = _timed(probes[SCAN], buttons.scan)
+        events = controller.events
+        events.drain = events._drain_cb = _timed(probes[DRAIN], events.drain)
+        motion = getattr(controller, "motion", None)
+        if motion is not None and hasattr(motion, "_arm"):
+            self._attach_steps(motion)
+
+    def _attach_steps(self, motion):
+        ticks_us = time.ticks_us
+        ticks_diff = time.ticks_diff
+        armed = self._armed
+        counters = self.counters
+        late = self.probes[STEP_LATE].record
+        arm = motion._arm
+        tick = _timed(self.probes[STEP], motion._tick_cb)
+
+        def timed_arm(period_us):
+            armed[0] = ticks_us()
+            armed[1] = period_us
+            arm(period_us)
+
+        # How late the timer fires against the period it was armed with
+        def timed_tick(timer):
+            lateness = ticks_diff(ticks_us(), armed[0]) - armed[1]
+            if lateness < 0:
+                lateness = 0
+            late(lateness)
+            if lateness > armed[1] >> 1:
+                counters[LATE_STEPS] += 1
+            tick(timer)
+
+        motion._arm = timed_arm
+        motion._tick_cb = timed_tick
+
+    def _collect(self):
+        controller = self.controller
+        if controller is None:
+            return
+        counters = self.counters
+        events = controller.events
+        counters[SCHEDULE_FAILURES] = events.schedule_failures
+        counters[QUEUE_OVERFLOWS] = events.overflows
+        counters[QUEUE_MAX_DEPTH] = events.max_depth
+        motion = getattr(controller, "motion", None)
+        counters[STALLS] = getattr(motion, "stalls", 0)
+        exposure = controller.exposure
+        counters[EXPOSURE_MAX_ERROR_US] = exposure.max_error_us if exposure is not None else 0
+        memory = controller.memory
+        if memory is not None:
+            counters[HEAP_FREE] = memory.heap_free
+            counters[HEAP_LARGEST] = memory.heap_largest
+            counters[GC_COLLECTIONS] = memory.collections
+            counters[GC_MAX_US] = memory.max_us
+            counters[GC_FORCED] = memory.forced
+
+    # Packs the interval since the last snapshot and starts a new one
+    def snapshot(self):
+        self._collect()
+        buf = self._buf
+        struct.pack_into(_HEADER, buf, 0, _MAGIC, _VERSION, len(self.probes), len(self.counters),
+                         self.sequence, time.ticks_ms())
+        offset = _HEADER_SIZE
+        probes = self.probes
+        for i in range(len(probes)):
+            probe = probes[i]
+            struct.pack_into(_PROBE, buf, offset, i, probe.count, probe.total_us,
+                             probe.min_us if probe.count else 0, probe.max_us, *probe.hist)
+            probe.reset()
+            offset += _PROBE_SIZE
+        counters = self.counters
+        for i in range(len(counters)):
+            struct.pack_into("<I", buf, offset, counters[i])
+            offset += 4
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return buf
+
+    def send(self) -> None:
+        packet = self.snapshot()
+        if self.sink is not None:
+            self.sink(packet)
+
+
+def udp_sink(host, port):
+    import socket
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = []
+
+    def send(packet):
+        try:
+            # Resolved on first use, the network comes up after boot
+            if not address:
+                address.append(socket.getaddrinfo(host, port)[0][-1])
+            sock.sendto(packet, address[0])
+        except OSError:
+            # No network yet, the next interval tries again
+            pass
+
+    return send
+
+
+def serial_sink(stream=None):
+    import binascii
+    import sys
+
+    out = stream if stream is not None else sys.stdout
+
+    def send(packet):
+        out.write("#TLM " + binascii.hexlify(packet).decode() + "\n")
+
+    return send
+
+
+# {"sequence", "ticks_ms", "probes": {name: {...}}, "counters": {name: value}}
+def decode(packet):
+    magic, version, probe_count, counter_count, sequence, ticks = struct.unpack_from(_HEADER, packet)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("not a telemetry packet")
+    if len(packet) < _HEADER_SIZE + probe_count * _PROBE_SIZE + 4 * counter_count:
+        raise ValueError("short telemetry packet")
+    probes = {}
+    offset = _HEADER_SIZE
+    for _ in range(probe_count):
+        fields = struct.unpack_from(_PROBE, packet, offset)
+        name = PROBES[fields[0]] if fields[0] < len(PROBES) else "probe{}".format(fields[0])
+        probes[name] = {
+            "count": fields[1],
+            "total_us": fields[2],
+            "min_us": fields[3],
+            "max_us": fields[4],
+            "hist": fields[5:],
+        }
+        offset += _PROBE_SIZE
+    counters = {}
+    for i in range(counter_count):
+        name = COUNTERS[i] if i < len(COUNTERS) else "counter{}".format(i)
+        counters[name] = struct.unpack_from("<I", packet, offset)[0]
+        offset += 4
+    return {"sequence": sequence, "ticks_ms": ticks, "probes": probes, "counters": counters}
@@ -0,0 +1,313 @@
+# TMC5160 stepper driver on the BOB5160 breakout
+#
+# The breakout is wired to SPI1 through the BOB_ENABLE jumpers (SDO GP8,
+# CSN GP9, SCK GP10, SDI GP11). Every access is a 40-bit datagram: address
+# (bit 7 set for writes) and 32 data bits, MSB first. The chip answers each
+# datagram with its SPI_STATUS byte and the data of the *previous* read, so a
+# batch of N reads costs N+1 datagrams. All datagrams of a batch go out of
+# one preallocated buffer, nothing is allocated per transfer.
+#
+# The chip's ramp generator does the motion, Python only sets targets.
+
+from array import array
+from machine import Pin, SPI, Timer
+from micropython import const
+from .motion import AgitationProfile, IDLE, FORWARD, REVERSAL_DWELL, REVERSE, CYCLE_DWELL
+
+# Registers
+GCONF = const(0x00)
+GSTAT = const(0x01)
+IOIN = const(0x04)
+IHOLD_IRUN = const(0x10)
+TPOWERDOWN = const(0x11)
+TPWMTHRS = const(0x13)
+TCOOLTHRS = const(0x14)
+RAMPMODE = const(0x20)
+XACTUAL = const(0x21)
+VACTUAL = const(0x22)
+VSTART = const(0x23)
+A1 = const(0x24)
+V1 = const(0x25)
+AMAX = const(0x26)
+VMAX = const(0x27)
+DMAX = const(0x28)
+D1 = const(0x2A)
+VSTOP = const(0x2B)
+XTARGET = const(0x2D)
+RAMP_STAT = const(0x35)
+CHOPCONF = const(0x6C)
+COOLCONF = const(0x6D)
+DRV_STATUS = const(0x6F)
+
+# RAMPMODE values
+MODE_POSITION = const(0)
+MODE_VELOCITY_POS = const(1)
+MODE_VELOCITY_NEG = const(2)
+MODE_HOLD = const(3)
+
+# SPI_STATUS bits, returned with every datagram
+STATUS_RESET = const(0x01)
+STATUS_DRIVER_ERROR = const(0x02)
+STATUS_SG2 = const(0x04)
+STATUS_STANDSTILL = const(0x08)
+STATUS_VELOCITY_REACHED = const(0x10)
+STATUS_POSITION_REACHED = const(0x20)
+
+VERSION = const(0x30)
+
+_WRITE = const(0x80)
+_DATAGRAM = const(5)
+_BATCH = const(16)
+
+# MRES field of CHOPCONF for each microstep resolution
+_MRES = {256: 0, 128: 1, 64: 2, 32: 3, 16: 4, 8: 5, 4: 6, 2: 7, 1: 8}
+
+
+class TMC5160:
+    def __init__(self, spi, cs, fclk=12_000_000, microsteps=8):
+        if microsteps not in _MRES:
+            raise ValueError("unsupported microstep resolution")
+        self._spi = spi
+        self._cs = cs
+        self._cs.value(1)
+        self.fclk = fclk
+        self.microsteps = microsteps
+        self._tx = bytearray(_DATAGRAM * _BATCH)
+        self._rx = bytearray(_DATAGRAM * _BATCH)
+        tx = memoryview(self._tx)
+        rx = memoryview(self._rx)
+        self._frames = tuple(
+            (tx[i * _DATAGRAM:(i + 1) * _DATAGRAM], rx[i * _DATAGRAM:(i + 1) * _DATAGRAM])
+            for i in range(_BATCH)
+        )
+        # Register the data of the next datagram's answer belongs to
+        self._last_read = -1
+        self.status = 0
+        self.datagrams = 0
+        # Decoded by poll() from DRV_STATUS
+        self.sg_result = 0
+        self.stalled = False
+        self.standstill = False
+
+    # Conversions for the internal clock, see the datasheet's ramp units
+    def velocity(self, steps_per_s):
+        return int(steps_per_s * 16777216.0 / self.fclk + 0.5)
+
+    def acceleration(self, steps_per_s2):
+        return int(steps_per_s2 * 2199023255552.0 / (float(self.fclk) * self.fclk) + 0.5)
+
+    def _put(self, i, address, value):
+        frame = self._tx
+        n = i * _DATAGRAM
+        frame[n] = address
+        frame[n + 1] = (value >> 24) & 0xFF
+        frame[n + 2] = (value >> 16) & 0xFF
+        frame[n + 3] = (value >> 8) & 0xFF
+        frame[n + 4] = value & 0xFF
+
+    def _value(self, i):
+        rx = self._rx
+        n = i * _DATAGRAM
+        value = (rx[n + 1] << 24) | (rx[n + 2] << 16) | (rx[n + 3] << 8) | rx[n + 4]
+        if rx[n + 1] & 0x80:
+            value -= 1 << 32
+        return value
+
+    def _transfer(self, count):
+        spi = self._spi
+        cs = self._cs
+        frames = self._frames
+        for i in range(count):
+            tx, rx = frames[i]
+            cs.value(0)
+            spi.write_readinto(tx, rx)
+            cs.value(1)
+        self.datagrams += count
+        self.status = self._rx[(count - 1) * _DATAGRAM]
+        address = self._tx[(count - 1) * _DATAGRAM]
+        self._last_read = -1 if address & _WRITE else address
+
+    def write(self, register, value) -> None:
+        self._put(0, register | _WRITE, value)
+        self._transfer(1)
+
+    # registers and values are parallel sequences of at most _BATCH entries
+    def write_many(self, registers, values) -> None:
+        count = len(registers)
+        if count > _BATCH:
+            raise ValueError("batch too long")
+        for i in range(count):
+            self._put(i, registers[i] | _WRITE, values[i])
+        self._transfer(count)
+
+    def read(self, register):
+        self._put(0, register, 0)
+        self._put(1, register, 0)
+        self._transfer(2)
+        return self._value(1)
+
+    # Pipelined: each datagram carries the next address and returns the
+    # previous register, one trailing IOIN read collects the last answer
+    def read_many(self, registers, out) -> None:
+        count = len(registers)
+        if count >= _BATCH:
+            raise ValueError("batch too long")
+        for i in range(count):
+            self._put(i, registers[i], 0)
+        self._put(count, IOIN, 0)
+        self._transfer(count + 1)
+        for i in range(count):
+            out[i] = self._value(i + 1)
+
+    # One datagram per call: collects the DRV_STATUS requested by the previous
+    # poll and asks for the next one. Decodes from the bytes, no long ints.
+    def poll(self) -> int:
+        previous = self._last_read
+        self._put(0, DRV_STATUS, 0)
+        self._transfer(1)
+        if previous == DRV_STATUS:
+            rx = self._rx
+            self.standstill = bool(rx[1] & 0x80)
+            self.stalled = bool(rx[1] & 0x01)
+            self.sg_result = ((rx[3] & 0x03) << 8) | rx[4]
+        return self.status
+
+    def version(self):
+        return (self.read(IOIN) >> 24) & 0xFF
+
+    def init(self, run_current=16, hold_current=8, stall_threshold=0, stall_speed=0) -> None:
+        if self.version() != VERSION:
+            raise OSError("no TMC5160 on SPI")
+        # spreadCycle with interpolation to 256 microsteps, StallGuard2 needs
+        # spreadCycle so stealthChop stays off
+        chopconf = 0x000100C3 | (1 << 28) | (_MRES[self.microsteps] << 24)
+        self.write_many(
+            (GSTAT, GCONF, CHOPCONF, IHOLD_IRUN, TPOWERDOWN, TPWMTHRS, TCOOLTHRS, COOLCONF),
+            (
+                0x07,
+                0,
+                chopconf,
+                (6 << 16) | ((run_current & 0x1F) << 8) | (hold_current & 0x1F),
+                10,
+                0,
+                # StallGuard is evaluated above this speed. TCOOLTHRS compares
+                # against TSTEP, the 1/256 microstep period in clock cycles
+                int(self.fclk * self.microsteps / (256 * stall_speed)) if stall_speed else 0,
+                (stall_threshold & 0x7F) << 16,
+            ),
+        )
+
+    # V1 = 0 gives a plain trapezoid on AMAX/DMAX, D1 must still be non-zero.
+    # VMAX is left alone, in velocity mode it would start the motor.
+    def set_ramp(self, accel, start_speed=0) -> None:
+        a = max(1, self.acceleration(accel))
+        start = self.velocity(start_speed)
+        self.write_many(
+            (VSTART, A1, V1, AMAX, DMAX, D1, VSTOP),
+            (start, a, 0, a, a, a, max(10, start)),
+        )
+
+    def stop(self) -> None:
+        # Velocity mode with VMAX 0 decelerates on AMAX and holds
+        self.write_many((RAMPMODE, VMAX), (MODE_VELOCITY_POS, 0))
+
+
+def open_tmc5160(baudrate=4_000_000, **kwargs):
+    # SPI mode 3, the chip samples on the rising edge
+    spi = SPI(1, baudrate=baudrate, polarity=1, phase=1, sck=Pin(10), mosi=Pin(11), miso=Pin(8))
+    return TMC5160(spi, Pin(9, Pin.OUT, value=1), **kwargs)
+
+
+class TMC5160Agitation:
+    # Same interface as motion.AgitationMotion, but the legs run on the
+    # chip's ramp generator. A low rate timer polls one datagram at a time
+    # for position_reached and counts the dwells in polls.
+    def __init__(self, driver, profile=None, period_ms=10):
+        self.driver = driver
+        self.profile = profile if profile is not None else AgitationProfile()
+        self.period_ms = period_ms
+        self.state = IDLE
+        self.cycles = 0
+        self.stalls = 0
+        self._target = 0
+        self._wait = 0
+        self._position = array("i", [0])
+        self._timer = Timer()
+        self._poll_cb = self.poll
+        self._apply_ramp()
+
+    def _apply_ramp(self):
+        p = self.profile
+        self.driver.set_ramp(p.accel, p.start_speed)
+        if self.state != IDLE:
+            # The ramp generator adapts a running move on the fly
+            self.driver.write(VMAX, self.driver.velocity(p.speed))
+
+    def configure(self, **kwargs) -> None:
+        for name, value in kwargs.items():
+            if not hasattr(self.profile, name):
+                raise AttributeError(name)
+            setattr(self.profile, name, value)
+        self._apply_ramp()
+
+    def set_speed(self, speed) -> None:
+        self.profile.speed = speed
+        if self.state != IDLE:
+            self.driver.write(VMAX, self.driver.velocity(speed))
+
+    @property
+    def running(self):
+        return self.state != IDLE
+
+    def start(self) -> None:
+        if self.state != IDLE:
+            return
+        driver = self.driver
+        driver.read_many((XACTUAL,), self._position)
+        self._target = self._position[0]
+        # Pin the target to where the motor is before leaving velocity mode
+        driver.write_many(
+            (XTARGET, RAMPMODE, VMAX),
+            (self._target, MODE_POSITION, driver.velocity(self.profile.speed)),
+        )
+        self._begin_leg(FORWARD)
+        self._timer.init(period=self.period_ms, callback=self._poll_cb)
+
+    def stop(self) -> None:
+        if self.state == IDLE:
+            return
+        self._timer.deinit()
+        self.state = IDLE
+        self.driver.stop()
+
+    def _begin_leg(self, state):
+        self.state = state
+        if state == FORWARD:
+            self._target += self.profile.forward_steps
+        else:
+            self._target -= self.profile.reverse_steps
+        self.driver.write(XTARGET, self._target)
+
+    def _dwell(self, state, ms):
+        self.state = state
+        self._wait = (ms + self.period_ms - 1) // self.period_ms
+
+    def poll(self, timer=None) -> None:
+        status = self.driver.poll()
+        if self.driver.stalled:
+            self.stalls += 1
+        state = self.state
+        if state == FORWARD or state == REVERSE:
+            if status & STATUS_POSITION_REACHED:
+                if state == FORWARD:
+                    self._dwell(REVERSAL_DWELL, self.profile.reversal_dwell_ms)
+                else:
+                    self._dwell(CYCLE_DWELL, self.profile.cycle_dwell_ms)
+        elif state == REVERSAL_DWELL or state == CYCLE_DWELL:
+            self._wait -= 1
+            if self._wait <= 0:
+                if state == CYCLE_DWELL:
+                    self.cycles += 1
+                    self._begin_leg(FORWARD)
+                else:
+                    self._begin_leg(REVERSE)
@@ -0,0 +1,188 @@
+# Input trace: the raw GPIO edges of a session, for replay on the host
+#
+# attach() takes the IRQ of every encoder and switch pin as a hard IRQ that
+# stores the edge (pin, level, ticks_us) in preallocated arrays. The IRQ
+# encoders' decoder is then scheduled with the pin, as its own soft IRQ would
+# have been; the switches keep being scanned and the PIO encoders counted,
+# the trace only listens. Once the arrays are full further edges are counted
+# as overflow, so a trace is always the unbroken start of a session, and
+# poll() saves it to flash, from a task and only once. A long quiet spell
+# gets a mark, the replay skips it.
+#
+# tools/trace_replay.py drives a trace through the boardsupport classes on
+# hosthal's virtual clock. The file, little endian:
+#   header  4s magic, B version, x, H edges, I overflow, I start ticks_us,
+#           I mask of the traced pins, I their levels at start()
+#   edge    I ticks_us, B pin | level << 7
+
+from array import array
+import machine
+from machine import Pin, mem32
+import micropython
+from micropython import const
+import struct
+import time
+
+_SIO_GPIO_IN = const(0xD0000004)
+
+_MAGIC = b"FTRC"
+_VERSION = const(1)
+_HEADER = "<4sBxHIIII"
+_HEADER_SIZE = const(24)
+_EDGE = "<IB"
+_EDGE_SIZE = const(5)
+_LEVEL = const(0x80)
+# Pin of a mark poll() records in a long quiet spell, so that no two records
+# are as far apart as the 2**30 µs ticks_us wraps at
+_MARK = const(0x7F)
+_QUIET_US = const(60_000_000)
+# Edges packed per write by save()
+_CHUNK = const(32)
+
+
+class EdgeTrace:
+    def __init__(self, size=2048, path="trace.bin") -> None:
+        if not 0 < size <= 0xFFFF:
+            raise ValueError("size must be 1-65535")
+        self.size = size
+        self.path = path
+        self._ticks = array("I", [0] * size)
+        self._codes = bytearray(size)
+        self._count = 0
+        self.mask = 0
+        self.levels = 0
+        self.start_us = 0
+        self.recording = False
+        self.saved = False
+        self._pins = []
+        # Statistics
+        self.overflow = 0
+        self.unscheduled = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def full(self):
+        return self._count >= self.size
+
+    # Hard IRQ context
+    def record(self, pin, level) -> None:
+        if not self.recording:
+            return
+        n = self._count
+        if n >= self.size:
+            self.overflow += 1
+            return
+        self._ticks[n] = time.ticks_us()
+        self._codes[n] = pin | (_LEVEL if level else 0)
+        self._count = n + 1
+
+    # Starts over, from the pin levels as they are now
+    def start(self) -> None:
+        self.recording = False
+        self._count = 0
+        self.overflow = 0
+        self.unscheduled = 0
+        self.saved = False
+        self.start_us = time.ticks_us()
+        self.levels = mem32[_SIO_GPIO_IN] & self.mask
+        self.recording = True
+
+    def stop(self) -> None:
+        self.recording = False
+
+    # Every encoder and switch pin of a controller, before the runtime starts
+    def attach(self, controller) -> None:
+        board = controller.board
+        controller.trace = self
+        rotaries = controller.rotaries
+        for i in range(len(rotaries)):
+            rotary = rotaries[i]
+            clk, dt = board.rotary_pins[i]
+            self.mask |= 1 << clk | 1 << dt
+            if hasattr(rotary, "_pin_clk") and hasattr(rotary, "_hard"):
+                # Registered with the pins again, as hard IRQs, to pick the wrapper up
+                rotary._process_rotary_pins = self._decoder(rotary, clk, dt, rotary._process_rotary_pins)
+                rotary._hard = True
+                rotary._hal_enable_irq()
+            else:
+                self._listen(clk)
+                self._listen(dt)
+        for pin in board.switch_pins:
+            self.mask |= 1 << pin
+            self._listen(pin)
+
+    def _listen(self, num):
+        record = self.record
+
+        def edge(pin):
+            record(num, pin.value())
+
+        pin = Pin(num)
+        pin.irq(edge, Pin.IRQ_RISING | Pin.IRQ_FALLING, hard=True)
+        self._pins.append(pin)
+
+    def _decoder(self, rotary, clk, dt, decode):
+        record = self.record
+        schedule = micropython.schedule
+        pin_clk = rotary._pin_clk
+
+        def edge(pin):
+            record(clk if pin is pin_clk else dt, pin.value())
+            try:
+                schedule(decode, pin)
+            except RuntimeError:
+                self.unscheduled += 1
+
+        return edge
+
+    # From a task, every second or so: saves a full trace once
+    def poll(self) -> None:
+        if self.full:
+            if not self.saved:
+                self.save()
+            return
+        n = self._count
+        last = self._ticks[n - 1] if n else self.start_us
+        if self.recording and time.ticks_diff(time.ticks_us(), last) > _QUIET_US:
+            state = machine.disable_irq()
+            self.record(_MARK, 0)
+            machine.enable_irq(state)
+
+    def save(self, path=None) -> None:
+        count = self._count
+        buf = bytearray(max(_HEADER_SIZE, _CHUNK * _EDGE_SIZE))
+        with open(path or self.path, "wb") as f:
+            struct.pack_into(_HEADER, buf, 0, _MAGIC, _VERSION, count, self.overflow, self.start_us,
+                             self.mask, self.levels)
+            f.write(memoryview(buf)[:_HEADER_SIZE])
+            n = 0
+            while n < count:
+                chunk = min(_CHUNK, count - n)
+                for i in range(chunk):
+                    struct.pack_into(_EDGE, buf, i * _EDGE_SIZE, self._ticks[n + i], self._codes[n + i])
+                f.write(memoryview(buf)[:chunk * _EDGE_SIZE])
+                n += chunk
+        self.saved = True
+
+
+# {"overflow", "mask", "levels", "edges": [(µs since start, pin, level), ...]},
+# without the marks
+def decode(data):
+    if len(data) < _HEADER_SIZE:
+        raise ValueError("not an input trace")
+    magic, version, count, overflow, start, mask, levels = struct.unpack_from(_HEADER, data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("not an input trace")
+    if len(data) < _HEADER_SIZE + count * _EDGE_SIZE:
+        raise ValueError("short input trace")
+    edges = []
+    last = 0
+    for n in range(count):
+        ticks, code = struct.unpack_from(_EDGE, data, _HEADER_SIZE + n * _EDGE_SIZE)
+        # ticks_us wraps at 2**30, the marks keep records closer than that
+        last += (ticks - start - last) & 0x3FFFFFFF
+        if code != _MARK:
+            edges.append((last, code & ~_LEVEL, 1 if code & _LEVEL else 0))
+    return {"overflow": overflow, "mask": mask, "levels": levels, "edges": edges}
@@ -0,0 +1,2 @@
+# Replaced by tools/build_mpy.py with the git version of the build
+VERSION = "dev"
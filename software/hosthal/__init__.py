@@ -0,0 +1,61 @@
+# Host-side stand-ins for the MicroPython HAL
+#
+# Lets the boardsupport package be imported and exercised under CPython:
+#
+#   import hosthal
+#   hosthal.install()
+#   from boardsupport.frankenstein_controller import FrankensteinController
+#
+# With virtual=True time stands still until the returned clock.VirtualClock is
+# advanced, and machine.Timer callbacks fire on it.
+
+import builtins
+import sys
+import time
+
+from . import asyncio_ext, clock, heap, machine, micropython, rp2, uctypes
+
+
+def _ticks_us():
+    return (time.perf_counter_ns() // 1000) & micropython.TICKS_MAX
+
+
+def _ticks_ms():
+    return (time.perf_counter_ns() // 1_000_000) & micropython.TICKS_MAX
+
+
+def _ticks_diff(a, b):
+    return ((a - b + micropython.TICKS_HALF) & micropython.TICKS_MAX) - micropython.TICKS_HALF
+
+
+def _ticks_add(a, delta):
+    return (a + delta) & micropython.TICKS_MAX
+
+
+def install(virtual=False):
+    sys.modules.setdefault("machine", machine)
+    sys.modules.setdefault("micropython", micropython)
+    sys.modules.setdefault("rp2", rp2)
+    sys.modules.setdefault("uctypes", uctypes)
+    # MicroPython treats const() as a builtin
+    builtins.const = micropython.const
+    # MicroPython extensions to the time module
+    time.ticks_us = _ticks_us
+    time.ticks_ms = _ticks_ms
+    time.ticks_diff = _ticks_diff
+    time.ticks_add = _ticks_add
+    time.sleep_us = lambda us: time.sleep(us / 1_000_000)
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    # MicroPython's asyncio additions
+    asyncio_ext.install()
+    # and those to the gc module
+    heap.install()
+    if virtual:
+        vclock = clock.VirtualClock()
+        vclock.install()
+        return vclock
+    # A later plain install() from an imported tool keeps the virtual clock
+    if machine._clock is not None:
+        machine._clock.install()
+        return machine._clock
+    return None
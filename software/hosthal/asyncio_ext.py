@@ -0,0 +1,33 @@
+# MicroPython asyncio extensions for CPython's asyncio
+
+import asyncio
+
+
+class ThreadSafeFlag:
+    # set() may be called from "IRQ" code, wait() clears the flag on return
+    def __init__(self):
+        self._flag = False
+        self._event = None
+
+    def set(self):
+        self._flag = True
+        if self._event is not None:
+            self._event.set()
+
+    def clear(self):
+        self._flag = False
+
+    async def wait(self):
+        while not self._flag:
+            self._event = asyncio.Event()
+            await self._event.wait()
+        self._flag = False
+
+
+def sleep_ms(ms):
+    return asyncio.sleep(ms / 1000)
+
+
+def install():
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+    asyncio.sleep_ms = sleep_ms
@@ -0,0 +1,103 @@
+# Deterministic virtual clock for the host HAL
+#
+# Replaces the time.ticks_* functions with a counter that only moves when
+# advance() or one of the sleep functions is called, and runs machine.Timer
+# callbacks at their due time on the way, followed by anything they passed to
+# micropython.schedule(). A run is then repeatable to the microsecond and
+# independent of how fast the host is:
+#
+#   clock = hosthal.install(virtual=True)
+#   controller = FrankensteinRotaryController()
+#   clock.advance_ms(3000)
+#
+# asyncio still runs on the host's own clock.
+
+import time
+
+from . import machine, micropython
+
+
+class VirtualClock:
+    # read_cost_us is added on every ticks_us() read, so busy-waits terminate
+    def __init__(self, start_us=0, read_cost_us=0):
+        self.now = start_us
+        self.read_cost_us = read_cost_us
+        self.fired = 0
+        # Optional callable returning how many µs after its deadline the next
+        # Timer callback runs, the soft IRQ latency of the real chip
+        self.latency = None
+        self._timers = []
+
+    def ticks_us(self):
+        self.now += self.read_cost_us
+        return self.now & micropython.TICKS_MAX
+
+    def ticks_ms(self):
+        return (self.now // 1000) & micropython.TICKS_MAX
+
+    def ticks_cpu(self):
+        return self.ticks_us()
+
+    def sleep_us(self, us):
+        self.advance(us)
+
+    def sleep_ms(self, ms):
+        self.advance(ms * 1000)
+
+    def sleep(self, seconds):
+        self.advance(int(seconds * 1_000_000))
+
+    # Called by machine.Timer
+    def arm(self, timer):
+        self.disarm(timer)
+        if timer.callback is None or timer.period <= 0:
+            return
+        timer._period_us = max(1, timer.period * 1_000_000 // timer.tick_hz)
+        timer._deadline = self.now + timer._period_us
+        self._timers.append(timer)
+
+    def disarm(self, timer):
+        if timer in self._timers:
+            self._timers.remove(timer)
+
+    def _next(self):
+        due = None
+        for timer in self._timers:
+            if due is None or timer._deadline < due._deadline:
+                due = timer
+        return due
+
+    def advance(self, us):
+        until = self.now + us
+        while True:
+            timer = self._next()
+            if timer is None or timer._deadline > until:
+                break
+            due = timer._deadline
+            if self.latency is not None:
+                due += self.latency()
+            self.now = max(self.now, due)
+            if timer.mode == machine.Timer.ONE_SHOT:
+                self._timers.remove(timer)
+            else:
+                timer._deadline += timer._period_us
+            self.fired += 1
+            timer.callback(timer)
+            micropython.run_scheduled()
+        self.now = max(self.now, until)
+        micropython.run_scheduled()
+
+    def advance_ms(self, ms):
+        self.advance(ms * 1000)
+
+    def install(self):
+        time.ticks_us = self.ticks_us
+        time.ticks_ms = self.ticks_ms
+        time.ticks_cpu = self.ticks_cpu
+        time.sleep_us = self.sleep_us
+        time.sleep_ms = self.sleep_ms
+        machine._clock = self
+
+    def uninstall(self):
+        self._timers.clear()
+        machine._clock = None
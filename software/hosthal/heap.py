@@ -0,0 +1,100 @@
+# Host stand-in for MicroPython's additions to the gc module
+#
+# CPython's gc has no mem_free(), mem_alloc() or threshold(). install() adds
+# them over a modelled heap: allocate() takes bytes from it, collect() frees
+# all but the live ones and runs CPython's own collection too. Past the
+# threshold, or when an allocation does not fit, the heap collects by itself
+# as the firmware's allocator does. The largest free block is the free bytes
+# split evenly into fragments runs, block() stands in for bytearray() to
+# probe for it. On the virtual clock a collection takes collect_us, and no
+# timer fires until it is over.
+
+import gc
+
+from . import machine
+
+SIZE = 192 * 1024
+
+_collect = gc.collect
+size = SIZE
+live = 0
+allocated = 0
+fragments = 1
+collect_us = 0
+collections = 0
+# Those the heap ran by itself
+automatic = 0
+_threshold = -1
+_since = 0
+
+
+def reset(heap_size=SIZE, live_bytes=0, fragment_count=1, collection_us=0):
+    global size, live, allocated, fragments, collect_us, collections, automatic, _threshold, _since
+    size = heap_size
+    live = allocated = live_bytes
+    fragments = fragment_count
+    collect_us = collection_us
+    collections = automatic = 0
+    _threshold = -1
+    _since = 0
+
+
+def mem_alloc():
+    return allocated
+
+
+def mem_free():
+    return size - allocated
+
+
+def largest():
+    return (size - allocated) // fragments
+
+
+def threshold(amount=None):
+    global _threshold
+    if amount is None:
+        return _threshold
+    _threshold = amount
+
+
+def collect():
+    global allocated, collections, _since
+    _collect()
+    allocated = live
+    collections += 1
+    _since = 0
+    if collect_us and machine._clock is not None:
+        # Timers due meanwhile fire late, on the next advance()
+        machine._clock.now += collect_us
+    return 0
+
+
+def _automatic():
+    global automatic
+    automatic += 1
+    collect()
+
+
+def allocate(n):
+    global allocated, _since
+    if n > largest():
+        _automatic()
+        if n > largest():
+            raise MemoryError("memory allocation failed, allocating {} bytes".format(n))
+    allocated += n
+    _since += n
+    if _threshold >= 0 and _since >= _threshold:
+        _automatic()
+
+
+def block(n):
+    allocate(n)
+    return bytearray(1)
+
+
+def install():
+    gc.collect = collect
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = mem_free
+    gc.threshold = threshold
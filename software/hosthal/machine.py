@@ -0,0 +1,217 @@
+# Host stand-in for the machine module
+#
+# All Pin objects share one GPIO level table so that emulated PIO programs,
+# machine.drive() and application code see the same pins.
+
+NUM_GPIO = 30
+
+_levels = bytearray(NUM_GPIO)
+_pins = {}
+_watchers = {}
+
+
+def watch(pin, callback):
+    # callback(pin, level) runs whenever an emulated peripheral changes the pin
+    _watchers.setdefault(pin, []).append(callback)
+
+
+def unwatch(pin=None):
+    if pin is None:
+        _watchers.clear()
+    else:
+        _watchers.pop(pin, None)
+
+
+def _write(pin, level):
+    # Output path used by emulated peripherals (PIO, UART, ...)
+    if _levels[pin] == level:
+        return
+    _levels[pin] = level
+    for callback in _watchers.get(pin, ()):
+        callback(pin, level)
+
+
+def drive(pin, level):
+    # Set an input level from the outside world and run its IRQ handler
+    level = 1 if level else 0
+    old = _levels[pin]
+    _levels[pin] = level
+    p = _pins.get(pin)
+    if p is None or p.handler is None or old == level:
+        return
+    if (level and p.trigger & Pin.IRQ_RISING) or (not level and p.trigger & Pin.IRQ_FALLING):
+        p.handler(p)
+
+
+_SIO_GPIO_IN = 0xD0000004
+
+
+class _Mem:
+    # Word access to the registers the firmware reads directly
+    def __getitem__(self, addr):
+        if addr == _SIO_GPIO_IN:
+            value = 0
+            for i in range(NUM_GPIO):
+                value |= _levels[i] << i
+            return value
+        raise ValueError("no model for address 0x{:08x}".format(addr))
+
+
+mem32 = _Mem()
+
+_irq_state = [1]
+
+# The VirtualClock Timer callbacks run on, if one is installed
+_clock = None
+
+
+def disable_irq():
+    state = _irq_state[0]
+    _irq_state[0] = 0
+    return state
+
+
+def enable_irq(state=1):
+    _irq_state[0] = state
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    ALT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self.handler = None
+        self.trigger = 0
+        _pins[id] = self
+        if pull == Pin.PULL_UP:
+            _levels[id] = 1
+        elif pull == Pin.PULL_DOWN:
+            _levels[id] = 0
+        if value is not None:
+            _levels[id] = 1 if value else 0
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return _levels[self.id]
+        _levels[self.id] = 1 if value else 0
+
+    def on(self):
+        _levels[self.id] = 1
+
+    def off(self):
+        _levels[self.id] = 0
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger
+        self.hard = hard
+
+
+class SPI:
+    def __init__(self, id, baudrate=1_000_000, polarity=0, phase=0, bits=8,
+                 firstbit=0, sck=None, mosi=None, miso=None):
+        self.id = id
+        self.baudrate = baudrate
+        self.writes = 0
+        self.last_write = b""
+
+    def write(self, buf):
+        self.writes += 1
+        self.last_write = bytes(buf)
+
+    def readinto(self, buf, write=0x00):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+    def write_readinto(self, write_buf, read_buf):
+        self.write(write_buf)
+        self.readinto(read_buf)
+
+
+class UART:
+    # A line nobody else drives: writes are kept, nothing is ever received
+    IRQ_RXIDLE = 64
+
+    def __init__(self, id, baudrate=115200, bits=8, parity=None, stop=1, tx=None, rx=None,
+                 timeout=0, rxbuf=256, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        self.written = bytearray()
+        self.handler = None
+
+    def write(self, buf):
+        self.written += bytes(buf)
+        return len(buf)
+
+    def readinto(self, buf, nbytes=None):
+        return None
+
+    def any(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def txdone(self):
+        return True
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self.handler = handler
+
+
+class PWM:
+    def __init__(self, pin):
+        self.pin = pin
+        self._freq = 0
+        self._duty = 0
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+
+    def deinit(self):
+        pass
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.mode = Timer.PERIODIC
+        self.callback = None
+        self.period = -1
+        self.tick_hz = 1000
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, freq=-1, period=-1, callback=None, tick_hz=1000):
+        self.mode = mode
+        self.callback = callback
+        self.tick_hz = tick_hz
+        self.period = period if period >= 0 else (tick_hz // freq if freq > 0 else -1)
+        if _clock is not None:
+            _clock.arm(self)
+
+    def deinit(self):
+        self.callback = None
+        if _clock is not None:
+            _clock.disarm(self)
@@ -0,0 +1,32 @@
+# Host stand-in for the micropython module
+
+TICKS_MAX = (1 << 30) - 1
+TICKS_HALF = 1 << 29
+
+_SCHEDULE_DEPTH = 8
+_scheduled = []
+
+
+def const(value):
+    return value
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def schedule(func, arg):
+    # Same failure mode as the firmware when the queue is full
+    if len(_scheduled) >= _SCHEDULE_DEPTH:
+        raise RuntimeError("schedule queue full")
+    _scheduled.append((func, arg))
+
+
+def run_scheduled():
+    # Run pending callbacks the way the VM does between bytecodes
+    count = 0
+    while _scheduled:
+        func, arg = _scheduled.pop(0)
+        func(arg)
+        count += 1
+    return count
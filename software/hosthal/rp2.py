@@ -0,0 +1,853 @@
+# Host stand-in for the rp2 module
+#
+# asm_pio() assembles programs into real 16-bit PIO instruction words and
+# StateMachine executes those words cycle by cycle, so the exact program that
+# ships to the board can be validated on the host. DMA channels move data
+# between buffers (through hosthal.uctypes addresses), PIO FIFOs and the DMA
+# trigger registers. Everything advances with run(cycles), one cycle being one
+# state machine clock.
+
+from . import machine, uctypes
+
+_MASK32 = 0xFFFFFFFF
+
+
+class PIOASMError(Exception):
+    pass
+
+
+class PIO:
+    IN_LOW = 0
+    IN_HIGH = 1
+    OUT_LOW = 2
+    OUT_HIGH = 3
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+    IRQ_SM0 = 0x100
+    IRQ_SM1 = 0x200
+    IRQ_SM2 = 0x400
+    IRQ_SM3 = 0x800
+
+    def __init__(self, id):
+        self.id = id
+        self.irq_flags = 0
+
+    def state_machine(self, index, *args, **kwargs):
+        return StateMachine(self.id * 4 + index, *args, **kwargs)
+
+
+_pio_blocks = (PIO(0), PIO(1))
+
+
+# -- assembler ------------------------------------------------------------
+
+# Operand encodings mirror the MicroPython rp2 module
+_PINS = 0
+_X = 1
+_Y = 2
+_NULL = 3
+_PINDIRS = 4
+_PC = 5
+_STATUS = 5
+_ISR = 6
+_OSR = 7
+_EXEC = 8
+_PIN = 6
+_GPIO = 0
+_BLOCK = 0x120
+_NOBLOCK = 0x100
+_IFFULL = 0x40
+_CLEAR = 0x40
+
+
+class _Instr:
+    def __init__(self, emitter, op, operands, label=None):
+        self.op = op
+        self.operands = operands
+        self.label = label
+        self.side_value = None
+        self.delay_value = 0
+        emitter.instrs.append(self)
+
+    def side(self, value):
+        self.side_value = value
+        return self
+
+    def delay(self, value):
+        self.delay_value = value
+        return self
+
+    def __getitem__(self, value):
+        return self.delay(value)
+
+
+class _Emitter:
+    def __init__(self, sideset_count):
+        self.sideset_count = sideset_count
+        self.instrs = []
+        self.labels = {}
+        self.wrap_target = None
+        self.wrap_at = None
+
+    def namespace(self):
+        emit = self
+
+        def wrap_target():
+            emit.wrap_target = len(emit.instrs)
+
+        def wrap():
+            emit.wrap_at = len(emit.instrs) - 1
+
+        def label(name):
+            if name in emit.labels:
+                raise PIOASMError("duplicate label {}".format(name))
+            emit.labels[name] = len(emit.instrs)
+
+        def word(instr, label=None):
+            return _Instr(emit, "word", (instr,), label)
+
+        def nop():
+            return _Instr(emit, "mov", (_Y, _Y))
+
+        def jmp(cond, label=None):
+            if label is None:
+                return _Instr(emit, "jmp", (0,), cond)
+            return _Instr(emit, "jmp", (cond,), label)
+
+        def wait(polarity, src, index):
+            if src is irq:
+                src = 2
+            elif src == _PIN:
+                src = 1
+            elif src == _GPIO:
+                src = 0
+            else:
+                raise PIOASMError("bad wait source")
+            return _Instr(emit, "wait", (polarity, src, index))
+
+        def in_(src, count):
+            return _Instr(emit, "in", (src, count))
+
+        def out(dest, count):
+            return _Instr(emit, "out", (dest, count))
+
+        def push(value=0, value2=0):
+            return _Instr(emit, "push", (value | value2,))
+
+        def pull(value=0, value2=0):
+            return _Instr(emit, "pull", (value | value2,))
+
+        def mov(dest, src):
+            return _Instr(emit, "mov", (dest, src))
+
+        def irq(mod, index=None):
+            if index is None:
+                mod, index = 0, mod
+            return _Instr(emit, "irq", (mod, index))
+
+        def set(dest, data):
+            return _Instr(emit, "set", (dest, data))
+
+        return {
+            "wrap_target": wrap_target,
+            "wrap": wrap,
+            "label": label,
+            "word": word,
+            "nop": nop,
+            "jmp": jmp,
+            "wait": wait,
+            "in_": in_,
+            "out": out,
+            "push": push,
+            "pull": pull,
+            "mov": mov,
+            "irq": irq,
+            "set": set,
+            "gpio": _GPIO,
+            "pins": _PINS,
+            "x": _X,
+            "y": _Y,
+            "null": _NULL,
+            "pindirs": _PINDIRS,
+            "pc": _PC,
+            "status": _STATUS,
+            "isr": _ISR,
+            "osr": _OSR,
+            "exec": _EXEC,
+            "invert": lambda v: v | 0x08,
+            "reverse": lambda v: v | 0x10,
+            "not_x": 1,
+            "x_dec": 2,
+            "not_y": 3,
+            "y_dec": 4,
+            "x_not_y": 5,
+            "pin": _PIN,
+            "not_osre": 7,
+            "block": _BLOCK,
+            "noblock": _NOBLOCK,
+            "iffull": _IFFULL,
+            "ifempty": _IFFULL,
+            "clear": _CLEAR,
+            "rel": lambda v: v | 0x10,
+        }
+
+    def encode(self, instr):
+        delay_bits = 5 - self.sideset_count
+        if instr.delay_value >= (1 << delay_bits):
+            raise PIOASMError("delay {} too large".format(instr.delay_value))
+        side = instr.side_value or 0
+        if self.sideset_count and side >= (1 << self.sideset_count):
+            raise PIOASMError("side-set value {} too large".format(side))
+        field = (side << delay_bits) | instr.delay_value if self.sideset_count else instr.delay_value
+        ops = instr.operands
+
+        if instr.op == "word":
+            return ops[0] & 0xFFFF
+        if instr.op == "jmp":
+            if instr.label not in self.labels:
+                raise PIOASMError("unknown label {}".format(instr.label))
+            return 0x0000 | field << 8 | ops[0] << 5 | self.labels[instr.label]
+        if instr.op == "wait":
+            return 0x2000 | field << 8 | ops[0] << 7 | ops[1] << 5 | ops[2] & 0x1F
+        if instr.op == "in":
+            return 0x4000 | field << 8 | (ops[0] & 7) << 5 | ops[1] & 0x1F
+        if instr.op == "out":
+            dest = 7 if ops[0] == _EXEC else ops[0]
+            return 0x6000 | field << 8 | dest << 5 | ops[1] & 0x1F
+        if instr.op in ("push", "pull"):
+            flags = ops[0]
+            if not flags & _NOBLOCK:
+                flags |= 0x20
+            return 0x8000 | field << 8 | (0x80 if instr.op == "pull" else 0) | flags & 0x60
+        if instr.op == "mov":
+            dest = 4 if ops[0] == _EXEC else ops[0]
+            src = ops[1]
+            op = 1 if src & 0x08 else 2 if src & 0x10 else 0
+            return 0xA000 | field << 8 | dest << 5 | op << 3 | src & 7
+        if instr.op == "irq":
+            return 0xC000 | field << 8 | ops[0] & 0x70 | ops[1] & 0x07
+        if instr.op == "set":
+            return 0xE000 | field << 8 | ops[0] << 5 | ops[1] & 0x1F
+        raise PIOASMError("unknown instruction {}".format(instr.op))
+
+
+class _Program:
+    def __init__(self, words, wrap_target, wrap, config):
+        self.words = words
+        self.wrap_target = wrap_target
+        self.wrap = wrap
+        self.config = config
+
+
+def _count(init):
+    if init is None:
+        return 0
+    if isinstance(init, tuple):
+        return len(init)
+    return 1
+
+
+def _run_in(emitter, func):
+    g = func.__globals__
+    names = emitter.namespace()
+    missing = object()
+    saved = {name: g.get(name, missing) for name in names}
+    g.update(names)
+    try:
+        func()
+    finally:
+        for name, value in saved.items():
+            if value is missing:
+                del g[name]
+            else:
+                g[name] = value
+
+
+def asm_pio(*, out_init=None, set_init=None, sideset_init=None, in_shiftdir=0,
+            out_shiftdir=0, autopush=False, autopull=False, push_thresh=32,
+            pull_thresh=32, fifo_join=PIO.JOIN_NONE):
+    config = {
+        "out_count": _count(out_init),
+        "set_count": _count(set_init),
+        "sideset_count": _count(sideset_init),
+        "in_shiftdir": in_shiftdir,
+        "out_shiftdir": out_shiftdir,
+        "autopush": autopush,
+        "autopull": autopull,
+        "push_thresh": push_thresh,
+        "pull_thresh": pull_thresh,
+        "fifo_join": fifo_join,
+    }
+
+    def decorator(func):
+        emitter = _Emitter(config["sideset_count"])
+        _run_in(emitter, func)
+        if len(emitter.instrs) > 32:
+            raise PIOASMError("program too long")
+        words = [emitter.encode(i) for i in emitter.instrs]
+        wrap_target = emitter.wrap_target or 0
+        wrap = emitter.wrap_at if emitter.wrap_at is not None else len(words) - 1
+        return _Program(words, wrap_target, wrap, config)
+
+    return decorator
+
+
+def asm_pio_encode(instr, sideset_count, sideset_opt=False):
+    emitter = _Emitter(sideset_count)
+    eval(instr, {}, emitter.namespace())
+    if len(emitter.instrs) != 1:
+        raise PIOASMError("expected a single instruction")
+    return emitter.encode(emitter.instrs[0])
+
+
+# -- state machines -------------------------------------------------------
+
+_state_machines = {}
+
+
+def _pin_id(pin):
+    if pin is None:
+        return None
+    return pin if isinstance(pin, int) else pin.id
+
+
+def _bitrev(v):
+    r = 0
+    for _ in range(32):
+        r = (r << 1) | (v & 1)
+        v >>= 1
+    return r
+
+
+class StateMachine:
+    def __init__(self, id, program=None, freq=-1, **kwargs):
+        self.id = id
+        self._pio = _pio_blocks[id // 4]
+        self._active = False
+        self.cycles = 0
+        _state_machines[id] = self
+        if program is not None:
+            self.init(program, freq, **kwargs)
+
+    def init(self, program, freq=-1, *, in_base=None, out_base=None, set_base=None,
+             jmp_pin=None, sideset_base=None, in_shiftdir=None, out_shiftdir=None,
+             push_thresh=None, pull_thresh=None):
+        cfg = program.config
+        if freq != -1 and not 1908 <= freq <= 125_000_000:
+            raise ValueError("freq out of range")
+        self.freq = 125_000_000 if freq == -1 else freq
+        self._words = program.words
+        self._wrap_target = program.wrap_target
+        self._wrap = program.wrap
+        self._in_base = _pin_id(in_base) or 0
+        self._out_base = _pin_id(out_base) or 0
+        self._set_base = _pin_id(set_base) or 0
+        self._sideset_base = _pin_id(sideset_base) or 0
+        self._jmp_pin = _pin_id(jmp_pin) or 0
+        self._out_count = cfg["out_count"]
+        self._set_count = cfg["set_count"]
+        self._sideset_count = cfg["sideset_count"]
+        self._in_shiftdir = cfg["in_shiftdir"] if in_shiftdir is None else in_shiftdir
+        self._out_shiftdir = cfg["out_shiftdir"] if out_shiftdir is None else out_shiftdir
+        self._autopush = cfg["autopush"]
+        self._autopull = cfg["autopull"]
+        self._push_thresh = (cfg["push_thresh"] if push_thresh is None else push_thresh) or 32
+        self._pull_thresh = (cfg["pull_thresh"] if pull_thresh is None else pull_thresh) or 32
+        join = cfg["fifo_join"]
+        self._tx_depth = 8 if join == PIO.JOIN_TX else 0 if join == PIO.JOIN_RX else 4
+        self._rx_depth = 8 if join == PIO.JOIN_RX else 0 if join == PIO.JOIN_TX else 4
+        self.restart()
+
+    def restart(self):
+        self.x = 0
+        self.y = 0
+        self.isr = 0
+        self.osr = 0
+        self._isr_count = 0
+        self._osr_count = 32
+        self.pc = 0
+        self._delay = 0
+        self._tx = []
+        self._rx = []
+        self.stalls = 0
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def put(self, value, shift=0):
+        if isinstance(value, int):
+            value = (value,)
+        for v in value:
+            while len(self._tx) >= self._tx_depth:
+                if not self._active:
+                    raise RuntimeError("TX FIFO full on an inactive state machine")
+                run(1)
+            self._tx.append((v << shift) & _MASK32)
+
+    def get(self, buf=None, shift=0):
+        while not self._rx:
+            if not self._active:
+                raise RuntimeError("RX FIFO empty on an inactive state machine")
+            run(1)
+        return self._rx.pop(0) >> shift
+
+    def tx_fifo(self):
+        return len(self._tx)
+
+    def rx_fifo(self):
+        return len(self._rx)
+
+    def exec(self, instr):
+        if isinstance(instr, str):
+            instr = asm_pio_encode(instr, self._sideset_count)
+        saved = self.pc
+        self._jumped = False
+        self._execute(instr)
+        if not self._jumped:
+            self.pc = saved
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        pass
+
+    # -- emulation --
+
+    def _write_pins(self, base, count, value):
+        for i in range(count):
+            machine._write((base + i) % 32, (value >> i) & 1)
+
+    def _read_pins(self, base, count):
+        value = 0
+        for i in range(count):
+            pin = (base + i) % 32
+            if pin < machine.NUM_GPIO and machine._levels[pin]:
+                value |= 1 << i
+        return value
+
+    def _source(self, src):
+        if src == _PINS:
+            return self._read_pins(self._in_base, 32)
+        if src == _X:
+            return self.x
+        if src == _Y:
+            return self.y
+        if src == _NULL:
+            return 0
+        if src == _STATUS:
+            return _MASK32 if len(self._tx) < 1 else 0
+        if src == _ISR:
+            return self.isr
+        if src == _OSR:
+            return self.osr
+        raise PIOASMError("bad source {}".format(src))
+
+    def _jump(self, addr):
+        self.pc = addr
+        self._jumped = True
+
+    def _execute(self, word):
+        op = word >> 13
+        field = (word >> 8) & 0x1F
+        arg = word & 0xFF
+        delay_bits = 5 - self._sideset_count
+        if self._sideset_count:
+            self._write_pins(self._sideset_base, self._sideset_count, field >> delay_bits)
+        self._pending_delay = field & ((1 << delay_bits) - 1)
+
+        if op == 0:  # JMP
+            cond = (arg >> 5) & 7
+            addr = arg & 0x1F
+            if cond == 0:
+                take = True
+            elif cond == 1:
+                take = self.x == 0
+            elif cond == 2:
+                take = self.x != 0
+                self.x = (self.x - 1) & _MASK32
+            elif cond == 3:
+                take = self.y == 0
+            elif cond == 4:
+                take = self.y != 0
+                self.y = (self.y - 1) & _MASK32
+            elif cond == 5:
+                take = self.x != self.y
+            elif cond == 6:
+                take = bool(machine._levels[self._jmp_pin])
+            else:
+                take = self._osr_count < self._pull_thresh
+            if take:
+                self._jump(addr)
+            return True
+
+        if op == 1:  # WAIT
+            polarity = (arg >> 7) & 1
+            src = (arg >> 5) & 3
+            index = arg & 0x1F
+            if src == 0:
+                level = machine._levels[index]
+            elif src == 1:
+                level = machine._levels[(self._in_base + index) % 32]
+            else:
+                bit = 1 << (index & 7)
+                level = 1 if self._pio.irq_flags & bit else 0
+                if level and polarity:
+                    self._pio.irq_flags &= ~bit
+            return level == polarity
+
+        if op == 2:  # IN
+            src = (arg >> 5) & 7
+            count = arg & 0x1F or 32
+            if self._autopush and self._isr_count >= self._push_thresh:
+                if len(self._rx) >= self._rx_depth:
+                    return False
+                self._rx.append(self.isr)
+                self.isr = 0
+                self._isr_count = 0
+            data = self._source(src) & ((1 << count) - 1)
+            if self._in_shiftdir == PIO.SHIFT_LEFT:
+                self.isr = ((self.isr << count) | data) & _MASK32
+            else:
+                self.isr = ((self.isr >> count) | (data << (32 - count))) & _MASK32 if count < 32 else data
+            self._isr_count = min(32, self._isr_count + count)
+            if self._autopush and self._isr_count >= self._push_thresh and len(self._rx) < self._rx_depth:
+                self._rx.append(self.isr)
+                self.isr = 0
+                self._isr_count = 0
+            return True
+
+        if op == 3:  # OUT
+            dest = (arg >> 5) & 7
+            count = arg & 0x1F or 32
+            if self._autopull and self._osr_count >= self._pull_thresh:
+                if not self._tx:
+                    return False
+                self.osr = self._tx.pop(0)
+                self._osr_count = 0
+            if self._out_shiftdir == PIO.SHIFT_LEFT:
+                data = self.osr >> (32 - count)
+                self.osr = (self.osr << count) & _MASK32
+            else:
+                data = self.osr & ((1 << count) - 1)
+                self.osr = self.osr >> count if count < 32 else 0
+            self._osr_count = min(32, self._osr_count + count)
+            if dest == 0:
+                self._write_pins(self._out_base, count, data)
+            elif dest == 1:
+                self.x = data
+            elif dest == 2:
+                self.y = data
+            elif dest == 5:
+                self._jump(data & 0x1F)
+            elif dest == 6:
+                self.isr = data
+                self._isr_count = count
+            elif dest == 7:
+                return self._execute(data)
+            return True
+
+        if op == 4:  # PUSH / PULL
+            conditional = arg & 0x40
+            block = arg & 0x20
+            if arg & 0x80:
+                if conditional and self._osr_count < self._pull_thresh:
+                    return True
+                if not self._tx:
+                    if block:
+                        return False
+                    self.osr = self.x
+                else:
+                    self.osr = self._tx.pop(0)
+                self._osr_count = 0
+            else:
+                if conditional and self._isr_count < self._push_thresh:
+                    return True
+                if len(self._rx) >= self._rx_depth:
+                    if block:
+                        return False
+                else:
+                    self._rx.append(self.isr)
+                self.isr = 0
+                self._isr_count = 0
+            return True
+
+        if op == 5:  # MOV
+            dest = (arg >> 5) & 7
+            operation = (arg >> 3) & 3
+            value = self._source(arg & 7)
+            if operation == 1:
+                value = ~value & _MASK32
+            elif operation == 2:
+                value = _bitrev(value)
+            if dest == 0:
+                self._write_pins(self._out_base, self._out_count, value)
+            elif dest == 1:
+                self.x = value
+            elif dest == 2:
+                self.y = value
+            elif dest == 4:
+                return self._execute(value & 0xFFFF)
+            elif dest == 5:
+                self._jump(value & 0x1F)
+            elif dest == 6:
+                self.isr = value
+                self._isr_count = 0
+            elif dest == 7:
+                self.osr = value
+                self._osr_count = 0
+            return True
+
+        if op == 6:  # IRQ
+            clear = arg & 0x40
+            wait = arg & 0x20
+            index = arg & 0x07
+            if arg & 0x10:
+                index = (index + self.id % 4) % 4
+            bit = 1 << index
+            if clear:
+                self._pio.irq_flags &= ~bit
+                return True
+            if not getattr(self, "_irq_raised", False):
+                self._pio.irq_flags |= bit
+                self._irq_raised = True
+            if wait and self._pio.irq_flags & bit:
+                return False
+            self._irq_raised = False
+            return True
+
+        # SET
+        dest = (arg >> 5) & 7
+        data = arg & 0x1F
+        if dest == 0:
+            self._write_pins(self._set_base, self._set_count, data)
+        elif dest == 1:
+            self.x = data
+        elif dest == 2:
+            self.y = data
+        return True
+
+    def step(self):
+        self.cycles += 1
+        if self._delay:
+            self._delay -= 1
+            return
+        self._jumped = False
+        if not self._execute(self._words[self.pc]):
+            self.stalls += 1
+            return
+        self._delay = self._pending_delay
+        if not self._jumped:
+            self.pc = self._wrap_target if self.pc == self._wrap else self.pc + 1
+
+
+# -- DMA ------------------------------------------------------------------
+
+_DMA_BASE = 0x50000000
+_DMA_STRIDE = 0x40
+_PIO_BASES = (0x50200000, 0x50300000)
+_PIO_TXF0 = 0x10
+_PIO_RXF0 = 0x20
+_TREQ_PERMANENT = 0x3F
+
+_dma_channels = {}
+
+
+def _bus_read(addr, size):
+    for pio, base in enumerate(_PIO_BASES):
+        if base + _PIO_RXF0 <= addr < base + _PIO_RXF0 + 16:
+            return _state_machines[pio * 4 + (addr - base - _PIO_RXF0) // 4]._rx.pop(0)
+    mv, offset = uctypes.resolve(addr)
+    return int.from_bytes(mv[offset:offset + size], "little")
+
+
+def _bus_write(addr, value, size):
+    for pio, base in enumerate(_PIO_BASES):
+        if base + _PIO_TXF0 <= addr < base + _PIO_TXF0 + 16:
+            # Narrow writes are replicated across the 32-bit bus
+            if size == 1:
+                value = (value & 0xFF) * 0x01010101
+            elif size == 2:
+                value = (value & 0xFFFF) * 0x00010001
+            _state_machines[pio * 4 + (addr - base - _PIO_TXF0) // 4]._tx.append(value)
+            return
+    if _DMA_BASE <= addr < _DMA_BASE + 12 * _DMA_STRIDE:
+        channel = _dma_channels[(addr - _DMA_BASE) // _DMA_STRIDE]
+        reg = (addr - _DMA_BASE) % _DMA_STRIDE
+        if reg in (0x00, 0x3C):
+            channel._read = value
+        elif reg == 0x04:
+            channel._write = value
+        elif reg == 0x08:
+            channel._reload = value
+        elif reg in (0x0C, 0x10):
+            channel._ctrl = value
+        if reg in (0x0C, 0x3C):
+            channel._trigger()
+        return
+    mv, offset = uctypes.resolve(addr)
+    mv[offset:offset + size] = value.to_bytes(size, "little")
+
+
+def _address(obj):
+    if isinstance(obj, int):
+        return obj
+    if isinstance(obj, StateMachine):
+        return _PIO_BASES[obj.id // 4] + _PIO_TXF0 + 4 * (obj.id % 4)
+    return uctypes.addressof(obj)
+
+
+class DMA:
+    def __init__(self):
+        for channel in range(12):
+            if channel not in _dma_channels:
+                break
+        else:
+            raise OSError("no free DMA channel")
+        self.channel = channel
+        self._read = 0
+        self._write = 0
+        self._reload = 0
+        self._count = 0
+        self._ctrl = self.pack_ctrl()
+        self._busy = False
+        self.transfers = 0
+        _dma_channels[channel] = self
+
+    def pack_ctrl(self, default=None, **kwargs):
+        fields = {
+            "enable": True,
+            "high_pri": False,
+            "size": 2,
+            "inc_read": True,
+            "inc_write": True,
+            "ring_size": 0,
+            "ring_sel": False,
+            "chain_to": self.channel,
+            "treq_sel": _TREQ_PERMANENT,
+            "irq_quiet": True,
+            "bswap": False,
+            "sniff_en": False,
+        }
+        if default is not None:
+            fields.update(self.unpack_ctrl(default))
+        fields.update(kwargs)
+        return (
+            int(fields["enable"])
+            | int(fields["high_pri"]) << 1
+            | fields["size"] << 2
+            | int(fields["inc_read"]) << 4
+            | int(fields["inc_write"]) << 5
+            | fields["ring_size"] << 6
+            | int(fields["ring_sel"]) << 10
+            | fields["chain_to"] << 11
+            | fields["treq_sel"] << 15
+            | int(fields["irq_quiet"]) << 21
+            | int(fields["bswap"]) << 22
+            | int(fields["sniff_en"]) << 23
+        )
+
+    @staticmethod
+    def unpack_ctrl(value):
+        return {
+            "enable": bool(value & 1),
+            "high_pri": bool(value >> 1 & 1),
+            "size": value >> 2 & 3,
+            "inc_read": bool(value >> 4 & 1),
+            "inc_write": bool(value >> 5 & 1),
+            "ring_size": value >> 6 & 0xF,
+            "ring_sel": bool(value >> 10 & 1),
+            "chain_to": value >> 11 & 0xF,
+            "treq_sel": value >> 15 & 0x3F,
+            "irq_quiet": bool(value >> 21 & 1),
+            "bswap": bool(value >> 22 & 1),
+            "sniff_en": bool(value >> 23 & 1),
+        }
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        if read is not None:
+            self._read = _address(read)
+        if write is not None:
+            self._write = _address(write)
+        if count is not None:
+            self._reload = count
+        if ctrl is not None:
+            self._ctrl = ctrl
+        if trigger:
+            self._trigger()
+
+    def active(self, value=None):
+        if value is None:
+            return self._busy
+        if value:
+            self._trigger()
+        else:
+            self._busy = False
+
+    def close(self):
+        self._busy = False
+        _dma_channels.pop(self.channel, None)
+
+    @property
+    def read(self):
+        return self._read
+
+    @property
+    def count(self):
+        return self._count
+
+    def _trigger(self):
+        if self._ctrl & 1:
+            self._count = self._reload
+            self._busy = self._count > 0
+
+    def _ready(self, treq):
+        if treq == _TREQ_PERMANENT:
+            return True
+        # DREQ 0-3 PIO0 TX, 4-7 PIO0 RX, 8-11 PIO1 TX, 12-15 PIO1 RX
+        sm = _state_machines.get(4 * (treq // 8) + treq % 4)
+        if sm is None:
+            return False
+        if treq % 8 < 4:
+            return len(sm._tx) < sm._tx_depth
+        return len(sm._rx) > 0
+
+    def _cycle(self):
+        if not self._busy:
+            return
+        fields = self._ctrl
+        if not self._ready(fields >> 15 & 0x3F):
+            return
+        size = 1 << (fields >> 2 & 3)
+        _bus_write(self._write, _bus_read(self._read, size), size)
+        self.transfers += 1
+        if fields >> 4 & 1:
+            self._read += size
+        if fields >> 5 & 1:
+            self._write += size
+        self._count -= 1
+        if self._count == 0:
+            self._busy = False
+            chain = fields >> 11 & 0xF
+            if chain != self.channel and chain in _dma_channels:
+                _dma_channels[chain]._trigger()
+
+
+def run(cycles=1):
+    # Advance every active DMA channel and state machine by a number of cycles
+    for _ in range(cycles):
+        for channel in list(_dma_channels.values()):
+            channel._cycle()
+        for sm in _state_machines.values():
+            if sm._active:
+                sm.step()
+
+
+def reset():
+    # Forget all state machines, DMA channels and PIO IRQ flags
+    _state_machines.clear()
+    _dma_channels.clear()
+    for pio in _pio_blocks:
+        pio.irq_flags = 0
@@ -0,0 +1,163 @@
+# Register-level stand-in for a TMC5160 on the host
+#
+# Pass it to boardsupport.tmc5160.TMC5160 in place of the SPI bus. Each
+# write_readinto() is one 40-bit datagram and must happen with CSN low. The
+# model keeps the register file, answers with SPI_STATUS plus the previous
+# read, and integrates the ramp generator in positioning and velocity mode
+# when advance() is called.
+
+from . import machine
+
+_TWO32 = 1 << 32
+
+# Registers read back from the live model rather than the register file
+_GSTAT = 0x01
+_IOIN = 0x04
+_RAMPMODE = 0x20
+_XACTUAL = 0x21
+_VACTUAL = 0x22
+_AMAX = 0x26
+_VMAX = 0x27
+_DMAX = 0x28
+_XTARGET = 0x2D
+_RAMP_STAT = 0x35
+_DRV_STATUS = 0x6F
+
+
+class FakeTMC5160:
+    def __init__(self, cs=9, fclk=12_000_000):
+        self.cs = cs
+        self.fclk = fclk
+        self.regs = {}
+        self.writes = []
+        self.datagrams = 0
+        self.reset_flag = True
+        self.position = 0.0
+        self.speed = 0.0
+        self.stall = False
+        self._pending = _IOIN
+
+    def _signed(self, value):
+        return value - _TWO32 if value & 0x80000000 else value
+
+    def reg(self, address):
+        return self.regs.get(address, 0)
+
+    @property
+    def xactual(self):
+        return int(round(self.position))
+
+    def _read(self, address):
+        if address == _IOIN:
+            return 0x30 << 24
+        if address == _GSTAT:
+            return 1 if self.reset_flag else 0
+        if address == _XACTUAL:
+            return self.xactual & 0xFFFFFFFF
+        if address == _VACTUAL:
+            return int(self.speed * 16777216.0 / self.fclk) & 0xFFFFFF
+        if address == _DRV_STATUS:
+            moving = self.speed != 0
+            value = 0 if self.stall and moving else 400
+            if self.stall and moving:
+                value |= 1 << 24
+            if not moving:
+                value |= 1 << 31
+            return value
+        return self.reg(address)
+
+    def _standstill(self):
+        return self.speed == 0
+
+    def _position_reached(self):
+        return self.xactual == self._signed(self.reg(_XTARGET))
+
+    def spi_status(self):
+        status = 0
+        if self.reset_flag:
+            status |= 0x01
+        if self.stall and self.speed:
+            status |= 0x04
+        if self._standstill():
+            status |= 0x08
+        if abs(self.speed) == self._vmax():
+            status |= 0x10
+        if self.reg(_RAMPMODE) == 0 and self._position_reached():
+            status |= 0x20
+        return status
+
+    def write_readinto(self, tx, rx):
+        assert len(tx) == len(rx) == 5, "datagrams are 40 bits"
+        assert machine._levels[self.cs] == 0, "CSN must be low during a datagram"
+        self.datagrams += 1
+        rx[0] = self.spi_status()
+        data = self._read(self._pending)
+        rx[1] = (data >> 24) & 0xFF
+        rx[2] = (data >> 16) & 0xFF
+        rx[3] = (data >> 8) & 0xFF
+        rx[4] = data & 0xFF
+        address = tx[0] & 0x7F
+        value = (tx[1] << 24) | (tx[2] << 16) | (tx[3] << 8) | tx[4]
+        if tx[0] & 0x80:
+            self.writes.append((address, value))
+            if address == _GSTAT:
+                if value & 1:
+                    self.reset_flag = False
+            elif address == _XACTUAL:
+                self.position = float(self._signed(value))
+            else:
+                self.regs[address] = value
+        self._pending = address
+
+    # Ramp units for the internal clock
+    def _vmax(self):
+        return self.reg(_VMAX) * self.fclk / 16777216.0
+
+    def _acc(self, register):
+        return self.reg(register) * float(self.fclk) * self.fclk / 2199023255552.0
+
+    def advance(self, seconds, dt=0.0005):
+        steps = max(1, int(seconds / dt + 0.5))
+        for _ in range(steps):
+            self._step(dt)
+
+    def _step(self, dt):
+        vmax = self._vmax()
+        amax = self._acc(_AMAX)
+        mode = self.reg(_RAMPMODE)
+        v = self.speed
+        if mode == 0:
+            target = self._signed(self.reg(_XTARGET))
+            distance = target - self.position
+            if distance == 0 and v == 0:
+                return
+            dmax = self._acc(_DMAX) or amax
+            direction = 1 if distance > 0 else -1
+            braking = v * v / (2 * dmax) if dmax else 0
+            if v * direction < 0 or braking >= abs(distance):
+                v -= (1 if v > 0 else -1) * dmax * dt
+            elif abs(v) < vmax:
+                v += direction * amax * dt
+                if abs(v) > vmax:
+                    v = direction * vmax
+            else:
+                v -= (1 if v > 0 else -1) * dmax * dt
+                if abs(v) < vmax:
+                    v = direction * vmax
+            position = self.position + v * dt
+            # Arrive exactly on the target instead of oscillating around it
+            if (position - target) * (self.position - target) <= 0 or abs(target - position) < 0.5:
+                position = float(target)
+                v = 0.0
+            self.position = position
+            self.speed = v
+        elif mode in (1, 2):
+            want = vmax if mode == 1 else -vmax
+            if v < want:
+                v = min(want, v + amax * dt)
+            elif v > want:
+                v = max(want, v - amax * dt)
+            self.position += v * dt
+            self.speed = v
+        else:
+            self.speed = 0.0
@@ -0,0 +1,30 @@
+# Host stand-in for the uctypes module
+#
+# addressof() hands out stable fake addresses in the RP2040 SRAM range so that
+# emulated DMA channels can resolve them back to the Python buffer.
+
+_SRAM_BASE = 0x20000000
+
+_next = _SRAM_BASE
+_objects = []
+
+
+def addressof(obj):
+    global _next
+    for addr, o in _objects:
+        if o is obj:
+            return addr
+    addr = _next
+    size = len(memoryview(obj).cast("B"))
+    _next += (size + 3) & ~3 or 4
+    _objects.append((addr, obj))
+    return addr
+
+
+def resolve(addr):
+    # Return (memoryview of bytes, offset) for an address handed out above
+    for base, obj in _objects:
+        mv = memoryview(obj).cast("B")
+        if base <= addr < base + len(mv):
+            return mv, addr - base
+    raise ValueError("unmapped address 0x{:08x}".format(addr))
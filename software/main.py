@@ -1,10 +1,16 @@
+from boardsupport import boottime
+
+boottime.mark("firmware")
+
 from boardsupport.frankenstein_controller import FrankensteinRotaryController
-import time
+from boardsupport.journal import Journal
+from boardsupport.runtime import Runtime
+from boardsupport.version import VERSION
 import logging, sys
 import micropython
-import network
 import json
-import webrepl
+
+boottime.mark("imports")
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
@@ -15,17 +21,120 @@ for handler in logging.getLogger().handlers:
 micropython.alloc_emergency_exception_buf(100)
 
 if __name__ == "__main__":
-    # Set up the board
-    controller = FrankensteinRotaryController()
-    controller.reset()
-
-    # Enable WIFI and WebREPL
     config_file = open("config.json")
     config = json.load(config_file)
+    boottime.mark("config")
+
+    # Set up the board, displays and encoders first
+    controller = FrankensteinRotaryController(
+        pio_refresh=config.get("pio_refresh", False),
+        refresh_rate=config.get("refresh_rate", 200),
+        encoder_backend=config.get("encoder_backend", "irq"),
+        # e.g. [[8, 50], [30, 10]], per encoder as a list of four, false for none
+        acceleration=config.get("encoder_acceleration"),
+        agitation=config.get("agitation"),
+        motion_backend=config.get("motion_backend", "step"),
+        dmx_lamp=config.get("dmx_lamp"),
+        # A relay on a GPIO instead, e.g. for a node of the RS485 bus
+        lamp_pin=config.get("lamp_pin"),
+        timers=False,
+        dual_core=config.get("dual_core", False),
+        # Per-digit and per-LED brightness, e.g. {"rate": 1000, "bits": 5}; needs PIO
+        dimming=config.get("dimming"),
+        # Speed, display values and the running timer from before the reset
+        journal=Journal("state"),
+    )
+    # Levels from 0 to 2 ** bits - 1, e.g. [31, 31, 31, 4] and [8, 8, 2, 2]
+    for i, level in enumerate(config.get("display_brightness", ())):
+        controller.set_brightness(i + 1, level)
+    for i, level in enumerate(config.get("led_brightness", ())):
+        controller.set_led_brightness(i + 1, level)
+    controller.reset()
+    controller.update()
+    boottime.mark("display")
+
+    # Recipes come from flash, the fetcher keeps them in sync with the server
+    from boardsupport.recipes import RecipeStore
+
+    controller.recipes = RecipeStore()
+    fetcher = None
+    if config.get("recipe_url"):
+        from boardsupport.recipes import RecipeFetcher
+
+        fetcher = RecipeFetcher(controller.recipes, config["recipe_url"], period_s=config.get("recipe_period_s", 600))
+
+    # Timing of the hot paths, e.g. {"udp": "192.168.1.10:5005", "period_s": 10}
+    # or {"serial": true}; without it the module is not loaded at all
+    settings = config.get("telemetry")
+    if settings:
+        from boardsupport.telemetry import Telemetry, udp_sink, serial_sink
+
+        telemetry = Telemetry(period_ms=settings.get("period_s", 10) * 1000)
+        if settings.get("udp"):
+            host, port = settings["udp"].split(":")
+            telemetry.sink = udp_sink(host, int(port))
+        else:
+            telemetry.sink = serial_sink()
+        telemetry.attach(controller)
+
+    # Raw encoder and switch edges for tools/trace_replay.py, e.g. {"size": 2048};
+    # saved to trace.bin when full or on the control server's TRACE SAVE
+    settings = config.get("trace")
+    if settings:
+        from boardsupport.trace import EdgeTrace
+
+        trace = EdgeTrace(**settings)
+        trace.attach(controller)
+        trace.start()
+
+    # Remote control for a tablet, see boardsupport/control.py; clients log in
+    # with "control_token", without one the port stays closed
+    control = None
+    if config.get("control_port"):
+        if config.get("control_token"):
+            from boardsupport.control import ControlServer
+
+            control = ControlServer(controller, config["control_token"], port=config["control_port"])
+        else:
+            logging.getLogger("boot").warning("control_port without control_token, no control server")
+
+    # Several boards on the RS485 bus, e.g. {"address": 0, "baud": 250000}; the
+    # master (address 0) mirrors its settings and starts exposures on all
+    bus = None
+    settings = config.get("bus")
+    if settings:
+        if config.get("dmx_lamp"):
+            raise ValueError("The RS485 transceiver carries either DMX or the bus")
+        if config.get("motion_backend", "step") != "none":
+            raise ValueError("The bus shares GP8/GP9 with the stepper, needs motion_backend none")
+        from boardsupport.bus import make_bus
+
+        settings = dict(settings)
+        bus = make_bus(settings.pop("address"), controller, **settings)
+
+    # Garbage collection in idle windows only, e.g. {"budget": 8, "probe_s": 60};
+    # false leaves it to MicroPython. Started last, on the heap the setup leaves
+    settings = config.get("memory", {})
+    if settings is not False:
+        from boardsupport.memory import MemoryManager
+
+        MemoryManager(controller, **settings).start()
 
-    wlan = network.WLAN(network.STA_IF)
-    network.hostname("rotary")
-    wlan.active(True)
-    wlan.connect(config['ssid'], config['wlanpw'])
+    # WebREPL
+    #import webrepl
     #webrepl.start(password=config['webrepl_pw'])
 
+    # From here on the UI, display and WiFi run as tasks on the event loop,
+    # WiFi associates in the background
+    runtime = Runtime(
+        controller,
+        wifi=(config['ssid'], config['wlanpw'], "rotary"),
+        stats_period_s=config.get("stats_period_s", 60),
+        fetcher=fetcher,
+        control=control,
+        bus=bus,
+    )
+    boottime.mark("runtime")
+    logging.getLogger("boot").info("%s boot: %s", VERSION, boottime.summary())
+    boottime.save(VERSION)
+    runtime.run()
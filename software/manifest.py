@@ -0,0 +1,11 @@
+# Freezes boardsupport into a firmware image, so it is neither compiled nor
+# loaded from the filesystem at boot:
+#
+#   make -C ports/rp2 BOARD=RPI_PICO_W FROZEN_MANIFEST=/path/to/software/manifest.py
+#
+# main.py and config.json stay on the filesystem. Run tools/build_mpy.py
+# first so boardsupport/version.py names the build.
+
+include("$(BOARD_DIR)/manifest.py")
+require("logging")
+package("boardsupport")
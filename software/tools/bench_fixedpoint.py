@@ -0,0 +1,127 @@
+# Cost of the fixed-point value model against the float path it replaced
+#
+# Runs on the host (through hosthal) or on the board itself, where it needs
+# bench_framebuffer.py next to it:
+#
+#   python3 tools/bench_fixedpoint.py
+#   mpremote cp tools/bench_framebuffer.py : + run tools/bench_fixedpoint.py
+#
+# countdown: one tick of a countdown shown in tenths of a second, from the
+# remaining µs to the frame; float is ceil(remaining / 1e5) / 10 rendered by
+# the legacy float renderer, fixed is (remaining + 99_999) // 100_000 with
+# point=1 rendered by the framebuffer. f-stop: one adjust() step, float is
+# d * 2 ** (steps / mode), fixed the table in exposure.py. Allocations are
+# measured as in bench_framebuffer.py; the RP2040 has no FPU and boxes every
+# float on the heap, so the board shows the larger difference.
+
+import gc
+import math
+import sys
+
+MICROPYTHON = sys.implementation.name == "micropython"
+
+if not MICROPYTHON:
+    import os
+    import time
+    import tracemalloc
+
+    sys.path.insert(0, os.path.dirname(__file__))
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    import hosthal
+
+    hosthal.install()
+
+    def _now_us():
+        return time.perf_counter_ns() / 1000
+else:
+    import time
+
+    def _now_us():
+        return time.ticks_us()
+
+from bench_framebuffer import LegacyRenderer
+from boardsupport import exposure
+from boardsupport.frankenstein_controller import FrankensteinController
+
+_MODES = (exposure.THIRD_STOP, exposure.SIXTH_STOP, exposure.TWELFTH_STOP)
+
+
+def _measure(call, count):
+    elapsed = 0.0
+    allocated = 0
+    for n in range(count):
+        if MICROPYTHON:
+            gc.disable()
+            before = gc.mem_alloc()
+            t0 = _now_us()
+            call(n)
+            t1 = _now_us()
+            allocated += gc.mem_alloc() - before
+            gc.enable()
+        else:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            t0 = _now_us()
+            call(n)
+            t1 = _now_us()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        elapsed += t1 - t0
+    return elapsed / count, allocated / count
+
+
+def _float_adjust(duration_us, steps, mode):
+    return max(0, min(exposure.MAX_EXPOSURE_US, int(duration_us * 2 ** (steps / mode) + 0.5)))
+
+
+class _LegacyState:
+    # The dict displays of the float model; the controller's displays are views
+    # on its int arrays and cannot hold a float, the LEDs are read through
+    def __init__(self, controller):
+        self.controller = controller
+        for n, display in enumerate(controller._displays, 1):
+            setattr(self, "display{}".format(n), {
+                "value": display["value"], "blink": display["blink"], "point": display["point"]})
+
+    def __getattr__(self, name):
+        return getattr(self.controller, name)
+
+
+def main(count=2000):
+    controller = FrankensteinController()
+    controller.display_timer.deinit()
+    state = _LegacyState(controller)
+    legacy = LegacyRenderer(state)
+    legacy_display = state.display2
+    display = controller.display2
+
+    # 99.9 s down to 0, 50 ms per tick
+    def countdown_float(n):
+        legacy_display["value"] = math.ceil((99_900_000 - 50_000 * (n % 1998)) / 100_000) / 10
+        controller.refresh.show(legacy.render(0))
+
+    def countdown_fixed(n):
+        display["point"] = 1
+        display["value"] = (99_900_000 - 50_000 * (n % 1998) + 99_999) // 100_000
+        controller.render_full_display(None)
+
+    def fstop_float(n):
+        _float_adjust(8_000_000 + n, n % 40 - 20, _MODES[n % 3])
+
+    def fstop_fixed(n):
+        exposure.adjust(8_000_000 + n, n % 40 - 20, _MODES[n % 3])
+
+    if not MICROPYTHON:
+        tracemalloc.start()
+    base_us, base_alloc = _measure(lambda n: None, count)
+    print("{:<10} {:>6} {:>10} {:>12}".format("path", "model", "us/call", "bytes/call"))
+    for name, pair in (("countdown", (countdown_float, countdown_fixed)), ("f-stop", (fstop_float, fstop_fixed))):
+        for label, call in zip(("float", "fixed"), pair):
+            us, allocated = _measure(call, count)
+            print("{:<10} {:>6} {:>10.2f} {:>12.1f}".format(
+                name, label, max(0.0, us - base_us), max(0.0, allocated - base_alloc)))
+    if not MICROPYTHON:
+        tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
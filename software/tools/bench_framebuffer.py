@@ -0,0 +1,252 @@
+# Benchmark the framebuffer renderer against the original dict/f-string renderer
+#
+# Runs on the host (through hosthal) or on the board itself:
+#
+#   python3 tools/bench_framebuffer.py
+#   mpremote run tools/bench_framebuffer.py
+#
+# On the host allocations are measured with tracemalloc (peak bytes per frame,
+# which includes CPython's boxing of ints that are immediate on the board), on
+# the board with gc.mem_alloc() while the collector is disabled.
+
+import gc
+import math
+import sys
+
+MICROPYTHON = sys.implementation.name == "micropython"
+
+if not MICROPYTHON:
+    import os
+    import time
+    import tracemalloc
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    import hosthal
+
+    hosthal.install()
+
+    def _now_us():
+        return time.perf_counter_ns() / 1000
+else:
+    import time
+
+    def _now_us():
+        return time.ticks_us()
+
+from boardsupport.frankenstein_controller import FrankensteinController
+
+
+def _as_float(display):
+    # The legacy model kept tenths as floats, the fixed-point value is read back as one
+    if display["point"]:
+        return {"value": display["value"] / 10 ** display["point"], "blink": display["blink"]}
+    return display
+
+
+class LegacyRenderer:
+    # The renderer as it was before the framebuffer, kept verbatim for comparison
+    # but for reading fixed-point values as floats
+    def __init__(self, controller):
+        self.c = controller
+
+    def _single_digit_to_byte(self, digit) -> int:
+        mapping = {
+            0: 190,
+            1: 10,
+            2: 230,
+            3: 110,
+            4: 90,
+            5: 124,
+            6: 252,
+            7: 14,
+            8: 254,
+            9: 126,
+            None: 0,
+        }
+        return int(mapping[digit])
+
+    def _render_integer(self, display, blinky_time) -> list:
+        if display["value"] < 0 or display["value"] > 1000:
+            raise ValueError
+        if display["blink"] and blinky_time:
+            return [0, 0, 0]
+        display_bytes = []
+        display_string = f"{display['value']:03d}"
+        for i in display_string:
+            display_bytes.append(self._single_digit_to_byte(int(i)))
+        return display_bytes
+
+    def _render_float(self, display, blinky_time) -> list:
+        if int(math.log10(display["value"])) + 1 > 2:
+            raise ValueError
+        if display["blink"] and blinky_time:
+            return [0, 0, 0]
+        display_bytes = []
+        display_string = f"{display['value']:4.1f}"
+        digit = 0
+        for i in display_string:
+            if i == " ":
+                i = 0
+            if i == ".":
+                continue
+            if digit == 1:
+                display_bytes.append(self._single_digit_to_byte(int(i)) + 1)
+            else:
+                display_bytes.append(self._single_digit_to_byte(int(i)))
+            digit = digit + 1
+        return display_bytes
+
+    def render(self, blinky_time):
+        c = self.c
+        output_buffer = []
+        for display in [c.display1, c.display2, c.display3, c.display4]:
+            display = _as_float(display)
+            if isinstance(display["value"], int):
+                for byte in self._render_integer(display, blinky_time):
+                    output_buffer.append(byte)
+            if isinstance(display["value"], float):
+                for byte in self._render_float(display, blinky_time):
+                    output_buffer.append(byte)
+
+        output_buffer.append(255)
+        for button_led in [c.button1_led, c.button2_led, c.button3_led, c.button4_led]:
+            if button_led["value"] and not (button_led["blink"] and blinky_time):
+                output_buffer[-1] = output_buffer[-1] - button_led["address"]
+        return bytearray(reversed(output_buffer))
+
+
+class _Phase:
+    # Stands in for the controller's clock-driven blink phase
+    value = 0
+
+    def __call__(self):
+        return self.value
+
+
+_phase = _Phase()
+
+
+def _frame_new(controller, phase):
+    _phase.value = phase
+    controller.render_full_display(None)
+
+
+def _frame_legacy(controller, legacy, phase):
+    controller.refresh.show(legacy.render(phase))
+
+
+# Scenarios mutate the model before frame n, like the application would
+def _static(controller, n):
+    pass
+
+
+def _countdown(controller, n):
+    if n % 10 == 0:
+        controller.display1["value"] = 999 - (n // 10) % 1000
+
+
+def _blinking(controller, n):
+    controller.display2["blink"] = True
+    controller.button3_led["blink"] = True
+
+
+def _tenths(controller, n):
+    controller.display3["value"] = 125 + 10 * ((n // 10) % 50)
+    controller.display3["point"] = 1
+
+
+SCENARIOS = (
+    ("static", _static),
+    ("countdown", _countdown),
+    ("blinking", _blinking),
+    ("tenths", _tenths),
+)
+
+
+def _setup(controller):
+    controller.display1["value"] = 300
+    controller.display1["blink"] = False
+    controller.display2["value"] = 60
+    controller.display2["blink"] = False
+    controller.display3["value"] = 300
+    controller.display3["blink"] = False
+    controller.display3["point"] = 0
+    controller.display4["value"] = 7
+    controller.button1_led["value"] = True
+    controller.button3_led["value"] = True
+    controller.button3_led["blink"] = False
+    controller.framebuffer.invalidate()
+
+
+def _measure(controller, scenario, frame, frames):
+    _setup(controller)
+    elapsed = 0.0
+    allocated = 0
+    writes = controller.refresh.frames
+    for n in range(frames):
+        scenario(controller, n)
+        phase = (n // 5) % 2
+        if MICROPYTHON:
+            gc.disable()
+            before = gc.mem_alloc()
+            t0 = _now_us()
+            frame(phase)
+            t1 = _now_us()
+            allocated += gc.mem_alloc() - before
+            gc.enable()
+        else:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            t0 = _now_us()
+            frame(phase)
+            t1 = _now_us()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        elapsed += t1 - t0
+    return elapsed / frames, allocated / frames, controller.refresh.frames - writes
+
+
+def _check_equivalence(controller, legacy):
+    for name, scenario in SCENARIOS:
+        _setup(controller)
+        for n in range(200):
+            scenario(controller, n)
+            phase = (n // 5) % 2
+            _frame_new(controller, phase)
+            expected = legacy.render(phase)
+            if bytes(controller.framebuffer.buf) != bytes(expected):
+                raise AssertionError(
+                    "{} frame {}: {} != {}".format(
+                        name, n, bytes(controller.framebuffer.buf), bytes(expected)
+                    )
+                )
+
+
+def main(frames=2000):
+    controller = FrankensteinController()
+    controller.display_timer.deinit()
+    controller._blink_phase = _phase
+    legacy = LegacyRenderer(controller)
+
+    _check_equivalence(controller, legacy)
+    print("framebuffer output matches legacy renderer")
+
+    if not MICROPYTHON:
+        tracemalloc.start()
+    # Measurement overhead (the call itself, tracemalloc bookkeeping) is subtracted
+    base_us, base_alloc, _ = _measure(controller, _static, lambda phase: None, frames)
+    print("{:<10} {:>8} {:>12} {:>12} {:>8}".format("scenario", "renderer", "us/frame", "bytes/frame", "writes"))
+    for name, scenario in SCENARIOS:
+        for label, frame in (
+            ("legacy", lambda phase: _frame_legacy(controller, legacy, phase)),
+            ("fb", lambda phase: _frame_new(controller, phase)),
+        ):
+            us, allocated, writes = _measure(controller, scenario, frame, frames)
+            us = max(0.0, us - base_us)
+            allocated = max(0.0, allocated - base_alloc)
+            print("{:<10} {:>8} {:>12.2f} {:>12.1f} {:>8}".format(name, label, us, allocated, writes))
+    if not MICROPYTHON:
+        tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Time and allocations per call of the controller's hot paths
+#
+# Runs on the host (through hosthal) or on the board itself:
+#
+#   python3 tools/bench_hotpaths.py [--save FILE | --check FILE]
+#   mpremote run tools/bench_hotpaths.py
+#
+# Covers the IRQ and timer callbacks and what the event drain calls per
+# record: render_full_display, the encoder decoder (_process_rotary_pins), the
+# agitation step timer (AgitationMotion._tick, which replaced _rotate), the
+# switch scan (BankDebouncer.scan) and rotary_event. --save writes the host
+# results as JSON, --check compares against such a file and exits non-zero
+# when a path got slower by more than a third or allocates more than before.
+# Allocations are measured as in bench_framebuffer.py; on the host pin levels
+# are stepped through the quadrature sequence, on the board they read whatever
+# is there.
+
+import gc
+import sys
+
+MICROPYTHON = sys.implementation.name == "micropython"
+
+if not MICROPYTHON:
+    import json
+    import os
+    import time
+    import tracemalloc
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    import hosthal
+
+    hosthal.install()
+    from hosthal import machine
+
+    def _now_us():
+        return time.perf_counter_ns() / 1000
+
+    def _set_level(pin, level):
+        machine._levels[pin] = level
+else:
+    import time
+
+    def _now_us():
+        return time.ticks_us()
+
+    def _set_level(pin, level):
+        pass
+
+from boardsupport.frankenstein_controller import (
+    FrankensteinRotaryController,
+    _BUTTON_PINS,
+    _ROTARY_PINS,
+)
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+# A slower path fails --check, and so does a single extra byte per call
+_TIME_TOLERANCE = 1.33
+
+
+class _Phase:
+    # Stands in for the controller's clock-driven blink phase
+    value = 0
+
+    def __call__(self):
+        return self.value
+
+
+def _render_static(controller):
+    def run(n):
+        controller.render_full_display(None)
+    return run
+
+
+def _render_changing(controller):
+    phase = _Phase()
+    controller._blink_phase = phase
+    display = controller.display1
+    display["blink"] = True
+
+    def run(n):
+        display["value"] = n % 1000
+        phase.value = (n >> 3) & 1
+        controller.render_full_display(None)
+    return run
+
+
+def _rotary_pins(controller):
+    rotary = controller.rotary_2
+    clk, dt = _ROTARY_PINS[1]
+    rotary.set(value=500)
+
+    def run(n):
+        # Up one full detent, down the next, so the value never clamps
+        level = GRAY[n & 3] if n & 4 else GRAY[3 - (n & 3)]
+        _set_level(clk, level[0])
+        _set_level(dt, level[1])
+        rotary._process_rotary_pins(None)
+    return run
+
+
+def _motion_tick(controller):
+    motion = controller.motion
+    motion.configure(reversal_dwell_ms=1, cycle_dwell_ms=1)
+    motion.start()
+
+    def run(n):
+        motion._tick(None)
+    return run
+
+
+def _bank_scan(controller):
+    bank = controller.buttons
+    pin = _BUTTON_PINS[4]
+
+    def run(n):
+        # A press every 64 scans, with a bounce on the way down
+        phase = n & 63
+        _set_level(pin, 1 if 1 <= phase < 30 and phase != 3 else 0)
+        bank.scan()
+        if phase == 63:
+            controller.events.drain()
+    return run
+
+
+def _rotary_event(controller):
+    def run(n):
+        controller.rotary_event(3, 1 if n & 1 else -1)
+    return run
+
+
+def _event_dispatch(controller):
+    events = controller.events
+
+    def run(n):
+        events.post_delta(2, 1 if n & 1 else -1)
+        events.drain()
+    return run
+
+
+BENCHMARKS = (
+    ("render_full_display (static)", _render_static),
+    ("render_full_display (changing)", _render_changing),
+    ("_process_rotary_pins", _rotary_pins),
+    ("AgitationMotion._tick", _motion_tick),
+    ("BankDebouncer.scan", _bank_scan),
+    ("rotary_event", _rotary_event),
+    ("event post + drain", _event_dispatch),
+)
+
+
+def _measure(run, calls):
+    elapsed = 0.0
+    allocated = 0
+    for n in range(calls):
+        if MICROPYTHON:
+            gc.disable()
+            before = gc.mem_alloc()
+            t0 = _now_us()
+            run(n)
+            t1 = _now_us()
+            allocated += gc.mem_alloc() - before
+            gc.enable()
+        else:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            t0 = _now_us()
+            run(n)
+            t1 = _now_us()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        elapsed += t1 - t0
+    return elapsed / calls, allocated / calls
+
+
+def _controller():
+    for clk, dt in _ROTARY_PINS:
+        _set_level(clk, 1)
+        _set_level(dt, 1)
+    for pin in _BUTTON_PINS:
+        _set_level(pin, 0)
+    controller = FrankensteinRotaryController(timers=False)
+    controller.reset()
+    return controller
+
+
+def run_all(calls=2000):
+    if not MICROPYTHON:
+        tracemalloc.start()
+    # Measurement overhead (the call itself, tracemalloc bookkeeping) is subtracted
+    base_us, base_alloc = _measure(lambda n: None, calls)
+    results = {}
+    for name, setup in BENCHMARKS:
+        # A fresh controller each time, state left by one path must not
+        # change the cost of the next
+        run = setup(_controller())
+        run(0)
+        us, allocated = _measure(run, calls)
+        results[name] = (max(0.0, us - base_us), max(0.0, allocated - base_alloc))
+    if not MICROPYTHON:
+        tracemalloc.stop()
+    return results
+
+
+def _regressions(results, baseline):
+    failed = []
+    for name, (us, allocated) in results.items():
+        if name not in baseline:
+            continue
+        base_us, base_alloc = baseline[name]
+        if us > base_us * _TIME_TOLERANCE + 1.0:
+            failed.append("{}: {:.2f} us/call, was {:.2f}".format(name, us, base_us))
+        if allocated > base_alloc + 1.0:
+            failed.append("{}: {:.1f} bytes/call, was {:.1f}".format(name, allocated, base_alloc))
+    return failed
+
+
+def main(argv=()):
+    results = run_all()
+    print("{:<32} {:>10} {:>12}".format("path", "us/call", "bytes/call"))
+    for name, _ in BENCHMARKS:
+        us, allocated = results[name]
+        print("{:<32} {:>10.2f} {:>12.1f}".format(name, us, allocated))
+    if MICROPYTHON or len(argv) < 2:
+        return 0
+    option, path = argv[0], argv[1]
+    if option == "--save":
+        with open(path, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        return 0
+    if option == "--check":
+        with open(path) as f:
+            failed = _regressions(results, json.load(f))
+        for line in failed:
+            print("REGRESSION " + line)
+        return 1 if failed else 0
+    print("unknown option " + option)
+    return 2
+
+
+if __name__ == "__main__":
+    if MICROPYTHON:
+        main()
+    else:
+        sys.exit(main(sys.argv[1:]))
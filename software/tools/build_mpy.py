@@ -0,0 +1,109 @@
+# Precompile boardsupport to .mpy and optionally deploy it
+#
+#   python3 tools/build_mpy.py [--out DIR] [--deploy [--device PORT]]
+#
+# Needs mpy-cross on the PATH or the mpy-cross package from PyPI; its version
+# must match the firmware's .mpy format. Writes DIR/boardsupport/*.mpy (the
+# default DIR is build/) with version.py set to `git describe`, plus main.py
+# as source. --deploy replaces the board's boardsupport package with the
+# build through mpremote, the .py files are removed as they would be
+# imported in preference to the .mpy ones. For a frozen build see manifest.py.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+SOFTWARE = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+PACKAGE = "boardsupport"
+
+
+def mpy_cross():
+    path = shutil.which("mpy-cross")
+    if path:
+        return [path]
+    try:
+        import mpy_cross  # noqa: F401
+    except ImportError:
+        sys.exit("mpy-cross not found, install it with: pip install mpy-cross")
+    return [sys.executable, "-m", "mpy_cross"]
+
+
+def git_version():
+    try:
+        out = subprocess.run(
+            ["git", "describe", "--always", "--dirty", "--tags"],
+            cwd=SOFTWARE, capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "dev"
+    return out.stdout.strip() or "dev"
+
+
+def build(out):
+    compiler = mpy_cross()
+    target = os.path.join(out, PACKAGE)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.makedirs(target)
+    version = git_version()
+    source_dir = os.path.join(SOFTWARE, PACKAGE)
+    total_py = total_mpy = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        version_py = os.path.join(tmp, "version.py")
+        with open(version_py, "w") as f:
+            f.write("VERSION = {!r}\n".format(version))
+        for name in sorted(os.listdir(source_dir)):
+            if not name.endswith(".py"):
+                continue
+            source = version_py if name == "version.py" else os.path.join(source_dir, name)
+            output = os.path.join(target, name[:-3] + ".mpy")
+            # -s keeps the package path in tracebacks
+            subprocess.run(
+                compiler + ["-march=armv6m", "-s", PACKAGE + "/" + name, "-o", output, source],
+                check=True,
+            )
+            total_py += os.path.getsize(source)
+            total_mpy += os.path.getsize(output)
+    shutil.copy(os.path.join(SOFTWARE, "main.py"), os.path.join(out, "main.py"))
+    print("{} {}: {} bytes of source -> {} bytes of .mpy in {}".format(
+        PACKAGE, version, total_py, total_mpy, target))
+    return target
+
+
+def deploy(out, device=None):
+    mpremote = ["mpremote"] + (["connect", device] if device else [])
+    # A missing package on the board is fine
+    subprocess.run(mpremote + ["fs", "rm", "-r", ":" + PACKAGE], check=False)
+    subprocess.run(
+        mpremote + [
+            "fs", "cp", "-r", os.path.join(out, PACKAGE), ":", "+",
+            "fs", "cp", os.path.join(out, "main.py"), ":main.py",
+        ],
+        check=True,
+    )
+
+
+def main(argv):
+    out = os.path.join(SOFTWARE, "build")
+    device = None
+    deploying = False
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == "--out":
+            out = os.path.abspath(args.pop(0))
+        elif arg == "--deploy":
+            deploying = True
+        elif arg == "--device":
+            device = args.pop(0)
+        else:
+            sys.exit("usage: build_mpy.py [--out DIR] [--deploy [--device PORT]]")
+    build(out)
+    if deploying:
+        deploy(out, device)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,269 @@
+# Several controllers on a virtual RS485 bus
+#
+#   python3 tools/bus_sim.py [nodes] [seconds]
+#
+# Builds a master and nodes-1 controllers on hosthal's virtual clock, each
+# with its own ticks_us (a random offset of up to a minute and up to 50 ppm
+# of drift against the master) and joins their BusNodes over a VirtualBus
+# that delivers every byte to the other ports one byte time after the
+# last. Each node polls every 2-3.5 ms like the runtime's bus task does, now
+# and then 20 ms late like behind a blocking network call. The ports raise
+# the rp2's RX idle interrupt 32 bit times after a frame, its soft IRQ runs
+# 10-60 µs later, now and then 2-5 ms later like behind a garbage collection.
+#
+# Reports how far each node's estimate of the master's clock is off, the
+# skew between the lamps of all nodes over a series of START_AT exposures,
+# with and without the idle interrupt, and the PING/STATUS round trips per
+# second with the bus load they cause.
+
+import os
+import random
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+import machine
+from boardsupport.bus import BusNode, MASTER
+from boardsupport.board import FRANKENSTEIN
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+
+TICKS_MAX = 0x3FFFFFFF
+_LAMP_PIN = 28
+
+
+class VirtualBus:
+    def __init__(self, baud=250_000, noise=0.0, seed=1):
+        self.byte_us = 10_000_000 / baud
+        self.idle_us = 32_000_000 / baud
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.ports = []
+        self.free_at = 0
+        self.bytes = 0
+        self.collisions = 0
+
+    def port(self, idle_irq=True):
+        port = VirtualPort(self, idle_irq)
+        self.ports.append(port)
+        return port
+
+
+class VirtualPort:
+    # A UART and transceiver: what one port writes, the others receive
+    IRQ_RXIDLE = 64
+
+    def __init__(self, bus, idle_irq=True):
+        self.bus = bus
+        self.rx = deque()
+        self._done = 0
+        self._last_rx = 0
+        self.handler = None
+        if not idle_irq:
+            self.IRQ_RXIDLE = None
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        self.handler = handler
+
+    def write(self, buf):
+        bus = self.bus
+        now = clock.now
+        data = bytes(buf)
+        collided = bus.free_at > now
+        if collided:
+            bus.collisions += 1
+        end = now + len(data) * bus.byte_us
+        for port in bus.ports:
+            if port is self:
+                continue
+            for i, byte in enumerate(data):
+                if collided or (bus.noise and bus.rng.random() < bus.noise):
+                    byte ^= 1 << bus.rng.randrange(8)
+                port.rx.append((now + (i + 1) * bus.byte_us, byte))
+            port._last_rx = end
+            if port.handler is not None:
+                port._idle_after(end)
+        bus.free_at = self._done = end
+        bus.bytes += len(data)
+        return len(data)
+
+    # Blocks the writing node until the last stop bit is out
+    def flush(self):
+        wait = int(self._done - clock.now + 0.999)
+        if wait > 0:
+            clock.advance(wait)
+
+    # The idle interrupt, unless more bytes came before the line was idle
+    def _idle_after(self, end):
+        bus = self.bus
+        late = 10 + bus.rng.randrange(50)
+        if bus.rng.random() < 0.02:
+            late += 2000 + bus.rng.randrange(3000)
+        due = end + bus.idle_us
+
+        def fire(timer):
+            if self._last_rx + bus.idle_us <= due:
+                self.handler(self)
+
+        machine.Timer(mode=machine.Timer.ONE_SHOT, period=int(due + late - clock.now + 0.999),
+                      tick_hz=1_000_000, callback=fire)
+
+    def any(self):
+        n = 0
+        for arrival, _ in self.rx:
+            if arrival > clock.now:
+                break
+            n += 1
+        return n
+
+    def readinto(self, buf):
+        rx = self.rx
+        n = 0
+        while rx and rx[0][0] <= clock.now and n < len(buf):
+            buf[n] = rx.popleft()[1]
+            n += 1
+        return n or None
+
+
+class NodeClock:
+    # ticks_us of a board that started offset_us earlier and runs ppm faster
+    def __init__(self, offset_us, ppm):
+        self.offset_us = offset_us
+        self.ppm = ppm
+
+    def at(self, t):
+        return (t + self.offset_us + t * self.ppm // 1_000_000) & TICKS_MAX
+
+    def __call__(self):
+        return self.at(clock.ticks_us())
+
+
+class Lamp:
+    def __init__(self):
+        self.on_at = []
+
+    def on(self):
+        self.on_at.append(clock.now)
+
+    def off(self):
+        pass
+
+
+class Node:
+    def __init__(self, bus, address, offset_us, ppm, rng, idle_irq=True, board=FRANKENSTEIN):
+        self.controller = FrankensteinRotaryController(
+            timers=False, motion_backend="none", lamp_pin=_LAMP_PIN, acceleration=False, board=board,
+        )
+        self.clock = NodeClock(offset_us, ppm)
+        self.lamp = Lamp()
+        exposure = self.controller.exposure
+        exposure.lamp = self.lamp
+        exposure.ticks_us = self.clock
+        port = bus.port(idle_irq)
+        self.bus = BusNode(port, address, controller=self.controller, baud=int(10_000_000 / bus.byte_us))
+        self.bus.ticks_us = self.clock
+        self.rng = rng
+        self.next_poll = clock.now + rng.randrange(2000)
+
+    def step(self):
+        if clock.now < self.next_poll:
+            return
+        self.bus.poll()
+        late = 20_000 if self.rng.random() < 0.02 else 0
+        self.next_poll = clock.now + 2000 + self.rng.randrange(1500) + late
+
+
+class Simulation:
+    def __init__(self, nodes=4, noise=0.0, seed=1, idle_irq=True, board=FRANKENSTEIN):
+        self.rng = random.Random(seed)
+        # The lamp spins on the clock, reading it has to take time
+        clock.read_cost_us = 1
+        self.bus = VirtualBus(noise=noise, seed=seed)
+        self.nodes = [Node(self.bus, MASTER, self.rng.randrange(1 << 29), 0, self.rng, idle_irq, board)]
+        for address in range(1, nodes):
+            self.nodes.append(Node(
+                self.bus, address, self.rng.randrange(1 << 29), self.rng.randrange(-50, 51), self.rng, idle_irq,
+                board,
+            ))
+        self.master = self.nodes[0]
+
+    def run(self, us, until=None):
+        end = clock.now + us
+        while clock.now < end:
+            for node in self.nodes:
+                node.step()
+            if until is not None and until():
+                return True
+            clock.advance(50)
+        return False
+
+    # Estimate against truth for every node, in µs
+    def sync_errors(self):
+        t = clock.now
+        master = self.master.clock.at(t)
+        errors = []
+        for node in self.nodes[1:]:
+            true = ((node.clock.at(t) - master + (1 << 29)) & TICKS_MAX) - (1 << 29)
+            errors.append(node.bus.offset_us - true)
+        return errors
+
+    # Lamp-on spread over all nodes for each of count START_AT exposures
+    def skews(self, count=20):
+        skews = []
+        for _ in range(count):
+            for node in self.nodes:
+                node.lamp.on_at.clear()
+            self.master.bus.start_at(100, 20_000)
+            self.run(150_000 + self.rng.randrange(100_000))
+            times = [node.lamp.on_at[0] for node in self.nodes if node.lamp.on_at]
+            if len(times) < len(self.nodes):
+                raise AssertionError("a lamp did not come on: {}".format(len(times)))
+            skews.append(max(times) - min(times))
+        return skews
+
+    # PING/STATUS round trips to each node in turn for us µs
+    def round_trips(self, us):
+        master = self.master.bus
+        start = clock.now
+        start_bytes = self.bus.bytes
+        trips = []
+        i = 0
+        while clock.now - start < us:
+            address = 1 + i % (len(self.nodes) - 1)
+            master.nodes.pop(address, None)
+            sent = clock.now
+            master.ping(address)
+            if self.run(10_000, lambda: address in master.nodes):
+                trips.append(clock.now - sent)
+            i += 1
+        elapsed = clock.now - start
+        load = (self.bus.bytes - start_bytes) * self.bus.byte_us / elapsed
+        return trips, i, elapsed, load
+
+
+def main(nodes=4, seconds=5):
+    results = []
+    for idle_irq in (True, False):
+        sim = Simulation(nodes, idle_irq=idle_irq)
+        sim.run(int(seconds * 1_000_000))
+        results.append((sim, sim.sync_errors(), sorted(sim.skews())))
+    sim, errors, skews = results[0]
+    trips, pings, elapsed, load = sim.round_trips(1_000_000)
+    trips.sort()
+    print("{} nodes at {} baud, {} s to sync".format(nodes, sim.master.bus.baud, seconds))
+    for (_, errors, skews), label in zip(results, ("RX idle interrupt", "poll() timestamps")):
+        print("{}: clock estimate error {} us".format(label, " ".join(str(e) for e in errors)))
+        print("{}: lamp skew over {} START_AT p50 {:.0f} us, max {:.0f} us".format(
+            label, len(skews), skews[len(skews) // 2], skews[-1]))
+    print("PING/STATUS: {} of {} answered within 10 ms, {:.0f}/s, round trip p50 {:.0f} us, bus load {:.0%}".format(
+        len(trips), pings, len(trips) * 1_000_000 / elapsed, trips[len(trips) // 2] if trips else 0, load))
+    print("frames with CRC errors: {}, collisions: {}".format(
+        sum(node.bus.crc_errors for node in sim.nodes), sim.bus.collisions))
+    return results, trips, pings
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4, float(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,196 @@
+# Replay encoder edge timings through the accelerated decoder off-device
+#
+#   python3 tools/check_acceleration.py [EDGES]
+#
+# Edge timings, generated here or read from EDGES (one "t_us clk dt" line per
+# edge, e.g. captured with a logic analyser), are replayed onto the first
+# encoder's pins on hosthal's virtual clock, so the decoder sees the same
+# ticks_us as it would have on the board. Checks slow turns, spins and
+# reversals against the default curve, the PIO decoder's per-poll
+# acceleration and the per-encoder settings, and compares how many detents
+# and rotary_event calls it takes to get display1 from 0 to 300 with and
+# without acceleration.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from hosthal import machine, rp2
+from boardsupport.frankenstein_controller import FrankensteinRotaryController, _ROTARY_PINS
+from boardsupport.rotary_pio_rp2 import RotaryPIO
+
+# Quadrature sequence with CLK leading, walking it forwards is clockwise
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+
+class Counting(FrankensteinRotaryController):
+    def __init__(self, **kwargs):
+        self.calls = 0
+        super().__init__(timers=False, **kwargs)
+
+    def rotary_event(self, rotary_id, delta):
+        self.calls += 1
+        super().rotary_event(rotary_id, delta)
+
+
+class Hand:
+    # Turns the first encoder: detents at given intervals, as edges in time
+    def __init__(self):
+        self.phase = 2
+        self.t = 0
+        self.edges = []
+
+    def detents(self, intervals_ms, direction=1):
+        for interval in intervals_ms:
+            # A half-step detent is two transitions, the second one counts
+            for half in (interval * 1000 // 2, interval * 1000 - interval * 1000 // 2):
+                self.t += half
+                self.phase = (self.phase + direction) % 4
+                self.edges.append((self.t, GRAY[self.phase][0], GRAY[self.phase][1]))
+        return self
+
+    def pause(self, ms):
+        self.t += ms * 1000
+        return self
+
+    # A flick speeds up from 60 ms to 4 ms per detent and slows down again
+    def flick(self, direction=1):
+        return self.detents((60, 30, 15, 8, 5, 4, 4, 4, 5, 8, 15, 30, 60), direction)
+
+
+def replay(edges):
+    clk, dt = _ROTARY_PINS[0]
+    start = clock.now
+    for t, clk_level, dt_level in edges:
+        clock.advance(max(0, start + t - clock.now))
+        if machine._levels[clk] != clk_level:
+            machine.drive(clk, clk_level)
+        if machine._levels[dt] != dt_level:
+            machine.drive(dt, dt_level)
+    clock.advance(1000)
+
+
+def read_edges(path):
+    edges = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                t, clk, dt = line.split()
+                edges.append((int(t), int(clk), int(dt)))
+    t0 = edges[0][0] if edges else 0
+    return [(t - t0, clk, dt) for t, clk, dt in edges]
+
+
+def idle_pins():
+    for clk, dt in _ROTARY_PINS:
+        machine.drive(clk, 1)
+        machine.drive(dt, 1)
+
+
+def fresh(**kwargs):
+    idle_pins()
+    controller = Counting(**kwargs)
+    controller.display1["value"] = 0
+    return controller
+
+
+def check_curve():
+    # Slow detents count one each
+    controller = fresh()
+    replay(Hand().pause(300).detents([250] * 10).edges)
+    assert controller.display1["value"] == 10, controller.display1
+
+    # 20 ms detents count ten, after the first one
+    controller = fresh()
+    replay(Hand().pause(300).detents([20] * 6).edges)
+    assert controller.display1["value"] == 1 + 5 * 10, controller.display1
+
+    # A flick: 60 1 + 30 1 + 15 10 + 8 10 + 5 4 4 4 5 50 each + 8 10 + 15 10 + 30 1 + 60 1
+    controller = fresh()
+    replay(Hand().pause(300).flick().edges)
+    assert controller.display1["value"] == 1 + 1 + 10 + 10 + 5 * 50 + 10 + 10 + 1 + 1, controller.display1
+
+    # A reversal starts over at one even when it is fast
+    controller = fresh()
+    controller.display1["value"] = 500
+    replay(Hand().pause(300).detents([5] * 3).detents([5] * 3, -1).edges)
+    assert controller.display1["value"] == 500 + 1 + 50 + 50 - 1 - 50 - 50, controller.display1
+
+    # Without acceleration every detent counts one
+    controller = fresh(acceleration=False)
+    replay(Hand().pause(300).flick().edges)
+    assert controller.display1["value"] == 13, controller.display1
+
+
+def check_settings():
+    curve = ((5, 20),)
+    controller = fresh(acceleration=[curve, None, [[10, 4], [40, 2]], None])
+    assert controller.rotary_1._accel == (5000, 20)
+    assert controller.rotary_2._accel == () and controller.rotary_4._accel == ()
+    assert controller.rotary_3._accel == (10000, 4, 40000, 2)
+    for bad in (((10, 5), (10, 2)), ((10, 0),)):
+        try:
+            controller.rotary_1.set_acceleration(bad)
+        except ValueError:
+            continue
+        raise AssertionError("accepted {}".format(bad))
+
+
+def check_pio():
+    rp2.reset()
+    rotary = RotaryPIO(pin_num_clk=6, pin_num_dt=7, min_val=0, max_val=999, half_step=True,
+                       range_mode=RotaryPIO.RANGE_BOUNDED)
+    rotary.set_acceleration(((8, 50), (30, 10)))
+    count = 0
+    # One step per 20 ms poll: ten each after the first
+    for _ in range(5):
+        clock.advance(20_000)
+        count += 1
+        rotary._update(count)
+    assert rotary.value() == 1 + 4 * 10, rotary.value()
+    # Four steps in one poll are 5 ms apart
+    clock.advance(20_000)
+    count += 4
+    rotary._update(count)
+    assert rotary.value() == 41 + 4 * 50, rotary.value()
+    # After a pause it starts over
+    clock.advance(500_000)
+    count += 1
+    rotary._update(count)
+    assert rotary.value() == 242, rotary.value()
+
+
+def to_300(**kwargs):
+    controller = fresh(**kwargs)
+    phase = Hand().phase
+    detents = 0
+    while controller.display1["value"] < 300:
+        hand = Hand()
+        hand.phase = phase
+        hand.pause(300).flick()
+        phase = hand.phase
+        replay(hand.edges)
+        detents += 13
+    return detents, controller.calls, controller.display1["value"]
+
+
+if __name__ == "__main__":
+    check_curve()
+    check_settings()
+    check_pio()
+    plain = to_300(acceleration=False)
+    fast = to_300()
+    print("0 to 300 s on display1 in flicks of 13 detents:")
+    print("  without acceleration: {} detents, {} rotary_event calls".format(*plain[:2]))
+    print("  with acceleration:    {} detents, {} rotary_event calls".format(*fast[:2]))
+    assert fast[1] * 5 <= plain[1]
+    if len(sys.argv) > 1:
+        controller = fresh()
+        replay(read_edges(sys.argv[1]))
+        print("{}: display1 at {}, {} rotary_event calls".format(sys.argv[1], controller.display1["value"],
+                                                                controller.calls))
+    print("OK")
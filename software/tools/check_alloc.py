@@ -0,0 +1,621 @@
+# Audit the IRQ and timer paths for heap allocations
+#
+#   python3 tools/check_alloc.py
+#
+# Runs every callback the board calls from a pin IRQ, a hard IRQ or a
+# machine.Timer through hosthal under tracemalloc and a per-opcode trace, and
+# fails when one of them allocates. On the board such an allocation is garbage
+# that a collection has to clear, and a collection in the middle of a step
+# pulse or exposure deadline is what boardsupport/memory.py keeps out of them.
+#
+# CPython allocates where MicroPython does not, so the audit reads allocations
+# per bytecode instruction of the boardsupport code and lets through:
+#   - one boxed int of 28 bytes, an int below 2**30 is a small int on the
+#     board (larger ints are bignums there too and do count)
+#   - the range object and iterator of a for loop, the board's for loops
+#     keep their iterator on the stack
+#   - whatever the hosthal stand-ins for machine, time and micropython do,
+#     they are C on the board
+# Everything else - tuples, dicts, strings, floats, closures, bound methods,
+# new attributes - is reported with the file, line and instruction. A few
+# samples first make sure the audit sees each kind of allocation.
+
+import dis
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from hosthal import machine, micropython, rp2
+from machine import Pin
+from boardsupport.bus import BusNode
+from boardsupport.core1 import Core1, ExposureProxy, MotionProxy
+from boardsupport.eventqueue import EventQueue
+from boardsupport.exposure import ExposureScheduler
+from boardsupport.motion import AgitationMotion
+from boardsupport.frankenstein_controller import FrankensteinRotaryController, _BUTTON_PINS, _ROTARY_PINS
+from boardsupport.telemetry import Telemetry
+from boardsupport.trace import EdgeTrace
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+# Traced calls per path, after as many to warm CPython's caches up
+CALLS = 200
+WARMUP = 32
+# Builtins CPython hands their arguments in a tuple, the board on the stack
+_VARARGS = (min, max)
+# Instructions that make a new object on the board too; CPython takes
+# tuples, lists and dicts from free lists tracemalloc does not see
+_BUILDS = frozenset((
+    "BUILD_TUPLE", "BUILD_LIST", "BUILD_SET", "BUILD_MAP", "BUILD_CONST_KEY_MAP", "BUILD_SLICE",
+    "BUILD_STRING", "FORMAT_VALUE", "MAKE_FUNCTION", "LIST_APPEND", "LIST_EXTEND", "SET_ADD",
+    "MAP_ADD", "DICT_UPDATE", "DICT_MERGE", "CALL_FUNCTION_EX",
+))
+# An int below 2**30 takes 28 bytes, or 32 from CPython's fast path for one digit
+_SMALL_INT = (sys.getsizeof(1), sys.getsizeof(1) + 4)
+_SMALL_MIN = -(1 << 30)
+_SMALL_MAX = (1 << 30) - 1
+_HOST = (
+    os.path.dirname(os.path.abspath(hosthal.__file__)),
+    os.path.dirname(os.path.abspath(__file__)),
+)
+
+
+def _host(code):
+    return os.path.abspath(code.co_filename).startswith(_HOST)
+
+
+def _boxed(value):
+    # A float, or an int the board keeps as a bignum
+    if isinstance(value, float):
+        return "a float"
+    if isinstance(value, int) and not _SMALL_MIN <= value <= _SMALL_MAX:
+        return "an int beyond 2**30"
+    return None
+
+
+class _Code:
+    # What the audit needs to know about the instructions of one code object
+    def __init__(self, code):
+        instructions = list(dis.get_instructions(code))
+        self.names = {ins.offset: ins.opname for ins in instructions}
+        self.builds = set(ins.offset for ins in instructions if ins.opname in _BUILDS)
+        # Where a value is stored: offset -> local name, or (object's local name, attribute)
+        self.stores = {}
+        # The GET_ITER of every for loop, and the call of range() right before one
+        self.loops = set()
+        for i, ins in enumerate(instructions):
+            if ins.opname == "STORE_FAST":
+                self.stores[ins.offset] = ins.argval
+            elif ins.opname == "STORE_ATTR" and i and instructions[i - 1].opname in ("LOAD_FAST", "LOAD_DEREF"):
+                self.stores[ins.offset] = (instructions[i - 1].argval, ins.argval)
+            if ins.opname != "GET_ITER" or i + 1 >= len(instructions) or instructions[i + 1].opname != "FOR_ITER":
+                continue
+            self.loops.add(ins.offset)
+            calls = []
+            j = i - 1
+            while j >= 0 and instructions[j].opname in ("CALL", "PRECALL"):
+                calls.append(instructions[j].offset)
+                j -= 1
+            loads = [x for x in instructions[:j + 1] if x.opname in ("LOAD_GLOBAL", "LOAD_NAME")]
+            if calls and any(x.argval == "range" for x in loads[-3:]):
+                self.loops.update(calls)
+
+
+class Audit:
+    # Growth of the traced heap is read at every event of the trace and
+    # profile hooks and put down to the instruction that ran since, the hooks
+    # start the count over as the last thing they do. Nothing in them makes
+    # a tuple of two that the code's own could take the place of.
+    def __init__(self):
+        self.findings = {}
+        self._codes = {}
+        self._mark = [0]
+        self._code = None
+        self._offset = 0
+        # Returned to sys.settrace as they are, a fresh bound method would be counted
+        self._trace_cb = self._trace
+        self._host_cb = self._host_trace
+
+    def _find(self, code, offset, message):
+        key = (code, offset)
+        if key not in self.findings:
+            self.findings[key] = message
+
+    def _grown(self, peak):
+        grown = peak - self._mark[0]
+        code = self._code
+        if code is None or grown <= 0 or grown in _SMALL_INT:
+            return
+        if self._offset not in self._info(code).loops:
+            self._find(code, self._offset, "{} bytes".format(grown))
+
+    def _info(self, code):
+        info = self._codes.get(code)
+        if info is None:
+            info = self._codes[code] = _Code(code)
+        return info
+
+    def _check(self, frame):
+        # The instruction that just ran in this frame
+        code = self._code
+        offset = self._offset
+        info = self._info(code)
+        if offset in info.builds:
+            self._find(code, offset, "builds an object")
+        target = info.stores.get(offset)
+        if target is None:
+            return
+        if isinstance(target, str):
+            value = frame.f_locals.get(target)
+        else:
+            obj = frame.f_locals.get(target[0])
+            value = getattr(obj, "__dict__", {}).get(target[1])
+        boxed = _boxed(value)
+        if boxed:
+            self._find(code, offset, "stores " + boxed)
+
+    def _rebase(self):
+        # The mark is read before the tuple it comes in, the peak starts over
+        # from it; a first read leaves that tuple on the free list
+        tracemalloc.get_traced_memory()
+        self._mark[0] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def _trace(self, frame, event, arg):
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._code is not None:
+            self._grown(peak)
+            self._check(frame)
+        if event == "opcode":
+            self._code = frame.f_code
+            self._offset = frame.f_lasti
+        else:
+            if event == "return" and _boxed(arg):
+                self._find(frame.f_code, frame.f_lasti, "returns " + _boxed(arg))
+            self._code = None
+        del peak
+        self._rebase()
+        return self._trace_cb
+
+    def _host_trace(self, frame, event, arg):
+        # A stand-in for C code, only where it returns matters
+        if event == "return":
+            self._code = None
+            self._rebase()
+        return self._host_cb
+
+    def _call(self, frame, event, arg):
+        if event != "call":
+            return None
+        frame.f_trace_lines = False
+        self._code = None
+        if _host(frame.f_code):
+            self._rebase()
+            return self._host_cb
+        # The frame object is the trace's, the code is counted from here on
+        frame.f_trace_opcodes = True
+        self._rebase()
+        return self._trace_cb
+
+    def _profile(self, frame, event, arg):
+        # Calls of builtins split the instruction that makes them
+        if event == "call" or event == "return":
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._code is not None and (event == "c_call" or arg not in _VARARGS):
+            # A min() or max() returns one of its arguments
+            self._grown(peak)
+        del peak
+        self._rebase()
+
+    def run(self, run, calls=CALLS):
+        # Lazy setup on a first call is not the hot path
+        run(0)
+        tracemalloc.start()
+        try:
+            for n in range(1, WARMUP + calls):
+                if n == WARMUP:
+                    self.findings.clear()
+                # Floats, tuples, lists and dicts come from free lists once
+                # there are some, out of tracemalloc's sight; a full
+                # collection empties them
+                gc.collect()
+                sys.setprofile(self._profile)
+                sys.settrace(self._call)
+                try:
+                    run(n)
+                finally:
+                    sys.settrace(None)
+                    sys.setprofile(None)
+        finally:
+            tracemalloc.stop()
+
+    def report(self):
+        lines = []
+        for (code, offset), message in sorted(self.findings.items(), key=lambda x: (x[0][0].co_filename, x[0][1])):
+            line = None
+            for o, l in dis.findlinestarts(code):
+                if o <= offset:
+                    line = l
+            lines.append("{}:{} {} {}: {}".format(
+                os.path.relpath(code.co_filename), line, code.co_name, self._info(code).names[offset], message))
+        return lines
+
+
+def _untraced(func, *args):
+    # Setup a path needs on the way that is not part of it
+    trace, profile = sys.gettrace(), sys.getprofile()
+    sys.settrace(None)
+    sys.setprofile(None)
+    try:
+        return func(*args)
+    finally:
+        sys.setprofile(profile)
+        sys.settrace(trace)
+
+
+def _set_level(pin, level):
+    machine._levels[pin] = level
+
+
+def _wake():
+    pass
+
+
+def _controller(**kwargs):
+    for clk, dt in _ROTARY_PINS:
+        _set_level(clk, 1)
+        _set_level(dt, 1)
+    for pin in _BUTTON_PINS:
+        _set_level(pin, 0)
+    controller = FrankensteinRotaryController(timers=False, **kwargs)
+    controller.reset()
+    # As under the runtime, the input task drains the queue
+    controller.events.notify(_wake)
+    return controller
+
+
+def _render(controller):
+    display = controller.display1
+    display["blink"] = True
+    controller.display2["point"] = 1
+
+    def run(n):
+        display["value"] = n % 1000
+        controller.display2["value"] = n * 7 % 1000
+        controller.button3_led["blink"] = bool(n & 8)
+        clock.advance_ms(300)
+        controller.render_full_display(None)
+    return run
+
+
+def _render_dimming(controller):
+    run = _render(controller)
+
+    def dimmed(n):
+        controller.display3["blink"] = bool(n & 16)
+        run(n)
+    return dimmed
+
+
+def _rotary_pins(controller):
+    rotary = controller.rotary_2
+    clk, dt = _ROTARY_PINS[1]
+    rotary.set(value=500)
+
+    def run(n):
+        # Up one full detent, down the next, fast and slow for the acceleration
+        level = GRAY[n & 3] if n & 4 else GRAY[3 - (n & 3)]
+        _set_level(clk, level[0])
+        _set_level(dt, level[1])
+        clock.advance(1000 if n & 32 else 40_000)
+        rotary._process_rotary_pins(None)
+    return run
+
+
+def _quadrature_bank(controller):
+    bank = controller.encoder_bank
+    clk, dt = _ROTARY_PINS[0]
+
+    def run(n):
+        for _ in range(3):
+            level = GRAY[n & 3] if n & 16 else GRAY[3 - (n & 3)]
+            machine.drive(clk, level[0])
+            machine.drive(dt, level[1])
+            rp2.run(20)
+            n += 1
+        clock.advance(20_000)
+        bank.poll()
+    return run
+
+
+def _bank_scan(controller):
+    bank = controller.buttons
+    controller.events.handler = lambda source, delta, ticks: None
+    pin = _BUTTON_PINS[4]
+    long_pin = _BUTTON_PINS[2]
+
+    def run(n):
+        # A press every 64 scans with a bounce on the way down, a long one every 512
+        phase = n & 63
+        _set_level(pin, 1 if 1 <= phase < 30 and phase != 3 else 0)
+        _set_level(long_pin, 1 if n & 511 < 300 else 0)
+        clock.advance(5000)
+        bank.scan()
+        if phase == 63:
+            controller.events.drain()
+    return run
+
+
+def _event_post(controller):
+    events = EventQueue(lambda source, delta, ticks: None, size=64)
+    events.notify(lambda: None)
+
+    def run(n):
+        events.post_delta(n & 3, 1 if n & 1 else -1)
+        events.post(5 + (n & 3))
+        if n & 15 == 15:
+            events.drain()
+    return run
+
+
+def _motion_tick(controller):
+    motion = controller.motion
+    motion.configure(reversal_dwell_ms=1, cycle_dwell_ms=1)
+    motion.start()
+
+    def run(n):
+        motion._tick(None)
+    return run
+
+
+class _Lamp:
+    def __init__(self):
+        self.lit = False
+
+    def on(self):
+        self.lit = True
+
+    def off(self):
+        self.lit = False
+
+
+def _exposure(controller):
+    # The guard spin reads the clock until the deadline
+    clock.read_cost_us = 1
+    scheduler = ExposureScheduler(_Lamp(), guard_us=500)
+    segments = (3000, 200_000, 1500)
+
+    def run(n):
+        if scheduler.state == 0:
+            scheduler.run(segments, at_us=clock.ticks_us() + 2000) if n & 1 else scheduler.run(segments)
+        elif scheduler.state == 1:
+            scheduler.start()
+        clock.advance(700)
+        scheduler._tick(None)
+    return run
+
+
+def _trace_record(controller):
+    trace = EdgeTrace(size=64)
+    trace.attach(controller)
+    trace.start()
+    clk, dt = _ROTARY_PINS[0]
+
+    def run(n):
+        if trace.full:
+            trace.start()
+        level = GRAY[n & 3]
+        machine.drive(clk, level[0])
+        machine.drive(dt, level[1])
+        machine.drive(_BUTTON_PINS[1], n >> 4 & 1)
+        micropython.run_scheduled()
+    return run
+
+
+def _bus_idle(controller):
+    class Port:
+        IRQ_RXIDLE = 64
+
+        def __init__(self):
+            self.pending = 0
+
+        def irq(self, handler, trigger):
+            self.handler = handler
+
+        def any(self):
+            return self.pending
+
+        def write(self, buf):
+            return len(buf)
+
+        def readinto(self, buf):
+            return None
+
+    port = Port()
+    node = BusNode(port, 2)
+
+    def run(n):
+        port.pending = n & 15
+        clock.advance(300)
+        port.handler(port)
+    return run
+
+
+def _telemetry(controller):
+    telemetry = Telemetry()
+    telemetry.attach(controller)
+    rotary = controller.rotary_1
+    clk, dt = _ROTARY_PINS[0]
+    motion = controller.motion
+    motion.start()
+
+    def run(n):
+        level = GRAY[n & 3]
+        _set_level(clk, level[0])
+        _set_level(dt, level[1])
+        rotary._process_rotary_pins(None)
+        controller.events.post_delta(0, 1)
+        motion._tick(None)
+        controller.render_full_display(None)
+    return run
+
+
+def _dmx_lamp(controller):
+    lamp = controller.lamp
+
+    def run(n):
+        lamp.set_level(n * 97 & 0xFFFF)
+        if n & 1:
+            lamp.on()
+        else:
+            lamp.off()
+    return run
+
+
+def _core1(controller):
+    clock.read_cost_us = 1
+    motion = AgitationMotion(Pin(9, Pin.OUT), Pin(10, Pin.OUT), Pin(8, Pin.OUT))
+    motion.configure(reversal_dwell_ms=1, cycle_dwell_ms=1)
+    core1 = Core1(motion, ExposureScheduler(_Lamp()))
+    motion_proxy = MotionProxy(core1)
+    exposure_proxy = ExposureProxy(core1)
+    motion_proxy.start()
+    core1.poll()
+
+    def run(n):
+        if n & 31 == 1:
+            # The command comes from core 0's event handlers
+            _untraced(exposure_proxy.expose, 3000)
+        clock.advance(150)
+        core1.poll()
+    return run
+
+
+def _countdowns(controller):
+    controller.display1["value"] = 999
+    controller.button_event("rotary_1_button")
+    controller.events.drain()
+
+    def run(n):
+        clock.advance_ms(100)
+        controller.update()
+    return run
+
+
+PATHS = (
+    ("render_full_display", _render, {}),
+    ("render_full_display (dimming)", _render_dimming, {"pio_refresh": True, "dimming": {"rate": 1000, "bits": 5}}),
+    ("_process_rotary_pins", _rotary_pins, {}),
+    ("QuadratureBank.poll", _quadrature_bank, {"encoder_backend": "pio"}),
+    ("BankDebouncer.scan", _bank_scan, {}),
+    ("EventQueue.post", _event_post, {}),
+    ("AgitationMotion._tick", _motion_tick, {}),
+    ("ExposureScheduler._tick", _exposure, {}),
+    ("EdgeTrace edges", _trace_record, {}),
+    ("BusNode RX idle", _bus_idle, {}),
+    ("Telemetry probes", _telemetry, {}),
+    ("DMXLamp on/off", _dmx_lamp, {"dmx_lamp": {"channel": 3, "fine": True}, "motion_backend": "none"}),
+    ("Core1.poll", _core1, {}),
+    ("countdowns and display", _countdowns, {}),
+)
+
+
+# The audit itself: each sample but the first allocates in its own way
+_SAMPLES = """
+class Thing:
+    def __init__(self):
+        self.x = 3
+        self.v = 1 << 20
+        self.buf = bytearray(4)
+
+    def m(self):
+        pass
+
+
+def none(t, n):
+    t.x = (t.x + n) & 0xFFFF
+    t.buf[n & 3] = t.x & 0xFF
+    return max(0, min(999, t.x))
+
+
+def flt(t, n):
+    return t.x * 1.5
+
+
+def tup(t, n):
+    return (t.x, n)
+
+
+def fstr(t, n):
+    return f"{n}"
+
+
+def bound(t, n):
+    return t.m
+
+
+def closure(t, n):
+    return lambda: n
+
+
+def big(t, n):
+    return t.v * t.v
+
+
+def lst(t, n):
+    return [n]
+
+
+def dct(t, n):
+    return {"a": n}
+
+
+def slc(t, n):
+    return t.buf[1:3]
+"""
+
+
+def self_check():
+    samples = {}
+    exec(compile(_SAMPLES, "<sample>", "exec"), samples)
+    thing = samples["Thing"]()
+    missed = []
+    for name in ("none", "flt", "tup", "fstr", "bound", "closure", "big", "lst", "dct", "slc"):
+        func = samples[name]
+        audit = Audit()
+        audit.run(lambda n: func(thing, n), calls=8)
+        if bool(audit.findings) != (name != "none"):
+            missed.append(name)
+    return missed
+
+
+def run_all():
+    failed = {}
+    for name, setup, kwargs in PATHS:
+        audit = Audit()
+        audit.run(setup(_controller(**kwargs)))
+        if audit.findings:
+            failed[name] = audit.report()
+    return failed
+
+
+if __name__ == "__main__":
+    missed = self_check()
+    if missed:
+        print("the audit gets these samples wrong: " + ", ".join(missed))
+        sys.exit(1)
+    failed = run_all()
+    for name, lines in failed.items():
+        print(name)
+        for line in lines:
+            print("  " + line)
+    if failed:
+        sys.exit(1)
+    print("{} paths, no allocations".format(len(PATHS)))
+    print("OK")
@@ -0,0 +1,239 @@
+# Validate the board table and the channel state off-device
+#
+#   python3 tools/check_board.py
+#
+# The Frankenstein table must give the pins, names and LED addresses the
+# controller was wired with, display1.. and button1_led.. must read and write
+# the state arrays like the dicts they replace, and a variant with a fifth
+# encoder and button must come up from its table alone: its display, encoder
+# and switch events and its LED, with the first four channels as before.
+# Boards with fewer and more channels, another range and another number of
+# timers must work through the control server and mirror over the bus, and
+# one without speed switches must ignore the speed it is sent.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from hosthal import machine, micropython
+from boardsupport.board import FRANKENSTEIN, Board
+from boardsupport.control import ControlServer
+from boardsupport.debounce import PRESS
+from boardsupport.frankenstein_controller import FrankensteinRotaryController, _display_key
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+VARIANT = Board(
+    encoders=FRANKENSTEIN.encoders + ((22, 28, 11),),
+    buttons=FRANKENSTEIN.buttons + ((9, 16),),
+)
+# One timer and the recipe, two digits
+SMALL = Board(encoders=FRANKENSTEIN.encoders[:2], buttons=FRANKENSTEIN.buttons, max_val=99)
+# Six channels, five of them timers; the pins leave the bus and the lamp alone
+WIDE = Board(encoders=FRANKENSTEIN.encoders + ((22, 12, 11), (2, 3, 10)), buttons=FRANKENSTEIN.buttons)
+# The encoders alone, no speed switches
+BARE = Board(encoders=FRANKENSTEIN.encoders, buttons=())
+
+
+def check_table():
+    board = FRANKENSTEIN
+    assert board.rotary_pins == ((6, 7), (26, 1), (19, 20), (16, 17))
+    assert board.switch_pins == (27, 13, 21, 18, 4, 5, 14, 15)
+    assert board.switch_names == ("rotary_1_button", "rotary_2_button", "rotary_3_button", "rotary_4_button",
+                                  "button1", "button2", "button3", "button4")
+    assert board.led_addresses == bytes((8, 4, 2, 1)) and board.led_bits == bytes((3, 2, 1, 0))
+    assert board.source_base == board.channels == 4 and board.timers == 3
+    assert VARIANT.timers == 4 and SMALL.timers == 1
+    for bad in ({"buttons": ((4, 3),)}, {"buttons": ((4, 1),) * 9}, {"timers": 4}, {"timers": -1}):
+        try:
+            Board(encoders=board.encoders, **{"buttons": board.buttons, **bad})
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(bad)
+    # Journal keys of the first four displays are those of before
+    assert [_display_key(i) for i in range(6)] == [1, 2, 3, 4, 6, 7]
+
+
+def _controller(board, **kwargs):
+    for clk, dt in board.rotary_pins:
+        machine.drive(clk, 1)
+        machine.drive(dt, 1)
+    for pin in board.switch_pins:
+        machine.drive(pin, 0)
+    controller = FrankensteinRotaryController(timers=False, acceleration=False, board=board, **kwargs)
+    controller.reset()
+    return controller
+
+
+def check_views():
+    controller = _controller(FRANKENSTEIN)
+    display = controller.display2
+    display["value"] = 42
+    display["point"] = 1
+    display["blink"] = True
+    assert controller.values[1] == 42 and controller.points[1] == 1 and controller.blinks[1] == 1
+    assert display["value"] == 42 and display["blink"] is True
+    assert controller._displays[1] is display and controller.rotary_2 is controller.rotaries[1]
+    led = controller.button3_led
+    led["blink"] = True
+    assert controller.led_blinks[2] == 1 and led["address"] == 2 and led["value"] is False
+    # button1 is lit for the low speed
+    assert controller.button1_led["value"] and controller.leds[0] == 1
+    for key in ("values", "address"):
+        try:
+            display[key]
+        except KeyError:
+            pass
+        else:
+            raise AssertionError(key)
+    assert repr(display) == "{'value': 42, 'blink': True, 'point': 1}"
+    controller.buttons.stop()
+
+
+def _press(controller, pin):
+    machine.drive(pin, 1)
+    clock.advance_ms(60)
+    machine.drive(pin, 0)
+    clock.advance_ms(60)
+    controller.events.drain()
+
+
+def _turn(controller, encoder, quarters):
+    clk, dt = controller.board.rotary_pins[encoder]
+    phase = 2
+    for _ in range(quarters):
+        phase = (phase + 1) % 4
+        machine.drive(clk, GRAY[phase][0])
+        machine.drive(dt, GRAY[phase][1])
+        clock.advance(5000)
+    micropython.run_scheduled()
+    controller.events.drain()
+
+
+def check_variant():
+    controller = _controller(VARIANT, motion_backend="none")
+    assert len(controller.framebuffer.buf) == 5 * 3 + 1 and len(controller._pulsing) == 10
+    assert controller.display5 is controller._displays[4] and controller.rotary_5 is controller.rotaries[4]
+    controller.buttons.start()
+    _turn(controller, 4, 8)
+    assert controller.values[4] == 4, list(controller.values)
+    _turn(controller, 0, 4)
+    assert controller.values[0] == 2 and controller.values[4] == 4
+    # The fifth encoder's switch selects the recipe, button5 has no action
+    _press(controller, 11)
+    _press(controller, 9)
+    assert controller.running == 0 and len(controller._countdowns) == 4
+    # The fourth one is a timer here
+    _press(controller, VARIANT.switch_pins[3])
+    assert controller.running == 4
+    _press(controller, VARIANT.switch_pins[3])
+    assert controller.running == 0
+    # Timer 1 from its switch, the other switches are busy meanwhile
+    _press(controller, VARIANT.switch_pins[0])
+    assert controller.running == 1 and controller._countdowns[0].running
+    _press(controller, VARIANT.switch_pins[1])
+    assert controller.running == 1
+    # button2 after the fifth encoder's switch
+    _press(controller, 5)
+    assert not controller.low_speed and controller.leds[1]
+    controller.button5_led["value"] = True
+    controller.update()
+    # Active low, button5's LED is bit 4
+    assert not controller.framebuffer.buf[0] & 16 and controller.framebuffer.buf[0] & 8
+    # By name as before, by index underneath
+    controller.button_event("rotary_1_button")
+    assert controller.running == 0
+    controller.switch_event(VARIANT.switch_names.index("button1"), PRESS)
+    assert controller.low_speed
+    controller.buttons.stop()
+
+
+def check_small():
+    controller = _controller(SMALL, motion_backend="none")
+    server = ControlServer(controller, "token")
+    assert len(controller._countdowns) == 1
+    assert server.handle("SET 3 5").startswith("ERR") and server.handle("SET 1 100").startswith("ERR")
+    assert server.handle("LATCH 2").startswith("ERR")
+    assert server.handle("SET 1 99") == "OK\n" and server.handle("SET 2 0") == "OK\n"
+    controller.rotary_event(1, 30)
+    assert controller.values[0] == 99
+    # Recipe 0 fills the one timer
+    assert server.handle("LOAD") == "OK\n" and list(controller.values) == [99, 0]
+    controller.values[0] = 20
+    assert server.handle("LATCH 1") == "OK\n" and controller.running == 1
+    clock.advance_ms(2000)
+    controller.update()
+    assert server.handle("GET") == "S 0 18 0 1 1 0\nOK\n"
+    from control_client import parse_state
+    assert parse_state("S 0 18 0 1 1 0") == {
+        "seq": 0, "display1": 18, "display2": 0, "running": 1, "low_speed": 1, "exposing": 0}
+    controller.buttons.stop()
+
+
+def check_wide_bus():
+    # Installs its own virtual clock
+    import bus_sim
+
+    sim = bus_sim.Simulation(3, seed=7, board=WIDE)
+    sim.run(2_000_000)
+    master = sim.master.controller
+    node = sim.nodes[1].controller
+    assert len(master._countdowns) == 5
+    master.rotary_event(6, 42)
+    master.rotary_event(5, 90)
+    sim.run(50_000)
+    for n in sim.nodes[1:]:
+        assert list(n.controller.values) == [0, 0, 0, 0, 90, 42], list(n.controller.values)
+    # Timer 5 on the node keeps its time against the master's edit
+    node.button_event("rotary_5_button")
+    master.rotary_event(5, 10)
+    master.rotary_event(1, 7)
+    sim.run(50_000)
+    assert node.values[4] == 90 and node.values[0] == 7 and sim.nodes[2].controller.values[4] == 100
+    # More displays than a SETTINGS frame holds
+    eight = Board(encoders=WIDE.encoders + ((28, 12, 11),) * 2, buttons=())
+    try:
+        bus_sim.Node(sim.bus, 9, 0, 0, sim.rng, board=eight)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("eight displays on the bus")
+
+
+def check_bare_bus():
+    import bus_sim
+
+    sim = bus_sim.Simulation(3, seed=7, board=BARE)
+    sim.run(2_000_000)
+    master = sim.master.controller
+    server = ControlServer(master, "token")
+    assert server.handle("SPEED HIGH") == "ERR no speed switch\n" and master.low_speed
+    # A speed change mirrored to nodes without the switches is left alone
+    master.low_speed = False
+    master.rotary_event(1, 7)
+    sim.run(50_000)
+    for n in sim.nodes[1:]:
+        assert n.controller.values[0] == 7 and n.controller.low_speed
+    # With them it is pressed by index, the high-speed switch on WIDE
+    sim = bus_sim.Simulation(2, seed=7, board=WIDE)
+    sim.run(2_000_000)
+    sim.master.controller.switch_event(WIDE.channels + 1, PRESS)
+    sim.run(50_000)
+    assert not sim.nodes[1].controller.low_speed and sim.nodes[1].controller.leds[1]
+
+
+if __name__ == "__main__":
+    check_table()
+    check_views()
+    check_variant()
+    check_small()
+    check_wide_bus()
+    check_bare_bus()
+    print("OK")
@@ -0,0 +1,68 @@
+# Check what a default boot loads and the boot time log
+#
+#   python3 tools/check_boot.py
+#
+# A controller with the IRQ encoders, the STEP/DIR stepper and no lamp must
+# not import the PIO encoder, TMC5160 or DMX modules, nor the recipe fetcher's
+# network code. boottime.save() must keep its log bounded.
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from boardsupport import boottime
+
+LAZY = ("boardsupport.rotary_pio_rp2", "boardsupport.tmc5160", "boardsupport.dmx", "boardsupport.recipes")
+
+
+def check_lazy_imports():
+    from boardsupport.frankenstein_controller import FrankensteinRotaryController
+    from boardsupport.journal import Journal
+    from boardsupport.runtime import Runtime
+
+    with tempfile.TemporaryDirectory() as directory:
+        controller = FrankensteinRotaryController(timers=False, journal=Journal(os.path.join(directory, "state")))
+        controller.reset()
+        controller.update()
+        Runtime(controller, stats_period_s=0)
+    loaded = [name for name in LAZY if name in sys.modules]
+    assert not loaded, loaded
+    FrankensteinRotaryController(timers=False, motion_backend="tmc5160")
+    assert "boardsupport.tmc5160" in sys.modules
+
+
+def check_log():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "boottimes.log")
+        for boot in range(300):
+            del boottime.marks()[:]
+            clock.now = 0
+            for phase in ("firmware", "imports", "config", "display", "runtime"):
+                clock.advance_ms(40 + boot % 7)
+                boottime.mark(phase)
+            boottime.save("v{}".format(boot), path=path, max_bytes=2048)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert os.path.getsize(path) < 2048
+        assert lines[-1].startswith("v299 total=")
+        assert all(line.split()[0].startswith("v") for line in lines)
+        numbers = [int(line.split()[0][1:]) for line in lines]
+        assert numbers == list(range(numbers[0], 300)), numbers
+        return boottime.summary(), len(lines)
+
+
+def main():
+    check_lazy_imports()
+    summary, kept = check_log()
+    print("boot: " + summary)
+    print("boottimes.log keeps the last {} boots".format(kept))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
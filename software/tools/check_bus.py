@@ -0,0 +1,212 @@
+# Validate the RS485 bus protocol off-device
+#
+#   python3 tools/check_bus.py
+#
+# Checks the CRC against binascii's CRC-16/CCITT, that the receiver drops a
+# corrupted frame and finds the next one after line noise, and that
+# ExposureScheduler.run(at_us=) turns the lamp on at the deadline. Then runs
+# bus_sim.py's four controllers: the settings of the master show up on every
+# node, but not its countdowns, nor over a node's own running countdown; PING
+# gets a STATUS back, a START_AT before the clocks are synchronized
+# is ignored, an exposure out of range is refused by the master and by the
+# nodes without ending their poll(), and after that the lamps of all nodes come on within 1 ms of
+# each other with and without the RX idle interrupt.
+
+import binascii
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bus_sim
+
+clock = bus_sim.clock
+# The lamp spins on the clock, reading it has to take time
+clock.read_cost_us = 1
+
+from boardsupport import bus as rs485
+from boardsupport.bus import BusNode, BROADCAST, MASTER
+from boardsupport.exposure import ExposureScheduler, ARMED, EXPOSING, IDLE
+
+
+class Capture:
+    # A port whose writes pile up and get read back
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, buf):
+        self.data += bytes(buf)
+        return len(buf)
+
+    def flush(self):
+        pass
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.data))
+        buf[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n or None
+
+
+def check_crc():
+    rng = random.Random(3)
+    for n in (0, 1, 5, 12, 23):
+        data = bytes(rng.randrange(256) for _ in range(n))
+        assert rs485.crc16(data, n) == binascii.crc_hqx(data, 0xFFFF), data
+    assert rs485.crc16(b"123456789", 9) == 0x29B1
+
+
+def check_framing():
+    port = Capture()
+    sender = BusNode(port, 3)
+    receiver = BusNode(Capture(), MASTER)
+    sender.ping(MASTER)
+    good = bytes(port.data)
+    assert good[0] == 0x7E and good[1] == MASTER and good[2] == 3 and good[3] == rs485.PING
+    bad = bytearray(good)
+    bad[3] ^= 0x10
+    # Noise with a stray sync byte and a payload length no frame has
+    receiver.port.data = bytearray(b"\x00\x7e\x01\x02\x03\xff\x55") + good + bad + good
+    sent = receiver.frames_sent
+    receiver.poll()
+    assert receiver.frames_received == 2 and receiver.crc_errors == 1, (
+        receiver.frames_received, receiver.crc_errors)
+    # Two STATUS answers to node 3, then the first beacon
+    data = receiver.port.data
+    assert receiver.frames_sent == sent + 3
+    assert data[1] == 3 and data[3] == rs485.STATUS and data[-rs485._BEACON_FRAME + 3] == rs485.BEACON
+    try:
+        BusNode(Capture(), BROADCAST)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("accepted the broadcast address")
+
+
+def check_run_at():
+    lamp = bus_sim.Lamp()
+    scheduler = ExposureScheduler(lamp)
+    at = clock.ticks_us() + 50_000
+    scheduler.run((20_000,), at_us=at)
+    assert scheduler.state == ARMED and not lamp.on_at
+    # The guard spin starts a little before
+    clock.advance(45_000)
+    assert not lamp.on_at
+    clock.advance(6_000)
+    assert scheduler.state == EXPOSING and len(lamp.on_at) == 1
+    assert 0 <= lamp.on_at[0] - at < 20 and 0 <= scheduler.start_error_us < 20, scheduler.start_error_us
+    clock.advance(25_000)
+    assert scheduler.state == IDLE and scheduler.exposures == 1
+    # Cancelled before the deadline, the lamp never comes on
+    scheduler.run((20_000,), at_us=clock.ticks_us() + 10_000)
+    scheduler.cancel()
+    clock.advance(40_000)
+    assert len(lamp.on_at) == 1 and scheduler.state == IDLE
+
+
+def _tick(sim, seconds):
+    for _ in range(seconds * 10):
+        sim.run(100_000)
+        for node in sim.nodes:
+            node.controller.update()
+
+
+def check_countdowns(sim):
+    master = sim.master.controller
+    node = sim.nodes[1].controller
+    others = [n.controller for n in sim.nodes[2:]]
+    master.rotary_event(2, 60)
+    sim.run(50_000)
+    display1 = master.values[0]
+    # The node runs timer 2, the master timer 1
+    node.button_event("rotary_2_button")
+    master.button_event("rotary_1_button")
+    bus = sim.master.bus
+    sent = []
+    bus.send_settings = lambda: sent.append(1) or BusNode.send_settings(bus)
+    _tick(sim, 3)
+    assert master.values[0] == display1 - 3 and node.values[1] == master.values[1] - 3
+    assert not sent
+    # An edit reaches the nodes, only not the running countdown of one
+    master.rotary_event(2, 40)
+    _tick(sim, 1)
+    assert len(sent) == 1 and node.values[1] == master.values[1] - 40 - 4
+    for c in others:
+        assert c.values[1] == master.values[1] and c.values[0] == display1
+    # Nor does the time the master's timer is paused at
+    master.button_event("rotary_1_button")
+    node.button_event("rotary_2_button")
+    _tick(sim, 1)
+    assert master.running == 0 and master.values[0] == display1 - 4
+    for c in [node] + others:
+        assert c.values[0] == display1
+    del bus.send_settings
+
+
+def check_bad_start(sim):
+    master = sim.master.bus
+    sent = master.frames_sent
+    try:
+        master.start_at(100, 0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("started an empty exposure")
+    assert master.frames_sent == sent
+    # The same from a master that does not check, the nodes log and go on
+    starts = [node.bus.starts for node in sim.nodes]
+    bus_us = time.ticks_add(master.bus_time(), 100_000)
+    master._send(BROADCAST, rs485.START_AT, "<II", bus_us, 0)
+    sim.run(50_000)
+    assert [node.bus.starts for node in sim.nodes] == starts
+    assert all(node.bus.frames_received for node in sim.nodes[1:])
+
+
+def check_simulation(idle_irq):
+    sim = bus_sim.Simulation(4, seed=5, idle_irq=idle_irq)
+    # Nobody is synchronized before the first beacons
+    sim.master.bus.start_at(50, 10_000)
+    sim.run(200_000)
+    assert all(not node.lamp.on_at for node in sim.nodes[1:])
+    assert len(sim.master.lamp.on_at) == 1
+    sim.run(2_000_000)
+    assert all(node.bus.synced for node in sim.nodes)
+    master = sim.master.controller
+    master.rotary_event(1, 25)
+    master.rotary_event(3, -5)
+    master.button_event("button1")
+    sim.run(50_000)
+    for node in sim.nodes[1:]:
+        c = node.controller
+        for display, mirrored in zip(master._displays, c._displays):
+            assert display["value"] == mirrored["value"], (node.bus.address, display, mirrored)
+        assert c.low_speed == master.low_speed
+    check_countdowns(sim)
+    trips, pings, _, _ = sim.round_trips(200_000)
+    assert trips and len(trips) * 2 >= pings, (len(trips), pings)
+    for node in sim.nodes[1:]:
+        address = node.bus.address
+        sim.master.bus.nodes.pop(address, None)
+        sim.master.bus.ping(address)
+        assert sim.run(50_000, lambda: address in sim.master.bus.nodes)
+        synced, offset, exposures, state = sim.master.bus.nodes[address]
+        assert synced == 1 and offset == node.bus.offset_us and exposures == 0
+    skews = sorted(sim.skews(10))
+    assert skews[-1] < 1000, skews
+    assert sum(node.bus.crc_errors for node in sim.nodes) == 0 and sim.bus.collisions == 0
+    check_bad_start(sim)
+    return skews
+
+
+if __name__ == "__main__":
+    check_crc()
+    check_framing()
+    check_run_at()
+    for idle_irq in (True, False):
+        skews = check_simulation(idle_irq)
+        print("lamp skew {}: p50 {} us, max {} us".format(
+            "with the RX idle interrupt" if idle_irq else "from poll()", skews[len(skews) // 2], skews[-1]))
+    print("OK")
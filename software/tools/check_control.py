@@ -0,0 +1,188 @@
+# Load test for the network control service
+#
+#   python3 tools/check_control.py [clients...]
+#
+# Runs the controller and its runtime on the host with a ControlServer on a
+# local port, then connects 1, 10 and 50 clients (or the given counts) that
+# each send a stream of commands, and reports command latency and loop lag.
+# Also checks that a change made by one client is pushed to all of them, that
+# bad commands are refused, that SET takes the exposure time in tenths in the
+# exposure mode, that a command failing unexpectedly answers ERR, and that
+# clients without the token and those beyond max_clients, pending ones
+# included, are turned away.
+
+import asyncio
+import os
+import random
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from boardsupport.control import ControlServer
+from boardsupport.debounce import LONG_PRESS
+from boardsupport.exposure import ExposureScheduler
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+from boardsupport.runtime import Runtime
+from control_client import ControlClient
+
+COMMANDS_PER_CLIENT = 50
+
+
+class _Lamp:
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+TOKEN = "darkroom"
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+async def worker(client, rng, latencies):
+    for _ in range(COMMANDS_PER_CLIENT):
+        command = rng.choice(("GET", "SET 4 {}".format(rng.randint(0, 999)), "SPEED LOW", "SPEED HIGH"))
+        t0 = time.perf_counter()
+        reply = await client.command(command)
+        latencies.append((time.perf_counter() - t0) * 1e6)
+        assert reply == "OK", (command, reply)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def load(server, count, rng):
+    clients = [await ControlClient().connect("127.0.0.1", server.port, TOKEN) for _ in range(count)]
+    latencies = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(client, random.Random(rng.random()), latencies) for client in clients))
+    elapsed = time.perf_counter() - t0
+
+    # One client's change reaches everybody
+    value = rng.randint(0, 999)
+    assert await clients[0].command("SET 2 {}".format(value)) == "OK"
+    for client in clients:
+        await client.wait_state(lambda s: s["display2"] == value)
+    for client in clients:
+        await client.close()
+    return latencies, elapsed
+
+
+async def functional(server, controller):
+    for token in ("", "darkroon", "darkroom2"):
+        try:
+            await ControlClient().connect("127.0.0.1", server.port, token)
+        except ConnectionError as e:
+            assert str(e) == "ERR auth", e
+        else:
+            raise AssertionError(token)
+    assert server.refused == 3 and not server.clients
+    try:
+        ControlServer(controller, "")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("no token")
+
+    client = await ControlClient().connect("127.0.0.1", server.port, TOKEN)
+    assert (await client.command("BOGUS")).startswith("ERR")
+    assert (await client.command("SET 5 1")).startswith("ERR")
+    assert (await client.command("SET 1 x")).startswith("ERR")
+    assert await client.command("EXPOSE 1000") == "ERR no lamp"
+    assert await client.command("STRIP") == "ERR no lamp"
+    # In exposure mode SET on display4 takes the time in tenths
+    controller.exposure = ExposureScheduler(_Lamp())
+    controller.switch_event(3, LONG_PRESS)
+    assert controller.exposure_mode
+    assert await client.command("SET 4 100") == "OK"
+    assert controller.exposure_us == 10_000_000 and controller.values[3] == 100
+    assert await client.command("SET 4 7") == "OK"
+    assert controller.exposure_us == 700_000 and controller.values[3] == 7
+    assert (await client.command("SET 4 0")).startswith("ERR")
+    assert (await client.command("SET 4 1000")).startswith("ERR")
+    assert controller.exposure_us == 700_000
+    controller.switch_event(3, LONG_PRESS)
+    controller.exposure = None
+    # Any failure of a command answers ERR and keeps the connection
+    recipes = controller.recipes
+    controller.recipes = object()
+    assert await client.command("SET 4 5") == "OK"
+    assert await client.command("LOAD") == "ERR internal"
+    controller.recipes = recipes
+    assert await client.command("SET 4 0") == "OK"
+    pushes = client.pushes
+    assert await client.command("GET") == "OK" and client.pushes == pushes + 1
+    assert await client.command("SET 1 90") == "OK"
+    assert await client.command("LATCH 1") == "OK"
+    await client.wait_state(lambda s: s["running"] == 1)
+    assert controller.running == 1
+    # Setting a running timer moves its deadline
+    assert await client.command("SET 1 200") == "OK"
+    await client.wait_state(lambda s: s["display1"] >= 199)
+    assert await client.command("LATCH 1") == "OK"
+    await client.wait_state(lambda s: s["running"] == 0)
+
+    server.max_clients = len(server.clients)
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    assert await reader.readline() == b"ERR busy\n"
+    writer.close()
+    # Connections that never authenticate count against the limit as well
+    server.max_clients = len(server.clients) + 1
+    _, silent = await asyncio.open_connection("127.0.0.1", server.port)
+    await asyncio.sleep(0.05)
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    assert await reader.readline() == b"ERR busy\n"
+    writer.close()
+    silent.close()
+    await asyncio.sleep(0.05)
+    assert server._pending == 0
+    server.max_clients = 100
+    await client.close()
+
+
+async def main(counts):
+    controller = FrankensteinRotaryController(timers=False)
+    server = ControlServer(controller, TOKEN, port=free_port(), max_clients=100)
+    runtime = Runtime(controller, stats_period_s=0, control=server)
+    tasks = runtime.create_tasks()
+    await asyncio.sleep(0.2)
+    rng = random.Random(16)
+    try:
+        await functional(server, controller)
+        print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+            "clients", "p50 us", "p99 us", "max us", "cmds/s", "loop lag max"))
+        for count in counts:
+            runtime.reset_stats()
+            latencies, elapsed = await load(server, count, rng)
+            print("{:>8} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f} {:>10} us".format(
+                count, percentile(latencies, 0.5), percentile(latencies, 0.99), max(latencies),
+                len(latencies) / elapsed, runtime.lag.max_us))
+        print("{} commands, {} errors, {} pushes".format(server.commands, server.errors, server.pushes))
+        # Three bad commands, EXPOSE and STRIP without a lamp, two exposure
+        # times out of range, the failed LOAD
+        assert server.errors == 8
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50]
+    asyncio.run(main(counts))
+    print("OK")
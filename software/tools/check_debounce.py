@@ -0,0 +1,100 @@
+# Exercise the bank debouncer off-device
+#
+#   python3 tools/check_debounce.py
+#
+# Feeds contact bounce, short and long presses through
+# boardsupport.debounce.BankDebouncer on hosthal and checks the PRESS,
+# RELEASE and LONG_PRESS events it queues. Also times one scan for 1, 8 and
+# 24 switches to show the cost does not grow with the bank.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from hosthal import machine, micropython
+from boardsupport.debounce import BankDebouncer, PRESS, RELEASE, LONG_PRESS
+from boardsupport.eventqueue import EventQueue
+
+PINS = (27, 13, 21, 18, 4, 5, 14, 15)
+PERIOD_MS = 5
+
+
+def make(pins=PINS, long_ms=800):
+    for pin in range(machine.NUM_GPIO):
+        machine.drive(pin, 0)
+    events = []
+    queue = EventQueue(lambda source, kind, ticks: events.append((source, kind)), size=64)
+    bank = BankDebouncer(pins, queue, period_ms=PERIOD_MS, long_ms=long_ms)
+    return bank, events
+
+
+def feed(bank, pin, levels):
+    # One level per scan
+    for level in levels:
+        machine.drive(pin, level)
+        bank.scan()
+    micropython.run_scheduled()
+
+
+def check_bounce():
+    bank, events = make()
+    # Chatter shorter than four scans never reaches the output
+    feed(bank, 4, [1, 0, 1, 0, 0, 1, 1, 0, 0, 0, 0, 0])
+    assert events == [], events
+    # Bounce on the way in, then a clean hold
+    feed(bank, 4, [1, 0, 1, 1, 0, 1, 1, 1, 1])
+    assert events == [(4, PRESS)], events
+    # Bounce on release
+    feed(bank, 4, [0, 1, 0, 0, 0, 0])
+    assert events == [(4, PRESS), (4, RELEASE)], events
+
+
+def check_long_press():
+    bank, events = make(long_ms=100)
+    feed(bank, 27, [1] * 4)
+    assert events == [(0, PRESS)]
+    hold = 100 // PERIOD_MS
+    feed(bank, 27, [1] * (hold - 1))
+    assert events == [(0, PRESS)], events
+    feed(bank, 27, [1])
+    assert events == [(0, PRESS), (0, LONG_PRESS)], events
+    # Only once per press, and the release still follows
+    feed(bank, 27, [1] * hold * 2 + [0] * 4)
+    assert events == [(0, PRESS), (0, LONG_PRESS), (0, RELEASE)], events
+
+
+def check_simultaneous():
+    bank, events = make()
+    for pin in PINS:
+        machine.drive(pin, 1)
+    for _ in range(4):
+        bank.scan()
+    micropython.run_scheduled()
+    assert sorted(events) == [(i, PRESS) for i in range(len(PINS))], events
+
+
+def scan_cost(pins, scans=20000):
+    bank, _ = make(pins)
+    start = time.perf_counter()
+    for _ in range(scans):
+        bank.scan()
+    return (time.perf_counter() - start) / scans * 1e6
+
+
+def main():
+    check_bounce()
+    check_long_press()
+    check_simultaneous()
+    print("timers: 1 for the bank (DebouncedSwitch used one per switch)")
+    for pins in (PINS[:1], PINS, tuple(range(24))):
+        print("scan with {:2} switches: {:.2f} µs (host)".format(len(pins), scan_cost(pins)))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
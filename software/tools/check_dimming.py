@@ -0,0 +1,193 @@
+# Validate the BCM display dimming off-device
+#
+#   python3 tools/check_dimming.py
+#
+# Runs boardsupport.refresh.BCMRefresh on the hosthal PIO/DMA emulator with
+# the 74HC595 chain model of check_refresh_pio.py and checks, over one full
+# BCM cycle of latched planes, that every segment and button LED is lit for
+# level / max_level of the cycle. Then runs fades and pulses on hosthal's
+# virtual clock, builds the controller with dimming and reports the CPU cost
+# of a rebuild and of animate() with every element pulsing; on the board the
+# runtime's "dimming" task statistics report the same.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from hosthal import rp2
+from check_refresh_pio import ShiftRegisterChain
+from boardsupport.framebuffer import FrameBuffer
+from boardsupport.refresh import BCMRefresh, bcm_order
+
+
+def duty(chain, slots):
+    # Fraction of the last full cycle each bit of the chain was high
+    frames = chain.latched[-slots:]
+    nbits = len(frames[0]) * 8
+    lit = [0] * nbits
+    for frame in frames:
+        value = int.from_bytes(frame, "big")
+        for bit in range(nbits):
+            if value >> bit & 1:
+                lit[bit] += 1
+    return lit, frames
+
+
+def check_order():
+    for bits in range(1, 8):
+        order = bcm_order(bits)
+        assert len(order) == (1 << bits) - 1
+        for k in range(bits):
+            assert list(order).count(k) == 1 << k
+    assert list(bcm_order(3)) == [2, 1, 2, 0, 2, 1, 2]
+
+
+def check_duty():
+    rp2.reset()
+    fb = FrameBuffer()
+    fb.set_display(0, 888)
+    fb.set_display(1, 888)
+    fb.set_display(2, 125, point=1)
+    fb.set_leds(0b1111)
+    fb.render()
+    chain = ShiftRegisterChain(len(fb.buf))
+    engine = BCMRefresh(fb.buf, rate=1000, bits=5)
+    chain.sm = engine._engine._sm
+    top = engine.max_level
+    slots = len(engine._order)
+    # Display 1 at three levels, display 2 off, one LED half, one off
+    for j, level in enumerate((top, 8, 1)):
+        engine.set_level(fb.digit_index(0, j), level)
+    for j in range(3):
+        engine.set_level(fb.digit_index(1, j), 0)
+    engine.set_level(engine.led(3), 16)
+    engine.set_level(engine.led(0), 0)
+    engine.show(fb.buf)
+    frame = engine._engine.cycles_per_frame
+    # Two whole cycles: the old ring finishes, the new one runs once
+    rp2.run(frame * slots * 2 + 50)
+    periods = [b - a for a, b in zip(chain.latch_cycles, chain.latch_cycles[1:])]
+    assert min(periods) == max(periods) == frame, periods
+    lit, frames = duty(chain, slots)
+    n = len(fb.buf)
+    for i in range(1, n):
+        level = engine.levels[i]
+        for bit in range(8):
+            expected = level if fb.buf[i] >> bit & 1 else 0
+            got = lit[(n - 1 - i) * 8 + bit]
+            assert got == expected, (i, bit, got, expected)
+    # The LED register is active low
+    for bit, level in ((0, 0), (1, top), (2, top), (3, 16)):
+        dark = slots - lit[(n - 1) * 8 + bit]
+        assert dark == level, (bit, dark, level)
+    engine.deinit()
+    return engine._engine, slots
+
+
+def check_effects():
+    rp2.reset()
+    fb = FrameBuffer()
+    engine = BCMRefresh(fb.buf, bits=4)
+    element = fb.digit_index(0, 0)
+    engine.fade(element, 5, 100)
+    engine.animate()
+    assert engine._shown[element] == 15
+    clock.advance(50_000)
+    engine.animate()
+    assert engine._shown[element] == 10, engine._shown[element]
+    clock.advance(60_000)
+    engine.animate()
+    assert engine._shown[element] == 5 and engine._effects == 0
+    # Pulse: dark half way through the period, back up at its end
+    engine.pulse(element, 1000)
+    clock.advance(1000_000 - clock.now % 1000_000)
+    engine.animate()
+    assert engine._shown[element] == 5
+    clock.advance(500_000)
+    engine.animate()
+    assert engine._shown[element] == 0
+    # A new level while pulsing keeps the pulse
+    engine.set_level(element, 15)
+    clock.advance(500_000)
+    engine.animate()
+    assert engine._shown[element] == 15 and engine._effects == 1
+    engine.pulse(element, 0)
+    assert engine._effects == 0
+    try:
+        engine.set_level(element, 16)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("accepted level 16 with 4 bits")
+    engine.deinit()
+
+
+def check_controller():
+    from boardsupport.frankenstein_controller import FrankensteinController
+
+    rp2.reset()
+    controller = FrankensteinController(timers=False, dimming={"rate": 1000, "bits": 5})
+    dimming = controller.dimming
+    assert dimming is not None and dimming.max_level == 31
+    fb = controller.framebuffer
+    controller.set_brightness(2, 4)
+    controller.set_brightness(1, 10, digit=2)
+    controller.set_led_brightness(1, 3)
+    controller.render_full_display(None)
+    assert dimming._shown[fb.digit_index(1, 0)] == 4
+    assert dimming._shown[fb.digit_index(0, 2)] == 10 and dimming._shown[fb.digit_index(0, 0)] == 31
+    assert dimming._shown[dimming.led(3)] == 3
+    # Blinking is a pulse, the framebuffer no longer blanks the digits
+    controller.display3["value"] = 42
+    controller.display3["blink"] = True
+    controller.button2_led["blink"] = True
+    controller.render_full_display(None)
+    assert controller._pulsing[2] and controller._pulsing[5] and dimming._effects == 4
+    assert not fb._blink[2]
+    controller.display3["blink"] = False
+    controller.button2_led["blink"] = False
+    controller.render_full_display(None)
+    assert dimming._effects == 0
+    assert FrankensteinController(timers=False).dimming is None
+    return controller
+
+
+def budget(controller):
+    dimming = controller.dimming
+    buf = controller.framebuffer.buf
+    count = 200
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        dimming.show(buf)
+    build_us = (time.perf_counter_ns() - start) / 1000 / count
+    for element in range(1, len(buf)):
+        dimming.pulse(element, 2000)
+    for bit in range(4):
+        dimming.pulse(dimming.led(bit), 2000)
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        clock.advance(20_000)
+        dimming.animate()
+    animate_us = (time.perf_counter_ns() - start) / 1000 / count
+    return build_us, animate_us
+
+
+if __name__ == "__main__":
+    check_order()
+    pio, slots = check_duty()
+    check_effects()
+    controller = check_controller()
+    build_us, animate_us = budget(controller)
+    print("{} planes in {} slots, {} cycles per slot: {:.0f} Hz BCM at {} Hz SM clock".format(
+        controller.dimming.bits, slots, pio.cycles_per_frame, pio._sm.freq / pio.cycles_per_frame / slots,
+        pio._sm.freq))
+    print("rebuild and show: {:.1f} us on the host".format(build_us))
+    print("animate, all 16 elements pulsing: {:.1f} us on the host, {:.2f}% of a core at 50 Hz".format(
+        animate_us, animate_us / 200))
+    print("OK")
@@ -0,0 +1,189 @@
+# Validate the DMX512 output off-device
+#
+#   python3 tools/check_dmx.py
+#
+# Runs boardsupport.dmx.DMXOutput on the hosthal PIO/DMA emulator (one cycle
+# is one µs at the 1 MHz state machine clock), records the TX line and
+# decodes it back into packets with DMXDecoder: break and mark-after-break
+# lengths, 250 kbaud 8N2 slots and the packet period. The decoder only needs
+# (time_us, level) edges, so captures from a logic analyser work as well.
+# A universe shorter than MIN_SLOTS, as the controller's one or two slot lamp
+# default makes, goes out padded to the 1204 µs DMX512 minimum.
+
+import os
+import sys
+from bisect import bisect_right
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from hosthal import machine, rp2
+from boardsupport.dmx import DMXOutput, DMXLamp, MIN_PACKET_US, MIN_SLOTS
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+
+TX = 8
+BIT_US = 4
+# Transmitter minimums from ANSI E1.11
+MIN_BREAK_US = 92
+MIN_MAB_US = 12
+
+
+class Packet:
+    def __init__(self, start, break_us, mab_us):
+        self.start = start
+        self.break_us = break_us
+        self.mab_us = mab_us
+        self.slots = bytearray()
+        self.framing_errors = 0
+
+
+class DMXDecoder:
+    def __init__(self, idle=1):
+        self.times = [0]
+        self.levels = [idle]
+
+    def edge(self, time_us, level):
+        if level != self.levels[-1]:
+            self.times.append(time_us)
+            self.levels.append(level)
+
+    def level(self, time_us):
+        return self.levels[bisect_right(self.times, time_us) - 1]
+
+    def _next_edge(self, i):
+        return self.times[i + 1] if i + 1 < len(self.times) else None
+
+    def decode(self, end_us):
+        # Edges are (time, new level). A low run of at least a break starts a
+        # packet, everything up to the next break is slots.
+        packets = []
+        packet = None
+        i = 1
+        while i < len(self.times):
+            t, level = self.times[i], self.levels[i]
+            nxt = self._next_edge(i)
+            if level == 0 and nxt is not None and nxt - t >= 88:
+                packet = Packet(t, nxt - t, None)
+                packets.append(packet)
+                i += 1
+                continue
+            if packet is not None and level == 1 and packet.mab_us is None:
+                packet.mab_us = (nxt if nxt is not None else end_us) - t
+                i += 1
+                continue
+            if packet is not None and level == 0:
+                # Start bit: sample mid-bit
+                if t + 11 * BIT_US > end_us:
+                    break
+                value = 0
+                for bit in range(8):
+                    value |= self.level(t + BIT_US * (bit + 1) + BIT_US // 2) << bit
+                if not (self.level(t + BIT_US * 9 + BIT_US // 2) and self.level(t + BIT_US * 10 + BIT_US // 2)):
+                    packet.framing_errors += 1
+                packet.slots.append(value)
+                # Continue with the first edge after this slot's stop bits
+                i = bisect_right(self.times, t + BIT_US * 11 - 1)
+                continue
+            i += 1
+        return packets
+
+
+def record(decoder, dmx_sm):
+    machine.watch(TX, lambda pin, level: decoder.edge(dmx_sm.cycles, level))
+
+
+def check_universe(slots, packets_wanted):
+    rp2.reset()
+    machine.unwatch()
+    dmx = DMXOutput(slots=slots)
+    decoder = DMXDecoder()
+    record(decoder, dmx._sm)
+    period = dmx.cycles_per_packet
+    assert period >= MIN_PACKET_US and dmx.slots == max(slots, MIN_SLOTS), (period, dmx.slots)
+
+    for ch in range(1, slots + 1):
+        dmx.set(ch, (ch * 7) & 0xFF)
+    dmx.commit()
+    expected_old = bytes(dmx.universe)
+    rp2.run(period * 2)
+
+    # Update mid-packet: every packet is either the old or the new universe
+    dmx.set(1, 0xAA)
+    dmx.set(slots, 0x55)
+    dmx.commit()
+    expected_new = bytes(dmx.universe)
+    rp2.run(period * packets_wanted)
+    end = dmx._sm.cycles
+
+    packets = [p for p in decoder.decode(end) if len(p.slots) == dmx.slots + 1]
+    assert len(packets) >= packets_wanted, len(packets)
+    seen_new = False
+    for p in packets:
+        assert p.framing_errors == 0
+        assert p.break_us >= MIN_BREAK_US, p.break_us
+        assert p.mab_us >= MIN_MAB_US, p.mab_us
+        assert p.slots[0] == 0, "start code"
+        frame = bytes(p.slots)
+        if frame == expected_new:
+            seen_new = True
+        else:
+            assert frame in (bytes(dmx.slots + 1), expected_old) and not seen_new, "torn or stale packet"
+    assert seen_new
+    periods = [b.start - a.start for a, b in zip(packets, packets[1:])]
+    assert min(periods) == max(periods) == period, periods
+    return dmx, packets, period
+
+
+def check_lamp():
+    rp2.reset()
+    machine.unwatch()
+    dmx = DMXOutput(slots=8)
+    decoder = DMXDecoder()
+    record(decoder, dmx._sm)
+    lamp = DMXLamp(dmx, 3, fine=True, level=0x1234)
+    lamp.on()
+    rp2.run(dmx.cycles_per_packet * 3)
+    lit = decoder.decode(dmx._sm.cycles)[-1].slots
+    assert lit[3] == 0x12 and lit[4] == 0x34, bytes(lit)
+    lamp.off()
+    rp2.run(dmx.cycles_per_packet * 3)
+    dark = decoder.decode(dmx._sm.cycles)[-1].slots
+    assert dark[3] == 0 and dark[4] == 0
+
+
+# The controller's default for a lamp on channel 1: one slot, padded
+def check_controller_lamp():
+    rp2.reset()
+    machine.unwatch()
+    controller = FrankensteinRotaryController(timers=False, motion_backend="none", dmx_lamp={"channel": 1})
+    dmx = controller.dmx
+    decoder = DMXDecoder()
+    record(decoder, dmx._sm)
+    controller.lamp.on()
+    rp2.run(dmx.cycles_per_packet * 4)
+    packets = decoder.decode(dmx._sm.cycles)[1:-1]
+    assert packets and all(len(p.slots) == MIN_SLOTS + 1 for p in packets)
+    assert packets[-1].slots[1] == 0xFF
+    periods = [b.start - a.start for a, b in zip(packets, packets[1:])]
+    assert min(periods) >= MIN_PACKET_US, periods
+
+
+def main():
+    dmx, packets, period = check_universe(512, 3)
+    p = packets[-1]
+    print("full universe: break {} µs, MAB {} µs, packet {} µs -> {:.2f} Hz, {} slots/s".format(
+        p.break_us, p.mab_us, period, dmx.rate, int(dmx.rate * 512)))
+    dmx, packets, period = check_universe(24, 20)
+    print("24 slots: packet {} µs -> {:.1f} Hz".format(period, dmx.rate))
+    dmx, packets, period = check_universe(1, 20)
+    print("1 slot, padded to {}: packet {} µs -> {:.1f} Hz".format(dmx.slots, period, dmx.rate))
+    check_controller_lamp()
+    check_lamp()
+    print("program: {} instructions".format(len(dmx._sm._words)))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
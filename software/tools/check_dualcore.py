@@ -0,0 +1,178 @@
+# Validate the core 1 engine off-device
+#
+#   python3 tools/check_dualcore.py
+#
+# Checks the mailbox ring and that each command keeps its own payload, then
+# runs the agitation move once on its timer and once polled by the Core1
+# engine on hosthal's virtual clock and checks that both produce the same
+# pulse train, and that an exposure through the ExposureProxy ends on its
+# deadline. Then builds the controller with
+# dual_core=True, with core 1 as a thread, drives it through its buttons and
+# finishes with a short run of stress_dualcore.py.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from machine import Pin
+from boardsupport.core1 import Core1, Mailbox, MotionProxy, ExposureProxy
+from boardsupport.exposure import ExposureScheduler, IDLE
+from boardsupport.motion import AgitationMotion
+from boardsupport.telemetry import Telemetry, STEP
+
+
+class Lamp:
+    def __init__(self):
+        self.lit = False
+        self.switched = []
+
+    def on(self):
+        self.lit = True
+        self.switched.append((time.ticks_us(), 1))
+
+    def off(self):
+        self.lit = False
+        self.switched.append((time.ticks_us(), 0))
+
+
+def check_mailbox():
+    mailbox = Mailbox(4)
+    assert mailbox.get() == -1
+    for i in range(4):
+        assert mailbox.put(i + 1, -i)
+    assert not mailbox.put(9) and len(mailbox) == 4
+    for i in range(4):
+        assert mailbox.get() == i + 1 and mailbox.arg == -i
+    assert mailbox.get() == -1
+    # Around the wrap of the positions many times
+    for i in range(100):
+        assert mailbox.put(i % 7, i)
+        if i & 1:
+            assert mailbox.get() == (i - 1) % 7 and mailbox.arg == i - 1
+            assert mailbox.get() == i % 7 and mailbox.arg == i
+    # Payloads ride in their entry and are let go once taken
+    first, second = (1, 2), (3,)
+    assert mailbox.put(4, 0, first) and mailbox.put(4, 0, second)
+    assert mailbox.get() == 4 and mailbox.payload is first
+    assert mailbox.get() == 4 and mailbox.payload is second
+    assert mailbox._payloads == [None] * 4
+    try:
+        Mailbox(6)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("accepted a size that is no power of two")
+
+
+def check_pulse_trains():
+    # Same profile, one engine on its timer, one on the core 1 loop
+    timed = AgitationMotion(Pin(9, Pin.OUT), Pin(10, Pin.OUT), Pin(8, Pin.OUT))
+    polled = AgitationMotion(Pin(2, Pin.OUT), Pin(3, Pin.OUT), Pin(11, Pin.OUT))
+    telemetry = Telemetry()
+    telemetry._attach_steps(timed)
+    engine = Core1(polled, None)
+    proxy = MotionProxy(engine)
+    timed.set_speed(800)
+    proxy.set_speed(800)
+    engine.poll()
+    timed.start()
+    proxy.start()
+    engine.poll()
+    end = clock.now + 8_000_000
+    while clock.now < end:
+        clock.advance(20)
+        engine.poll()
+    ticks = telemetry.probes[STEP].count
+    assert abs(engine.step_late.count - ticks) <= 1, (engine.step_late.count, ticks)
+    assert proxy.cycles == timed.cycles and proxy.cycles > 0
+    assert engine.step_late.max_us <= 20, engine.step_late.max_us
+    proxy.stop()
+    engine.poll()
+    assert not proxy.running
+    timed.stop()
+
+
+def check_exposure():
+    # The lamp-off spin needs time to pass while it reads the clock
+    clock.read_cost_us = 1
+    lamp = Lamp()
+    engine = Core1(None, ExposureScheduler(lamp))
+    proxy = ExposureProxy(engine)
+    for duration in (123_456, 1_000, 900_000):
+        lamp.switched.clear()
+        proxy.expose(duration)
+        engine.poll()
+        assert proxy.state != IDLE and proxy.remaining_us() > 0
+        while proxy.state != IDLE:
+            clock.advance(7)
+            engine.poll()
+        (on, _), (off, _) = lamp.switched
+        assert 0 <= off - on - duration <= 10, (duration, off - on)
+    assert proxy.exposures == 3 and proxy.max_error_us <= 10
+    # Two runs and two ramp sets posted before core 1 takes them
+    runs = []
+    run = engine.exposure.run
+    engine.exposure.run = lambda segments, at_us=None: runs.append(segments) or run(segments, at_us)
+    proxy.run((5_000, 6_000))
+    proxy.run([7_000])
+    engine.poll()
+    assert runs == [(5_000, 6_000), (7_000,)], runs
+    engine.exposure.run = run
+    proxy.cancel()
+    motion = AgitationMotion(Pin(2, Pin.OUT), Pin(3, Pin.OUT), Pin(11, Pin.OUT))
+    engine = Core1(motion)
+    motion_proxy = MotionProxy(engine)
+    motion_proxy.configure(speed=400)
+    motion_proxy.configure(speed=800)
+    mailbox = engine.mailbox
+    cruise = []
+    while mailbox.get() >= 0:
+        cruise.append(mailbox.payload[0].cruise)
+    assert cruise == [2500, 1250], cruise
+    try:
+        proxy.expose(0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("accepted an empty exposure")
+
+
+def check_controller():
+    from boardsupport.frankenstein_controller import FrankensteinRotaryController
+
+    controller = FrankensteinRotaryController(timers=False, dual_core=True)
+    core1 = controller.core1
+    assert isinstance(controller.motion, MotionProxy)
+    controller.button_event("button2")
+    controller.display1["value"] = 5
+    controller.button_event("rotary_1_button")
+    time.sleep(0.3)
+    assert controller.motion.running and core1.step_late.count > 100
+    assert core1.motion._forward.cruise == 1250
+    controller.button_event("rotary_1_button")
+    time.sleep(0.05)
+    assert not controller.motion.running
+    core1.stop()
+    time.sleep(0.05)
+    assert not core1.running
+
+
+if __name__ == "__main__":
+    check_mailbox()
+    check_pulse_trains()
+    check_exposure()
+    clock.uninstall()
+    hosthal.install()
+    check_controller()
+    import stress_dualcore
+
+    # Under the GIL only the typical step is a fair comparison
+    (single_p50, _, _), (dual_p50, _, _) = stress_dualcore.main(1)
+    assert dual_p50 < single_p50
+    print("OK")
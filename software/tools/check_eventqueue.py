@@ -0,0 +1,129 @@
+# Exercise the input event queue off-device
+#
+#   python3 tools/check_eventqueue.py
+#
+# Builds the controller on hosthal and replays input bursts through the real
+# pin IRQ and debounce scan paths while the main loop is "busy" (nothing scheduled
+# runs until the burst is over). Checks that every encoder step and button
+# press arrives, that one scheduled drain handles the whole burst, and that
+# overflow is counted instead of raising.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from hosthal import machine, micropython
+from boardsupport.eventqueue import EventQueue
+from boardsupport.frankenstein_controller import FrankensteinController, _ROTARY_PINS, _BUTTON_PINS, _BUTTON_NAMES
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+
+class Recorder(FrankensteinController):
+    def __init__(self):
+        self.deltas = [0, 0, 0, 0]
+        self.presses = []
+        super().__init__()
+
+    def rotary_event(self, rotary_id, delta):
+        self.deltas[rotary_id - 1] += delta
+
+    def button_event(self, pin):
+        self.presses.append(pin)
+
+
+def turn(pins, phase, transitions):
+    direction = 1 if transitions > 0 else -1
+    for _ in range(abs(transitions)):
+        phase = (phase + direction) % 4
+        clk, dt = GRAY[phase]
+        machine.drive(pins[0], clk)
+        machine.drive(pins[1], dt)
+    return phase
+
+
+def press(c, index):
+    pin = _BUTTON_PINS[index]
+    for level in (1, 0):
+        machine.drive(pin, level)
+        for _ in range(4):
+            c.buttons.scan()
+
+
+def check_burst():
+    for clk, dt in _ROTARY_PINS:
+        machine.drive(clk, 1)
+        machine.drive(dt, 1)
+    c = Recorder()
+    micropython.run_scheduled()
+    phases = [2, 2, 2, 2]
+    moves = (40, -24, 200, 7)
+    # A burst: all encoders turning, interleaved with every switch twice
+    for round in range(2):
+        for i in range(4):
+            phases[i] = turn(_ROTARY_PINS[i], phases[i], moves[i] // 2)
+        for i in range(len(_BUTTON_PINS)):
+            press(c, i)
+    assert len(micropython._scheduled) == 1, "one drain scheduled for the whole burst"
+    micropython.run_scheduled()
+
+    expected = [c.rotary_1.value(), c.rotary_2.value(), c.rotary_3.value(), c.rotary_4.value()]
+    assert c.deltas == expected, (c.deltas, expected)
+    assert c.presses == list(_BUTTON_NAMES) * 2, c.presses
+    q = c.events
+    assert q.overflows == 0 and q.schedule_failures == 0
+    assert q.drains == 1
+    return q, sum(abs(m) for m in moves), 2 * len(_BUTTON_NAMES)
+
+
+def check_overflow():
+    got = []
+    q = EventQueue(lambda s, d, t: got.append((s, d)), size=4)
+    # Rotating sources cannot coalesce, everything past four records overflows
+    for i in range(6):
+        q.post_delta(i % 3, 1)
+    assert q.overflows == 2 and len(q) == 4
+    micropython.run_scheduled()
+    assert got == [(0, 1), (1, 1), (2, 1), (0, 1)], got
+    # Same source coalesces into the pending record, clamped to 16 bits
+    for _ in range(5):
+        q.post_delta(3, 10000)
+    micropython.run_scheduled()
+    assert got[-2:] == [(3, 30000), (3, 20000)], got[-2:]
+    return q
+
+
+def check_schedule_full():
+    # With the scheduler queue full the post survives and a later post retries
+    got = []
+    q = EventQueue(lambda s, d, t: got.append(s))
+    for _ in range(micropython._SCHEDULE_DEPTH):
+        micropython.schedule(lambda a: None, None)
+    q.post(1)
+    assert q.schedule_failures == 1 and len(q) == 1
+    micropython.run_scheduled()
+    q.post(2)
+    micropython.run_scheduled()
+    assert got == [1, 2], got
+
+
+def main():
+    q, steps, presses = check_burst()
+    print("burst: {} encoder transitions and {} presses -> {} records, {} drain(s), max depth {}".format(
+        steps, presses, q.drained, q.drains, q.max_depth))
+    print("       posted {}, coalesced {} ({:.0%}), overflows {}".format(
+        q.posted, q.coalesced, q.coalesce_rate, q.overflows))
+    print("       before: one listener pass per edge and {} schedule() calls, queue depth {}".format(
+        presses, micropython._SCHEDULE_DEPTH))
+    q = check_overflow()
+    print("overflow: {} of {} posts dropped and counted".format(q.overflows, q.posted))
+    check_schedule_full()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# Measure exposure timing off-device on a virtual clock
+#
+#   python3 tools/check_exposure.py
+#
+# Replaces time.ticks_us/ticks_ms with a virtual µs clock (every read costs a
+# few µs, like on the chip) and fires the scheduler's one-shot timer with a
+# random soft-IRQ latency, occasionally a long stall. Runs a few thousand
+# exposures and test strips, some across the ticks wrap, and reports how far
+# lamp-off lands from the requested time; the lamp-off spin never holds the
+# timer callback longer than the guard. The development countdowns are run
+# the same way, against the old 100 ms tick counter. Last, the controller's
+# exposure mode sets the time in f-stops and button3 steps a test strip.
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from hosthal.clock import VirtualClock
+from boardsupport import exposure
+from boardsupport.exposure import ExposureScheduler, Countdown, GUARD_US, adjust, test_strip
+from boardsupport.debounce import LONG_PRESS
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+
+READ_COST_US = 2
+
+
+class Lamp:
+    def __init__(self, clock):
+        self.clock = clock
+        self.on_at = None
+        self.lit_us = []
+
+    def on(self):
+        self.on_at = self.clock.now
+
+    def off(self):
+        self.lit_us.append(self.clock.now - self.on_at)
+
+
+# Soft timer callbacks wait for the VM, now and then for something long
+MAX_LATENCY_US = 40
+
+
+def latency(rng, stall_rate):
+    if rng.random() < stall_rate:
+        return rng.randint(3000, 20000)
+    return rng.randint(5, MAX_LATENCY_US)
+
+
+# Returns the longest a callback ran
+def run_until_idle(clock, scheduler, rng, stall_rate):
+    timer = scheduler._timer
+    longest = 0
+    while scheduler.state == exposure.EXPOSING:
+        callback = timer.callback
+        assert callback is not None
+        timer.callback = None
+        clock.now += timer.period * 1_000_000 // timer.tick_hz + latency(rng, stall_rate)
+        start = clock.now
+        callback(timer)
+        longest = max(longest, clock.now - start)
+    return longest
+
+
+def check_exposures(count, stall_rate, start_us=0):
+    rng = random.Random(count)
+    clock = VirtualClock(start_us, READ_COST_US)
+    clock.install()
+    lamp = Lamp(clock)
+    scheduler = ExposureScheduler(lamp)
+    errors = []
+    total = 0
+    for _ in range(count):
+        duration = rng.randint(200_000, 120_000_000)
+        scheduler.expose(duration)
+        longest = run_until_idle(clock, scheduler, rng, stall_rate)
+        assert longest <= GUARD_US + 3 * READ_COST_US, longest
+        errors.append(lamp.lit_us[-1] - duration)
+        total += duration
+        clock.now += rng.randint(1000, 5_000_000)
+    return errors, total, scheduler
+
+
+def check_strip():
+    rng = random.Random(1)
+    clock = VirtualClock((1 << 30) - 3_000_000, READ_COST_US)
+    clock.install()
+    lamp = Lamp(clock)
+    scheduler = ExposureScheduler(lamp)
+    segments = test_strip(8_000_000, 6, step=1, mode=exposure.THIRD_STOP)
+    scheduler.run(segments)
+    while True:
+        run_until_idle(clock, scheduler, rng, 0)
+        if scheduler.state == exposure.IDLE:
+            break
+        clock.now += 2_000_000
+        scheduler.start()
+    cumulative = [sum(lamp.lit_us[:i + 1]) for i in range(len(segments))]
+    for i, t in enumerate(cumulative):
+        expected = 8_000_000 * 2 ** (i / 3)
+        assert abs(t - expected) < 20 + i * 20, (i, t, expected)
+    return cumulative
+
+
+def check_steps():
+    assert adjust(10_000_000, 1) == 10_100_000
+    assert adjust(10_000_000, 3, exposure.THIRD_STOP) == 20_000_000
+    assert adjust(10_000_000, -6, exposure.SIXTH_STOP) == 5_000_000
+    assert adjust(10_000_000, 12, exposure.TWELFTH_STOP) == 20_000_000
+    assert test_strip(5_000_000, 3, mode=exposure.THIRD_STOP, incremental=False)[2] == 7_937_005
+    # The integer table against the float power of two, within 0.1 ppm
+    for duration in (1, 999, 100_000, 5_000_000, 12_345_678, 999_000_000):
+        for mode in (exposure.THIRD_STOP, exposure.SIXTH_STOP, exposure.TWELFTH_STOP):
+            for steps in range(-80, 80):
+                expected = max(0, min(exposure.MAX_EXPOSURE_US, int(duration * 2 ** (steps / mode) + 0.5)))
+                assert abs(adjust(duration, steps, mode) - expected) <= 1 + expected // 10_000_000, \
+                    (duration, steps, mode)
+
+
+def check_countdowns(rng):
+    # 999 s timers, started at random phases and across the ticks_ms wrap
+    worst_new = worst_old = 0
+    for start in (0, ((1 << 30) - 500) * 1000):
+        clock = VirtualClock(start + rng.randint(0, 99_999), READ_COST_US)
+        clock.install()
+        countdown = Countdown()
+        countdown.start(999_000)
+        t0 = clock.now
+        # 100 ms display tick with jitter, as in _second_tick
+        while countdown.remaining_ms():
+            clock.now += 100_000 + rng.randint(0, 3000)
+        worst_new = max(worst_new, abs(clock.now - t0 - 999_000_000))
+        # Old scheme: whole seconds counted from whatever tick_counter was at
+        for phase in range(10):
+            elapsed = (10 - phase) * 100_000 + 998 * 1_000_000
+            worst_old = max(worst_old, abs(elapsed - 999_000_000))
+    return worst_new, worst_old
+
+
+def check_controller():
+    clock = VirtualClock(0, READ_COST_US)
+    clock.install()
+    lamp = Lamp(clock)
+    controller = FrankensteinRotaryController(timers=False, motion_backend="none")
+    controller.exposure = ExposureScheduler(lamp)
+    controller.values[3] = 7
+    # A blink of display4 from elsewhere stays as it is without a strip
+    controller.blinks[3] = 1
+    controller.update()
+    assert controller.blinks[3] == 1
+    controller.blinks[3] = 0
+    # Long press on the fourth encoder: 8.0 s on display4, 2/3 stop up
+    controller.switch_event(3, LONG_PRESS)
+    assert controller.exposure_mode and controller.values[3] == 80 and controller.points[3] == 1
+    controller.rotary_event(4, 2)
+    assert controller.exposure_us == adjust(8_000_000, 2, exposure.THIRD_STOP) and controller.values[3] == 127
+    controller.rotary_event(4, -5)
+    assert abs(controller.exposure_us - 4_000_000) <= 2 and controller.values[3] == 40
+    # The three strips of 4, 5 and 6.3 s, one per press of button3
+    segments = test_strip(controller.exposure_us, 6, 1, exposure.THIRD_STOP)
+    for i in range(3):
+        controller.button_event("button3")
+        run_until_idle(clock, controller.exposure, random.Random(i), 0)
+        controller.update()
+        assert controller.blinks[3] == 1 and abs(lamp.lit_us[i] - segments[i]) <= GUARD_US
+    # A press during a strip cancels the rest
+    controller.button_event("button3")
+    controller.button_event("button3")
+    assert controller.exposure.state == exposure.IDLE and len(lamp.lit_us) == 4
+    controller.update()
+    assert controller.blinks[3] == 0
+    # and comes back after one
+    controller.blinks[3] = 1
+    controller.button_event("button3")
+    run_until_idle(clock, controller.exposure, random.Random(9), 0)
+    controller.update()
+    controller.button_event("button3")
+    controller.button_event("button3")
+    controller.update()
+    assert controller.blinks[3] == 1
+    controller.blinks[3] = 0
+    # No further than display4 shows
+    controller.rotary_event(4, -100)
+    assert controller.values[3] == 1
+    controller.rotary_event(4, 100)
+    assert controller.values[3] == 999 and controller.exposure_us == 99_900_000
+    # Back to the recipe number, which the mode kept
+    controller.switch_event(3, LONG_PRESS)
+    assert not controller.exposure_mode and controller.values[3] == 7 and controller.points[3] == 0
+    controller.rotary_event(4, 1)
+    assert controller.values[3] == 8 and controller.exposure_us == 99_900_000
+    controller.buttons.stop()
+
+
+def main():
+    check_steps()
+    for stall_rate, label in ((0, "no stalls"), (0.05, "5% stalls")):
+        errors, total, scheduler = check_exposures(2000, stall_rate)
+        late = sum(1 for e in errors if e > 50)
+        print("{:10} {} exposures, {:.1f} h lit: error min {} µs max {} µs, {} late".format(
+            label, len(errors), total / 3.6e9, min(errors), max(errors), late))
+        if stall_rate == 0:
+            assert max(abs(e) for e in errors) <= 2 * READ_COST_US + 2, errors
+        assert min(errors) >= 0
+    errors, _, _ = check_exposures(200, 0, start_us=(1 << 30) - 10_000_000)
+    assert max(errors) <= 2 * READ_COST_US + 2
+    print("across ticks_us wrap: max error {} µs".format(max(errors)))
+    cumulative = check_strip()
+    print("test strip (1/3 stop from 8 s): {}".format(", ".join("{:.2f}".format(t / 1e6) for t in cumulative)))
+    worst_new, worst_old = check_countdowns(random.Random(2))
+    print("999 s countdown: deadline off by {:.1f} ms, tick counter off by up to {:.0f} ms".format(
+        worst_new / 1000, worst_old / 1000))
+    assert worst_new < 110_000
+    check_controller()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
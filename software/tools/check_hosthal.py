@@ -0,0 +1,123 @@
+# Run both controllers off-device on the virtual clock
+#
+#   python3 tools/check_hosthal.py
+#
+# Builds FrankensteinController and FrankensteinRotaryController with their
+# timers running on hosthal's VirtualClock, then turns encoders and presses
+# buttons through the pin IRQ paths and checks that the display timer, the
+# switch scan, the countdowns and the agitation all happen at their virtual
+# times. Two runs of the same session must end in the same state.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from hosthal import machine
+from boardsupport import motion
+from boardsupport.frankenstein_controller import (
+    FrankensteinController,
+    FrankensteinRotaryController,
+    _BUTTON_PINS,
+    _ROTARY_PINS,
+)
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+
+def turn(pins, phase, transitions):
+    clk, dt = pins
+    for _ in range(abs(transitions)):
+        phase = (phase + (1 if transitions > 0 else -1)) % 4
+        machine.drive(clk, GRAY[phase][0])
+        machine.drive(dt, GRAY[phase][1])
+        clock.advance(500)
+    return phase
+
+
+def press(index, hold_ms=60):
+    machine.drive(_BUTTON_PINS[index], 1)
+    clock.advance_ms(hold_ms)
+    machine.drive(_BUTTON_PINS[index], 0)
+    clock.advance_ms(hold_ms)
+
+
+def idle_pins():
+    for clk, dt in _ROTARY_PINS:
+        machine.drive(clk, 1)
+        machine.drive(dt, 1)
+    for pin in _BUTTON_PINS:
+        machine.drive(pin, 0)
+
+
+def check_base():
+    idle_pins()
+    controller = FrankensteinController()
+    frames = controller.refresh.frames
+    fired = clock.fired
+    controller.display2["value"] = 42
+    clock.advance_ms(1000)
+    # 10 Hz display timer plus the 5 ms switch scan
+    assert clock.fired - fired == 10 + 200, clock.fired - fired
+    assert controller.refresh.frames > frames
+    controller.display_timer.deinit()
+    controller.buttons.stop()
+
+
+def session():
+    clock.now = 0
+    fired = clock.fired
+    idle_pins()
+    # Every detent counts one, the turns below take no time at all
+    controller = FrankensteinRotaryController(acceleration=False)
+    # 2 counts up on display1, then 4 down from 10 on display2
+    turn(_ROTARY_PINS[0], 2, 4)
+    controller.display2["value"] = 10
+    turn(_ROTARY_PINS[1], 2, -8)
+    assert controller.display1["value"] == 2, controller.display1
+    assert controller.display2["value"] == 6, controller.display2
+
+    # button2 selects the high speed, rotary_1_button starts the 2 s timer
+    press(5)
+    assert not controller.low_speed and controller.button2_led["value"]
+    press(0)
+    assert controller.running == 1
+    assert controller.motion.state == motion.FORWARD
+    started = clock.now - 60_000
+    clock.advance_ms(1500)
+    assert controller.display1["value"] == 1, controller.display1
+    # Agitating at 800 steps/s
+    assert controller.motion._step > 700, controller.motion._step
+    clock.advance_ms(600)
+    assert controller.running == 0
+    assert controller.display1["value"] == 0
+    assert controller.motion.state == motion.IDLE
+    elapsed = clock.now - started
+    assert 2_000_000 <= elapsed <= 2_100_000 + 60_000, elapsed
+    state = (
+        clock.now,
+        clock.fired - fired,
+        tuple(d["value"] for d in controller._displays),
+        bytes(controller.framebuffer.buf),
+        controller.events.drained,
+    )
+    controller.second_tick_timer.deinit()
+    controller.buttons.stop()
+    return state
+
+
+def main():
+    check_base()
+    first = session()
+    second = session()
+    assert first == second, (first, second)
+    print("virtual session: {:.3f} s, {} timer callbacks, displays {}".format(
+        first[0] / 1e6, first[1], first[2]))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
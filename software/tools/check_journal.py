@@ -0,0 +1,230 @@
+# Power-loss test for the settings journal
+#
+#   python3 tools/check_journal.py
+#
+# Runs a long session of random set()/flush() calls, with compactions, while
+# recording every file write. Then cuts the power at every byte of that write
+# history: the files are rebuilt as they were at the cut, with the write in
+# progress torn, and restored. The result must hold exactly the records that
+# were completely written before the cut, and a journal recovered from a torn
+# write must keep working. Also checks the controller state round trip: a
+# running countdown journals its start value only, and nothing is flushed
+# while the tank agitates or the lamp is on.
+
+import builtins
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from boardsupport import journal as journal_module
+from boardsupport.exposure import EXPOSING
+from boardsupport.journal import Journal
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+
+KEYS = 12
+
+
+class RecordingFile:
+    def __init__(self, log, path, mode):
+        self._log = log
+        self._path = path
+        self._file = builtins.open(path, mode)
+        if "w" in mode:
+            log.append((path, "truncate", b""))
+
+    def write(self, data):
+        self._log.append((self._path, "write", bytes(data)))
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+def recording_open(log):
+    def _open(path, mode="r"):
+        if "w" in mode or "a" in mode:
+            return RecordingFile(log, path, mode)
+        return builtins.open(path, mode)
+    return _open
+
+
+def session(directory, rng, steps=200):
+    # Returns the write log and, per write, the state its records complete
+    log = []
+    journal_module.open = recording_open(log)
+    try:
+        journal = Journal(os.path.join(directory, "state"), max_bytes=256, delay_ms=0)
+        state = {}
+        for _ in range(steps):
+            for _ in range(rng.randint(1, 4)):
+                key = rng.randrange(KEYS)
+                value = rng.choice((rng.randint(-5, 5), rng.randint(-(1 << 31), (1 << 31) - 1)))
+                journal.set(key, value)
+                state[key] = value
+            journal.flush()
+        assert journal.compactions > 5, journal.compactions
+        return log, state, journal
+    finally:
+        del journal_module.open
+
+
+def rebuild(log, directory, cut):
+    # Files as they were when the power went after `cut` written bytes
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    budget = cut
+    for path, op, data in log:
+        path = os.path.join(directory, os.path.basename(path))
+        if op == "truncate":
+            open(path, "wb").close()
+            continue
+        data = data[:budget]
+        with open(path, "ab") as f:
+            f.write(data)
+        budget -= len(data)
+        if budget <= 0:
+            break
+
+
+def expected_at(log, cut):
+    # Appended records complete at the cut, snapshots only once committed
+    state = {}
+    for path, op, data in log:
+        if op == "truncate":
+            continue
+        complete = min(len(data), cut)
+        cut -= len(data)
+        if data.startswith(b"FJNL"):
+            if complete == len(data):
+                state = dict(records(data[8:-8]))
+        else:
+            state.update(records(data[:complete]))
+        if cut <= 0:
+            break
+    return state
+
+
+def records(data):
+    for pos in range(0, len(data) - 7, 8):
+        marker, key, check, value = journal_module.struct.unpack_from("<BBHi", data, pos)
+        yield key, value
+
+
+def check_power_loss(rng):
+    work = tempfile.mkdtemp()
+    scratch = tempfile.mkdtemp()
+    try:
+        log, final, _ = session(work, rng)
+        total = sum(len(data) for _, op, data in log)
+        cuts = 0
+        torn = 0
+        for cut in range(total + 1):
+            rebuild(log, scratch, cut)
+            restored = Journal(os.path.join(scratch, "state"))
+            expected = expected_at(log, cut)
+            assert restored.values == expected, (cut, restored.values, expected)
+            cuts += 1
+            if restored.dropped_bytes:
+                torn += 1
+            # Keep going after every 97th cut: later writes must survive
+            if cut % 97 == 0:
+                restored.set(200, cut)
+                restored.set(0, 1234)
+                restored.flush()
+                again = Journal(os.path.join(scratch, "state"))
+                assert again.values == {**expected, 200: cut, 0: 1234}, cut
+        assert expected_at(log, total) == final
+        return cuts, torn, total
+    finally:
+        shutil.rmtree(work)
+        shutil.rmtree(scratch)
+
+
+class _Exposing:
+    state = EXPOSING
+
+
+def check_controller():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "state")
+        controller = FrankensteinRotaryController(timers=False, journal=Journal(path))
+        journal = controller.journal
+        controller.button_event("button2")
+        controller.display1["value"] = 9
+        controller.display2["value"] = 90
+        controller.display4["value"] = 12
+        # Starting the timer writes its start value at once
+        controller.button_event("rotary_1_button")
+        assert not journal.dirty and controller.motion.running
+        appends = journal.appends + journal.compactions
+        # The ticks are not journaled, other changes wait for the agitation
+        for _ in range(25):
+            clock.advance_ms(100)
+            controller.update()
+        assert controller.display1["value"] == 7
+        controller.display2["value"] = 91
+        for _ in range(25):
+            clock.advance_ms(100)
+            controller.update()
+        assert journal.dirty and journal.appends + journal.compactions == appends
+
+        # Reset with timer 1 running, started at 9 s
+        restored = FrankensteinRotaryController(timers=False, journal=Journal(path))
+        assert not restored.low_speed and restored.button2_led["value"]
+        assert [d["value"] for d in restored._displays] == [9, 90, 0, 12]
+        assert restored.display1["blink"] and restored.running == 0
+        restored.button_event("rotary_1_button")
+        assert not restored.display1["blink"] and restored.running == 1
+        restored.buttons.stop()
+
+        # Paused, the rest is written once the tank has stopped
+        controller.button_event("rotary_1_button")
+        for _ in range(50):
+            clock.advance_ms(100)
+            controller.update()
+        assert not controller.motion.running and not journal.dirty
+        # Nor during an exposure
+        controller.exposure = _Exposing()
+        controller.display3["value"] = 30
+        for _ in range(30):
+            clock.advance_ms(100)
+            controller.update()
+        assert journal.dirty
+        controller.exposure = None
+        clock.advance_ms(100)
+        controller.update()
+        assert not journal.dirty
+        controller.buttons.stop()
+        restored = FrankensteinRotaryController(timers=False, journal=Journal(path))
+        assert [d["value"] for d in restored._displays] == [controller.display1["value"], 91, 30, 12]
+        assert not restored.display1["blink"]
+        restored.buttons.stop()
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    cuts, torn, total = check_power_loss(random.Random(13))
+    print("power cut at each of {} bytes of writes: {} restores, {} with a torn tail".format(total, cuts, torn))
+    size = check_controller()
+    print("controller state round trip, {} bytes on flash".format(size))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
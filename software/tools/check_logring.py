@@ -0,0 +1,146 @@
+# Exercise the deferred log ring off-device
+#
+#   python3 tools/check_logring.py
+#
+# Checks ordering, overwrite of the oldest records, level gating and that a
+# dump decodes to the same lines the ring drains to a logger. Then drives the
+# controller's buttons and encoders through the pin paths and checks that
+# nothing reaches the logger until the ring is drained. Prints the cost of a
+# log() call next to the logger.debug() calls it replaces.
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from hosthal import machine, micropython
+from boardsupport.frankenstein_controller import FrankensteinRotaryController, LOG_MESSAGES, _BUTTON_NAMES, _BUTTON_PINS
+from boardsupport.logring import LogRing, DEBUG, INFO, WARNING, decode
+from logring_decode import format_dump
+
+MESSAGES = ((DEBUG, "tick %d of %d"), (INFO, "pressed %s"), (WARNING, "odd %d"))
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append((record.levelno, record.getMessage()))
+
+
+def capture_logger(name):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = Capture()
+    logger.addHandler(handler)
+    return logger, handler
+
+
+def check_ring():
+    logger, out = capture_logger("check.ring")
+    ring = LogRing(MESSAGES, names=("a", "b"), size=8)
+    ring.log(0, 1, 2)
+    ring.log(1, 1)
+    ring.log(2, -5)
+    assert len(ring) == 3
+    assert ring.drain(logger) == 3
+    assert [line.split(" ", 1)[1] for _, line in out.lines] == ["tick 1 of 2", "pressed b", "odd -5"]
+    assert [level for level, _ in out.lines] == [DEBUG, INFO, WARNING]
+
+    # The ring keeps the newest records
+    for i in range(20):
+        ring.log(0, i, 20)
+    assert len(ring) == 8 and ring.dropped == 12
+    data = ring.dump()
+    dump = decode(data)
+    assert [args[0] for _, _, args in dump["records"]] == list(range(12, 20))
+    out.lines.clear()
+    assert ring.drain(logger, limit=5) == 5 and len(ring) == 3
+    ring.drain(logger)
+    assert len(ring) == 0 and out.lines[0][1].endswith("tick 12 of 20")
+
+    # Gated messages are not stored at all
+    ring.level = INFO
+    ring.log(0, 1, 1)
+    ring.log(2, 7)
+    assert len(ring) == 1
+    ring.drain(logger)
+
+    for bad in (b"", b"XXXX" + bytes(12), data[:-1]):
+        try:
+            decode(bad)
+        except ValueError:
+            continue
+        raise AssertionError("decoded a bad dump")
+
+
+def check_controller():
+    logger, out = capture_logger("check.controller")
+    controller = FrankensteinRotaryController(timers=False)
+    controller.logger = logger
+    controller.display4["value"] = 7
+    for pin in (_BUTTON_PINS[7], _BUTTON_PINS[4], _BUTTON_PINS[0]):
+        machine.drive(pin, 1)
+        for _ in range(10):
+            controller.buttons.scan()
+        micropython.run_scheduled()
+        machine.drive(pin, 0)
+        for _ in range(10):
+            controller.buttons.scan()
+        micropython.run_scheduled()
+    controller.rotary_event(2, 5)
+    assert not out.lines, out.lines
+    text = format_dump(decode(controller.log.dump()))
+    controller.log.drain(logger)
+    lines = [line.split(" ", 1)[1] for _, line in out.lines]
+    assert lines == ["Button button4", "No recipe 7", "Button button1", "Button rotary_1_button",
+                     "Encoder 2 moved by 5"], lines
+    assert out.lines[1][0] == WARNING
+    for line in lines:
+        assert line in text, (line, text)
+
+
+def bench():
+    logger = logging.getLogger("check.bench")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+    ring = LogRing(LOG_MESSAGES, _BUTTON_NAMES, size=128)
+    n = 20000
+    results = []
+    t0 = time.perf_counter()
+    for i in range(n):
+        ring.log(0, 1, i & 7)
+    results.append(("ring.log", time.perf_counter() - t0))
+    ring.level = WARNING
+    t0 = time.perf_counter()
+    for i in range(n):
+        ring.log(0, 1, i & 7)
+    results.append(("ring.log, gated", time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    for i in range(n):
+        logger.debug("Encoder %d moved by %d", 1, i & 7)
+    results.append(("logger.debug", time.perf_counter() - t0))
+    pin = _BUTTON_NAMES[i & 7]
+    t0 = time.perf_counter()
+    for i in range(n):
+        logger.debug(f"Button: {pin}")
+    results.append(("logger.debug f-string", time.perf_counter() - t0))
+    for name, seconds in results:
+        print("{:<24} {:>6.2f} us per call".format(name, seconds / n * 1e6))
+
+
+if __name__ == "__main__":
+    check_ring()
+    check_controller()
+    bench()
+    print("OK")
@@ -0,0 +1,155 @@
+# Validate the idle-window garbage collection off-device
+#
+#   python3 tools/check_memory.py
+#
+# Runs a rotary controller with the agitation and an exposure on hosthal's
+# virtual clock over its modelled heap, where a collection takes 6 ms and no
+# timer fires meanwhile. A steady churn of allocations fills the heap. Left
+# to the heap the collections land anywhere, during exposures and steps,
+# which then run late; with the MemoryManager polling as under the runtime
+# they wait for the dwells and for the end of the exposure, and no step is
+# late. Also checks the count of forced collections and that the bisection
+# finds the largest block of a fragmented heap.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+clock.read_cost_us = 1
+
+from hosthal import heap
+from boardsupport import memory
+from boardsupport.exposure import ExposureScheduler
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+from boardsupport.memory import MemoryManager
+from boardsupport.telemetry import Telemetry, decode
+
+# The probe's allocations come from the modelled heap
+memory.bytearray = heap.block
+
+_POLL_MS = 100
+_CHURN = 1000
+_COLLECT_US = 6000
+
+
+class _Lamp:
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+def _session(managed, seconds=90):
+    heap.reset(heap_size=160_000, live_bytes=40_000, collection_us=_COLLECT_US)
+    controller = FrankensteinRotaryController(timers=False, acceleration=False)
+    controller.exposure = ExposureScheduler(_Lamp())
+    telemetry = Telemetry()
+    telemetry.attach(controller)
+    manager = None
+    if managed:
+        manager = MemoryManager(controller, period_ms=_POLL_MS, probe_s=20)
+        manager.start()
+    started = heap.collections
+    controller.motion.start()
+    forced = heap.automatic
+    exposing = 0
+    for n in range(seconds * 1000 // _POLL_MS):
+        if n % 150 == 60:
+            controller.exposure.expose(4_000_000)
+        collections = heap.collections
+        busy = controller.exposure.state
+        heap.allocate(_CHURN)
+        if manager is not None:
+            manager.poll()
+        if busy:
+            exposing += heap.collections - collections
+        clock.advance_ms(_POLL_MS)
+    controller.motion.stop()
+    report = decode(telemetry.snapshot())
+    return {
+        "manager": manager,
+        "collections": heap.collections - started,
+        # A probe's failed allocations collect too, those are no surprise
+        "forced": heap.automatic - forced if manager is None else manager.forced,
+        "late_steps": report["counters"]["late_steps"],
+        "exposing": exposing,
+        "counters": report["counters"],
+    }
+
+
+def check_unmanaged():
+    result = _session(False)
+    assert result["forced"] == result["collections"] > 5, result
+    assert result["late_steps"] > 0, result
+    assert result["exposing"] > 0, result
+    assert result["counters"]["gc_collections"] == 0
+    return result
+
+
+def check_managed():
+    result = _session(True)
+    manager = result["manager"]
+    assert manager.forced == 0, result
+    assert result["late_steps"] == 0, result
+    assert result["exposing"] == 0 and manager.deferred > 0, result
+    assert manager.collections >= result["collections"] // 2 > 5, result
+    # The start and one sample per 20 s
+    assert manager.samples == 5, manager.samples
+    assert abs(manager.heap_largest - manager.heap_free) <= 256
+    assert manager.heap_free == 120_000
+    counters = result["counters"]
+    assert counters["heap_free"] == manager.heap_free and counters["gc_collections"] == manager.collections
+    assert counters["gc_max_us"] >= _COLLECT_US
+    return result
+
+
+def check_forced():
+    heap.reset(live_bytes=50_000)
+    controller = FrankensteinRotaryController(timers=False)
+    manager = MemoryManager(controller, budget=4, threshold=3)
+    manager.start()
+    collections = manager.collections
+    automatic = heap.automatic
+    # Busy throughout, the threshold collects between two polls
+    manager.quiet_ms = lambda: 0
+    for _ in range(8):
+        heap.allocate(5000)
+    manager.poll()
+    assert manager.deferred == 1 and manager.forced == 0
+    for _ in range(4):
+        heap.allocate(5000)
+    manager.poll()
+    assert heap.automatic == automatic + 1 and manager.forced == 1
+    manager.poll()
+    assert manager.forced == 1 and manager.deferred == 1 and manager.collections == collections
+
+
+def check_fragmented():
+    heap.reset(live_bytes=30_000, fragment_count=4)
+    controller = FrankensteinRotaryController(timers=False)
+    manager = MemoryManager(controller)
+    manager.start()
+    free = heap.SIZE - 30_000
+    assert manager.heap_free == free
+    assert free // 4 - 256 <= manager.heap_largest <= free // 4, manager.heap_largest
+    # The probe's garbage is gone
+    assert heap.mem_alloc() == 30_000
+    lines = manager.report()
+    assert lines[0].startswith("heap: {} free".format(free)), lines
+
+
+if __name__ == "__main__":
+    unmanaged = check_unmanaged()
+    managed = check_managed()
+    check_forced()
+    check_fragmented()
+    for name, result in (("heap alone", unmanaged), ("idle windows", managed)):
+        print("{}: {} collections, {} forced, {} while exposing, {} late steps".format(
+            name, result["collections"], result["forced"], result["exposing"], result["late_steps"]))
+    for line in managed["manager"].report():
+        print(line)
+    print("OK")
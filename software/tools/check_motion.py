@@ -0,0 +1,114 @@
+# Validate the agitation motion engine off-device
+#
+#   python3 tools/check_motion.py
+#
+# Drives boardsupport.motion.AgitationMotion by firing its one-shot timer by
+# hand on a virtual µs clock, records every step pulse and checks the legs,
+# directions, dwells and the trapezoid limits for both button speeds.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from hosthal import machine
+from machine import Pin
+from boardsupport import motion
+from boardsupport.motion import AgitationMotion, AgitationProfile
+
+STEP = 9
+DIR = 10
+EN = 8
+
+
+class Recorder:
+    def __init__(self):
+        self.now = 0
+        self.pulses = []
+
+    def run(self, engine, until_us):
+        timer = engine._timer
+        while timer.callback is not None and self.now < until_us:
+            self.now += timer.period * 1_000_000 // timer.tick_hz
+            callback = timer.callback
+            timer.callback = None
+            steps = engine._step
+            state = engine.state
+            callback(timer)
+            if state in (motion.FORWARD, motion.REVERSE) and machine._levels[STEP] == 0:
+                self.pulses.append((self.now, machine._levels[DIR], steps))
+
+
+def legs(pulses):
+    # Split the pulse train into runs of the same direction
+    out = []
+    for t, d, _ in pulses:
+        if out and out[-1][0] == d and t - out[-1][1][-1] < 500_000:
+            out[-1][1].append(t)
+        else:
+            out.append((d, [t]))
+    return out
+
+
+def check(speed, profile):
+    step, dire, en = Pin(STEP, Pin.OUT), Pin(DIR, Pin.OUT), Pin(EN, Pin.OUT)
+    engine = AgitationMotion(step, dire, en, profile)
+    engine.set_speed(speed)
+    rec = Recorder()
+    assert en.value() == 1
+    engine.start()
+    assert en.value() == 0
+    rec.run(engine, 30_000_000)
+
+    runs = legs(rec.pulses)
+    assert len(runs) >= 4, len(runs)
+    for i, (d, times) in enumerate(runs[:-1]):
+        expected = profile.forward_steps if d == 0 else profile.reverse_steps
+        assert len(times) == expected, (i, d, len(times), expected)
+        assert d == i % 2, "legs must alternate forward/reverse"
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # Never faster than the cruise speed, and speeds up and slows down
+        assert min(gaps) >= int(1_000_000 / speed + 0.5), min(gaps)
+        assert gaps[0] > min(gaps) and gaps[-1] > min(gaps)
+        assert gaps == gaps[::-1], "decel must mirror accel"
+        # Velocity change between steps bounded by the configured accel
+        for a, b in zip(gaps, gaps[1:]):
+            dv = abs(1e6 / b - 1e6 / a)
+            dt = (a + b) / 2e6
+            assert dv / dt <= profile.accel * 1.2, (dv / dt, profile.accel)
+
+    # Dwells: last pulse of a leg to the first pulse of the next one
+    dwells = [runs[i + 1][1][0] - runs[i][1][-1] for i in range(len(runs) - 1)]
+    first = engine._forward.interval(0)
+    first_rev = engine._reverse.interval(0)
+    for i, dwell in enumerate(dwells):
+        if i % 2 == 0:
+            assert dwell == profile.reversal_dwell_ms * 1000 + first_rev, dwell
+        else:
+            assert dwell == profile.cycle_dwell_ms * 1000 + first, dwell
+
+    engine.stop()
+    assert en.value() == 1 and not engine.running
+    cycle = engine._forward.duration_us() + engine._reverse.duration_us() + (
+        profile.reversal_dwell_ms + profile.cycle_dwell_ms) * 1000
+    ramp = len(engine._forward.ramp)
+    return len(rec.pulses), engine.cycles, cycle, ramp
+
+
+def main():
+    for speed in (400, 800):
+        profile = AgitationProfile()
+        pulses, cycles, cycle_us, ramp = check(speed, profile)
+        print("speed {:4} steps/s: {:5} pulses, {} cycles, cycle {:.2f} s, {} ramp steps".format(
+            speed, pulses, cycles, cycle_us / 1e6, ramp))
+    # A short, slow-accelerating move never reaches cruise and turns into a triangle
+    profile = AgitationProfile(forward_rev=0.05, reverse_rev=0.02, accel=500, cycle_dwell_ms=500)
+    check(800, profile)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# Check the recipe store and fetcher against the local recipe server
+#
+#   python3 tools/check_recipes.py
+#
+# Syncs 1000 recipes from tools/recipe_server.py into a temporary store, then
+# checks the conditional requests (304 while nothing changed, also after a
+# restart), that a damaged download leaves the old recipes in place, and that
+# button4 loads the recipe selected on display4. Reports the lookup latency
+# next to parsing the same recipes from JSON.
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from recipe_server import RecipeServer
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+from boardsupport.recipes import MAX_RECIPES, RecipeFetcher, RecipeStore
+
+
+def make_recipes(rng):
+    recipes = {}
+    for number in range(1, MAX_RECIPES):
+        if rng.random() < 0.9 or number == MAX_RECIPES - 1:
+            times = [rng.randint(30, 999), rng.randint(10, 120), rng.randint(30, 999)]
+            recipes[number] = (times, "R{}".format(number))
+    return recipes
+
+
+def check_sync(directory, rng):
+    recipes = make_recipes(rng)
+    server = RecipeServer(recipes).start()
+    try:
+        store = RecipeStore(os.path.join(directory, "recipes.bin"))
+        assert store.count == 0 and store.get(1) is None
+        fetcher = RecipeFetcher(store, server.url)
+        assert asyncio.run(fetcher.sync())
+        assert store.count == MAX_RECIPES
+        for number in range(MAX_RECIPES):
+            expected = recipes.get(number)
+            got = store.get(number)
+            if expected is None:
+                assert got is None, number
+            else:
+                assert list(got) == expected[0], (number, got, expected)
+                assert store.name(number) == expected[1]
+
+        # Unchanged: one 304, also for a fresh fetcher after a restart
+        assert not asyncio.run(fetcher.sync())
+        restarted = RecipeFetcher(RecipeStore(store.path), server.url)
+        assert restarted.etag == fetcher.etag
+        assert not asyncio.run(restarted.sync())
+        assert server.not_modified == 2
+
+        # Changed on the server
+        recipes[7] = ([111, 22, 333], "changed")
+        server.update(recipes)
+        assert asyncio.run(fetcher.sync())
+        assert store.get(7) == (111, 22, 333)
+
+        # A download cut short must not replace what is there
+        good = server.body
+        server.body = good[:-5]
+        server.etag = '"broken"'
+        try:
+            asyncio.run(fetcher.sync())
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("truncated download accepted")
+        assert store.count == MAX_RECIPES and store.get(7) == (111, 22, 333)
+        server.body = good
+
+        # Server gone: the store stays usable
+        port_url = server.url
+        server.stop()
+        server = None
+        try:
+            asyncio.run(RecipeFetcher(store, port_url, timeout_s=2).sync())
+        except (OSError, asyncio.TimeoutError):
+            pass
+        else:
+            raise AssertionError("sync without a server succeeded")
+        assert store.get(7) == (111, 22, 333)
+        return store, recipes, fetcher
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def lookup_latency(store, directory, rng, lookups=20000):
+    numbers = [rng.randrange(MAX_RECIPES) for _ in range(lookups)]
+    t0 = time.perf_counter()
+    for number in numbers:
+        store.get(number)
+    binary_us = (time.perf_counter() - t0) * 1e6 / lookups
+
+    # The same recipes as a JSON file, parsed for every lookup
+    path = os.path.join(directory, "recipes.json")
+    with open(path, "w") as f:
+        json.dump({str(n): store.get(n) for n in range(store.count) if store.get(n)}, f)
+    t0 = time.perf_counter()
+    for number in numbers[:200]:
+        with open(path) as f:
+            json.load(f).get(str(number))
+    json_us = (time.perf_counter() - t0) * 1e6 / 200
+    return binary_us, json_us
+
+
+def check_load_button(store, recipes):
+    controller = FrankensteinRotaryController(timers=False, recipes=store)
+    controller.display4["value"] = 7
+    controller.button_event("button4")
+    assert [d["value"] for d in controller._displays[:3]] == [111, 22, 333]
+    missing = next(n for n in range(1, MAX_RECIPES) if n not in recipes)
+    controller.display4["value"] = missing
+    controller.button_event("button4")
+    assert controller.display1["value"] == 111
+    controller.display4["value"] = 0
+    controller.button_event("button4")
+    assert [d["value"] for d in controller._displays[:3]] == [300, 60, 300]
+
+
+def main():
+    rng = random.Random(12)
+    with tempfile.TemporaryDirectory() as directory:
+        store, recipes, fetcher = check_sync(directory, rng)
+        print("sync: {} checks, {} updates, {} not modified".format(
+            fetcher.checks, fetcher.updates, fetcher.not_modified))
+        binary_us, json_us = lookup_latency(store, directory, rng)
+        print("lookup at {} recipes: {:.2f} us from recipes.bin ({} bytes), {:.0f} us parsing JSON".format(
+            store.count, binary_us, os.stat(store.path).st_size, json_us))
+        check_load_button(store, recipes)
+        store.close()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
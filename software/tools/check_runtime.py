@@ -0,0 +1,129 @@
+# Run the asyncio runtime off-device under input and network load
+#
+#   python3 tools/check_runtime.py [seconds]
+#
+# Builds the controller with timers=False on hosthal and runs
+# boardsupport.runtime.Runtime on CPython's asyncio next to two load tasks:
+# one spins the encoders and presses buttons through the real pin paths, the
+# other blocks the loop for 20 ms every 250 ms the way a synchronous network
+# call would. Prints loop lag and per-task runtime with and without the load.
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from hosthal import machine
+from boardsupport.frankenstein_controller import FrankensteinRotaryController, _ROTARY_PINS, _BUTTON_PINS
+from boardsupport.runtime import Runtime
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+
+async def user(controller, turns):
+    # Encoder 2 clockwise in bursts, button1/button2 alternately
+    phase = 2
+    clk, dt = _ROTARY_PINS[1]
+    n = 0
+    while True:
+        for _ in range(8):
+            phase = (phase + 1) % 4
+            machine.drive(clk, GRAY[phase][0])
+            machine.drive(dt, GRAY[phase][1])
+        turns[0] += 8
+        pin = _BUTTON_PINS[4 + n % 2]
+        machine.drive(pin, 1)
+        await asyncio.sleep_ms(40)
+        machine.drive(pin, 0)
+        await asyncio.sleep_ms(40)
+        n += 1
+
+
+async def network_load():
+    while True:
+        await asyncio.sleep_ms(250)
+        time.sleep(0.02)
+
+
+async def session(seconds, load):
+    for clk, dt in _ROTARY_PINS:
+        machine.drive(clk, 1)
+        machine.drive(dt, 1)
+    # The bursts are far faster than a hand, every detent counts one
+    controller = FrankensteinRotaryController(timers=False, acceleration=False)
+    controller.display1["value"] = 2
+    controller.button_event("rotary_1_button")
+    runtime = Runtime(controller, stats_period_s=0)
+    turns = [0]
+    tasks = runtime.create_tasks()
+    if load:
+        tasks.append(asyncio.create_task(user(controller, turns)))
+        tasks.append(asyncio.create_task(network_load()))
+    await asyncio.sleep(seconds)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return controller, runtime, turns[0]
+
+
+async def faults():
+    # A task that raises keeps its period, a handler that raises once loses
+    # only its own event, and neither ends the gather
+    controller = FrankensteinRotaryController(timers=False, acceleration=False)
+    runtime = Runtime(controller, stats_period_s=0)
+    calls = [0]
+
+    def poll():
+        calls[0] += 1
+        raise RuntimeError("poll")
+
+    handler = controller.events.handler
+    handled = []
+
+    def flaky(source, delta, ticks):
+        handled.append(source)
+        if len(handled) == 1:
+            raise RuntimeError("handler")
+        handler(source, delta, ticks)
+
+    controller.events.handler = flaky
+    tasks = runtime.create_tasks()
+    tasks.append(asyncio.create_task(runtime._every("faulty", 10, poll)))
+    await asyncio.sleep_ms(20)
+    for source in range(3):
+        controller.events.post(source)
+    await asyncio.sleep(0.3)
+    assert all(not task.done() for task in tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert calls[0] >= 10, calls
+    assert len(handled) == 3, handled
+
+
+def main():
+    asyncio.run(faults())
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for load in (False, True):
+        controller, runtime, turns = asyncio.run(session(seconds, load))
+        print("{} ({:.0f} s):".format("with input and network load" if load else "idle", seconds))
+        for line in runtime.report():
+            print("  " + line)
+        # The 2 s countdown on display1 finished on its deadline
+        assert controller.running == 0 and controller.display1["value"] == 0
+        assert controller.refresh.frames > 0
+        if load:
+            # Half-step encoder: two transitions per count
+            assert controller.display2["value"] == min(999, turns // 2), (controller.display2, turns)
+            assert controller.events.overflows == 0
+            assert runtime.lag.max_us >= 15000, "the blocking call must show up as lag"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Check the telemetry probes, the packet format and both sinks
+#
+#   python3 tools/check_telemetry.py
+#
+# Attaches Telemetry to a rotary controller on the virtual clock, turns an
+# encoder, presses a button and runs the agitation with an injected timer
+# latency, then checks that each probe counted exactly the calls made, that
+# late step ticks are counted, and that packets survive the serial and UDP
+# sinks and the decoder. A controller without telemetry must be untouched.
+
+import io
+import os
+import random
+import socket
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from hosthal import machine
+from boardsupport.frankenstein_controller import FrankensteinRotaryController, _BUTTON_PINS, _ROTARY_PINS
+from boardsupport.telemetry import Telemetry, decode, serial_sink, udp_sink
+from telemetry_decode import format_report, parse_line
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+
+def idle_pins():
+    for clk, dt in _ROTARY_PINS:
+        machine.drive(clk, 1)
+        machine.drive(dt, 1)
+    for pin in _BUTTON_PINS:
+        machine.drive(pin, 0)
+
+
+def check_untouched():
+    controller = FrankensteinRotaryController(timers=False)
+    assert controller.telemetry is None
+    for obj, name in ((controller, "render_full_display"), (controller.rotary_1, "_process_rotary_pins"),
+                      (controller.buttons, "scan"), (controller.motion, "_arm")):
+        assert name not in obj.__dict__, name
+
+
+def session(rng):
+    idle_pins()
+    controller = FrankensteinRotaryController(timers=False, acceleration=False)
+    telemetry = Telemetry()
+    packets = []
+    telemetry.sink = lambda packet: packets.append(bytes(packet))
+    telemetry.attach(controller)
+
+    # 40 transitions on encoder 3, drained by the scheduled consumer
+    clk, dt = _ROTARY_PINS[2]
+    phase = 2
+    for _ in range(40):
+        phase = (phase + 1) % 4
+        machine.drive(clk, GRAY[phase][0])
+        machine.drive(dt, GRAY[phase][1])
+        clock.advance(300)
+    # button3 held for 20 scans
+    machine.drive(_BUTTON_PINS[6], 1)
+    for _ in range(20):
+        controller.buttons.scan()
+    machine.drive(_BUTTON_PINS[6], 0)
+    for _ in range(10):
+        controller.buttons.scan()
+    clock.advance(0)
+    for _ in range(7):
+        controller.update()
+
+    # Agitate for 1 s at 800 steps/s, still in the forward leg; one step
+    # tick in 20 runs 20 ms late, more than twice any step interval
+    late = [0]
+
+    def latency():
+        if rng.random() < 0.05:
+            late[0] += 1
+            return 20_000
+        return rng.randint(0, 30)
+
+    clock.latency = latency
+    controller.button_event("button2")
+    controller.display1["value"] = 30
+    controller.button_event("rotary_1_button")
+    clock.advance_ms(1000)
+    controller.button_event("rotary_1_button")
+    clock.latency = None
+    telemetry.send()
+    return controller, telemetry, packets, late[0]
+
+
+def check_report(report, controller, late):
+    probes = report["probes"]
+    assert probes["encoder"]["count"] == 40, probes["encoder"]
+    assert probes["scan"]["count"] == 30
+    assert probes["render"]["count"] == 7, probes["render"]
+    assert probes["drain"]["count"] >= 2
+    assert probes["step"]["count"] == probes["step_late"]["count"] > 300
+    for probe in probes.values():
+        assert sum(probe["hist"]) == probe["count"]
+        assert probe["min_us"] <= probe["max_us"]
+    assert report["counters"]["late_steps"] == late, (report["counters"], late)
+    assert probes["step_late"]["max_us"] >= 20_000
+    assert controller.display3["value"] == 20
+
+
+def check_sinks(packet):
+    out = io.StringIO()
+    serial_sink(out)(packet)
+    assert parse_line(out.getvalue()) == decode(packet)
+    assert parse_line("[INFO]:boot: something else") is None
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(2)
+    udp_sink("127.0.0.1", receiver.getsockname()[1])(packet)
+    assert receiver.recv(2048) == packet
+    receiver.close()
+
+
+def main():
+    check_untouched()
+    controller, telemetry, packets, late = session(random.Random(15))
+    assert len(packets) == 1
+    report = decode(packets[0])
+    check_report(report, controller, late)
+    check_sinks(packets[0])
+    # The next interval starts empty
+    telemetry.send()
+    assert all(p["count"] == 0 for p in decode(packets[1])["probes"].values())
+    assert decode(packets[1])["sequence"] == 1
+    print("{} byte packet".format(len(packets[0])))
+    print(format_report(report))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# Validate the TMC5160 driver and on-chip agitation off-device
+#
+#   python3 tools/check_tmc5160.py
+#
+# Runs boardsupport.tmc5160 against hosthal's register-level fake chip:
+# datagram framing and pipelined reads, the init and ramp batches, the
+# agitation legs and dwells on the fake ramp generator, speed changes, stop
+# and stall reporting, and the SPI cost of each.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from array import array
+from machine import Pin
+from hosthal.tmc5160 import FakeTMC5160
+from boardsupport import motion
+from boardsupport.motion import AgitationProfile
+from boardsupport import tmc5160
+from boardsupport.tmc5160 import TMC5160, TMC5160Agitation
+
+CS = 9
+PERIOD_MS = 10
+
+
+def make():
+    chip = FakeTMC5160(cs=CS)
+    driver = TMC5160(chip, Pin(CS, Pin.OUT))
+    return chip, driver
+
+
+def check_transactions():
+    chip, driver = make()
+    assert driver.version() == tmc5160.VERSION
+    assert chip.datagrams == 2
+
+    before = chip.datagrams
+    driver.init(run_current=20, hold_current=6, stall_threshold=-3, stall_speed=200)
+    init_datagrams = chip.datagrams - before
+    assert not chip.reset_flag, "GSTAT reset flag must be cleared"
+    assert (chip.reg(tmc5160.CHOPCONF) >> 24) & 0x0F == 5, "MRES for 8 microsteps"
+    assert (chip.reg(tmc5160.IHOLD_IRUN) >> 8) & 0x1F == 20
+    assert (chip.reg(tmc5160.COOLCONF) >> 16) & 0x7F == (-3 & 0x7F)
+
+    # Values survive the round trip, negative ones included
+    driver.write_many((tmc5160.XTARGET, tmc5160.VSTART), (-12345, 77))
+    out = array("i", [0, 0])
+    before = chip.datagrams
+    driver.read_many((tmc5160.XTARGET, tmc5160.VSTART), out)
+    assert list(out) == [-12345, 77], list(out)
+    assert chip.datagrams - before == 3, "pipelined read of 2 registers takes 3 datagrams"
+
+    # Unit conversion against the datasheet figures for 12 MHz
+    assert driver.velocity(1000) == 1398
+    assert driver.acceleration(1000) == 15
+    return init_datagrams
+
+
+def run(chip, agitation, seconds, trace=None):
+    for _ in range(int(seconds * 1000) // PERIOD_MS):
+        chip.advance(PERIOD_MS / 1000)
+        agitation.poll()
+        if trace is not None:
+            trace.append((agitation.state, chip.xactual))
+
+
+def check_agitation(speed):
+    chip, driver = make()
+    driver.init()
+    profile = AgitationProfile(speed=speed)
+    agitation = TMC5160Agitation(driver, profile, period_ms=PERIOD_MS)
+    # Configuring while stopped must not start the motor
+    agitation.configure(accel=3000)
+    chip.advance(0.5)
+    assert chip.speed == 0 and chip.xactual == 0
+
+    agitation.start()
+    before = chip.datagrams
+    trace = []
+    run(chip, agitation, 20, trace)
+    polls = len(trace)
+    datagrams = chip.datagrams - before
+
+    # Reconstruct the legs from the positions where each state was left
+    ends = []
+    for (state, _), (next_state, x) in zip(trace, trace[1:]):
+        if state != next_state:
+            ends.append((state, x))
+    position = 0
+    forward = reverse = 0
+    for state, x in ends:
+        if state == motion.FORWARD:
+            position += profile.forward_steps
+            forward += 1
+            assert x == position, (x, position)
+        elif state == motion.REVERSE:
+            position -= profile.reverse_steps
+            reverse += 1
+            assert x == position, (x, position)
+    assert forward >= 2 and reverse >= 2, ends
+
+    # Dwells last their configured time in polls
+    runs = []
+    for state, _ in trace:
+        if runs and runs[-1][0] == state:
+            runs[-1][1] += 1
+        else:
+            runs.append([state, 1])
+    for state, count in runs[1:-1]:
+        if state == motion.REVERSAL_DWELL:
+            assert count == profile.reversal_dwell_ms // PERIOD_MS, count
+        elif state == motion.CYCLE_DWELL:
+            assert count == profile.cycle_dwell_ms // PERIOD_MS, count
+        else:
+            assert count * PERIOD_MS >= 1000 * (profile.reverse_steps if state == motion.REVERSE
+                                                 else profile.forward_steps) // speed
+
+    # The speed buttons change VMAX of the running move with one datagram
+    before = chip.datagrams
+    agitation.set_speed(speed * 2)
+    assert chip.datagrams - before == 1
+    assert chip.reg(tmc5160.VMAX) == driver.velocity(speed * 2)
+
+    # Stalls are seen through the regular status poll
+    chip.stall = True
+    run(chip, agitation, 1)
+    chip.stall = False
+    assert agitation.stalls > 0
+
+    agitation.stop()
+    chip.advance(1)
+    assert chip.speed == 0 and not agitation.running
+    stopped_at = chip.xactual
+    # Restarting continues from wherever the motor stopped
+    agitation.start()
+    while agitation.state == motion.FORWARD:
+        run(chip, agitation, PERIOD_MS / 1000)
+    assert chip.xactual == stopped_at + profile.forward_steps
+    return polls, datagrams, agitation.cycles
+
+
+def main():
+    init_datagrams = check_transactions()
+    print("init: {} datagrams, version read and one write batch".format(init_datagrams))
+    for speed in (400, 800):
+        polls, datagrams, cycles = check_agitation(speed)
+        print("speed {:4} steps/s: {} cycles in 20 s, {} datagrams for {} polls ({:.2f} per poll)".format(
+            speed, cycles, datagrams, polls, datagrams / polls))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
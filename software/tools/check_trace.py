@@ -0,0 +1,204 @@
+# Record an input trace off-device and replay it
+#
+#   python3 tools/check_trace.py
+#
+# Attaches an EdgeTrace to a rotary controller on hosthal's virtual clock,
+# across the ticks_us wrap, and plays a session on its pins: slow and fast
+# encoder turns, a switch press with contact bounce, a glitch too short to be
+# a press, a minute and more of nothing and a timer with agitation. The
+# saved trace must hold every edge at its time, and tools/trace_replay.py
+# must hand the same events to a fresh controller, twice alike. With soft IRQ
+# latency the replay loses detents of the fast turn and --check flags it.
+# A full trace counts the overflow and saves itself once.
+
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import trace_replay
+
+clock = trace_replay.clock
+
+from hosthal import machine
+from boardsupport.debounce import PRESS
+from boardsupport.frankenstein_controller import (
+    FrankensteinRotaryController, _BUTTON_PINS, _BUTTON_SOURCE_BASE, _ROTARY_PINS,
+)
+from boardsupport.trace import EdgeTrace, decode
+
+GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))
+# Host-dependent parts of a report
+_HOST = ("irq_us", "event_us", "host_seconds")
+
+
+class Session:
+    def __init__(self, trace_size=2048):
+        for clk, dt in _ROTARY_PINS:
+            machine.drive(clk, 1)
+            machine.drive(dt, 1)
+        self.controller = FrankensteinRotaryController(timers=False, acceleration=False)
+        controller = self.controller
+        self.trace = EdgeTrace(size=trace_size)
+        self.trace.attach(controller)
+        self.trace.start()
+        self.detents = [0] * len(_ROTARY_PINS)
+        self.presses = [0] * len(_BUTTON_PINS)
+        self.edges = []
+        self.start = clock.now
+        handler = controller.events.handler
+
+        def observe(source, delta, ticks):
+            if source < _BUTTON_SOURCE_BASE:
+                self.detents[source] += delta
+            elif delta == PRESS:
+                self.presses[source - _BUTTON_SOURCE_BASE] += 1
+            handler(source, delta, ticks)
+
+        controller.events.handler = observe
+        controller.buttons.start()
+        self.phase = [2] * len(_ROTARY_PINS)
+
+    def drive(self, pin, level):
+        if machine._levels[pin] != level:
+            self.edges.append((clock.now - self.start, pin, level))
+        machine.drive(pin, level)
+
+    def turn(self, encoder, quarters, gap_us, rng=None):
+        clk, dt = _ROTARY_PINS[encoder]
+        step = 1 if quarters > 0 else -1
+        for _ in range(abs(quarters)):
+            self.phase[encoder] = (self.phase[encoder] + step) % 4
+            level_clk, level_dt = GRAY[self.phase[encoder]]
+            # One pin changes per quarter
+            self.drive(clk, level_clk)
+            self.drive(dt, level_dt)
+            clock.advance(gap_us if rng is None else rng.randint(gap_us // 4, gap_us))
+
+    def press(self, button, hold_ms, rng):
+        pin = _BUTTON_PINS[button]
+        for _ in range(6):
+            self.drive(pin, 1)
+            clock.advance(rng.randint(50, 400))
+            self.drive(pin, 0)
+            clock.advance(rng.randint(50, 400))
+        self.drive(pin, 1)
+        clock.advance(hold_ms * 1000)
+        for _ in range(4):
+            self.drive(pin, 0)
+            clock.advance(rng.randint(50, 300))
+            self.drive(pin, 1)
+            clock.advance(rng.randint(50, 300))
+        self.drive(pin, 0)
+        clock.advance(60_000)
+
+    def finish(self):
+        clock.advance(200_000)
+        self.controller.buttons.stop()
+        if self.controller.motion is not None:
+            self.controller.motion.stop()
+
+
+def play(session, rng):
+    session.turn(0, 48, 5000)
+    session.turn(1, -20, 300)
+    session.turn(2, 24, 3000, rng)
+    session.press(5, 80, rng)
+    # A 3 ms glitch on button3 is no press
+    session.drive(_BUTTON_PINS[6], 1)
+    clock.advance(3000)
+    session.drive(_BUTTON_PINS[6], 0)
+    clock.advance(50_000)
+    # Quiet for 70 s, the trace marks it
+    for _ in range(70):
+        clock.advance(1_000_000)
+        session.trace.poll()
+    # Timer 1 with the agitation for a second
+    session.controller.display1["value"] = 30
+    session.press(0, 60, rng)
+    clock.advance(1_000_000)
+    session.press(0, 60, rng)
+    session.turn(3, 10, 800)
+    session.finish()
+
+
+def check_record(session):
+    trace = session.trace
+    assert trace.overflow == 0 and not trace.full
+    assert len(trace) == len(session.edges) + 1, (len(trace), len(session.edges))
+    path = os.path.join(tempfile.mkdtemp(), "trace.bin")
+    trace.save(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    decoded = decode(data)
+    assert decoded["edges"] == session.edges
+    assert decoded["mask"] & (1 << _ROTARY_PINS[0][0]) and decoded["mask"] & (1 << _BUTTON_PINS[7])
+    assert decoded["levels"] >> _ROTARY_PINS[0][0] & 1 and not decoded["levels"] >> _BUTTON_PINS[0] & 1
+    assert session.detents == [24, -10, 12, 5], session.detents
+    assert session.presses == [2, 0, 0, 0, 0, 1, 0, 0], session.presses
+    try:
+        decode(data[:30])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("decoded a short trace")
+    return data
+
+
+def check_replay(data, session):
+    report = trace_replay.replay(data)
+    assert report["detents"] == session.detents == report["reference_detents"], report
+    assert report["presses"] == session.presses == report["reference_presses"], report
+    assert report["lost_detents"] == report["missed_presses"] == 0
+    assert report["steps"] > 300 and report["late_steps"] == 0, report
+    # Switch events come after the debounce, encoder events at once
+    assert 15_000 <= report["button_latency_us"][0] <= 25_000, report["button_latency_us"]
+    assert report["encoder_latency_us"][1] == 0
+    again = trace_replay.replay(data)
+    for name in _HOST:
+        again[name] = report[name]
+    assert again == report
+    return report
+
+
+def check_latency(data, clean):
+    report = trace_replay.replay(data, latency_us=800, seed=3)
+    # The 300 µs quarters of encoder 2 outrun the late decoder
+    assert report["lost_detents"] > 0, report
+    assert report["detents"][0] == clean["detents"][0]
+    assert trace_replay._regressions(report, clean)
+    assert not trace_replay._regressions(dict(clean, irq_us=0, event_us=0, host_seconds=0), clean)
+    return report
+
+
+def check_overflow():
+    session = Session(trace_size=16)
+    session.turn(0, 40, 2000)
+    trace = session.trace
+    assert trace.full and len(trace) == 16 and trace.overflow == 24
+    path = os.path.join(tempfile.mkdtemp(), "trace.bin")
+    trace.path = path
+    trace.poll()
+    assert trace.saved
+    os.remove(path)
+    trace.poll()
+    assert not os.path.exists(path)
+    session.finish()
+
+
+if __name__ == "__main__":
+    rng = random.Random(23)
+    # The session runs across the ticks_us wrap
+    clock.advance((1 << 30) - 500_000 - clock.now % (1 << 30))
+    session = Session()
+    play(session, rng)
+    data = check_record(session)
+    report = check_replay(data, session)
+    late = check_latency(data, report)
+    check_overflow()
+    print(trace_replay.format_report(report))
+    print("with up to 800 us of IRQ latency: {} detents lost".format(late["lost_detents"]))
+    print("OK")
@@ -0,0 +1,106 @@
+# Client for the controller's network control service
+#
+#   CONTROL_TOKEN=... python3 tools/control_client.py rotary[:7000] "SET 1 300" "LATCH 1"
+#   CONTROL_TOKEN=... python3 tools/control_client.py rotary   (prints state pushes)
+#
+# The token is the board's "control_token" from config.json.
+# ControlClient is also what check_control.py drives its load test with.
+# State pushes ("S ...") are picked out of the stream by a reader task, so
+# command() only ever returns the reply.
+
+import asyncio
+import os
+import sys
+
+# display1.. are as many as the board has displays
+def parse_state(line):
+    values = [int(v) for v in line.split()[1:]]
+    state = {"seq": values[0], "running": values[-3], "low_speed": values[-2], "exposing": values[-1]}
+    for i in range(1, len(values) - 3):
+        state["display{}".format(i)] = values[i]
+    return state
+
+
+class ControlClient:
+    def __init__(self):
+        self.state = None
+        self.pushes = 0
+        self._replies = asyncio.Queue()
+        self._changed = asyncio.Event()
+        self._reader_task = None
+
+    async def connect(self, host, port=7000, token=""):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write("AUTH {}\n".format(token).encode())
+        await self.writer.drain()
+        first = await self.reader.readline()
+        if not first.startswith(b"S "):
+            raise ConnectionError(first.decode().strip() or "closed")
+        self.state = parse_state(first.decode())
+        self._reader_task = asyncio.create_task(self._read())
+        return self
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                await self._replies.put(None)
+                return
+            line = line.decode().strip()
+            if line.startswith("S "):
+                self.state = parse_state(line)
+                self.pushes += 1
+                self._changed.set()
+            else:
+                await self._replies.put(line)
+
+    async def command(self, line):
+        self.writer.write((line + "\n").encode())
+        await self.writer.drain()
+        reply = await self._replies.get()
+        if reply is None:
+            raise ConnectionError("closed")
+        return reply
+
+    # Waits for a pushed state for which predicate(state) is true
+    async def wait_state(self, predicate, timeout=2.0):
+        async def wait():
+            while not predicate(self.state):
+                self._changed.clear()
+                await self._changed.wait()
+        await asyncio.wait_for(wait(), timeout)
+        return self.state
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def _main(argv):
+    host, _, port = argv[0].partition(":")
+    client = await ControlClient().connect(host, int(port) if port else 7000, os.environ.get("CONTROL_TOKEN", ""))
+    print(client.state)
+    if len(argv) > 1:
+        for line in argv[1:]:
+            print("{} -> {}".format(line, await client.command(line)))
+    else:
+        pushes = 0
+        while True:
+            await client.wait_state(lambda s: client.pushes > pushes, timeout=None)
+            pushes = client.pushes
+            print(client.state)
+    await client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: control_client.py HOST[:PORT] [COMMAND ...]")
+    try:
+        asyncio.run(_main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,55 @@
+# Print a dump of the controller's log ring
+#
+#   mpremote exec "controller.log.save()" + cp :log.bin .
+#   python3 tools/logring_decode.py log.bin
+#
+# Records are printed oldest first with their ticks_ms time and their age
+# at the time of the dump. Message texts come from the controller module, so
+# decode with the same tree that is on the board.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from boardsupport.frankenstein_controller import LOG_MESSAGES, _BUTTON_NAMES
+from boardsupport.logring import decode, format_message
+
+LEVELS = {10: "DEBUG", 20: "INFO", 30: "WARNING", 40: "ERROR"}
+
+
+def format_dump(dump):
+    lines = []
+    if dump["dropped"]:
+        lines.append("({} older records dropped)".format(dump["dropped"]))
+    for ticks, message, args in dump["records"]:
+        if message < len(LOG_MESSAGES):
+            level, text = LOG_MESSAGES[message]
+            text = format_message(text, args, _BUTTON_NAMES)
+        else:
+            level, text = 0, "message {} {}".format(message, args)
+        # ticks_ms wraps at 2**30
+        age = ((dump["ticks_ms"] - ticks) & 0x3FFFFFFF) / 1000
+        lines.append("{:>10.3f} {:>7.3f}s ago [{}] {}".format(ticks / 1000, age, LEVELS.get(level, level), text))
+    return "\n".join(lines)
+
+
+def main(argv):
+    if len(argv) != 1:
+        sys.exit("usage: logring_decode.py DUMP|-")
+    if argv[0] == "-":
+        data = sys.stdin.buffer.read()
+    else:
+        with open(argv[0], "rb") as f:
+            data = f.read()
+    try:
+        print(format_dump(decode(data)))
+    except ValueError as e:
+        sys.exit("{}: {}".format(argv[0], e))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
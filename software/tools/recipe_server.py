@@ -0,0 +1,122 @@
+# Local stand-in for the recipe server
+#
+#   python3 tools/recipe_server.py recipes.json [port]
+#
+# Serves /recipes.bin built with boardsupport.recipes.pack() from a JSON file
+# of {"<number>": {"times": [s1, s2, s3], "name": "..."}}, re-read whenever
+# the file changes. Answers If-None-Match and If-Modified-Since with 304 like
+# a real web server would. check_recipes.py runs it in a thread.
+
+import email.utils
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from boardsupport.recipes import pack
+
+
+def load_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    return {int(number): (entry["times"], entry.get("name", "")) for number, entry in data.items()}
+
+
+class RecipeServer:
+    def __init__(self, recipes=None, port=0, path=None):
+        self.path = path
+        self.requests = 0
+        self.not_modified = 0
+        self._mtime = None
+        if recipes is not None:
+            self.update(recipes)
+        else:
+            self._reload()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._get(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.url = "http://127.0.0.1:{}/recipes.bin".format(self.port)
+
+    def update(self, recipes, modified=None):
+        self.body = bytes(pack(recipes))
+        # HTTP dates have whole seconds
+        self.modified = int(modified if modified is not None else time.time())
+        self.etag = '"{:08x}"'.format(zlib.crc32(self.body))
+
+    def _reload(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self.update(load_json(self.path), mtime)
+
+    def _get(self, request):
+        self.requests += 1
+        if request.path != "/recipes.bin":
+            request.send_error(404)
+            return
+        if self.path is not None:
+            self._reload()
+        if self._unchanged(request.headers):
+            self.not_modified += 1
+            request.send_response(304)
+            request.send_header("ETag", self.etag)
+            request.end_headers()
+            return
+        request.send_response(200)
+        request.send_header("Content-Type", "application/octet-stream")
+        request.send_header("Content-Length", str(len(self.body)))
+        request.send_header("ETag", self.etag)
+        request.send_header("Last-Modified", email.utils.formatdate(self.modified, usegmt=True))
+        request.end_headers()
+        request.wfile.write(self.body)
+
+    def _unchanged(self, headers):
+        etag = headers.get("If-None-Match")
+        if etag is not None:
+            return etag == self.etag
+        since = headers.get("If-Modified-Since")
+        if since is not None:
+            try:
+                return self.modified <= email.utils.parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: recipe_server.py recipes.json [port]")
+        sys.exit(2)
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8000
+    server = RecipeServer(path=sys.argv[1], port=port)
+    print("serving " + server.url)
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
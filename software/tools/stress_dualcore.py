@@ -0,0 +1,187 @@
+# Step jitter and exposure error with and without the second core
+#
+# Runs on the board itself or on the host (through hosthal):
+#
+#   mpremote run tools/stress_dualcore.py
+#   python3 tools/stress_dualcore.py [seconds]
+#
+# Runs the agitation move at high speed and back to back exposures of
+# 30-150 ms on a stand-in lamp while core 0 is kept busy: encoder bursts
+# through the event queue, display renders, a 20 ms blocking call standing
+# in for the network stack and a garbage collection. Once with the timers on
+# core 0 and once with dual_core, and reports how late the steps came
+# against their deadlines (p50/p99 from the power-of-two histogram, so upper
+# bounds) and the worst lamp-off error.
+#
+# On the host core 1 is a thread under the GIL and core 0's timers fire only
+# between the load chunks, which is how the firmware's soft timers behave
+# around long C calls; the numbers show the difference, the board shows the
+# real ones.
+
+import gc
+import sys
+
+MICROPYTHON = sys.implementation.name == "micropython"
+
+if not MICROPYTHON:
+    import os
+    import time
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    import hosthal
+
+    hosthal.install()
+    from hosthal import machine
+
+    def _block(ms):
+        time.sleep(ms / 1000)
+
+    class _HostTimers:
+        # Fires machine.Timer callbacks when pumped, by the host's clock
+        def __init__(self):
+            self.timers = []
+
+        def arm(self, timer):
+            self.disarm(timer)
+            if timer.callback is None or timer.period <= 0:
+                return
+            timer._period_us = max(1, timer.period * 1_000_000 // timer.tick_hz)
+            timer._deadline = time.ticks_add(time.ticks_us(), timer._period_us)
+            self.timers.append(timer)
+
+        def disarm(self, timer):
+            if timer in self.timers:
+                self.timers.remove(timer)
+
+        def pump(self):
+            fired = True
+            while fired:
+                fired = False
+                now = time.ticks_us()
+                for timer in tuple(self.timers):
+                    if time.ticks_diff(now, timer._deadline) >= 0:
+                        if timer.mode == machine.Timer.ONE_SHOT:
+                            self.timers.remove(timer)
+                        else:
+                            timer._deadline = time.ticks_add(timer._deadline, timer._period_us)
+                        timer.callback(timer)
+                        fired = True
+
+    _timers = _HostTimers()
+    machine._clock = _timers
+    _pump = _timers.pump
+    # Lets the core 1 thread in between core 0's bytecodes more often
+    sys.setswitchinterval(0.0001)
+else:
+    import hashlib
+    import time
+
+    _BLOCK = bytes(16384)
+
+    # One C call that holds core 0 like a socket or SPI transfer does
+    def _block(ms):
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < ms:
+            hashlib.sha256(_BLOCK)
+
+    def _pump():
+        pass
+
+from machine import Pin
+from boardsupport.core1 import Core1, MotionProxy, ExposureProxy
+from boardsupport.exposure import ExposureScheduler, IDLE
+from boardsupport.frankenstein_controller import FrankensteinRotaryController
+from boardsupport.motion import AgitationMotion
+from boardsupport.telemetry import Telemetry, STEP_LATE, BUCKETS
+
+
+class Lamp:
+    def __init__(self):
+        self.lit = False
+
+    def on(self):
+        self.lit = True
+
+    def off(self):
+        self.lit = False
+
+
+def _percentile(probe, fraction):
+    seen = 0
+    for i in range(BUCKETS):
+        seen += probe.hist[i]
+        if probe.count and seen >= fraction * probe.count:
+            return 2 << i
+    return 0
+
+
+def _load(ui, n):
+    phase = n % 4
+    if phase == 0:
+        events = ui.events
+        for k in range(64):
+            events.post_delta(k & 3, 1 if k & 4 else -1)
+            if k & 7 == 7:
+                events.drain()
+    elif phase == 1:
+        ui.render_full_display(None)
+    elif phase == 2:
+        _block(20)
+    else:
+        gc.collect()
+
+
+def session(dual, seconds):
+    motion = AgitationMotion(Pin(9, Pin.OUT), Pin(10, Pin.OUT), Pin(8, Pin.OUT))
+    motion.set_speed(800)
+    exposure = ExposureScheduler(Lamp())
+    # The UI side, without a motor of its own
+    ui = FrankensteinRotaryController(timers=False, motion_backend="none")
+    core1 = None
+    if dual:
+        core1 = Core1(motion, exposure)
+        motion = MotionProxy(core1)
+        exposure = ExposureProxy(core1)
+        late = core1.step_late
+        core1.start()
+    else:
+        telemetry = Telemetry()
+        telemetry._attach_steps(motion)
+        late = telemetry.probes[STEP_LATE]
+    seed = 1
+    n = 0
+    motion.start()
+    start = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), start) < seconds * 1000:
+        _load(ui, n)
+        n += 1
+        _pump()
+        if exposure.state == IDLE:
+            seed = (seed * 1103515245 + 12345) & 0x7FFFFFFF
+            exposure.expose((30 + seed % 120) * 1000)
+            _pump()
+    motion.stop()
+    exposure.cancel()
+    if core1 is not None:
+        core1.stop()
+        time.sleep_ms(50)
+    else:
+        _pump()
+    return late, exposure.exposures, exposure.max_error_us
+
+
+def main(seconds=3):
+    print("{:<12} {:>8} {:>10} {:>10} {:>10} {:>10} {:>14}".format(
+        "mode", "steps", "late p50", "late p99", "late max", "exposures", "lamp error max"))
+    results = []
+    for dual in (False, True):
+        late, exposures, error = session(dual, seconds)
+        results.append((_percentile(late, 0.5), late.max_us, error))
+        print("{:<12} {:>8} {:>7} us {:>7} us {:>7} us {:>10} {:>11} us".format(
+            "dual core" if dual else "single core", late.count, _percentile(late, 0.5),
+            _percentile(late, 0.99), late.max_us, exposures, error))
+    return results
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 and not MICROPYTHON else 3)
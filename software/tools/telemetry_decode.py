@@ -0,0 +1,101 @@
+# Print the controller's telemetry packets
+#
+#   python3 tools/telemetry_decode.py --udp 5005
+#   mpremote | python3 tools/telemetry_decode.py
+#   python3 tools/telemetry_decode.py --serial /dev/ttyACM0
+#
+# With "udp" in the telemetry settings the board sends one datagram per
+# interval; with "serial" the packets are "#TLM <hex>" lines among the log
+# output, which is passed through. Percentiles come from the power-of-two
+# histogram and are upper bounds.
+
+import binascii
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+hosthal.install()
+
+from boardsupport.telemetry import BUCKETS, decode
+
+_PREFIX = "#TLM "
+
+
+# Exclusive upper bound of the bucket holding the percentile, as text
+def percentile(hist, fraction):
+    total = sum(hist)
+    seen = 0
+    for i in range(BUCKETS):
+        seen += hist[i]
+        if total and seen >= fraction * total:
+            return "<{}".format(2 << i) if i < BUCKETS - 1 else ">={}".format(1 << i)
+    return "-"
+
+
+def format_report(report):
+    lines = ["#{} at {:.1f} s".format(report["sequence"], report["ticks_ms"] / 1000)]
+    for name, probe in report["probes"].items():
+        count = probe["count"]
+        if not count:
+            lines.append("  {:<10} -".format(name))
+            continue
+        lines.append("  {:<10} {:>7} calls  avg {:>6.1f} us  min {:>5}  max {:>6}  p50 {}  p99 {}".format(
+            name, count, probe["total_us"] / count, probe["min_us"], probe["max_us"],
+            percentile(probe["hist"], 0.5), percentile(probe["hist"], 0.99)))
+    lines.append("  " + "  ".join("{} {}".format(k, v) for k, v in report["counters"].items()))
+    return "\n".join(lines)
+
+
+# Decodes a "#TLM" line, None for any other line
+def parse_line(line):
+    line = line.strip()
+    if not line.startswith(_PREFIX):
+        return None
+    return decode(binascii.unhexlify(line[len(_PREFIX):]))
+
+
+def follow_lines(stream, out=sys.stdout):
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode(errors="replace")
+        try:
+            report = parse_line(line)
+        except (ValueError, binascii.Error) as e:
+            out.write("bad telemetry line: {}\n".format(e))
+            continue
+        out.write((format_report(report) if report is not None else line.rstrip("\n")) + "\n")
+        out.flush()
+
+
+def follow_udp(port, out=sys.stdout):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", port))
+    while True:
+        packet, sender = sock.recvfrom(2048)
+        try:
+            out.write("{} {}\n".format(sender[0], format_report(decode(packet))))
+        except ValueError as e:
+            out.write("{}: {}\n".format(sender[0], e))
+        out.flush()
+
+
+def main(argv):
+    if argv[:1] == ["--udp"]:
+        follow_udp(int(argv[1]))
+    elif argv[:1] == ["--serial"]:
+        with open(argv[1], "rb") as stream:
+            follow_lines(stream)
+    elif not argv:
+        follow_lines(sys.stdin)
+    else:
+        sys.exit("usage: telemetry_decode.py [--udp PORT | --serial DEVICE]")
+
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv[1:])
+    except KeyboardInterrupt:
+        pass
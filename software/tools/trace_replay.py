@@ -0,0 +1,288 @@
+# Replay an input trace through the boardsupport classes
+#
+#   mpremote cp :trace.bin .
+#   python3 tools/trace_replay.py trace.bin [--latency US] [--save FILE | --check FILE]
+#
+# Builds a rotary controller on hosthal's virtual clock, sets the traced pins
+# to their levels at the start of the trace and changes each pin at the
+# recorded µs, so the encoder decoder, the switch debouncer, the event queue
+# and the agitation see the session as the board did. The display task runs
+# every 100 ms as under the runtime, encoder acceleration is off so that
+# deltas count detents. --latency runs every pin IRQ handler and timer
+# callback up to US µs late, from a seeded generator, to see what a busy VM
+# does to the same hands.
+#
+# Reports the detents decoded per encoder against a decoding of the raw
+# edges, the presses per switch against those held steady for 20 ms, the
+# virtual µs from the edge that completed an event to its handler, the host
+# µs per IRQ and per handled event, and the step ticks of the agitation and
+# how many ran late. --save and --check work as in bench_hotpaths.py: --check
+# fails when a tree loses more detents or presses, or handles them later or
+# at more than a third more host time, than the saved run.
+
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import hosthal
+
+clock = hosthal.install(virtual=True)
+
+from hosthal import machine, micropython
+from boardsupport.debounce import PRESS
+from boardsupport.frankenstein_controller import (
+    FrankensteinRotaryController, _BUTTON_PINS, _BUTTON_SOURCE_BASE, _ROTARY_PINS,
+)
+from boardsupport.telemetry import Telemetry, decode as decode_telemetry
+from boardsupport.trace import decode
+
+_DISPLAY_MS = 100
+_STEADY_US = 20_000
+_TIME_TOLERANCE = 4 / 3
+# Quadrature position of (clk << 1 | dt) in the direction the decoder counts up
+_POSITION = {0: 0, 2: 1, 3: 2, 1: 3}
+
+
+def _percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+def reference(trace):
+    # Detents per encoder and steady presses per switch, from the edges alone
+    levels = [trace["levels"] >> pin & 1 for pin in range(machine.NUM_GPIO)]
+    quarters = [0] * len(_ROTARY_PINS)
+    encoder = {}
+    for i, (clk, dt) in enumerate(_ROTARY_PINS):
+        encoder[clk] = encoder[dt] = i
+    button = {pin: i for i, pin in enumerate(_BUTTON_PINS)}
+    presses = [0] * len(_BUTTON_PINS)
+    # Per switch: the debounced level and when the raw level last changed
+    steady = [levels[pin] for pin in _BUTTON_PINS]
+    changed = [0] * len(_BUTTON_PINS)
+
+    def settle(i, until):
+        pin = _BUTTON_PINS[i]
+        if levels[pin] != steady[i] and until - changed[i] >= _STEADY_US:
+            steady[i] = levels[pin]
+            if steady[i]:
+                presses[i] += 1
+
+    end = 0
+    for t, pin, level in trace["edges"]:
+        end = t
+        if pin in encoder:
+            i = encoder[pin]
+            clk, dt = _ROTARY_PINS[i]
+            before = _POSITION[levels[clk] << 1 | levels[dt]]
+            levels[pin] = level
+            move = (_POSITION[levels[clk] << 1 | levels[dt]] - before) % 4
+            # Two apart is a missed edge, its direction is unknown
+            if move == 1:
+                quarters[i] += 1
+            elif move == 3:
+                quarters[i] -= 1
+        elif pin in button:
+            i = button[pin]
+            settle(i, t)
+            levels[pin] = level
+            changed[i] = t
+    for i in range(len(_BUTTON_PINS)):
+        settle(i, end + _STEADY_US)
+    # The half step decoder counts a detent every two quarters
+    detents = [int(q / 2) for q in quarters]
+    return detents, presses
+
+
+class Replay:
+    def __init__(self, trace, latency_us=0, seed=1):
+        self.trace = trace
+        self.rng = random.Random(seed)
+        self.latency_us = latency_us
+        clock.latency = self._latency if latency_us else None
+        self.controller = FrankensteinRotaryController(timers=False, acceleration=False)
+        controller = self.controller
+        self.telemetry = Telemetry()
+        self.telemetry.attach(controller)
+        # Levels at the start of the trace, without running any handler
+        for pin in range(machine.NUM_GPIO):
+            if trace["mask"] >> pin & 1:
+                machine._levels[pin] = trace["levels"] >> pin & 1
+        self.source_of = {}
+        for i, (clk, dt) in enumerate(_ROTARY_PINS):
+            self.source_of[clk] = self.source_of[dt] = i
+        for i, pin in enumerate(_BUTTON_PINS):
+            self.source_of[pin] = _BUTTON_SOURCE_BASE + i
+        self.last_edge = {}
+        self.detents = [0] * len(_ROTARY_PINS)
+        self.presses = [0] * len(_BUTTON_PINS)
+        self.latency = {"encoder": [], "button": []}
+        self.irq_us = []
+        self.event_us = []
+        handler = controller.events.handler
+        controller.events.handler = lambda source, delta, ticks: self._event(handler, source, delta, ticks)
+
+    def _latency(self):
+        return self.rng.randint(0, self.latency_us)
+
+    def _event(self, handler, source, delta, ticks):
+        start = time.perf_counter_ns()
+        handler(source, delta, ticks)
+        self.event_us.append((time.perf_counter_ns() - start) / 1000)
+        edge = self.last_edge.get(source)
+        if source < _BUTTON_SOURCE_BASE:
+            self.detents[source] += delta
+            kind = "encoder"
+        else:
+            if delta == PRESS:
+                self.presses[source - _BUTTON_SOURCE_BASE] += 1
+            kind = "button"
+        if edge is not None:
+            self.latency[kind].append(clock.now - edge)
+
+    def _irq(self, pin):
+        start = time.perf_counter_ns()
+        pin.handler(pin)
+        self.irq_us.append((time.perf_counter_ns() - start) / 1000)
+
+    def _edge(self, num, level):
+        old = machine._levels[num]
+        machine._levels[num] = level
+        self.last_edge[self.source_of.get(num)] = clock.now
+        pin = machine._pins.get(num)
+        if pin is None or pin.handler is None or old == level:
+            return
+        if not (level and pin.trigger & machine.Pin.IRQ_RISING or not level and pin.trigger & machine.Pin.IRQ_FALLING):
+            return
+        if self.latency_us:
+            # A soft IRQ, the handler reads the pins when it gets to run
+            machine.Timer(mode=machine.Timer.ONE_SHOT, period=self._latency() + 1, tick_hz=1_000_000,
+                          callback=lambda timer: self._irq(pin))
+        else:
+            self._irq(pin)
+
+    def run(self):
+        controller = self.controller
+        controller.buttons.start()
+        display = machine.Timer(period=_DISPLAY_MS, callback=lambda timer: controller.update())
+        start = clock.now
+        wall = time.perf_counter()
+        for t, pin, level in self.trace["edges"]:
+            clock.advance(start + t - clock.now)
+            self._edge(pin, level)
+            micropython.run_scheduled()
+        # Long enough for the last debounce and the queue to settle
+        clock.advance(200_000)
+        wall = time.perf_counter() - wall
+        display.deinit()
+        controller.buttons.stop()
+        if controller.motion is not None:
+            controller.motion.stop()
+        clock.latency = None
+        return self.report(wall)
+
+    def report(self, wall):
+        detents, presses = reference(self.trace)
+        telemetry = decode_telemetry(self.telemetry.snapshot())
+        events = self.controller.events
+        lost = sum(abs(a - b) for a, b in zip(detents, self.detents))
+        missed = sum(abs(a - b) for a, b in zip(presses, self.presses))
+        return {
+            "edges": len(self.trace["edges"]),
+            "seconds": round(self.trace["edges"][-1][0] / 1e6, 3) if self.trace["edges"] else 0,
+            "detents": self.detents,
+            "reference_detents": detents,
+            "lost_detents": lost,
+            "presses": self.presses,
+            "reference_presses": presses,
+            "missed_presses": missed,
+            "encoder_latency_us": [_percentile(self.latency["encoder"], 50), _percentile(self.latency["encoder"], 99)],
+            "button_latency_us": [_percentile(self.latency["button"], 50), _percentile(self.latency["button"], 99)],
+            "irq_us": round(sum(self.irq_us) / len(self.irq_us), 2) if self.irq_us else 0,
+            "event_us": round(sum(self.event_us) / len(self.event_us), 2) if self.event_us else 0,
+            "events": events.drained,
+            "coalesced": events.coalesced,
+            "overflows": events.overflows,
+            "steps": telemetry["probes"]["step"]["count"],
+            "late_steps": telemetry["counters"]["late_steps"],
+            "step_late_max_us": telemetry["probes"]["step_late"]["max_us"],
+            "host_seconds": round(wall, 3),
+        }
+
+
+def replay(data, latency_us=0, seed=1):
+    return Replay(decode(data), latency_us, seed).run()
+
+
+def format_report(report):
+    return "\n".join((
+        "{} edges over {} s".format(report["edges"], report["seconds"]),
+        "encoders: {} detents, {} in the edges, {} lost".format(
+            report["detents"], report["reference_detents"], report["lost_detents"]),
+        "switches: {} presses, {} held 20 ms, {} missed".format(
+            report["presses"], report["reference_presses"], report["missed_presses"]),
+        "edge to handler: encoder p50 {} us p99 {} us, switch p50 {} us p99 {} us".format(
+            *report["encoder_latency_us"], *report["button_latency_us"]),
+        "host: {} us per IRQ, {} us per event, {} events, {} coalesced, {} overflows".format(
+            report["irq_us"], report["event_us"], report["events"], report["coalesced"], report["overflows"]),
+        "agitation: {} step ticks, {} late, latest by {} us".format(
+            report["steps"], report["late_steps"], report["step_late_max_us"]),
+    ))
+
+
+def _regressions(report, baseline):
+    failed = []
+    for name in ("lost_detents", "missed_presses", "overflows", "late_steps"):
+        if report[name] > baseline.get(name, report[name]):
+            failed.append("{}: {}, was {}".format(name, report[name], baseline[name]))
+    for name in ("encoder_latency_us", "button_latency_us"):
+        if name in baseline and report[name][1] > baseline[name][1]:
+            failed.append("{}: p99 {} us, was {}".format(name, report[name][1], baseline[name][1]))
+    for name in ("irq_us", "event_us"):
+        if name in baseline and report[name] > baseline[name] * _TIME_TOLERANCE + 1.0:
+            failed.append("{}: {} us, was {}".format(name, report[name], baseline[name]))
+    return failed
+
+
+def main(argv):
+    args = list(argv)
+    latency_us = 0
+    if "--latency" in args:
+        i = args.index("--latency")
+        latency_us = int(args[i + 1])
+        del args[i:i + 2]
+    if not args:
+        print("usage: trace_replay.py TRACE [--latency US] [--save FILE | --check FILE]")
+        return 2
+    with open(args[0], "rb") as f:
+        data = f.read()
+    try:
+        report = replay(data, latency_us)
+    except ValueError as e:
+        print("{}: {}".format(args[0], e))
+        return 2
+    print(format_report(report))
+    if len(args) < 3:
+        return 0
+    option, path = args[1], args[2]
+    if option == "--save":
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        return 0
+    if option == "--check":
+        with open(path) as f:
+            failed = _regressions(report, json.load(f))
+        for line in failed:
+            print("REGRESSION " + line)
+        return 1 if failed else 0
+    print("unknown option " + option)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))